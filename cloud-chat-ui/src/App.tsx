@@ -77,31 +77,55 @@ export default function App() {
   };
 
   const pollResearch = async (interactionId: string, messageId: string) => {
-    const poll = async () => {
+    const finish = (text: string) => {
+      setMessages(prev => prev.map(m => 
+        m.id === messageId 
+          ? { ...m, text } 
+          : m
+      ));
+      setIsLoading(false);
+    };
+
+    // Long-poll fallback: the proxy holds each request until the job changes
+    const poll = async (version?: number): Promise<void> => {
       try {
-        const res = await fetch(`${BANDIT_API_BASE}/research/${interactionId}`);
+        const query = version === undefined ? "wait=30" : `wait=30&version=${version}`;
+        const res = await fetch(`${BANDIT_API_BASE}/research/${interactionId}?${query}`);
         const data = await res.json();
         
         if (data.status === "completed" || data.report) {
-          setMessages(prev => prev.map(m => 
-            m.id === messageId 
-              ? { ...m, text: data.report || data.response || "Research complete." } 
-              : m
-          ));
-          setIsLoading(false);
-          return true;
+          finish(data.report || data.response || "Research complete.");
+        } else if (data.error) {
+          finish(`Research failed: ${data.error}`);
+        } else {
+          await poll(data.version);
         }
-        return false;
       } catch (e) {
         console.error("Polling error", e);
-        return true; // Stop on error
+        setIsLoading(false); // Stop on error
       }
     };
 
-    const interval = setInterval(async () => {
-      const done = await poll();
-      if (done) clearInterval(interval);
-    }, 5000);
+    // Server-sent progress: one upstream poller on the proxy, pushed here as it changes
+    if (typeof EventSource === "undefined") {
+      poll();
+      return;
+    }
+    const events = new EventSource(`${BANDIT_API_BASE}/research/${interactionId}/events`);
+    events.addEventListener("completed", (e) => {
+      events.close();
+      const data = JSON.parse((e as MessageEvent).data);
+      finish(data.report || "Research complete.");
+    });
+    ["failed", "cancelled", "incomplete"].forEach(status => events.addEventListener(status, (e) => {
+      events.close();
+      const data = JSON.parse((e as MessageEvent).data);
+      finish(`Research ${status}: ${data.error || "Unknown error"}`);
+    }));
+    events.onerror = () => {
+      events.close();
+      poll();
+    };
   };
 
   const handleVideoGeneration = async (prompt: string, messageId: string) => {
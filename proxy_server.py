@@ -3,21 +3,51 @@ import re
 import base64
 import json
 import asyncio
+import math
 import threading
-from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 from zoneinfo import ZoneInfo
 import uvicorn
-from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any, Union
-import google.auth
-from google.auth.transport.requests import Request as GoogleRequest
-import requests
+import httpx
 import time
 from google import genai
 from google.genai import types
+from scripts.model_runtime import (
+    generate_content, generate_content_stream, embed_content, run_blocking, tier_stats, upstream_call,
+)
+from scripts.metrics import METRICS, CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, request_scope, \
+    set_request_mode, usage_counts
+from scripts.response_cache import build_cache_from_env
+from scripts.semantic_cache import SemanticCache, SEMANTIC_EMBED_MODEL, SEMANTIC_EMBED_DIM, SEMANTIC_EMBED_TIMEOUT
+from scripts.single_flight import SingleFlight, request_fingerprint
+from scripts.job_queue import build_job_queue_from_env, PRIORITY_NORMAL
+from scripts.credential_broker import get_broker
+from scripts.context_cache import ContextCacheManager, is_stale_cache_error
+from scripts.session_store import SessionStore, SessionMessage, Session
+from scripts.hedging import Hedger
+from scripts.prompt_classifier import PromptClassifier, optional_spaces
+from scripts.embedding_service import EmbeddingService, encode_vector
+from scripts.tts_cache import build_tts_cache_from_env, load_phrases, tts_key, TTS_PREWARM_FILE
+from scripts.tts_stream import audio_chunks, is_pcm, parse_pcm_mime, split_chunks, wav_header
+from scripts.research_jobs import ResearchManager, ResearchQueueFull, RESEARCH_POLL_MAX, build_research_store_from_env
+from scripts.admission import (
+    ADMISSION, AdmissionRejected, PriorityMiddleware, PRIORITY_BACKGROUND, priority_class,
+)
+from scripts.model_router import ModelRouter, NoHealthyEndpoint
+from scripts.tracing import TRACER, TracingMiddleware, span
+from scripts.artifact_store import RangeNotSatisfiable, build_artifact_store_from_env, parse_range, parse_tags
+from scripts.engine_client import (
+    EngineQueryError, ENGINE_DEFAULT_DEADLINE, engine_endpoint,
+    query_async as engine_query_async, aclose as close_engine_client,
+)
 
 # Import from bandit_cli with fallback to environment variables
 try:
@@ -30,10 +60,11 @@ except ImportError:
     def get_engine_resource_name(project: str, location: str, engine_id: str) -> str:
         return f"projects/{project}/locations/{location}/reasoningEngines/{engine_id}"
 
-# Background response cache (LRU-style, max 100 entries)
-BACKGROUND_CACHE: OrderedDict = OrderedDict()
-CACHE_MAX_SIZE = 100
-CACHE_LOCK = threading.Lock()
+# Background response cache: memory L1 + SQLite L2 (byte budget, TTL, eviction stats)
+BACKGROUND_CACHE = build_cache_from_env()
+
+# Single-flight: identical in-flight prompts share one upstream call
+CHAT_FLIGHTS = SingleFlight("chat")
 
 # Model tiers for different response modes (Gemini 3 Family)
 FAST_MODEL = "gemini-3-flash-preview"        # Instant mode - frontier intelligence
@@ -41,16 +72,16 @@ FULL_MODEL = "gemini-3-flash-preview"        # Auto mode - balanced
 DEEP_THINK_MODEL = "gemini-3.1-pro-preview"   # Deep think - maximum reasoning (Upgraded from 3.0)
 IMAGE_MODEL = "gemini-3.1-flash-image-preview" # Nano Banana 2
 
-# Natural language patterns that trigger deep thinking
-DEEP_THINK_PATTERNS = [
-    r'\bthink\s*(harder|deeply|more)\b',
-    r'\bdeep\s*think\b',
-    r'\bultra\s*think\b',
-    r'\breason\s*(through|about|deeply)\b',
-    r'\banalyze\s*(carefully|deeply|thoroughly)\b',
-    r'\btake\s*your\s*time\b',
-    r'\bcareful(ly)?\s*consider\b',
-]
+# Natural language phrases that trigger deep thinking (whole words; spaces are optional)
+DEEP_THINK_PATTERNS = optional_spaces([
+    "think harder", "think deeply", "think more",
+    "deep think",
+    "ultra think",
+    "reason through", "reason about", "reason deeply",
+    "analyze carefully", "analyze deeply", "analyze thoroughly",
+    "take your time",
+    "careful consider", "carefully consider",
+])
 
 # Global Persona Definition
 BANDIT_SYSTEM_PROMPT = """[Identity & Role]
@@ -100,16 +131,68 @@ GOD_LEVEL_DOMAINS = {
     }
 }
 
+# Every routing vocabulary behind one classifier: each prompt is classified once
+PROMPT_CLASSIFIER = PromptClassifier(
+    {
+        "deep_think": DEEP_THINK_PATTERNS,
+        **{f"domain:{key}": info["keywords"] for key, info in GOD_LEVEL_DOMAINS.items()},
+    },
+    word_bounded={"deep_think"},
+)
+
+@lru_cache(maxsize=64)
+def classify_prompt(prompt: str) -> frozenset:
+    """Routing features of a prompt (cached, so each detector below reuses the same scan)."""
+    return PROMPT_CLASSIFIER.classify(prompt)
+
 def detect_god_level_domain(prompt: str) -> dict | None:
     """Detect if prompt requires god-level domain expertise."""
-    prompt_lower = prompt.lower()
+    features = classify_prompt(prompt)
     for domain_key, domain_info in GOD_LEVEL_DOMAINS.items():
-        if any(kw in prompt_lower for kw in domain_info["keywords"]):
+        if f"domain:{domain_key}" in features:
             return domain_info
     return None
 
 app = FastAPI(title="Bandit Proxy API", description="OpenAI-compatible proxy for Bandit Reasoning Engine")
 
+# X-Bandit-Priority: interactive (default) | fleet | background -> admission class of upstream calls
+app.add_middleware(PriorityMiddleware)
+# Request count/latency per route template and thinking mode, for GET /metrics
+app.add_middleware(MetricsMiddleware)
+# Outermost: stage spans per request, X-Bandit-Trace-Id header, JSONL export of sampled and slow requests
+app.add_middleware(TracingMiddleware)
+
+def admission_rejected_response(e: Union[AdmissionRejected, NoHealthyEndpoint]) -> JSONResponse:
+    """Fast 429 (shed by admission control) or 503 (every breaker open) with a retry hint."""
+    retry_after = max(1, math.ceil(e.retry_after))
+    return JSONResponse(status_code=429 if isinstance(e, AdmissionRejected) else 503,
+                        headers={"Retry-After": str(retry_after)},
+                        content={"error": str(e), "retry_after": retry_after, "agent": "Bandit"})
+
+def error_response(e: Exception) -> JSONResponse:
+    """JSON error for a failed handler: 429 for shed load, 503 with open breakers, 500 otherwise."""
+    if isinstance(e, (AdmissionRejected, NoHealthyEndpoint)):
+        return admission_rejected_response(e)
+    return JSONResponse(status_code=500, content={"error": str(e), "agent": "Bandit"})
+
+def stream_error_event(e: Exception) -> str:
+    """In-band SSE error for a stream whose 200 status is already sent (same codes as error_response)."""
+    error = {'message': str(e), 'code': 500}
+    if isinstance(e, HTTPException):
+        error.update(message=str(e.detail), code=e.status_code)
+    elif isinstance(e, (AdmissionRejected, NoHealthyEndpoint)):
+        error.update(code=429 if isinstance(e, AdmissionRejected) else 503,
+                     retry_after=max(1, math.ceil(e.retry_after)))
+    return f"data: {json.dumps({'error': error})}\n\n"
+
+@app.exception_handler(AdmissionRejected)
+async def handle_admission_rejected(request: Request, e: AdmissionRejected):
+    return admission_rejected_response(e)
+
+@app.exception_handler(NoHealthyEndpoint)
+async def handle_no_healthy_endpoint(request: Request, e: NoHealthyEndpoint):
+    return admission_rejected_response(e)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -125,15 +208,41 @@ class ImageRequest(BaseModel):
     prompt: str
     aspect_ratio: Optional[str] = "1:1"
     resolution: Optional[str] = "1K"
+    response_format: Optional[str] = "url"  # "url" (artifact reference) or "b64_json" (inline, legacy)
+
+ARTIFACTS = build_artifact_store_from_env()
+
+def artifact_url(artifact) -> str:
+    return f"/v1/artifacts/{artifact.id}"
+
+async def link_artifacts(text: str) -> str:
+    """Replace Reasoning Engine [ARTIFACT ...] tags with markdown links to /v1/artifacts.
+
+    The engine writes to BANDIT_ARTIFACT_BUCKET; linking records that gs://
+    location so the download route can serve it with any artifact backend
+    (tags pointing anywhere else are not served).
+    """
+    for tag, artifact in parse_tags(text):
+        await asyncio.to_thread(ARTIFACTS.link, artifact)
+        text = text.replace(tag, f"![generated image]({artifact_url(artifact)})")
+    return text
 
 @app.post("/generate-image")
 async def generate_image(request: ImageRequest):
-    """Generate an image using Nano Banana 2 (Gemini 3.1 Flash Image)."""
+    """Generate an image using Nano Banana 2 (Gemini 3.1 Flash Image).
+
+    The image is stored in the artifact store and returned as a short reference;
+    download it from /v1/artifacts/{id} (range requests supported).
+    """
+    if request.response_format not in ("url", "b64_json"):
+        return JSONResponse(status_code=400, content={"error": "response_format must be 'url' or 'b64_json'",
+                                                      "agent": "Bandit"})
     try:
         # Use existing client or initialize new one
         client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
         
-        response = client.models.generate_content(
+        response = await generate_content(
+            client, "image",
             model=IMAGE_MODEL,
             contents=request.prompt,
             config=types.GenerateContentConfig(
@@ -146,29 +255,59 @@ async def generate_image(request: ImageRequest):
         )
         
         # Extract image data
-        image_b64 = None
+        image = None
         if response.candidates and response.candidates[0].content.parts:
             for part in response.candidates[0].content.parts:
                 if hasattr(part, 'inline_data') and part.inline_data:
-                    import base64
-                    image_b64 = base64.b64encode(part.inline_data.data).decode('utf-8')
+                    image = part.inline_data
                     break
                 
-        if image_b64:
-            from fastapi.responses import JSONResponse
-            return {
-                "image": image_b64,
-                "model": IMAGE_MODEL,
-                "agent": "Bandit",
-                "revised_prompt": response.text if response.text else request.prompt
-            }
-        else:
+        if image is None:
             raise HTTPException(status_code=500, detail="No image was generated.")
+        result = {
+            "model": IMAGE_MODEL,
+            "agent": "Bandit",
+            "revised_prompt": response.text if response.text else request.prompt
+        }
+        if request.response_format == "b64_json":
+            result["image"] = base64.b64encode(image.data).decode('utf-8')
+            return result
+        artifact = await asyncio.to_thread(ARTIFACTS.put, image.data, image.mime_type or "image/png")
+        return {**result, "artifact": {**artifact.to_dict(), "url": artifact_url(artifact)}}
             
     except Exception as e:
-        from fastapi.responses import JSONResponse
         print(f"[IMAGE ERROR] {e}")
-        return JSONResponse(status_code=500, content={"error": str(e), "agent": "Bandit"})
+        return error_response(e)
+
+@app.api_route("/v1/artifacts/{artifact_id}", methods=["GET", "HEAD"])
+async def download_artifact(artifact_id: str, request: Request):
+    """Artifact bytes; supports single byte-range requests (206) for resumable downloads."""
+    artifact = await asyncio.to_thread(ARTIFACTS.get, artifact_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{artifact.id}"',
+        "Cache-Control": "public, max-age=31536000, immutable",  # content-addressed: never changes
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    try:
+        byte_range = parse_range(request.headers.get("range"), artifact.size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{artifact.size}"})
+    if_range = request.headers.get("if-range")
+    if byte_range and if_range and if_range != headers["ETag"]:
+        byte_range = None
+    status, start, end = 200, 0, artifact.size - 1
+    if byte_range:
+        status, (start, end) = 206, byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{artifact.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    if request.method == "HEAD" or artifact.size == 0:
+        return Response(status_code=status, headers=headers, media_type=artifact.mime_type)
+    return StreamingResponse(iterate_in_threadpool(ARTIFACTS.read(artifact.id, start, end)), status_code=status,
+                             headers=headers, media_type=artifact.mime_type)
 
 # Startup time for uptime tracking
 STARTUP_TIME = time.time()
@@ -177,16 +316,14 @@ VERSION = "3.0.6"  # Bandit Fleet Compatible + Embeddings
 # Pre-initialize genai client at startup to reduce request latency
 try:
     from scripts.bandit_cli import DEFAULT_PROJECT
-    GENAI_CLIENT = genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
+    GENAI_CLIENT = genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global",
+                                credentials=get_broker().try_credentials())
     print(f"[INIT] Pre-initialized genai client for project: {DEFAULT_PROJECT} (global endpoint)")
     print(f"[INIT] God-Level domains loaded: {list(GOD_LEVEL_DOMAINS.keys())}")
 except Exception as e:
     GENAI_CLIENT = None
     print(f"[INIT WARNING] Failed to pre-initialize genai client: {e}")
 
-# Auth token cache (tokens valid for ~60 min, refresh at 55 min)
-AUTH_TOKEN_CACHE = {"token": None, "expires_at": 0}
-AUTH_TOKEN_TTL = 55 * 60  # 55 minutes
 
 # Health Check Endpoint - Visions Fleet Compliant
 @app.get("/health")
@@ -207,7 +344,7 @@ async def health_detailed():
     
     auth_status = "unknown"
     try:
-        token = get_auth_token()
+        token = await CREDENTIALS.get_token_async()
         auth_status = "ok" if token else "failed"
     except Exception as e:
         auth_status = f"error: {str(e)[:50]}"
@@ -225,9 +362,88 @@ async def health_detailed():
             "instant": FAST_MODEL,
             "auto": FULL_MODEL,
             "thinking": DEEP_THINK_MODEL
+        },
+        "runtime": {
+            "tiers": tier_stats(),
+            "single_flight": CHAT_FLIGHTS.stats(),
+            "background_jobs": ENRICHMENT_QUEUE.stats(),
+            "auth": CREDENTIALS.stats(),
+            "context_cache": CONTEXT_CACHE.stats(),
+            "sessions": SESSIONS.stats(),
+            "hedging": AUTO_HEDGER.stats(),
+            "tts_cache": TTS_CACHE.stats(),
+            "artifacts": ARTIFACTS.stats(),
+            "research": RESEARCH.stats(),
+            "admission": ADMISSION.stats(),
+            "routing": ROUTER.stats(),
+            "tracing": TRACER.stats(),
         }
     }
 
+@METRICS.collector
+def runtime_metrics():
+    """Scrape-time view of the state the runtime components already track (no second bookkeeping)."""
+    cache = BACKGROUND_CACHE.stats()
+    auth = CREDENTIALS.stats()
+    tts = TTS_CACHE.stats()
+    semantic = SEMANTIC_CACHE.stats()
+    caches = {"background": cache, "auth_token": auth, "tts": tts, "semantic": semantic}
+    yield ("bandit_cache_hits_total", "counter", "Cache hits by cache",
+           [({"cache": name}, stats["hits"]) for name, stats in caches.items()])
+    yield ("bandit_cache_misses_total", "counter", "Cache misses by cache",
+           [({"cache": name}, stats["misses"]) for name, stats in caches.items()])
+    yield ("bandit_cache_evictions_total", "counter", "Cache evictions by cache",
+           [({"cache": "background"}, cache["evictions"]), ({"cache": "tts"}, tts["evictions"])])
+    yield ("bandit_cache_entries", "gauge", "Entries held by each cache",
+           [({"cache": "background"}, cache["entries"]), ({"cache": "tts"}, tts["entries"])])
+    yield ("bandit_auth_token_refreshes_total", "counter", "OAuth token refreshes",
+           [({"mode": "inline"}, auth["refreshes"] - auth["background_refreshes"]),
+            ({"mode": "background"}, auth["background_refreshes"])])
+    
+    jobs = ENRICHMENT_QUEUE.stats()
+    research = RESEARCH.stats()
+    yield ("bandit_threads", "gauge", "Live Python threads (worker pool, refreshers, SDK threads)",
+           [({}, threading.active_count())])
+    yield ("bandit_queue_depth", "gauge", "Jobs waiting per background queue",
+           [({"queue": "enrichment"}, jobs["depth"]), ({"queue": "research"}, research["queued"])])
+    yield ("bandit_queue_running", "gauge", "Jobs running per background queue",
+           [({"queue": "enrichment"}, jobs["running"]), ({"queue": "research"}, research["active"])])
+    yield ("bandit_queue_jobs_total", "counter", "Background jobs by queue and outcome",
+           [({"queue": "enrichment", "outcome": outcome}, jobs[outcome])
+            for outcome in ("submitted", "completed", "failed", "deduped", "shed")]
+           + [({"queue": "research", "outcome": "submitted"}, research["submitted"])])
+    yield ("bandit_tier_in_flight", "gauge", "Upstream calls in flight per model tier",
+           [({"tier": tier}, stats["in_flight"]) for tier, stats in tier_stats().items()])
+    
+    admission = ADMISSION.stats()["models"]
+    yield ("bandit_admission_waiting", "gauge", "Calls waiting for admission per model",
+           [({"model": model}, stats["waiting"]) for model, stats in admission.items()])
+    yield ("bandit_admission_limit", "gauge", "Current AIMD concurrency limit per model",
+           [({"model": model}, stats["limit"]) for model, stats in admission.items()])
+    yield ("bandit_admission_rejected_total", "counter", "Calls shed by admission control",
+           [({"model": model, "priority": level}, count)
+            for model, stats in admission.items() for level, count in stats["rejected"].items()])
+    
+    routing = ROUTER.stats()["endpoints"]
+    yield ("bandit_router_retries_total", "counter", "Retries on the same endpoint",
+           [({"endpoint": name}, stats["retries"]) for name, stats in routing.items()])
+    yield ("bandit_router_fallbacks_total", "counter", "Routes that fell back to this endpoint",
+           [({"endpoint": name}, stats["fallbacks"]) for name, stats in routing.items()])
+    yield ("bandit_router_skips_total", "counter", "Calls that skipped an endpoint with an open breaker",
+           [({"endpoint": name}, stats["skips"]) for name, stats in routing.items()])
+    yield ("bandit_breaker_open", "gauge", "1 while the endpoint's circuit breaker is open",
+           [({"endpoint": name}, int(stats["state"] == "open")) for name, stats in routing.items()])
+    yield ("bandit_endpoint_health_score", "gauge", "Router health score (0..1)",
+           [({"endpoint": name}, stats["score"]) for name, stats in routing.items()])
+    hedging = AUTO_HEDGER.stats()
+    yield ("bandit_hedged_calls_total", "counter", "Auto-mode calls that started a hedge",
+           [({}, hedging["hedged"])])
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of request, upstream, token, cache, queue and routing metrics."""
+    return Response(content=METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/")
 async def root():
     """Root endpoint with basic info."""
@@ -236,6 +452,7 @@ async def root():
         "version": VERSION,
         "docs": "/docs",
         "health": "/health",
+        "metrics": "/metrics",
         "cache": "/v1/cache",
         "a2a": "/.well-known/agent.json",
         "rpc": "/rpc"
@@ -318,7 +535,10 @@ async def rpc_endpoint(request: Request):
     
     # Route to handlers
     if method == "ask":
-        result = await a2a_handle_ask(params)
+        try:
+            result = await a2a_handle_ask(params)
+        except (AdmissionRejected, NoHealthyEndpoint) as e:
+            return error_response(e)
     elif method == "list_skills":
         result = {"skills": BANDIT_SKILLS}
     elif method == "get_status":
@@ -355,7 +575,8 @@ async def a2a_handle_ask(params: dict) -> dict:
         # Use the instant path for A2A calls (fast responses)
         client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
         
-        response = client.models.generate_content(
+        response = await generate_content(
+            client, "instant" if thinking_mode == "instant" else "auto",
             model=FAST_MODEL if thinking_mode == "instant" else FULL_MODEL,
             contents=query,
             config=types.GenerateContentConfig(
@@ -372,12 +593,11 @@ async def a2a_handle_ask(params: dict) -> dict:
             "model": FAST_MODEL if thinking_mode == "instant" else FULL_MODEL,
             "thinking_mode": thinking_mode
         }
+    except (AdmissionRejected, NoHealthyEndpoint):
+        raise  # shed load: the caller answers 429/503 with Retry-After instead of a result
     except Exception as e:
         return {"error": str(e), "agent": "bandit"}
 
-# Import for JSONResponse
-from fastapi.responses import JSONResponse
-
 # ══════════════════════════════════════════════════════════════════════════════
 # VISIONS FLEET CHAT ENDPOINT
 # ══════════════════════════════════════════════════════════════════════════════
@@ -439,7 +659,8 @@ async def fleet_chat(request: FleetChatRequest):
                 elif tool_name == "code_execution":
                     active_tools.append(types.Tool(code_execution=types.ToolCodeExecution))
         
-        response = client.models.generate_content(
+        response = await generate_content(
+            client, thinking_mode if thinking_mode in ("thinking", "auto") else "instant",
             model=model,
             contents=user_message,
             config=types.GenerateContentConfig(
@@ -469,10 +690,7 @@ async def fleet_chat(request: FleetChatRequest):
         
     except Exception as e:
         print(f"[FLEET CHAT ERROR] {e}")
-        return JSONResponse(
-            status_code=500,
-            content={"error": str(e), "agent": "Bandit"}
-        )
+        return error_response(e)
 
 @app.post("/generate")
 async def fleet_generate(request: FleetChatRequest):
@@ -519,7 +737,8 @@ async def search_grounded(request: SearchRequest):
     try:
         client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
         
-        response = client.models.generate_content(
+        response = await generate_content(
+            client, "tools",
             model=FAST_MODEL,
             contents=request.query,
             config=types.GenerateContentConfig(
@@ -549,7 +768,7 @@ async def search_grounded(request: SearchRequest):
         
     except Exception as e:
         print(f"[SEARCH ERROR] {e}")
-        return JSONResponse(status_code=500, content={"error": str(e), "agent": "Bandit"})
+        return error_response(e)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # URL CONTEXT ANALYSIS
@@ -568,7 +787,8 @@ async def analyze_url(request: UrlRequest):
         url_list = "\n".join([f"- {url}" for url in request.urls])
         full_prompt = f"{request.prompt}\n\nAnalyze the following URLs:\n{url_list}"
         
-        response = client.models.generate_content(
+        response = await generate_content(
+            client, "tools",
             model=FAST_MODEL,
             contents=full_prompt,
             config=types.GenerateContentConfig(
@@ -595,7 +815,7 @@ async def analyze_url(request: UrlRequest):
         
     except Exception as e:
         print(f"[URL CONTEXT ERROR] {e}")
-        return JSONResponse(status_code=500, content={"error": str(e), "agent": "Bandit"})
+        return error_response(e)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # CODE EXECUTION
@@ -610,7 +830,8 @@ async def execute_code(request: CodeRequest):
     try:
         client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
         
-        response = client.models.generate_content(
+        response = await generate_content(
+            client, "tools",
             model=FAST_MODEL,
             contents=request.prompt,
             config=types.GenerateContentConfig(
@@ -652,7 +873,7 @@ async def execute_code(request: CodeRequest):
         
     except Exception as e:
         print(f"[CODE EXECUTION ERROR] {e}")
-        return JSONResponse(status_code=500, content={"error": str(e), "agent": "Bandit"})
+        return error_response(e)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # DEEP RESEARCH AGENT (ASYNC)
@@ -660,75 +881,126 @@ async def execute_code(request: CodeRequest):
 
 DEEP_RESEARCH_AGENT = "deep-research-pro-preview-12-2025"
 
+RESEARCH_WAIT_MAX = 60        # longest long-poll (?wait=) in seconds
+RESEARCH_HEARTBEAT = 15       # SSE keep-alive comment interval
+
+async def create_research_interaction(prompt: str):
+    client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
+    return await run_blocking(
+        "research", client.interactions.create,
+        input=prompt,
+        agent=DEEP_RESEARCH_AGENT,
+        background=True,
+        agent_config={
+            "type": "deep-research",
+            "thinking_summaries": "auto"
+        }
+    )
+
+async def fetch_research_interaction(interaction_id: str):
+    client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
+    with priority_class(PRIORITY_BACKGROUND):  # server-side poller, nobody is waiting on this call
+        return await run_blocking("research", client.interactions.get, interaction_id)
+
+RESEARCH = ResearchManager(create_research_interaction, fetch_research_interaction, build_research_store_from_env())
+
+def research_response(job) -> dict:
+    """Public view of a research job (same keys as the old live poll, plus progress)."""
+    result = {"interaction_id": job.id, "status": job.status, "agent": "Bandit",
+              "thoughts": job.thoughts, "version": job.version}
+    if job.status == "completed":
+        result["report"] = job.report
+    elif job.done:
+        result["error"] = job.error or "Unknown error"
+    elif job.status == "queued":
+        result["queue_position"] = RESEARCH.queue_position(job)
+        result["message"] = "Research is queued behind other research jobs."
+    else:
+        result["message"] = f"Research still in progress. Stream /research/{job.id}/events or long-poll with ?wait=30."
+    return result
+
+async def lookup_research(interaction_id: str):
+    """Local job state; interactions started elsewhere are adopted with a single live read."""
+    return RESEARCH.get(interaction_id) or await RESEARCH.track(interaction_id)
+
 @app.post("/research")
 async def deep_research(request: ResearchRequest):
     """
-    Start async deep research task.
-    Returns interaction_id to poll for results.
+    Start async deep research task (queued when the research slots are full).
+    Returns interaction_id; follow it with /research/{id}/events (SSE) or /research/{id}?wait=30.
     """
+    # Build research prompt with optional formatting
+    research_prompt = request.topic
+    if request.format:
+        research_prompt += f"\n\nFormat the output as follows:\n{request.format}"
     try:
-        client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
-        
-        # Build research prompt with optional formatting
-        research_prompt = request.topic
-        if request.format:
-            research_prompt += f"\n\nFormat the output as follows:\n{request.format}"
-        
-        interaction = client.interactions.create(
-            input=research_prompt,
-            agent=DEEP_RESEARCH_AGENT,
-            background=True,
-            agent_config={
-                "type": "deep-research",
-                "thinking_summaries": "auto"
-            }
-        )
-        
-        return {
-            "interaction_id": interaction.id,
-            "status": "started",
-            "agent": "Bandit",
-            "research_agent": DEEP_RESEARCH_AGENT,
-            "message": "Deep research started. Poll /research/{interaction_id} for results."
-        }
-        
+        job = await RESEARCH.submit(research_prompt)
+    except ResearchQueueFull as e:
+        return JSONResponse(status_code=429, headers={"Retry-After": str(max(1, int(RESEARCH_POLL_MAX)))},
+                            content={"error": str(e), "agent": "Bandit"})
     except Exception as e:
         print(f"[DEEP RESEARCH ERROR] {e}")
-        return JSONResponse(status_code=500, content={"error": str(e), "agent": "Bandit"})
+        return error_response(e)
+
+    queued = job.status == "queued"
+    return {
+        "interaction_id": job.id,
+        "status": "queued" if queued else "started",
+        "queue_position": RESEARCH.queue_position(job) if queued else None,
+        "agent": "Bandit",
+        "research_agent": DEEP_RESEARCH_AGENT,
+        "message": f"Deep research {'queued' if queued else 'started'}. "
+                   f"Stream /research/{job.id}/events or poll /research/{job.id} for results."
+    }
 
 @app.get("/research/{interaction_id}")
-async def get_research_status(interaction_id: str):
+async def get_research_status(interaction_id: str, wait: float = 0, version: Optional[int] = None):
     """
-    Poll research task status.
-    Returns completed report when done.
+    Research task status from local state (one server-side poller per interaction).
+    With ?wait=N the request is held up to N seconds (max 60) until the job changes past `version`.
     """
     try:
-        client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
-        
-        interaction = client.interactions.get(interaction_id)
-        
-        if interaction.status == "completed":
-            return {
-                "status": "completed",
-                "report": interaction.outputs[-1].text if interaction.outputs else None,
-                "agent": "Bandit"
-            }
-        elif interaction.status == "failed":
-            return {
-                "status": "failed",
-                "error": str(interaction.error) if hasattr(interaction, 'error') else "Unknown error",
-                "agent": "Bandit"
-            }
-        else:
-            return {
-                "status": "in_progress",
-                "agent": "Bandit",
-                "message": "Research still in progress. Poll again in 10 seconds."
-            }
-        
+        job = await lookup_research(interaction_id)
+        if wait > 0 and not job.done:
+            job = await RESEARCH.wait(interaction_id, job.version if version is None else version,
+                                      min(wait, RESEARCH_WAIT_MAX))
+        return research_response(job)
+    except Exception as e:
+        print(f"[RESEARCH STATUS ERROR] {e}")
+        return error_response(e)
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_research_events(interaction_id: str):
+    """SSE: `thought` per new thinking summary, `status` on each change, then the terminal status event."""
+    version, sent_thoughts = None, 0
+    while True:
+        job = RESEARCH.get(interaction_id)
+        if job.version != version:
+            for thought in job.thoughts[sent_thoughts:]:
+                yield sse_event("thought", {"text": thought})
+            sent_thoughts = len(job.thoughts)
+            version = job.version
+            if job.done:
+                yield sse_event(job.status, research_response(job))
+                return
+            yield sse_event("status", {"status": job.status, "version": job.version, "polls": job.polls,
+                                       "queue_position": RESEARCH.queue_position(job)})
+        job = await RESEARCH.wait(interaction_id, version, RESEARCH_HEARTBEAT)
+        if job.version == version and not job.done:
+            yield ": keep-alive\n\n"
+
+@app.get("/research/{interaction_id}/events")
+async def research_events(interaction_id: str):
+    """Server-sent progress for a research job; ends with a `completed` (or `failed`...) event."""
+    try:
+        await lookup_research(interaction_id)
     except Exception as e:
         print(f"[RESEARCH STATUS ERROR] {e}")
-        return JSONResponse(status_code=500, content={"error": str(e), "agent": "Bandit"})
+        return error_response(e)
+    return StreamingResponse(stream_research_events(interaction_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # ─────────────────────────────────────────────────────────────────────────────
 # V1 API ALIASES (K.A.M Fleet Compatibility)
@@ -740,9 +1012,14 @@ async def v1_research(request: ResearchRequest):
     return await deep_research(request)
 
 @app.get("/v1/research/{interaction_id}/poll")
-async def v1_research_poll(interaction_id: str):
+async def v1_research_poll(interaction_id: str, wait: float = 0, version: Optional[int] = None):
     """Alias for /research/{id} - K.A.M fleet compatible."""
-    return await get_research_status(interaction_id)
+    return await get_research_status(interaction_id, wait, version)
+
+@app.get("/v1/research/{interaction_id}/events")
+async def v1_research_events(interaction_id: str):
+    """Alias for /research/{id}/events - K.A.M fleet compatible."""
+    return await research_events(interaction_id)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # EMBEDDINGS
@@ -752,6 +1029,11 @@ class EmbeddingRequest(BaseModel):
     """Create embeddings request."""
     input: Union[str, List[str]]
     model: Optional[str] = "gemini-embedding-001"
+    encoding_format: Optional[str] = "float"  # "float" or "base64" (little-endian float32)
+    dimensions: Optional[int] = None
+    task_type: Optional[str] = None           # Gemini task type, e.g. RETRIEVAL_DOCUMENT
+
+EMBEDDINGS = EmbeddingService()
 
 @app.post("/v1/embeddings")
 async def create_embeddings(request: EmbeddingRequest):
@@ -759,23 +1041,24 @@ async def create_embeddings(request: EmbeddingRequest):
     Create embeddings for text input.
     Compatible with OpenAI embeddings API format.
     """
+    texts = request.input if isinstance(request.input, list) else [request.input]
+    if not texts:
+        return JSONResponse(status_code=400, content={"error": "input must not be empty", "agent": "Bandit"})
+    encoding_format = request.encoding_format or "float"
+    if encoding_format not in ("float", "base64"):
+        return JSONResponse(status_code=400, content={
+            "error": "encoding_format must be 'float' or 'base64'", "agent": "Bandit"})
+    if request.dimensions is not None and request.dimensions < 1:
+        return JSONResponse(status_code=400, content={"error": "dimensions must be positive", "agent": "Bandit"})
+
     try:
         client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
-        
-        # Handle both single string and list of strings
-        texts = request.input if isinstance(request.input, list) else [request.input]
-        
-        embeddings_data = []
-        for i, text in enumerate(texts):
-            result = client.models.embed_content(
-                model=request.model,
-                content=text
-            )
-            embeddings_data.append({
-                "object": "embedding",
-                "index": i,
-                "embedding": result.embedding if hasattr(result, 'embedding') else result.embeddings[0].values
-            })
+        vectors = await EMBEDDINGS.embed(client, texts, model=request.model, task_type=request.task_type,
+                                         dimensions=request.dimensions)
+        embeddings_data = [
+            {"object": "embedding", "index": i, "embedding": encode_vector(vector, encoding_format)}
+            for i, vector in enumerate(vectors)
+        ]
         
         return {
             "object": "list",
@@ -790,7 +1073,12 @@ async def create_embeddings(request: EmbeddingRequest):
         
     except Exception as e:
         print(f"[EMBEDDINGS ERROR] {e}")
-        return JSONResponse(status_code=500, content={"error": str(e), "agent": "Bandit"})
+        return error_response(e)
+
+@app.get("/v1/embeddings/stats")
+async def embeddings_stats():
+    """Embedding batching and cache statistics."""
+    return EMBEDDINGS.stats()
 
 # ─────────────────────────────────────────────────────────────────────────────
 # TEXT-TO-SPEECH (TTS) - Bandit's Voice
@@ -807,59 +1095,181 @@ class TTSRequest(BaseModel):
     model: Optional[str] = TTS_MODEL
     style: Optional[str] = None  # Natural language style prompt
 
+TTS_CACHE = build_tts_cache_from_env()
+TTS_FLIGHTS = SingleFlight("tts")
+
+def tts_speech_text(text: str, style: Optional[str]) -> str:
+    """Prompt sent to the TTS model (style as a natural language prefix)."""
+    return f"[{style}] {text}" if style else text
+
+def tts_config(voice: str) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        speech_config=types.SpeechConfig(
+            voice_config=types.VoiceConfig(
+                prebuilt_voice_config=types.PrebuiltVoiceConfig(
+                    voice_name=voice
+                )
+            )
+        ),
+        response_modalities=["AUDIO"],
+    )
+
+async def synthesize_speech(speech_text: str, voice: str, model: str) -> tuple:
+    """(audio bytes, mime type) from Gemini TTS; raises if no audio came back."""
+    client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
+    response = await generate_content(client, "tts", model=model, contents=speech_text, config=tts_config(voice))
+    if response.candidates and response.candidates[0].content.parts:
+        for part in response.candidates[0].content.parts:
+            if getattr(part, 'inline_data', None) and part.inline_data.data:
+                return part.inline_data.data, part.inline_data.mime_type or "audio/wav"
+    raise ValueError("No audio generated")
+
+async def cached_speech(text: str, voice: str, model: str, style: Optional[str]) -> tuple:
+    """(audio bytes, cache hit?) - identical concurrent misses share one synthesis."""
+    key = tts_key(text, voice, model, style)
+    cached = await asyncio.to_thread(TTS_CACHE.get, key)
+    if cached:
+        return cached.data, True
+
+    async def synthesize():
+        start = time.perf_counter()
+        audio, mime_type = await synthesize_speech(tts_speech_text(text, style), voice, model)
+        await asyncio.to_thread(TTS_CACHE.set, key, audio, mime_type, time.perf_counter() - start)
+        return audio
+
+    return await TTS_FLIGHTS.do(key, synthesize), False
+
 @app.post("/tts")
 async def text_to_speech(request: TTSRequest):
     """
     Generate speech from text using Bandit's voice.
-    Returns base64-encoded audio.
+    Returns base64-encoded audio; repeated phrases are served from the TTS cache.
     """
     try:
-        client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
-        
-        # Build the prompt with style if provided
-        speech_text = request.text
-        if request.style:
-            speech_text = f"[{request.style}] {speech_text}"
-        
-        # Generate speech using Gemini TTS
-        response = client.models.generate_content(
-            model=request.model,
-            contents=speech_text,
-            config=types.GenerateContentConfig(
-                speech_config=types.SpeechConfig(
-                    voice_config=types.VoiceConfig(
-                        prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                            voice_name=request.voice
-                        )
-                    )
-                ),
-                response_modalities=["AUDIO"],
-            )
-        )
-        
-        # Extract audio data
-        audio_data = None
-        if response.candidates and response.candidates[0].content.parts:
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'inline_data') and part.inline_data:
-                    audio_data = part.inline_data.data
-                    break
-        
-        if audio_data:
-            import base64
-            return {
-                "audio": base64.b64encode(audio_data).decode('utf-8'),
-                "voice": request.voice,
-                "model": request.model,
-                "agent": "Bandit",
-                "format": "audio/wav"
-            }
-        else:
-            return JSONResponse(status_code=500, content={"error": "No audio generated", "agent": "Bandit"})
-        
+        audio_data, cached = await cached_speech(request.text, request.voice, request.model, request.style)
+        return {
+            "audio": base64.b64encode(audio_data).decode('utf-8'),
+            "voice": request.voice,
+            "model": request.model,
+            "agent": "Bandit",
+            "format": "audio/wav",
+            "cached": cached,
+        }
     except Exception as e:
         print(f"[TTS ERROR] {e}")
-        return JSONResponse(status_code=500, content={"error": str(e), "agent": "Bandit"})
+        return error_response(e)
+
+class TTSStreamRequest(TTSRequest):
+    """Request for /tts/stream: raw audio instead of base64 JSON."""
+    format: Optional[str] = "wav"  # "wav" (streaming header + PCM) or "pcm" (bare samples)
+
+async def open_speech_stream(key: str, speech_text: str, voice: str, model: str) -> tuple:
+    """
+    Start streamed synthesis and wait for the first audio chunk.
+    Returns (mime type, async iterator of audio bytes); the full clip is cached once the stream completes.
+    """
+    start = time.perf_counter()
+    client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
+    stream = generate_content_stream(client, "tts", model=model, contents=speech_text, config=tts_config(voice))
+
+    async def inline_parts():
+        async for response in stream:
+            for inline in audio_chunks(response):
+                yield inline
+
+    parts = inline_parts()
+    try:
+        first = await parts.__anext__()
+    except StopAsyncIteration:
+        raise ValueError("No audio generated")
+    except BaseException:
+        await stream.aclose()
+        raise
+    mime_type = first.mime_type or "audio/wav"
+
+    async def body():
+        received = [first.data]
+        completed = False
+        try:
+            yield first.data
+            async for inline in parts:
+                received.append(inline.data)
+                yield inline.data
+            completed = True
+        finally:
+            # Client gone mid-clip: release the tier slot now rather than at garbage collection
+            await parts.aclose()
+            await stream.aclose()
+        if completed:
+            await asyncio.to_thread(TTS_CACHE.set, key, b"".join(received), mime_type, time.perf_counter() - start)
+
+    return mime_type, body()
+
+@app.post("/tts/stream")
+async def text_to_speech_stream(request: TTSStreamRequest):
+    """
+    Stream Bandit's voice as raw audio (chunked transfer) while it is being synthesized.
+    Playback can start on the first chunk; cached clips are replayed from disk.
+    """
+    if request.format not in ("wav", "pcm"):
+        return JSONResponse(status_code=400, content={"error": "format must be 'wav' or 'pcm'", "agent": "Bandit"})
+    key = tts_key(request.text, request.voice, request.model, request.style)
+    cached = await asyncio.to_thread(TTS_CACHE.get, key)
+    if cached:
+        mime_type = cached.mime_type
+        async def replay():
+            for chunk in split_chunks(cached.data):
+                yield chunk
+        chunks = replay()
+    else:
+        try:
+            mime_type, chunks = await open_speech_stream(
+                key, tts_speech_text(request.text, request.style), request.voice, request.model)
+        except Exception as e:
+            print(f"[TTS STREAM ERROR] {e}")
+            return error_response(e)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-TTS-Cached": str(bool(cached)).lower()}
+    if not is_pcm(mime_type):  # already a container format, pass it through
+        return StreamingResponse(chunks, media_type=mime_type, headers=headers)
+    fmt = parse_pcm_mime(mime_type)
+    headers.update({"X-Audio-Sample-Rate": str(fmt.rate), "X-Audio-Channels": str(fmt.channels),
+                    "X-Audio-Bits": str(fmt.bits)})
+    if request.format == "pcm":
+        return StreamingResponse(chunks, media_type=fmt.media_type, headers=headers)
+
+    async def wav():
+        yield wav_header(fmt)
+        async for chunk in chunks:
+            yield chunk
+    return StreamingResponse(wav(), media_type="audio/wav", headers=headers)
+
+class TTSPrewarmRequest(BaseModel):
+    """Phrases to synthesize into the TTS cache ahead of time."""
+    phrases: List[str]
+    voice: Optional[str] = BANDIT_VOICE
+    model: Optional[str] = TTS_MODEL
+    style: Optional[str] = None
+
+async def prewarm_tts(phrases: List[str], voice: str = BANDIT_VOICE, model: str = TTS_MODEL,
+                      style: Optional[str] = None) -> dict:
+    async def synthesize(speech_text: str):
+        with priority_class(PRIORITY_BACKGROUND):
+            return await synthesize_speech(speech_text, voice, model)
+    return await TTS_CACHE.prewarm(
+        [(tts_key(p, voice, model, style), tts_speech_text(p, style)) for p in phrases], synthesize,
+    )
+
+@app.post("/tts/cache/prewarm")
+async def tts_cache_prewarm(request: TTSPrewarmRequest):
+    """Synthesize phrases that are not cached yet (greetings, confirmations, error lines)."""
+    counts = await prewarm_tts(request.phrases, request.voice, request.model, request.style)
+    return {**counts, "stats": TTS_CACHE.stats(), "agent": "Bandit"}
+
+@app.get("/tts/cache")
+async def tts_cache_stats():
+    """TTS cache hit rate, bytes and synthesis time saved."""
+    return TTS_CACHE.stats()
 
 @app.get("/tts/voices")
 async def list_voices():
@@ -884,10 +1294,10 @@ async def list_voices():
 async def get_cached_response(prompt: str = ""):
     """Retrieve a cached background response if available."""
     if not prompt:
-        return {"cached": False, "cache_size": len(BACKGROUND_CACHE)}
+        return {"cached": False, "cache_size": len(BACKGROUND_CACHE), "stats": BACKGROUND_CACHE.stats()}
     
     key = cache_key(prompt)
-    cached = cache_get(key)
+    cached = await cache_get(key)
     
     if cached:
         return {
@@ -899,6 +1309,58 @@ async def get_cached_response(prompt: str = ""):
     
     return {"cached": False, "key": key[:8]}
 
+# ─────────────────────────────────────────────────────────────────────────────
+# SEMANTIC CACHE (near-duplicate instant prompts)
+# ─────────────────────────────────────────────────────────────────────────────
+
+SEMANTIC_CACHE = SemanticCache()
+
+def embed_for_semantic_cache(text: str) -> asyncio.Task:
+    """Start embedding a prompt for the semantic cache (the task's vector is None if embedding fails)."""
+    return asyncio.ensure_future(_embed_for_semantic_cache(text))
+
+async def semantic_lookup(mode: str, embedding: asyncio.Task, timeout: float = SEMANTIC_EMBED_TIMEOUT):
+    """Near-duplicate hit, or None; a slow embedding skips the lookup instead of delaying the model call."""
+    try:
+        vector = await asyncio.wait_for(asyncio.shield(embedding), timeout)
+    except asyncio.TimeoutError:
+        SEMANTIC_CACHE.embed_timeouts += 1
+        print(f"[SEMANTIC CACHE] Embedding slower than {timeout:.2f}s, skipping the lookup")
+        return None
+    return SEMANTIC_CACHE.lookup(mode, vector) if vector is not None else None
+
+def remember_semantic_answer(mode: str, embedding: asyncio.Task, prompt: str, answer: str):
+    """Add an answer to the semantic cache once its prompt's embedding is ready (now, or in the background)."""
+    def add(task: asyncio.Task):
+        if not task.cancelled() and task.result() is not None:
+            SEMANTIC_CACHE.add(mode, task.result(), prompt, answer)
+    embedding.add_done_callback(add)
+
+async def _embed_for_semantic_cache(text: str) -> Optional[List[float]]:
+    try:
+        client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
+        vectors = await EMBEDDINGS.embed(client, [text], model=SEMANTIC_EMBED_MODEL,
+                                         task_type="SEMANTIC_SIMILARITY", dimensions=SEMANTIC_EMBED_DIM)
+        return vectors[0].tolist()
+    except Exception as e:
+        print(f"[SEMANTIC CACHE] Embedding failed: {e}")
+        return None
+
+class SemanticFalseHitRequest(BaseModel):
+    """Report a semantic cache answer that did not fit the prompt."""
+    entry_id: int
+
+@app.get("/v1/semantic-cache")
+async def semantic_cache_stats():
+    """Semantic cache hit/miss/false-hit metrics and per-mode policy."""
+    return SEMANTIC_CACHE.stats()
+
+@app.post("/v1/semantic-cache/false-hit")
+async def semantic_cache_false_hit(request: SemanticFalseHitRequest):
+    """Count a false hit (entry id comes from the X-Bandit-Cache header) and evict it."""
+    removed = SEMANTIC_CACHE.report_false_hit(request.entry_id)
+    return {"removed": removed, "false_hits": SEMANTIC_CACHE.false_hits}
+
 # Models
 class Message(BaseModel):
     role: str
@@ -917,6 +1379,7 @@ class ChatCompletionRequest(BaseModel):
     max_tokens: Optional[int] = None
     stream: bool = False
     thinking_mode: Optional[str] = "auto"  # 'instant' = flash-lite bypass, 'thinking' = full reasoning, 'auto' = adaptive
+    session_id: Optional[str] = None  # server keeps history; messages then holds only the new turn
 
 class ChatCompletionResponse(BaseModel):
     id: str
@@ -925,122 +1388,61 @@ class ChatCompletionResponse(BaseModel):
     model: str
     choices: List[Choice]
     usage: Dict[str, int]
+    session_id: Optional[str] = None
 
 # Deep thinking detection
 def detect_deep_thinking(prompt: str) -> bool:
     """Detect if the user's prompt requests deep thinking/reasoning."""
-    prompt_lower = prompt.lower()
-    for pattern in DEEP_THINK_PATTERNS:
-        if re.search(pattern, prompt_lower, re.IGNORECASE):
-            return True
-    return False
+    return "deep_think" in classify_prompt(prompt)
 
 def cache_key(prompt: str) -> str:
     """Generate a cache key from prompt."""
     import hashlib
-    return hashlib.md5(prompt.encode()).hexdigest()[:16]
-
-def cache_set(key: str, value: str):
-    """Store a value in the background cache."""
-    with CACHE_LOCK:
-        if key in BACKGROUND_CACHE:
-            BACKGROUND_CACHE.move_to_end(key)
-        BACKGROUND_CACHE[key] = {"response": value, "timestamp": time.time()}
-        while len(BACKGROUND_CACHE) > CACHE_MAX_SIZE:
-            BACKGROUND_CACHE.popitem(last=False)
-
-def cache_get(key: str) -> Optional[str]:
-    """Retrieve a value from the background cache."""
-    with CACHE_LOCK:
-        if key in BACKGROUND_CACHE:
-            BACKGROUND_CACHE.move_to_end(key)
-            return BACKGROUND_CACHE[key]["response"]
-        return None
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+async def cache_set(key: str, value: str, ttl: Optional[float] = None):
+    """Store a value in the background cache (off the event loop: the L2 is SQLite)."""
+    await asyncio.to_thread(BACKGROUND_CACHE.set, key, value, ttl)
+
+async def cache_get(key: str) -> Optional[str]:
+    """Retrieve a value from the background cache (off the event loop: the L2 is SQLite)."""
+    return await asyncio.to_thread(BACKGROUND_CACHE.get, key)
+
+async def background_reasoning_query(job: dict):
+    """Job handler: query the Reasoning Engine and cache the result."""
+    prompt, key = job["prompt"], job["cache_key"]
+    if await cache_get(key):
+        return
+    print(f"[BACKGROUND] Starting Reasoning Engine query for key: {key[:8]}...")
+    start = time.time()
+    with priority_class(PRIORITY_BACKGROUND):
+        bandit_response = await _query_reasoning_engine(prompt)
+    await cache_set(key, bandit_response)
+    elapsed = time.time() - start
+    print(f"[BACKGROUND] Cached response in {elapsed:.2f}s for key: {key[:8]}")
+
+# Bounded worker pool for Reasoning Engine enrichment (dedup by cache key, load shedding)
+ENRICHMENT_QUEUE = build_job_queue_from_env()
+ENRICHMENT_QUEUE.register("reasoning_enrichment", background_reasoning_query)
+
+async def spawn_background_query(prompt: str, priority: int = PRIORITY_NORMAL) -> bool:
+    """Queue a background Reasoning Engine fill unless cached, queued or shed."""
+    key = cache_key(prompt)
+    if await cache_get(key):
+        return False
+    return ENRICHMENT_QUEUE.submit("reasoning_enrichment", key, {"prompt": prompt, "cache_key": key}, priority)
 
-def background_reasoning_query(prompt: str, cache_key_str: str):
-    """Run a background query to the Reasoning Engine and cache the result."""
-    try:
-        print(f"[BACKGROUND] Starting Reasoning Engine query for key: {cache_key_str[:8]}...")
-        start = time.time()
-        
-        token = get_auth_token()
-        if not token:
-            print("[BACKGROUND] Failed to get auth token")
-            return
-        
-        resource_name = get_engine_resource_name(DEFAULT_PROJECT, DEFAULT_LOCATION, DEFAULT_ENGINE_ID)
-        api_endpoint = f"https://{DEFAULT_LOCATION}-aiplatform.googleapis.com/v1beta1/{resource_name}:query"
-        
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "input": {"prompt": prompt},
-            "classMethod": "query"
-        }
-        
-        response = requests.post(api_endpoint, headers=headers, json=payload, timeout=120)
-        
-        if response.status_code == 200:
-            result_json = response.json()
-            bandit_response = result_json.get("output", "")
-            if isinstance(bandit_response, dict):
-                bandit_response = str(bandit_response)
-            
-            cache_set(cache_key_str, bandit_response)
-            elapsed = time.time() - start
-            print(f"[BACKGROUND] Cached response in {elapsed:.2f}s for key: {cache_key_str[:8]}")
-        else:
-            print(f"[BACKGROUND] Error: {response.status_code}")
-            
-    except Exception as e:
-        print(f"[BACKGROUND ERROR] {e}")
+@app.get("/v1/jobs")
+async def background_jobs():
+    """Background enrichment queue depth, counters and job latency."""
+    return ENRICHMENT_QUEUE.stats()
 
-# Auth Helper with caching
-def get_auth_token():
-    """Get authentication token for GCP API calls. Uses cache to avoid latency spikes."""
-    global AUTH_TOKEN_CACHE
-    
-    # Check cache first
-    now = time.time()
-    if AUTH_TOKEN_CACHE["token"] and AUTH_TOKEN_CACHE["expires_at"] > now:
-        return AUTH_TOKEN_CACHE["token"]  # Return cached token (silent - no print)
-    
-    try:
-        credentials, project = google.auth.default()
-        
-        if not credentials.valid or credentials.expired:
-            credentials.refresh(GoogleRequest())
-        
-        token = credentials.token
-        if token:
-            AUTH_TOKEN_CACHE["token"] = token
-            AUTH_TOKEN_CACHE["expires_at"] = now + AUTH_TOKEN_TTL
-            print(f"[AUTH] Token refreshed and cached for {AUTH_TOKEN_TTL//60} min")
-            return token
-            
-    except Exception as e:
-        print(f"[AUTH ERROR] {e}")
-        # Fallback to gcloud
-        try:
-            import subprocess
-            result = subprocess.run(
-                ["gcloud", "auth", "print-access-token"],
-                capture_output=True, text=True, shell=True, timeout=10
-            )
-            if result.returncode == 0:
-                token = result.stdout.strip().split('\n')[-1]
-                if token.startswith('ya29.'):
-                    AUTH_TOKEN_CACHE["token"] = token
-                    AUTH_TOKEN_CACHE["expires_at"] = now + AUTH_TOKEN_TTL
-                    print(f"[AUTH] Token from gcloud, cached for {AUTH_TOKEN_TTL//60} min")
-                    return token
-        except Exception as e2:
-            print(f"[AUTH ERROR] Fallback failed: {e2}")
-    
-    return None
+# Auth Helper (shared credential broker: background refresh, locked, never blocks on a valid token)
+CREDENTIALS = get_broker()
+
+def get_auth_token() -> Optional[str]:
+    """Get authentication token for GCP API calls."""
+    return CREDENTIALS.get_token()
 
 def parse_gemini_content(content: Union[str, List[Dict[str, Any]]]) -> tuple[str, Any]:
     """
@@ -1069,7 +1471,8 @@ def parse_gemini_content(content: Union[str, List[Dict[str, Any]]]) -> tuple[str
                 try:
                     header, encoded = image_url.split(",", 1)
                     mime_type = header.split(":")[1].split(";")[0]
-                    data = base64.b64decode(encoded)
+                    with span("decode_image", encoded_bytes=len(encoded)):
+                        data = base64.b64decode(encoded)
                     gemini_parts.append(types.Part.from_bytes(data=data, mime_type=mime_type))
                     text_parts.append("[Image]")
                 except Exception as e:
@@ -1081,17 +1484,486 @@ def parse_gemini_content(content: Union[str, List[Dict[str, Any]]]) -> tuple[str
     prompt_text = "\n".join(text_parts)
     return prompt_text, gemini_parts
 
+# ─────────────────────────────────────────────────────────────────────────────
+# MULTI-TURN CONVERSATIONS (OpenAI messages -> Gemini contents)
+# ─────────────────────────────────────────────────────────────────────────────
+
+ENGINE_HISTORY_MESSAGES = 20  # the Reasoning Engine only takes a prompt string
+
+@dataclass
+class Conversation:
+    """An OpenAI message list split into a stable prefix and the current user turn."""
+    system_instruction: str
+    history: List[types.Content]  # every turn before the current user message
+    prompt: str                   # text of the current user message
+    current: Any                  # str or Parts, as returned by parse_gemini_content
+    transcript: str = ""          # recent history as plain text
+    cache_name: Optional[str] = None  # Gemini cached_content used for the history, if any
+
+    def engine_prompt(self, prompt: str) -> str:
+        """Prompt for the Reasoning Engine with recent history as context (CLI format)."""
+        return f"{self.transcript}\n\nCurrent query: {prompt}" if self.transcript else prompt
+
+def as_content(role: str, gemini_contents: Any) -> types.Content:
+    """Wrap parse_gemini_content output as a single Content turn."""
+    if isinstance(gemini_contents, str):
+        parts = [types.Part.from_text(text=gemini_contents)]
+    else:
+        parts = list(gemini_contents)
+    return types.Content(role=role, parts=parts)
+
+def parse_message(message: Message) -> SessionMessage:
+    """Decode one OpenAI message once (base64 images -> bytes Parts)."""
+    text, gemini_contents = parse_gemini_content(message.content)
+    wire_bytes = len(message.content) if isinstance(message.content, str) else len(json.dumps(message.content))
+    return SessionMessage(message.role, text, gemini_contents, wire_bytes)
+
+def build_conversation(messages: List[Message]) -> Conversation:
+    """Map OpenAI messages to Gemini: system messages extend the Bandit prompt, assistant -> model."""
+    return conversation_from_parsed([parse_message(m) for m in messages])
+
+def conversation_from_parsed(messages: List[SessionMessage]) -> Conversation:
+    """build_conversation for already-decoded messages (session history + delta)."""
+    last_user = next((i for i in range(len(messages) - 1, -1, -1) if messages[i].role == "user"), None)
+    if last_user is None:
+        raise HTTPException(status_code=400, detail="No user message found")
+    
+    system_parts = [BANDIT_SYSTEM_PROMPT]
+    history: List[types.Content] = []
+    transcript = []
+    for message in messages[:last_user]:
+        text, gemini_contents = message.text, message.contents
+        if message.role in ("system", "developer"):
+            if text.strip():
+                system_parts.append(text)
+            continue
+        if not text.strip() and not gemini_contents:
+            continue
+        role = "model" if message.role == "assistant" else "user"
+        if message.role == "tool":
+            text = f"[Tool result] {text}"
+            gemini_contents = text
+        content = as_content(role, gemini_contents)
+        if history and history[-1].role == role:
+            history[-1].parts.extend(content.parts)  # Gemini expects alternating turns
+        else:
+            history.append(content)
+        transcript.append(f"{'Bandit' if role == 'model' else 'User'}: {text}")
+    
+    prompt, current = messages[last_user].text, messages[last_user].contents
+    return Conversation(
+        system_instruction="\n\n".join(system_parts),
+        history=history,
+        prompt=prompt,
+        current=current,
+        transcript="\n".join(transcript[-ENGINE_HISTORY_MESSAGES:]),
+    )
+
+CONTEXT_CACHE = ContextCacheManager()
+
+def chat_fingerprint(mode: str, model: str, conversation: Conversation) -> str:
+    """Single-flight key; single-turn default-prompt requests keep the old key.
+
+    Built from the turn as the client sent it, before the [Current Time: ...]
+    stamp, so identical requests a second apart still coalesce.
+    """
+    current = conversation.current
+    if not conversation.history and conversation.system_instruction == BANDIT_SYSTEM_PROMPT:
+        return request_fingerprint(mode, model, current)
+    return request_fingerprint(mode, model, [conversation.system_instruction, *conversation.history,
+                                             as_content("user", current)])
+
+def conversation_request(client, model: str, config: types.GenerateContentConfig, conversation: Conversation,
+                         current: Any, use_cache: bool = True) -> tuple[Any, types.GenerateContentConfig, Optional[str]]:
+    """(contents, config, cached_content name) for a model call, reusing a cached history prefix."""
+    if not conversation.history:
+        return current, config, None
+    turn = [as_content("user", current)]
+    if not use_cache:
+        return conversation.history + turn, config, None
+    plan = CONTEXT_CACHE.plan(client, model, conversation.system_instruction, conversation.history, turn)
+    conversation.cache_name = plan.cached_content
+    return plan.contents, CONTEXT_CACHE.config_for(config, plan), plan.cached_content
+
+async def generate_conversation(client, tier: str, model: str, config: types.GenerateContentConfig,
+                                conversation: Conversation, current: Any):
+    """generate_content for a conversation; a stale cache handle is dropped and the call retried uncached."""
+    contents, request_config, cache_name = conversation_request(client, model, config, conversation, current)
+    try:
+        return await generate_content(client, tier, model=model, contents=contents, config=request_config)
+    except Exception as e:
+        if not cache_name or not is_stale_cache_error(e):
+            raise
+        print(f"[CONTEXT CACHE] Stale cache {cache_name}, retrying without it")
+        await CONTEXT_CACHE.invalidate(client, cache_name)
+        contents, request_config, _ = conversation_request(client, model, config, conversation, current,
+                                                           use_cache=False)
+        return await generate_content(client, tier, model=model, contents=contents, config=request_config)
+
+@app.get("/v1/context-cache")
+async def context_cache_stats():
+    """Gemini explicit context cache usage (created/renewed/evicted handles, hit rate)."""
+    return CONTEXT_CACHE.stats()
+
+# ─────────────────────────────────────────────────────────────────────────────
+# SESSIONS (client sends session_id + only the new message)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def forget_session_cache(session: Session):
+    """Evicted session: its Gemini cache handle is no longer worth paying storage for."""
+    if session.cache_name and GENAI_CLIENT:
+        asyncio.ensure_future(CONTEXT_CACHE.invalidate(GENAI_CLIENT, session.cache_name))
+
+SESSIONS = SessionStore(on_evict=forget_session_cache)
+
+class SessionCreateRequest(BaseModel):
+    """Optionally seed a session with an existing conversation."""
+    messages: List[Message] = []
+
+def remember_turn(session: Optional[Session], new_messages: List[SessionMessage], answer: str,
+                  conversation: Conversation):
+    """Store the delta and the assistant reply so the next turn only uploads its own message."""
+    if session is None or not answer:
+        return
+    if conversation.cache_name:
+        session.cache_name = conversation.cache_name
+    reply = SessionMessage("assistant", answer, answer, len(answer))
+    SESSIONS.record_turn(session, new_messages + [reply])
+
+def session_info(session: Session) -> dict:
+    return {
+        "session_id": session.id,
+        "messages": len(session.messages),
+        "turns": session.turns,
+        "stored_bytes": session.history_bytes(),
+        "created": int(session.created_at),
+        "idle_seconds": round(time.time() - session.last_access, 1),
+        "cache_name": session.cache_name,
+    }
+
+@app.post("/v1/sessions")
+async def create_session(request: SessionCreateRequest):
+    """Start a server-side conversation; pass the returned session_id to /v1/chat/completions."""
+    session = SESSIONS.create([parse_message(m) for m in request.messages])
+    return session_info(session)
+
+@app.get("/v1/sessions")
+async def sessions_stats():
+    """Session store size, evictions and upload bytes saved by delta requests."""
+    return SESSIONS.stats()
+
+@app.get("/v1/sessions/{session_id}")
+async def get_session(session_id: str):
+    session = SESSIONS.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return session_info(session)
+
+@app.delete("/v1/sessions/{session_id}")
+async def delete_session(session_id: str):
+    return {"deleted": SESSIONS.delete(session_id)}
+
+async def query_reasoning_engine(prompt: str, flight_prompt: Optional[str] = None) -> str:
+    """Query the Reasoning Engine over REST, raising HTTPException on failure.
+
+    `flight_prompt` (the prompt without its time stamp) keys single-flight coalescing.
+    """
+    return await CHAT_FLIGHTS.do(
+        request_fingerprint("auto", "bandit-reasoning-engine", flight_prompt or prompt),
+        lambda: _query_reasoning_engine(prompt),
+    )
+
+async def _query_reasoning_engine(prompt: str) -> str:
+    # Get Authentication (only leaves the event loop if no valid token is cached)
+    with span("auth"):
+        token = await CREDENTIALS.get_token_async()
+    if not token:
+        raise HTTPException(status_code=500, detail="Failed to get authentication token")
+    
+    resource_name = get_engine_resource_name(DEFAULT_PROJECT, DEFAULT_LOCATION, DEFAULT_ENGINE_ID)
+    api_endpoint = engine_endpoint(resource_name, DEFAULT_LOCATION)
+    
+    try:
+        print(f"[FULL PATH] Using Reasoning Engine...")
+        # Pooled keep-alive connection (HTTP/2 when available), no per-call TLS handshake
+        async with upstream_call("bandit-reasoning-engine", "engine"):
+            return await link_artifacts(
+                await engine_query_async(api_endpoint, prompt, token, deadline=ENGINE_DEFAULT_DEADLINE))
+    except AdmissionRejected:
+        raise
+    except EngineQueryError as e:
+        raise HTTPException(status_code=e.status_code, detail=f"Bandit Error: {e.body}")
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Bandit Request Timed Out")
+    except Exception as e:
+        print(f"Proxy Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ─────────────────────────────────────────────────────────────────────────────
+# HEDGED AUTO MODE (Reasoning Engine, hedged with the fast path)
+# ─────────────────────────────────────────────────────────────────────────────
+
+AUTO_HEDGER = Hedger()
+ROUTER = ModelRouter()
+
+async def fast_path_answer(conversation: Conversation, gemini_contents: Any) -> str:
+    """Instant-tier answer used as the auto-mode hedge."""
+    client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
+    response = await CHAT_FLIGHTS.do(
+        chat_fingerprint("instant", FAST_MODEL, conversation),
+        lambda: generate_conversation(client, "instant", FAST_MODEL, instant_config(conversation.system_instruction),
+                                      conversation, gemini_contents),
+    )
+    if not response.text:
+        raise RuntimeError(f"{FAST_MODEL} returned no text")
+    return response.text
+
+async def deep_think_answer(conversation: Conversation, gemini_contents: Any) -> str:
+    """Deep think answer, with its thought summary prepended for display."""
+    client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
+    response = await CHAT_FLIGHTS.do(
+        chat_fingerprint("thinking", DEEP_THINK_MODEL, conversation),
+        lambda: generate_conversation(client, "thinking", DEEP_THINK_MODEL,
+                                      deep_think_config(conversation.system_instruction),
+                                      conversation, gemini_contents),
+    )
+    thoughts = ""
+    for part in response.candidates[0].content.parts:
+        if hasattr(part, 'thought') and part.thought and part.text:
+            thoughts += part.text + "\n"
+    if not response.text:
+        raise RuntimeError(f"{DEEP_THINK_MODEL} returned no text")
+    if thoughts:
+        # Thoughts go first so they can be viewed
+        return f"🧠 **Bandit's Thoughts:**\n* {thoughts.strip()} *\n\n---\n\n" + response.text
+    return response.text
+
+def engine_route(conversation: Conversation, prompt: str):
+    return ("bandit-reasoning-engine", lambda: query_reasoning_engine(conversation.engine_prompt(prompt),
+                                                                      conversation.engine_prompt(conversation.prompt)))
+
+async def hedged_auto_answer(conversation: Conversation, prompt: str, gemini_contents: Any) -> tuple[str, str]:
+    """(model_used, answer): the Reasoning Engine, hedged with the fast path once it runs past its p95.
+
+    With a breaker open (or the engine scoring worse than the fast path) there
+    is nothing to race: the router goes straight to the healthy endpoint.
+    """
+    engine = engine_route(conversation, prompt)
+    fast = (FAST_MODEL, lambda: fast_path_answer(conversation, gemini_contents))
+    if ROUTER.order([engine[0], fast[0]]) == [engine[0], fast[0]]:
+        return await AUTO_HEDGER.run(ROUTER.observed(*engine), ROUTER.observed(*fast))
+    return await ROUTER.run([engine, fast])
+
+def instant_config(system_instruction: str = BANDIT_SYSTEM_PROMPT) -> types.GenerateContentConfig:
+    """Generation config for the instant (fast path) tier."""
+    return types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        temperature=1.0,  # Gemini 3 recommended
+        max_output_tokens=1024,
+        thinking_config=types.ThinkingConfig(thinking_level="low"),
+    )
+
+def deep_think_config(system_instruction: str = BANDIT_SYSTEM_PROMPT) -> types.GenerateContentConfig:
+    """Generation config for the deep think tier (thought summaries included)."""
+    return types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        temperature=1.0,  # Gemini 3 recommended
+        max_output_tokens=8192,
+        thinking_config=types.ThinkingConfig(thinking_level="high", include_thoughts=True),
+    )
+
+# ─────────────────────────────────────────────────────────────────────────────
+# SSE STREAMING (stream=true)
+# ─────────────────────────────────────────────────────────────────────────────
+
+FINISH_REASON_MAP = {
+    "STOP": "stop",
+    "MAX_TOKENS": "length",
+    "SAFETY": "content_filter",
+    "RECITATION": "content_filter",
+    "BLOCKLIST": "content_filter",
+    "PROHIBITED_CONTENT": "content_filter",
+    "SPII": "content_filter",
+}
+
+def map_finish_reason(finish_reason: Any) -> str:
+    """Translate a Gemini FinishReason into the OpenAI vocabulary."""
+    if finish_reason is None:
+        return "stop"
+    name = getattr(finish_reason, "name", str(finish_reason))
+    return FINISH_REASON_MAP.get(name, "stop")
+
+def usage_from_metadata(usage_metadata: Any) -> Dict[str, int]:
+    """Build an OpenAI usage block from Gemini usage_metadata."""
+    prompt_tokens, completion_tokens, total_tokens = usage_counts(usage_metadata)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": total_tokens}
+
+def sse_chunk(completion_id: str, created: int, model: str, delta: dict,
+              finish_reason: Optional[str] = None, usage: Optional[dict] = None) -> str:
+    """Format one `chat.completion.chunk` as an SSE event."""
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage is not None:
+        chunk["usage"] = usage
+    return f"data: {json.dumps(chunk)}\n\n"
+
+async def stream_single_delta(model: str, get_text, on_answer=None):
+    """SSE stream for an answer that arrives in one piece (Reasoning Engine, caches)."""
+    created = int(time.time())
+    completion_id = f"chatcmpl-{created}"
+    yield sse_chunk(completion_id, created, model, {"role": "assistant"})
+    try:
+        text = await get_text()
+    except Exception as e:
+        print(f"[STREAM ERROR] {model}: {e}")
+        yield stream_error_event(e)
+        yield "data: [DONE]\n\n"
+        return
+    yield sse_chunk(completion_id, created, model, {"content": text})
+    if on_answer:
+        on_answer(text)
+    yield sse_chunk(completion_id, created, model, {}, finish_reason="stop",
+                    usage=request_scope().usage())  # 0 for cache hits, like the non-streaming response
+    yield "data: [DONE]\n\n"
+
+async def stream_chat_completion(thinking_mode: str, prompt: str, gemini_contents: Any, start_time: float,
+                                 semantic_embedding: Optional[asyncio.Task] = None,
+                                 conversation: Optional[Conversation] = None, on_answer=None):
+    """
+    Yield OpenAI-compatible SSE deltas.
+    Instant and deep think stream tokens as Gemini produces them; thought
+    summaries go out as `reasoning_content` deltas. Auto mode (Reasoning
+    Engine) has no streaming API, so its answer is sent as a single delta.
+    """
+    if conversation is None:
+        conversation = Conversation(BANDIT_SYSTEM_PROMPT, [], prompt, gemini_contents)
+    if thinking_mode not in ("instant", "thinking"):
+        async def hedged_text():
+            return (await hedged_auto_answer(conversation, prompt, gemini_contents))[1]
+        async for event in stream_single_delta("bandit-reasoning-engine", hedged_text, on_answer):
+            yield event
+        return
+    
+    if thinking_mode == "instant":
+        model, tier, config = FAST_MODEL, "instant", instant_config(conversation.system_instruction)
+    else:
+        model, tier, config = DEEP_THINK_MODEL, "thinking", deep_think_config(conversation.system_instruction)
+    health = ROUTER.health(model)
+    engine = engine_route(conversation, prompt)
+    if not health.allow():
+        print(f"[ROUTER] {model} breaker open, answering from the Reasoning Engine")
+        health.skips += 1
+        async def engine_text():
+            return (await ROUTER.run([engine]))[1]
+        async for event in stream_single_delta("bandit-reasoning-engine", engine_text, on_answer):
+            yield event
+        return
+    
+    created = int(time.time())
+    completion_id = f"chatcmpl-{created}"
+    
+    client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
+    contents, request_config, cache_name = conversation_request(client, model, config, conversation, gemini_contents)
+    yield sse_chunk(completion_id, created, model, {"role": "assistant"})
+    
+    finish_reason = None
+    usage_metadata = None
+    first_token_at = None
+    answer_parts = []
+    while True:
+        try:
+            async for chunk in generate_content_stream(client, tier, model=model, contents=contents, config=request_config):
+                if chunk.usage_metadata:
+                    usage_metadata = chunk.usage_metadata
+                if not chunk.candidates:
+                    continue
+                candidate = chunk.candidates[0]
+                if candidate.finish_reason:
+                    finish_reason = candidate.finish_reason
+                if not candidate.content or not candidate.content.parts:
+                    continue
+                for part in candidate.content.parts:
+                    if not part.text:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                        print(f"[STREAM] First token from {model} in {first_token_at - start_time:.2f}s")
+                    if part.thought:
+                        yield sse_chunk(completion_id, created, model, {"reasoning_content": part.text})
+                    else:
+                        answer_parts.append(part.text)
+                        yield sse_chunk(completion_id, created, model, {"content": part.text})
+        except Exception as e:
+            if cache_name and first_token_at is None and is_stale_cache_error(e):
+                # Nothing sent yet: drop the stale cache handle and replay uncached
+                print(f"[CONTEXT CACHE] Stale cache {cache_name}, retrying without it")
+                await CONTEXT_CACHE.invalidate(client, cache_name)
+                contents, request_config, cache_name = conversation_request(
+                    client, model, config, conversation, gemini_contents, use_cache=False)
+                continue
+            print(f"[STREAM ERROR] {model}: {e}")
+            health.record(e, time.time() - start_time)
+            if first_token_at is None:
+                # Nothing streamed yet: the answer can still come from the fallback tier, in one delta
+                try:
+                    model, answer = await ROUTER.run([engine])
+                except Exception as fallback_error:
+                    e = fallback_error
+                else:
+                    answer_parts = [answer]
+                    yield sse_chunk(completion_id, created, model, {"content": answer})
+                    finish_reason, usage_metadata = None, None
+                    break
+            yield stream_error_event(e)
+            yield "data: [DONE]\n\n"
+            return
+        health.record(None, time.time() - start_time)
+        break
+    
+    print(f"[STREAM] {model} completed in {time.time() - start_time:.2f}s")
+    if on_answer:
+        on_answer("".join(answer_parts))
+    if semantic_embedding is not None and model != engine[0]:
+        remember_semantic_answer(thinking_mode, semantic_embedding, prompt, "".join(answer_parts))
+    if thinking_mode == "instant" and model == FAST_MODEL:
+        # Same background enrichment as the non-streaming fast path
+        await spawn_background_query(prompt)
+    yield sse_chunk(completion_id, created, model, {}, finish_reason=map_finish_reason(finish_reason),
+                    usage=usage_from_metadata(usage_metadata))
+    yield "data: [DONE]\n\n"
+
 # Proxy Endpoint
 @app.post("/v1/chat/completions", response_model=ChatCompletionResponse)
-async def chat_completions(request: ChatCompletionRequest):
+async def chat_completions(request: ChatCompletionRequest, http_response: Response):
     start_time = time.time()
     
-    # Extract Prompt
-    last_user_msg = next((m for m in reversed(request.messages) if m.role == "user"), None)
-    if not last_user_msg:
-        raise HTTPException(status_code=400, detail="No user message found")
+    # Split the messages into history (cacheable prefix) and the current user turn.
+    # With a session the stored (already decoded) history is prepended to the delta.
+    session = None
+    new_messages: List[SessionMessage] = []
+    session_header = {}
+    if request.session_id:
+        session = SESSIONS.get(request.session_id)
+        if session is None:
+            raise HTTPException(status_code=404,
+                                detail="Session not found or expired; create a new session and resend the history")
+        with span("parse", messages=len(request.messages)):
+            new_messages = [parse_message(m) for m in request.messages]
+            conversation = conversation_from_parsed(session.messages + new_messages)
+        session_header = {"X-Bandit-Session": session.id}
+        http_response.headers.update(session_header)
+    else:
+        with span("parse", messages=len(request.messages)):
+            conversation = build_conversation(request.messages)
+    original_prompt, gemini_contents = conversation.prompt, conversation.current
     
-    original_prompt, gemini_contents = parse_gemini_content(last_user_msg.content)
+    def on_answer(answer: str):
+        remember_turn(session, new_messages, answer, conversation)
     
     # Skip time injection for instant mode (reduces latency)
     if request.thinking_mode == "instant":
@@ -1114,144 +1986,80 @@ async def chat_completions(request: ChatCompletionRequest):
     if thinking_mode == "auto" and detect_deep_thinking(original_prompt):
         print(f"[AUTO] Detected deep thinking request in prompt, upgrading to 'thinking' mode")
         thinking_mode = "thinking"
+    set_request_mode(thinking_mode)
     
-    # FAST PATH: Use gemini-3-flash-preview directly (bypasses Reasoning Engine routing)
-    if thinking_mode == "instant":
-        max_retries = 2
-        for attempt in range(max_retries + 1):
-            try:
-                print(f"[FAST PATH] Using {FAST_MODEL} (Attempt {attempt+1})...")
-                # Gemini 3.x uses 'global' location for Vertex AI
-                client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
-                
-                response = client.models.generate_content(
-                    model=FAST_MODEL,
-                    contents=gemini_contents,
-                    config=types.GenerateContentConfig(
-                        system_instruction=BANDIT_SYSTEM_PROMPT,
-                        temperature=1.0,  # Gemini 3 recommended
-                        max_output_tokens=1024,
-                        thinking_config=types.ThinkingConfig(thinking_level="low"),
-                    )
+    # SEMANTIC CACHE: serve near-duplicate text prompts without a model call. Entries are answers under the
+    # default system prompt, so requests with their own system message never read or fill it
+    semantic_embedding = None
+    if SEMANTIC_CACHE.enabled(thinking_mode) and isinstance(gemini_contents, str) and not conversation.history \
+            and conversation.system_instruction == BANDIT_SYSTEM_PROMPT:
+        with span("semantic_cache"):
+            semantic_embedding = embed_for_semantic_cache(original_prompt)
+            hit = await semantic_lookup(thinking_mode, semantic_embedding)
+        if hit:
+            print(f"[SEMANTIC CACHE] Hit (score {hit.score:.3f}) in {time.time() - start_time:.2f}s")
+            set_request_mode("cached")
+            cache_header = {"X-Bandit-Cache": f"semantic; entry={hit.entry_id}; score={hit.score:.4f}"}
+            if request.stream:
+                async def cached_text():
+                    return hit.response
+                return StreamingResponse(
+                    stream_single_delta("bandit-semantic-cache", cached_text, on_answer),
+                    media_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **cache_header, **session_header},
                 )
-                
-                bandit_response = response.text
-                model_used = FAST_MODEL
-                elapsed = time.time() - start_time
-                print(f"[FAST PATH] Completed in {elapsed:.2f}s")
-                
-                # Fire background query to Reasoning Engine for richer response
-                key = cache_key(prompt)
-                if not cache_get(key):  # Only if not already cached
-                    bg_thread = threading.Thread(
-                        target=background_reasoning_query,
-                        args=(prompt, key),
-                        daemon=True
-                    )
-                    bg_thread.start()
-                    print(f"[FAST PATH] Spawned background query thread")
-                break # Success
-                
-            except Exception as e:
-                print(f"[FAST PATH ERROR] Attempt {attempt+1} failed: {e}")
-                if attempt < max_retries and ("429" in str(e) or "resource exhausted" in str(e).lower()):
-                    wait_time = (2 ** attempt) + 1
-                    print(f"[SELF-HEALING] Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
-                    continue
-                thinking_mode = "auto"  # Fall back to full path if retries exhausted
-                break
+            http_response.headers.update(cache_header)
+            bandit_response = hit.response
+            model_used = "bandit-semantic-cache"
+            thinking_mode = "cached"
     
-    # DEEP THINK PATH: Use gemini-3.1-pro-preview for maximum reasoning
-    if thinking_mode == "thinking" and not bandit_response:
-        max_retries = 2
-        for attempt in range(max_retries + 1):
-            try:
-                print(f"[DEEP THINK] Using {DEEP_THINK_MODEL} (Attempt {attempt+1})...")
-                client = GENAI_CLIENT or genai.Client(vertexai=True, project=DEFAULT_PROJECT, location="global")
-                
-                # System instruction for deep thinking mode
-                system_instruction = BANDIT_SYSTEM_PROMPT
-                
-                response = client.models.generate_content(
-                    model=DEEP_THINK_MODEL,
-                    contents=gemini_contents,
-                    config=types.GenerateContentConfig(
-                        system_instruction=system_instruction,
-                        temperature=1.0,  # Gemini 3 recommended
-                        max_output_tokens=8192,
-                        thinking_config=types.ThinkingConfig(thinking_level="high", include_thoughts=True),
-                    )
-                )
-                
-                # Extract thoughts
-                thoughts = ""
-                for part in response.candidates[0].content.parts:
-                    if hasattr(part, 'thought') and part.thought and part.text:
-                        thoughts += part.text + "\n"
-                        
-                bandit_response = response.text
-                if thoughts:
-                    # Append thoughts to the start of the response so they can be viewed
-                    bandit_response = f"🧠 **Bandit's Thoughts:**\n* {thoughts.strip()} *\n\n---\n\n" + bandit_response
-                    
-                model_used = DEEP_THINK_MODEL
-                elapsed = time.time() - start_time
-                print(f"[DEEP THINK] Completed in {elapsed:.2f}s")
-                break # Success
-                
-            except Exception as e:
-                print(f"[DEEP THINK ERROR] Attempt {attempt+1} failed: {e}")
-                if attempt < max_retries and ("429" in str(e) or "resource exhausted" in str(e).lower()):
-                    wait_time = (2 ** attempt) + 1
-                    print(f"[SELF-HEALING] Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
-                    continue
-                print(f"[DEEP THINK] All retries failed, falling back to Reasoning Engine...")
-                thinking_mode = "auto"  # Fall back to full path
-                break
+    # Only genuine auto requests are hedged (fast/deep fallbacks already tried the fast path)
+    hedge_auto = thinking_mode == "auto"
     
-    # FULL PATH: Use Reasoning Engine (for 'thinking' and 'auto' modes, or fallback)
+    # STREAMING: OpenAI-compatible SSE deltas (time-to-first-token instead of total latency)
+    if request.stream:
+        return StreamingResponse(
+            stream_chat_completion(thinking_mode, prompt, gemini_contents, start_time, semantic_embedding, conversation,
+                                   on_answer),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **session_header},
+        )
+    
+    # ROUTED PATHS: instant (gemini-3-flash-preview) and deep think (gemini-3.1-pro-preview) fall back to
+    # the Reasoning Engine. The router retries transient errors with jittered backoff, and a tier whose
+    # breaker is open is skipped without a call instead of being rediscovered through retries
     if not bandit_response:
-        # Get Authentication
-        token = get_auth_token()
-        if not token:
-            raise HTTPException(status_code=500, detail="Failed to get authentication token")
-        
-        resource_name = get_engine_resource_name(DEFAULT_PROJECT, DEFAULT_LOCATION, DEFAULT_ENGINE_ID)
-        api_endpoint = f"https://{DEFAULT_LOCATION}-aiplatform.googleapis.com/v1beta1/{resource_name}:query"
-        
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "input": {"prompt": prompt},
-            "classMethod": "query"
-        }
-        
         try:
-            print(f"[FULL PATH] Using Reasoning Engine...")
-            response = requests.post(api_endpoint, headers=headers, json=payload, timeout=120)
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail=f"Bandit Error: {response.text}")
-            
-            result_json = response.json()
-            bandit_response = result_json.get("output", "")
-            if isinstance(bandit_response, dict):
-                bandit_response = str(bandit_response)
-            model_used = "bandit-reasoning-engine"
-            elapsed = time.time() - start_time
-            print(f"[FULL PATH] Completed in {elapsed:.2f}s")
-                
-        except requests.exceptions.Timeout:
-            raise HTTPException(status_code=504, detail="Bandit Request Timed Out")
+            if thinking_mode == "instant":
+                route = [(FAST_MODEL, lambda: fast_path_answer(conversation, gemini_contents)),
+                         engine_route(conversation, prompt)]
+                model_used, bandit_response = await ROUTER.run(route)
+            elif thinking_mode == "thinking":
+                route = [(DEEP_THINK_MODEL, lambda: deep_think_answer(conversation, gemini_contents)),
+                         engine_route(conversation, prompt)]
+                model_used, bandit_response = await ROUTER.run(route)
+            elif hedge_auto:
+                model_used, bandit_response = await hedged_auto_answer(conversation, prompt, gemini_contents)
+            else:
+                model_used, bandit_response = await ROUTER.run([engine_route(conversation, prompt)])
+        except HTTPException:
+            raise
         except Exception as e:
-            print(f"Proxy Error: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+            # The router re-raises the last tier's error (RuntimeError, genai APIError, ...): answer in JSON
+            print(f"[ROUTER] {thinking_mode} failed after {time.time() - start_time:.2f}s: {e}")
+            return error_response(e)
+        elapsed = time.time() - start_time
+        print(f"[ROUTER] {model_used} answered in {elapsed:.2f}s")
         
+        if thinking_mode == "instant" and model_used == FAST_MODEL:
+            if semantic_embedding is not None:
+                remember_semantic_answer(thinking_mode, semantic_embedding, original_prompt, bandit_response)
+            # Fire background query to Reasoning Engine for richer response
+            if await spawn_background_query(prompt):  # Only if not cached or already queued
+                print(f"[FAST PATH] Queued background enrichment job")
+    
+    on_answer(bandit_response)
+    
     # Format OpenAI Response
     return ChatCompletionResponse(
         id=f"chatcmpl-{int(time.time())}",
@@ -1264,9 +2072,39 @@ async def chat_completions(request: ChatCompletionRequest):
                 finish_reason="stop"
             )
         ],
-        usage={"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        usage=request_scope().usage(),  # every upstream call made for this request (0 for cache hits)
+        session_id=session.id if session else None,
     )
 
+async def prewarm_tts_from_file(path: str):
+    """Background pre-warm of BANDIT_TTS_PREWARM_FILE in Bandit's default voice."""
+    try:
+        phrases = load_phrases(path)
+        counts = await prewarm_tts(phrases)
+        print(f"[TTS CACHE] Pre-warmed {path}: {counts}")
+    except Exception as e:
+        print(f"[TTS CACHE] Pre-warm of {path} failed: {e}")
+
+@app.on_event("startup")
+async def start_background_jobs():
+    """Start the enrichment worker pool (resumes journaled jobs), token refresher, research pollers and TTS pre-warm."""
+    CREDENTIALS.start()
+    await ENRICHMENT_QUEUE.start()
+    await RESEARCH.resume()
+    if TTS_PREWARM_FILE and TTS_CACHE.enabled:
+        asyncio.create_task(prewarm_tts_from_file(TTS_PREWARM_FILE))
+
+@app.on_event("shutdown")
+async def shutdown_model_runtime():
+    """Stop background workers and release pooled upstream connections."""
+    await ENRICHMENT_QUEUE.stop()
+    CREDENTIALS.stop()
+    if GENAI_CLIENT:
+        await CONTEXT_CACHE.aclose(GENAI_CLIENT)  # cached contents bill storage until their TTL
+    await close_engine_client()
+    TTS_CACHE.close()
+    await RESEARCH.close()
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
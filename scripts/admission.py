@@ -0,0 +1,316 @@
+"""Admission control in front of every upstream model call.
+
+A burst used to go straight to Vertex, come back as 429s, and then be
+retried on a fixed exponential schedule, which added load exactly when the
+quota was exhausted. Each model now has a limiter that decides, before the
+call, whether it may go out:
+
+- a token bucket caps the request rate (MODEL_RATE_LIMITS, requests/s)
+- an AIMD concurrency limit grows by ~1 per window of successes and halves
+  on a 429; a Retry-After (or RetryInfo) hint pauses the model entirely
+- priority classes: interactive (voice, mobile, chat UIs) may use the whole
+  limit, fleet batch traffic 75% of it, background enrichment 50%; waiters
+  are served highest class first
+- load is shed early: when the estimated wait exceeds the class's budget the
+  call fails at once with AdmissionRejected (HTTP 429 + Retry-After) instead
+  of queueing forever
+
+The caller's class travels in a context variable (`admission_priority`), set
+from the X-Bandit-Priority header by the proxy and by background workers.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import re
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_FLEET = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {"interactive": PRIORITY_INTERACTIVE, "fleet": PRIORITY_FLEET, "background": PRIORITY_BACKGROUND}
+PRIORITY_LABELS = {level: name for name, level in PRIORITY_NAMES.items()}
+
+ADMISSION_ENABLED = os.getenv("BANDIT_ADMISSION", "1") != "0"
+# Share of a model's concurrency limit each class may occupy
+PRIORITY_SHARE = {PRIORITY_INTERACTIVE: 1.0, PRIORITY_FLEET: 0.75, PRIORITY_BACKGROUND: 0.5}
+# Longest a call of each class may wait for admission before it is shed (seconds)
+PRIORITY_MAX_WAIT = {
+    PRIORITY_INTERACTIVE: float(os.getenv("BANDIT_ADMISSION_WAIT_INTERACTIVE", 10)),
+    PRIORITY_FLEET: float(os.getenv("BANDIT_ADMISSION_WAIT_FLEET", 5)),
+    PRIORITY_BACKGROUND: float(os.getenv("BANDIT_ADMISSION_WAIT_BACKGROUND", 2)),
+}
+MAX_WAITERS = int(os.getenv("BANDIT_ADMISSION_MAX_WAITERS", 256))  # per model
+
+# Requests/s per model (burst = 2 s worth); BANDIT_RATE_LIMITS="model=rps,model=rps" overrides
+DEFAULT_RATE = 10.0
+MODEL_RATE_LIMITS = {
+    "gemini-3-flash-preview": 20.0,
+    "gemini-3.1-pro-preview": 5.0,
+    "gemini-3.1-flash-image-preview": 2.0,
+    "gemini-2.5-flash-lite-preview-tts": 5.0,
+    "gemini-embedding-001": 20.0,
+    "bandit-reasoning-engine": 10.0,
+}
+for _item in filter(None, os.getenv("BANDIT_RATE_LIMITS", "").split(",")):
+    _model, _, _rate = _item.partition("=")
+    MODEL_RATE_LIMITS[_model.strip()] = float(_rate)
+
+INITIAL_LIMIT = float(os.getenv("BANDIT_ADMISSION_INITIAL_LIMIT", 16))
+MIN_LIMIT = 1.0
+MAX_LIMIT = float(os.getenv("BANDIT_ADMISSION_MAX_LIMIT", 64))
+DECREASE_FACTOR = 0.5
+DEFAULT_THROTTLE_PAUSE = 1.0   # pause after a 429 without a Retry-After hint
+DECREASE_COOLDOWN = 1.0        # one multiplicative decrease per burst of 429s
+
+admission_priority: contextvars.ContextVar = contextvars.ContextVar("admission_priority",
+                                                                    default=PRIORITY_INTERACTIVE)
+
+
+class AdmissionRejected(Exception):
+    """Shed before calling upstream; `retry_after` is the suggested wait in seconds."""
+
+    def __init__(self, model: str, retry_after: float, reason: str):
+        super().__init__(f"{model} overloaded ({reason}); retry after {retry_after:.0f}s")
+        self.model = model
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def parse_priority(value: Optional[str]) -> int:
+    return PRIORITY_NAMES.get((value or "").strip().lower(), PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def priority_class(level: int):
+    """Run the enclosed calls (and tasks created inside) at `level`."""
+    token = admission_priority.set(level)
+    try:
+        yield
+    finally:
+        admission_priority.reset(token)
+
+
+def is_throttled(error: Exception) -> bool:
+    """A quota/rate 429 from upstream (google-genai APIError, httpx, or text)."""
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    text = str(error)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text or "resource exhausted" in text.lower()
+
+
+def retry_after_from_error(error: Exception) -> Optional[float]:
+    """Retry-After header or RetryInfo.retryDelay carried by an upstream error, in seconds."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(float(value), 0.0)
+            except ValueError:
+                pass
+    match = re.search(r"retry_?delay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(getattr(error, "details", "")) + str(error),
+                      re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+
+class ModelLimiter:
+    """Token bucket + AIMD concurrency limit + priority wait queue for one model."""
+
+    def __init__(self, model: str, rate: float, burst: Optional[float] = None,
+                 initial_limit: float = INITIAL_LIMIT, min_limit: float = MIN_LIMIT, max_limit: float = MAX_LIMIT):
+        self.model = model
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate * 2, 1.0)
+        self.tokens = self.burst
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._refilled_at = time.monotonic()
+        self._last_decrease = 0.0
+        self._waiters: list = []          # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.rejected = {name: 0 for name in PRIORITY_NAMES}
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    # ── bookkeeping ─────────────────────────────────────────────────────────
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _capacity(self, level: int) -> int:
+        return max(1, int(self.limit * PRIORITY_SHARE.get(level, 1.0)))
+
+    def _can_admit(self, level: int, now: float) -> bool:
+        return now >= self.paused_until and self.tokens >= 1 and self.in_flight < self._capacity(level)
+
+    def estimated_wait(self, level: int, now: Optional[float] = None) -> float:
+        """Rough seconds until a new `level` call would be admitted (pause + rate backlog)."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        ahead = sum(1 for p, _, _ in self._waiters if p <= level)
+        token_wait = max(0.0, (ahead + 1 - self.tokens) / self.rate) if self.rate else 0.0
+        return max(self.paused_until - now, 0.0) + token_wait
+
+    def _take(self, now: float):
+        self.tokens -= 1
+        self.in_flight += 1
+        self.admitted += 1
+
+    def _wake_next(self):
+        """Give the head waiter a chance to run (it re-checks and keeps its place if still blocked)."""
+        if self._waiters and not self._waiters[0][2].done():
+            self._waiters[0][2].set_result(None)
+
+    # ── admission ───────────────────────────────────────────────────────────
+
+    async def acquire(self, level: int):
+        now = time.monotonic()
+        self._refill(now)
+        name = PRIORITY_LABELS.get(level, "background")
+        if not self._waiters and self._can_admit(level, now):
+            self._take(now)
+            return
+        budget = PRIORITY_MAX_WAIT.get(level, PRIORITY_MAX_WAIT[PRIORITY_BACKGROUND])
+        estimate = self.estimated_wait(level, now)
+        if len(self._waiters) >= MAX_WAITERS or estimate > budget:
+            self.rejected[name] += 1
+            raise AdmissionRejected(self.model, max(estimate, 1.0),
+                                    "queue full" if len(self._waiters) >= MAX_WAITERS else "over capacity")
+
+        deadline = now + budget
+        loop = asyncio.get_running_loop()
+        entry = None
+        try:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                head = not self._waiters or self._waiters[0] is entry
+                if head and self._can_admit(level, now):
+                    if entry is not None:
+                        heapq.heappop(self._waiters)
+                        entry = None
+                    self._take(now)
+                    self.waited_seconds += budget - (deadline - now)
+                    self._wake_next()  # the next waiter may fit as well
+                    return
+                if now >= deadline:
+                    self.rejected[name] += 1
+                    raise AdmissionRejected(self.model, max(self.estimated_wait(level, now), 1.0), "admission timeout")
+                if entry is None:
+                    entry = (level, next(self._seq), loop.create_future())
+                    heapq.heappush(self._waiters, entry)
+                    continue  # may have jumped ahead of lower-priority waiters
+                elif entry[2].done():  # woken: re-arm in place, keeping our queue position
+                    index = self._waiters.index(entry)
+                    entry = (entry[0], entry[1], loop.create_future())
+                    self._waiters[index] = entry
+                # Sleep until woken by a release, the next token, the end of a pause, or the deadline
+                timeout = deadline - now
+                if self.tokens < 1 and self.rate:
+                    timeout = min(timeout, (1 - self.tokens) / self.rate)
+                if self.paused_until > now:
+                    timeout = min(timeout, self.paused_until - now)
+                try:
+                    await asyncio.wait_for(asyncio.shield(entry[2]), max(timeout, 0.001))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if entry is not None:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._wake_next()
+
+    def release(self, error: Optional[Exception] = None, ok: bool = True):
+        """Finish a call: additive increase on success, multiplicative decrease (and pause) on 429."""
+        self.in_flight -= 1
+        now = time.monotonic()
+        if error is not None and is_throttled(error):
+            self.throttled += 1
+            pause = retry_after_from_error(error) or DEFAULT_THROTTLE_PAUSE
+            self.paused_until = max(self.paused_until, now + pause)
+            if now - self._last_decrease >= DECREASE_COOLDOWN:
+                self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                self._last_decrease = now
+        elif ok and error is None:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._wake_next()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "rate": self.rate,
+            "tokens": round(self.tokens, 2),
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "paused_for": round(max(self.paused_until - now, 0.0), 2),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "throttled": self.throttled,
+            "waited_seconds": round(self.waited_seconds, 3),
+        }
+
+
+class AdmissionController:
+    """One ModelLimiter per upstream model, created on first use."""
+
+    def __init__(self, enabled: bool = ADMISSION_ENABLED, rates: Optional[Dict[str, float]] = None,
+                 default_rate: float = DEFAULT_RATE):
+        self.enabled = enabled
+        self.rates = MODEL_RATE_LIMITS if rates is None else rates
+        self.default_rate = default_rate
+        self._limiters: Dict[str, ModelLimiter] = {}
+
+    def limiter(self, model: str) -> ModelLimiter:
+        model = (model or "default").split("/")[-1]
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limiter = self._limiters[model] = ModelLimiter(model, self.rates.get(model, self.default_rate))
+        return limiter
+
+    @asynccontextmanager
+    async def admit(self, model: str, level: Optional[int] = None):
+        """Hold an admission slot for one upstream call; raises AdmissionRejected when shed."""
+        if not self.enabled:
+            yield
+            return
+        limiter = self.limiter(model)
+        await limiter.acquire(admission_priority.get() if level is None else level)
+        try:
+            yield
+        except BaseException as e:  # cancellations free the slot without counting as success
+            limiter.release(e if isinstance(e, Exception) else None, ok=False)
+            raise
+        limiter.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "models": {m: l.stats() for m, l in self._limiters.items()}}
+
+
+ADMISSION = AdmissionController()
+
+
+class PriorityMiddleware:
+    """ASGI middleware: run each request at the class named by its X-Bandit-Priority header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        header = next((v for k, v in scope.get("headers", ()) if k == b"x-bandit-priority"), None)
+        with priority_class(parse_priority(header.decode("latin-1") if header else None)):
+            return await self.app(scope, receive, send)
@@ -0,0 +1,317 @@
+"""Content-addressed store for generated binary artifacts (images).
+
+Generated images used to travel as base64 inside JSON (`/generate-image`)
+or inside the Reasoning Engine's text output as `[IMAGE_B64]...[/IMAGE_B64]`,
+which every client then regex-scanned and decoded. Artifacts are now written
+once, keyed by sha256 of their bytes (identical images are stored once), and
+responses carry a short reference instead:
+
+    [ARTIFACT uri=gs://bucket/artifacts/<sha256> type=image/png size=1234567]
+
+Two backends share one interface:
+- `LocalArtifactStore`: files under .cache/artifacts (the proxy's default)
+- `GCSArtifactStore`: objects in a bucket (BANDIT_ARTIFACT_BUCKET); the
+  Reasoning Engine runs remotely, so it always writes here
+
+The proxy serves either backend at GET /v1/artifacts/{id} with byte-range support.
+Engine artifacts are `link`ed into the local store as a metadata-only entry
+and their bytes are read from GCS. Only objects under the configured engine
+location (BANDIT_ARTIFACT_BUCKET / BANDIT_ARTIFACT_PREFIX) can be linked:
+the URI comes from model output, and the proxy reads it with its own
+credentials.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+ARTIFACT_PATH = Path(os.getenv(
+    "BANDIT_ARTIFACT_PATH",
+    Path(__file__).resolve().parent.parent / ".cache" / "artifacts",
+))
+ARTIFACT_BUCKET = os.getenv("BANDIT_ARTIFACT_BUCKET")  # gs://bucket or bucket
+ARTIFACT_PREFIX = os.getenv("BANDIT_ARTIFACT_PREFIX", "artifacts")
+READ_CHUNK_BYTES = 256 * 1024
+
+ARTIFACT_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+# Short, bounded tags: a plain substring check finds them, no DOTALL scan over megabytes of base64
+ARTIFACT_TAG_RE = re.compile(r"\[ARTIFACT uri=(\S+) type=(\S+) size=(\d+)\]")
+
+MIME_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp", "image/gif": ".gif"}
+
+
+class RangeNotSatisfiable(ValueError):
+    """Range header outside the artifact (HTTP 416)."""
+
+
+@dataclass
+class Artifact:
+    id: str
+    mime_type: str
+    size: int
+    uri: str
+
+    @property
+    def tag(self) -> str:
+        return f"[ARTIFACT uri={self.uri} type={self.mime_type} size={self.size}]"
+
+    @property
+    def extension(self) -> str:
+        return MIME_EXTENSIONS.get(self.mime_type, ".bin")
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def artifact_id(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_tags(text: str):
+    """(tag, Artifact) for every artifact reference in engine output."""
+    if "[ARTIFACT " not in text:
+        return []
+    found = []
+    for match in ARTIFACT_TAG_RE.finditer(text):
+        uri, mime_type, size = match.groups()
+        found.append((match.group(0), Artifact(uri.rsplit("/", 1)[-1].split(":")[-1], mime_type, int(size), uri)))
+    return found
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) for a single `bytes=` range, None to send the whole artifact.
+
+    Multi-range and malformed headers are ignored (a full 200 is a valid answer);
+    a range that starts past the end raises RangeNotSatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":  # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if end < start:
+        return None
+    return start, end
+
+
+class LocalArtifactStore:
+    """objects/<id[:2]>/<id> plus a <id>.json metadata sidecar.
+
+    `engine_bucket`/`engine_prefix` is where the Reasoning Engine writes; only
+    artifacts there can be linked (served from GCS without a local copy).
+    """
+
+    def __init__(self, root: Path = ARTIFACT_PATH, engine_bucket: Optional[str] = ARTIFACT_BUCKET,
+                 engine_prefix: str = ARTIFACT_PREFIX):
+        self.root = Path(root)
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        self.engine_bucket = engine_bucket.replace("gs://", "").strip("/") if engine_bucket else None
+        self.engine_prefix = engine_prefix.strip("/")
+        self.writes = 0
+        self.dedup_hits = 0
+        self.links_refused = 0
+
+    def _object(self, aid: str) -> Path:
+        return self.root / "objects" / aid[:2] / aid
+
+    def uri(self, aid: str) -> str:
+        return f"artifact:{aid}"
+
+    def put(self, data: bytes, mime_type: str) -> Artifact:
+        aid = artifact_id(data)
+        artifact = Artifact(aid, mime_type, len(data), self.uri(aid))
+        path = self._object(aid)
+        if path.exists():
+            self.dedup_hits += 1
+            return artifact
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{aid}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(data)
+        meta = path.with_name(f"{aid}.json")
+        meta.write_text(json.dumps({"mime_type": mime_type, "size": len(data), "created_at": time.time()}))
+        os.replace(tmp, path)  # the object appears last, so a visible object always has its sidecar
+        self.writes += 1
+        return artifact
+
+    def engine_uri(self, aid: str) -> Optional[str]:
+        """gs:// URI the Reasoning Engine uses for `aid`, or None without a configured bucket."""
+        if not self.engine_bucket:
+            return None
+        name = f"{self.engine_prefix}/{aid}" if self.engine_prefix else aid
+        return f"gs://{self.engine_bucket}/{name}"
+
+    def link(self, artifact: Artifact) -> bool:
+        """Record an engine artifact kept in GCS so get() finds it; False if refused or already known.
+
+        The URI must be exactly the engine location for its id, and an existing
+        entry (local object or earlier link) is never replaced.
+        """
+        if artifact.uri == self.uri(artifact.id) or not ARTIFACT_ID_RE.match(artifact.id):
+            return False
+        if artifact.uri != self.engine_uri(artifact.id):
+            self.links_refused += 1
+            print(f"[ARTIFACTS WARNING] Not linking {artifact.uri}: only gs://{self.engine_bucket or '<unset>'}/"
+                  f"{self.engine_prefix} (BANDIT_ARTIFACT_BUCKET / BANDIT_ARTIFACT_PREFIX) is served")
+            return False
+        path = self._object(artifact.id)
+        meta = path.with_name(f"{artifact.id}.json")
+        if path.exists() or meta.exists():
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = meta.with_name(f"{artifact.id}.{uuid.uuid4().hex}.tmp")
+        tmp.write_text(json.dumps({"mime_type": artifact.mime_type, "size": artifact.size, "uri": artifact.uri,
+                                   "created_at": time.time()}))
+        try:
+            os.link(tmp, meta)  # unlike os.replace, fails if another request linked it first
+        except FileExistsError:
+            return False
+        finally:
+            tmp.unlink()
+        return True
+
+    def _meta(self, aid: str) -> Optional[dict]:
+        try:
+            return json.loads(self._object(aid).with_name(f"{aid}.json").read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def get(self, aid: str) -> Optional[Artifact]:
+        if not ARTIFACT_ID_RE.match(aid):
+            return None
+        meta = self._meta(aid)
+        if meta is None:
+            return None
+        mime_type = meta.get("mime_type", "application/octet-stream")
+        try:
+            return Artifact(aid, mime_type, self._object(aid).stat().st_size, self.uri(aid))
+        except FileNotFoundError:
+            if meta.get("uri") is None or meta["uri"] != self.engine_uri(aid):
+                return None
+            return Artifact(aid, mime_type, meta["size"], meta["uri"])  # linked: the bytes are in GCS
+
+    def read(self, aid: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Bytes start..end (inclusive) in READ_CHUNK_BYTES pieces."""
+        path = self._object(aid)
+        if not path.exists():
+            uri = (self._meta(aid) or {}).get("uri")
+            if uri is not None and uri == self.engine_uri(aid):
+                yield from remote_store(uri).read(aid, start, end)
+                return
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(READ_CHUNK_BYTES if remaining is None else min(READ_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def stats(self) -> dict:
+        return {"backend": "local", "root": str(self.root), "writes": self.writes, "dedup_hits": self.dedup_hits,
+                "links_refused": self.links_refused}
+
+
+class GCSArtifactStore:
+    """Objects at gs://<bucket>/<prefix>/<id>; content type kept as blob metadata."""
+
+    def __init__(self, bucket: str = ARTIFACT_BUCKET, prefix: str = ARTIFACT_PREFIX, project: Optional[str] = None,
+                 credentials=None):
+        from google.cloud import storage
+        self.bucket_name = bucket.replace("gs://", "").strip("/")
+        self.prefix = prefix.strip("/")
+        self.bucket = storage.Client(project=project, credentials=credentials).bucket(self.bucket_name)
+        self.writes = 0
+        self.dedup_hits = 0
+
+    def _name(self, aid: str) -> str:
+        return f"{self.prefix}/{aid}" if self.prefix else aid
+
+    def uri(self, aid: str) -> str:
+        return f"gs://{self.bucket_name}/{self._name(aid)}"
+
+    def put(self, data: bytes, mime_type: str) -> Artifact:
+        from google.api_core.exceptions import PreconditionFailed
+        aid = artifact_id(data)
+        try:
+            # if_generation_match=0: create only, so duplicate images are never re-uploaded
+            self.bucket.blob(self._name(aid)).upload_from_string(data, content_type=mime_type, if_generation_match=0)
+            self.writes += 1
+        except PreconditionFailed:
+            self.dedup_hits += 1
+        return Artifact(aid, mime_type, len(data), self.uri(aid))
+
+    def link(self, artifact: Artifact) -> bool:
+        """Nothing to record: get() serves this bucket only, which is where the engine writes."""
+        if artifact.uri != self.uri(artifact.id):
+            print(f"[ARTIFACTS WARNING] {artifact.uri} is outside gs://{self.bucket_name}/{self.prefix}; "
+                  f"point the Reasoning Engine and the proxy at the same BANDIT_ARTIFACT_BUCKET")
+        return False
+
+    def get(self, aid: str) -> Optional[Artifact]:
+        if not ARTIFACT_ID_RE.match(aid):
+            return None
+        blob = self.bucket.get_blob(self._name(aid))
+        if blob is None:
+            return None
+        return Artifact(aid, blob.content_type or "application/octet-stream", blob.size, self.uri(aid))
+
+    def read(self, aid: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        yield self.bucket.blob(self._name(aid)).download_as_bytes(start=start, end=end)
+
+    def stats(self) -> dict:
+        return {"backend": "gcs", "bucket": self.bucket_name, "prefix": self.prefix,
+                "writes": self.writes, "dedup_hits": self.dedup_hits}
+
+
+def build_artifact_store_from_env():
+    """GCS store when BANDIT_ARTIFACT_BUCKET is set, local disk otherwise (or if GCS is unusable)."""
+    if ARTIFACT_BUCKET:
+        try:
+            return GCSArtifactStore(ARTIFACT_BUCKET)
+        except Exception as e:
+            print(f"[ARTIFACTS WARNING] GCS store unavailable ({e}), storing artifacts locally")
+    return LocalArtifactStore()
+
+
+def gcs_location(uri: str) -> Tuple[str, str]:
+    """(bucket, prefix) of a gs://bucket/prefix/<id> artifact URI."""
+    bucket, _, name = uri[len("gs://"):].partition("/")
+    return bucket, name.rsplit("/", 1)[0] if "/" in name else ""
+
+
+@lru_cache(maxsize=16)
+def _gcs_store(bucket: str, prefix: str) -> GCSArtifactStore:
+    return GCSArtifactStore(bucket, prefix=prefix)
+
+
+def remote_store(uri: str) -> GCSArtifactStore:
+    """Shared (application default credentials) store for the bucket a gs:// artifact lives in."""
+    return _gcs_store(*gcs_location(uri))
+
+
+def fetch_artifact(artifact: Artifact, store=None, credentials=None) -> bytes:
+    """Bytes for an artifact reference (gs:// URIs are read from their own bucket)."""
+    if artifact.uri.startswith("gs://"):
+        bucket, prefix = gcs_location(artifact.uri)
+        store = GCSArtifactStore(bucket, prefix=prefix, credentials=credentials)
+    store = store or LocalArtifactStore()
+    return b"".join(store.read(artifact.id))
@@ -20,6 +20,16 @@ from google.cloud import aiplatform
 from google.api_core import retry
 from google import genai
 from google.genai import types
+try:
+    from credential_broker import get_broker
+    from engine_client import EngineQueryError, engine_endpoint, query_sync as engine_query_sync
+    from hq_index import HQIndex, GeminiEmbedder
+    from artifact_store import fetch_artifact, parse_tags
+except ImportError:
+    from scripts.credential_broker import get_broker
+    from scripts.engine_client import EngineQueryError, engine_endpoint, query_sync as engine_query_sync
+    from scripts.hq_index import HQIndex, GeminiEmbedder
+    from scripts.artifact_store import fetch_artifact, parse_tags
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.panel import Panel
@@ -48,7 +58,7 @@ console = Console(theme=lmsify_theme)
 # Read from environment (Cloud Run sets GOOGLE_CLOUD_PROJECT automatically)
 DEFAULT_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT", os.getenv("GCP_PROJECT", "project-5f169828-6f8d-450b-923"))
 DEFAULT_LOCATION = "global"
-# Base64 image transfer (no GCS permissions needed)
+# Generated images arrive as [ARTIFACT uri=gs://...] references (legacy engines inline [IMAGE_B64])
 # Updated: DAV1D v3 - Fixed spinner + Flash-Lite greetings (2025-12-10)
 DEFAULT_ENGINE_ID = "3723065118905335808"
 # Gemini 3 Models - 1M token context, free tier
@@ -57,8 +67,7 @@ RAG_MODEL = os.getenv("BANDIT_RAG_MODEL", "gemini-3-flash-preview")
 RAG_EMBED_MODEL = os.getenv("BANDIT_RAG_EMBED_MODEL", "text-embedding-004")
 DEFAULT_MODEL = "gemini-3-flash-preview"  # 1M context
 PRO_MODEL = "gemini-3.1-pro-preview"      # Advanced reasoning
-VERTEX_AI_SEARCH_LOCATION = os.getenv("VERTEX_AI_SEARCH_LOCATION", "global")
-VERTEX_AI_SEARCH_DATA_STORE_ID = os.getenv("VERTEX_AI_SEARCH_DATA_STORE_ID")
+HQ_INDEX_LOCATION = os.getenv("BANDIT_HQ_INDEX_LOCATION", "us-central1")  # embedding endpoint
 
 # Memory configuration
 SHORT_TERM_MEMORY_LIMIT = 1000  # Session context: last 1000 messages
@@ -374,106 +383,73 @@ def _resolve_model_location(model_name: str, requested_location: str) -> str:
     return requested_location or DEFAULT_LOCATION
 
 def _load_credentials():
-    """Load ADC credentials, supporting JSON in env for fileless auth."""
-    from google.auth.transport.requests import Request
-    from google.auth import default
-    from google.oauth2 import service_account
-    
-    json_blob = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
-    scopes = ["https://www.googleapis.com/auth/cloud-platform"]
-    
-    if json_blob:
-        try:
-            info = json.loads(json_blob)
-            creds = service_account.Credentials.from_service_account_info(info, scopes=scopes)
-            creds.refresh(Request())
-            return creds
-        except Exception as exc:
-            console.print(f"[warning]Failed to load GOOGLE_APPLICATION_CREDENTIALS_JSON: {exc}. Falling back to ADC.[/warning]")
-    
-    creds, _ = default(scopes=scopes)
-    creds.refresh(Request())
-    return creds
+    """Shared broker credentials with a valid token (refreshed only near expiry)."""
+    broker = get_broker()
+    broker.get_token()
+    return broker.credentials
 
 
 def query_engine(client, resource_name: str, prompt: str, context: str = "", location: str = DEFAULT_LOCATION) -> str:
     """Queries the Reasoning Engine via the AI Platform API."""
-    import requests
-    
-    # Get credentials
-    credentials = _load_credentials()
+    # Get a token from the shared broker (no OAuth round trip while it is valid)
+    token = get_broker().get_token()
     
     # Construct the API endpoint
-    resolved_location = location or DEFAULT_LOCATION
-    api_endpoint = f"https://{resolved_location}-aiplatform.googleapis.com/v1beta1/{resource_name}:query"
-    
-    headers = {
-        "Authorization": f"Bearer {credentials.token}",
-        "Content-Type": "application/json"
-    }
+    api_endpoint = engine_endpoint(resource_name, location or DEFAULT_LOCATION)
     
     # Add context to prompt if available
     full_prompt = f"{context}\n\nCurrent query: {prompt}" if context else prompt
     
-    # Reasoning Engine REST API requires both 'input' and 'classMethod'
-    payload = {
-        "input": {"prompt": full_prompt},
-        "classMethod": "query"
-    }
-    
-    response = requests.post(api_endpoint, headers=headers, json=payload)
-    
-    # Enhanced error handling
+    # Pooled keep-alive client: repeat queries in a session reuse one TLS connection
     try:
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        error_detail = ""
-        try:
-            error_detail = f"\nAPI Response: {response.text}"
-        except:
-            pass
-        raise Exception(f"{str(e)}{error_detail}")
-    
-    result = response.json()
-    output_text = result.get("output", str(result))
+        output_text = engine_query_sync(api_endpoint, full_prompt, token)
+    except EngineQueryError as e:
+        raise Exception(f"Reasoning Engine returned {e.status_code}\nAPI Response: {e.body}")
     
-    # Process potential image data (Base64)
+    return save_engine_images(output_text)
+
+def save_engine_images(output_text: str) -> str:
+    """Download images referenced in engine output to generated_images/ and replace the tags.
+
+    Artifact tags are short, so only a substring check touches the full text;
+    the DOTALL scan for inline base64 runs only for legacy engines that still emit it.
+    """
+    for tag, artifact in parse_tags(output_text):
+        try:
+            os.makedirs("generated_images", exist_ok=True)
+            filename = f"generated_images/bandit_img_{artifact.id[:16]}{artifact.extension}"
+            if not os.path.exists(filename):  # content-addressed: already downloaded
+                with open(filename, "wb") as f:
+                    f.write(fetch_artifact(artifact, credentials=get_broker().try_credentials()))
+            output_text = output_text.replace(tag, f"\n🖼️  Image saved: {os.path.abspath(filename)}\n")
+        except Exception as e:
+            output_text = output_text.replace(tag, f"\n❌ Image save error: {str(e)}\n")
+
+    if "[IMAGE_B64]" not in output_text:
+        return output_text
     import re
     import base64
-    import os
-    from datetime import datetime
-    
-    # Check for [IMAGE_B64] tag
-    img_pattern = r'\[IMAGE_B64\](.*?)\[/IMAGE_B64\]'
-    match = re.search(img_pattern, output_text, re.DOTALL)
-    
+    match = re.search(r'\[IMAGE_B64\](.*?)\[/IMAGE_B64\]', output_text, re.DOTALL)
     if match:
         try:
             b64_data = match.group(1).strip()
-            
-            # Create directory if needed
             os.makedirs("generated_images", exist_ok=True)
-            
-            # Generate filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = datetime.now(TIMEZONE).strftime("%Y%m%d_%H%M%S")
             filename = f"generated_images/bandit_img_{timestamp}.png"
             
-            # Decode and save
             with open(filename, "wb") as f:
                 f.write(base64.b64decode(b64_data))
             
-            # Replace base64 block with success message
             output_text = output_text.replace(match.group(0), f"\n🖼️  Image saved: {os.path.abspath(filename)}\n")
-            
         except Exception as e:
             output_text = output_text.replace(match.group(0), f"\n❌ Image save error: {str(e)}\n")
-
     return output_text
 
 def run_vertex_search(query: str, project: str, location: str) -> str:
     """Execute a Vertex-grounded search via google-genai tools."""
     resolved_location = _resolve_model_location(SEARCH_MODEL, location)
-    search_client = genai.Client(vertexai=True, project=project, location=resolved_location)
+    search_client = genai.Client(vertexai=True, project=project, location=resolved_location,
+                                  credentials=get_broker().try_credentials())
     tools = [types.Tool(google_search=types.GoogleSearchRetrieval())]
 
     response = search_client.models.generate_content(
@@ -489,119 +465,58 @@ def stream_query_engine(client, resource_name: str, prompt: str, context: str =
     
     Shows a thinking animation while waiting for the response.
     """
-    import requests
     import time
     
-    # Get credentials
-    credentials = _load_credentials()
+    # Get a token from the shared broker (no OAuth round trip while it is valid)
+    token = get_broker().get_token()
     
     # Construct the API endpoint
-    resolved_location = location or DEFAULT_LOCATION
-    api_endpoint = f"https://{resolved_location}-aiplatform.googleapis.com/v1beta1/{resource_name}:query"
-    
-    headers = {
-        "Authorization": f"Bearer {credentials.token}",
-        "Content-Type": "application/json"
-    }
+    api_endpoint = engine_endpoint(resource_name, location or DEFAULT_LOCATION)
     
     # Add context to prompt if available
     full_prompt = f"{context}\n\nCurrent query: {prompt}" if context else prompt
     
-    payload = {
-        "input": {"prompt": full_prompt},
-        "classMethod": "query"
-    }
-    
     start_time = time.time()
     
     # Simple spinner status (works reliably on Windows)
     with console.status("[bold magenta]🧠 Thinking...[/bold magenta]", spinner="dots") as status:
         try:
-            response = requests.post(api_endpoint, headers=headers, json=payload, timeout=120)
+            output_text = engine_query_sync(api_endpoint, full_prompt, token, deadline=120)
             elapsed = time.time() - start_time
             status.update(f"[bold magenta]📥 Processing... ({elapsed:.1f}s)[/bold magenta]")
-            
-            response.raise_for_status()
-            result = response.json()
-            output_text = result.get("output", str(result))
-            
-        except requests.exceptions.HTTPError as e:
-            elapsed = time.time() - start_time
-            error_detail = ""
-            try:
-                error_detail = f"\nAPI Response: {response.text}"
-            except Exception:
-                pass
-            raise Exception(f"{str(e)}{error_detail}")
-        except Exception as e:
-            raise
+        except EngineQueryError as e:
+            raise Exception(f"Reasoning Engine returned {e.status_code}\nAPI Response: {e.body}")
     
     # Show completion time
     elapsed = time.time() - start_time
     console.print(f"[dim]✓ Response in {elapsed:.1f}s[/dim]")
     
-    # Process potential image data (Base64)
-    import re
-    import base64
-    
-    img_pattern = r'\[IMAGE_B64\](.*?)\[/IMAGE_B64\]'
-    match = re.search(img_pattern, output_text, re.DOTALL)
-    
-    if match:
-        try:
-            b64_data = match.group(1).strip()
-            os.makedirs("generated_images", exist_ok=True)
-            timestamp = datetime.now(TIMEZONE).strftime("%Y%m%d_%H%M%S")
-            filename = f"generated_images/bandit_img_{timestamp}.png"
-            
-            with open(filename, "wb") as f:
-                f.write(base64.b64decode(b64_data))
-            
-            output_text = output_text.replace(match.group(0), f"\n🖼️  Image saved: {os.path.abspath(filename)}\n")
-        except Exception as e:
-            output_text = output_text.replace(match.group(0), f"\n❌ Image save error: {str(e)}\n")
-    
-    return output_text
+    return save_engine_images(output_text)
 
-def run_rag(query: str, project: str, data_store_location: str, data_store_id: str) -> str:
-    """Grounds responses on a Vertex AI Search data store."""
-    from google.cloud import discoveryengine_v1 as discoveryengine
+_HQ_INDEX: Optional[HQIndex] = None
 
-    client = discoveryengine.SearchServiceClient()
+def get_hq_index(project: Optional[str] = None) -> HQIndex:
+    """Lazily open the local HQ index (embeddings use RAG_EMBED_MODEL)."""
+    global _HQ_INDEX
+    if _HQ_INDEX is None:
+        _HQ_INDEX = HQIndex(embedder=GeminiEmbedder(RAG_EMBED_MODEL, project=project or DEFAULT_PROJECT,
+                                                    location=HQ_INDEX_LOCATION))
+    return _HQ_INDEX
 
-    serving_config = client.serving_config_path(
-        project=project,
-        location=data_store_location,
-        data_store=data_store_id,
-        serving_config="default_config",
-    )
-
-    request = discoveryengine.SearchRequest(
-        serving_config=serving_config,
-        query=query,
-        page_size=5,
-        query_expansion_spec=discoveryengine.SearchRequest.QueryExpansionSpec(
-            condition=discoveryengine.SearchRequest.QueryExpansionSpec.Condition.AUTO,
-        ),
-        spell_correction_spec=discoveryengine.SearchRequest.SpellCorrectionSpec(
-            mode=discoveryengine.SearchRequest.SpellCorrectionSpec.Mode.AUTO
-        ),
-    )
-
-    response = client.search(request)
-    
-    # Defensive null checks for document content
-    snippets = []
-    for r in response.results:
-        if hasattr(r, 'document') and r.document and hasattr(r.document, 'content') and r.document.content:
-            snippets.append(r.document.content)
+def run_rag(query: str, project: str, profile: Optional[str] = None) -> str:
+    """Grounds responses on the local HQ vector index (see scripts/hq_index.py)."""
+    index = get_hq_index(project)
+    index.update()  # only re-reads changed files, only re-embeds changed chunks
+    results = index.search(query, profile=profile)
+    snippets = [f"[{r.path} :: {r.section}]\n{r.text}" for r in results]
 
     if not snippets:
-        return "No relevant documents found in Vertex AI Search."
+        return "No relevant documents found in the HQ index."
 
     context = "\n\n".join(snippets)
 
-    rag_client = genai.Client(vertexai=True, project=project, location=_resolve_model_location(RAG_MODEL, "global")) 
+    rag_client = genai.Client(vertexai=True, project=project, location=_resolve_model_location(RAG_MODEL, "global"),
+                              credentials=get_broker().try_credentials())
 
     prompt = (
         "Use the following snippets from the knowledge base to answer the question.\n"
@@ -662,7 +577,7 @@ async def main():
 
     try:
         with console.status("[bold green]Initializing Neural Link...[/bold green]", spinner="dots"):
-            aiplatform.init(project=args.project, location=args.location)
+            aiplatform.init(project=args.project, location=args.location, credentials=get_broker().try_credentials())
             from google.cloud.aiplatform_v1 import ReasoningEngineServiceClient
             client = ReasoningEngineServiceClient()
             resource_name = get_engine_resource_name(args.project, args.location, args.engine_id)
@@ -699,19 +614,18 @@ async def main():
 
             if user_input.lower().startswith("/rag"):
                 query = user_input[len("/rag"):].strip()
+                profile = None
+                if query.startswith("@"):  # /rag @snow_context <query>
+                    profile, _, query = query[1:].partition(" ")
+                    query = query.strip()
                 if not query:
-                    console.print("[warning]Usage: /rag <query>[/warning]")
-                    continue
-
-                if not VERTEX_AI_SEARCH_DATA_STORE_ID:
-                    console.print("[error]VERTEX_AI_SEARCH_DATA_STORE_ID environment variable not set.[/error]")
-                    console.print("[info]Please set this to your Vertex AI Search data store ID to use the /rag command.[/info]")
+                    console.print("[warning]Usage: /rag [@profile] <query>[/warning]")
                     continue
 
                 console.print(Panel(query, title="[bold yellow]RAG[/bold yellow]", border_style="yellow", expand=True))
                 try:
-                    with console.status("[bandit]Grounding in Vertex AI Search...[/bandit]", spinner="aesthetic"):
-                        rag_text = run_rag(query, args.project, VERTEX_AI_SEARCH_LOCATION, VERTEX_AI_SEARCH_DATA_STORE_ID)
+                    with console.status("[bandit]Grounding in the HQ index...[/bandit]", spinner="aesthetic"):
+                        rag_text = run_rag(query, args.project, profile)
                     memory.add_message("user", f"/rag {query}")
                     memory.add_message("bandit", rag_text)
                     console.print(Panel(
@@ -867,7 +781,7 @@ async def main():
 
 ### Search & RAG
 - `/search <query>` - Google Search grounding
-- `/rag <query>` - Search HQ knowledge base
+- `/rag [@profile] <query>` - Search HQ knowledge base (local index)
 
 ### Multi-Agent Council
 - `/council <task>` - Convene Bandit, Ice Wire, and Cipher
@@ -0,0 +1,268 @@
+"""Gemini explicit context caching for multi-turn chat.
+
+Every turn of a long conversation re-sends the Bandit system prompt and the
+whole history. Gemini can store that stable prefix server-side
+(`client.caches`) and bill/process it as cached input on later turns. This
+module keeps a local index of the caches we created, keyed by a rolling hash
+over (model, system instruction, history[:i]), so a request can reuse the
+longest cached prefix of its own history and send only the tail.
+
+- creation is automatic and off the request path, once the uncached part of a
+  history is big enough to be worth a cache
+- caches that keep getting used have their TTL extended before they expire
+- LRU eviction and stale-handle errors delete/forget the cache
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from google.genai import types
+
+try:
+    from model_runtime import tier_semaphore
+except ImportError:
+    from scripts.model_runtime import tier_semaphore
+
+CONTEXT_CACHE_ENABLED = os.getenv("BANDIT_CONTEXT_CACHE", "1") != "0"
+CONTEXT_CACHE_TTL = int(os.getenv("BANDIT_CONTEXT_CACHE_TTL", 15 * 60))
+# Gemini rejects caches below a model-specific minimum (1024-4096 tokens)
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("BANDIT_CONTEXT_CACHE_MIN_TOKENS", 4096))
+# Only build a longer cache once this much history sits outside the current one
+CONTEXT_CACHE_STEP_TOKENS = int(os.getenv("BANDIT_CONTEXT_CACHE_STEP_TOKENS", 2048))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("BANDIT_CONTEXT_CACHE_MAX_ENTRIES", 64))
+EXPIRY_SKEW = 30          # don't hand out a cache this close to expiry
+IMAGE_TOKEN_ESTIMATE = 258
+
+
+def estimate_tokens(contents: List[types.Content], system_instruction: str = "") -> int:
+    """Cheap token estimate (~4 chars/token, fixed cost per inline image)."""
+    tokens = len(system_instruction) // 4
+    for content in contents:
+        for part in content.parts or []:
+            if part.text:
+                tokens += len(part.text) // 4
+            elif part.inline_data is not None:
+                tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+
+def _content_digest(content: types.Content) -> bytes:
+    h = hashlib.sha256((content.role or "").encode())
+    for part in content.parts or []:
+        if part.text is not None:
+            h.update(b"t" + part.text.encode())
+        elif part.inline_data is not None:
+            h.update(b"d" + (part.inline_data.mime_type or "").encode())
+            h.update(hashlib.sha256(part.inline_data.data or b"").digest())
+        else:
+            h.update(repr(part).encode())
+    return h.digest()
+
+
+def prefix_keys(model: str, system_instruction: str, contents: List[types.Content]) -> List[str]:
+    """keys[i] identifies (model, system instruction, contents[:i+1])."""
+    h = hashlib.sha256(f"{model}\x00{system_instruction}\x00".encode())
+    keys = []
+    for content in contents:
+        h.update(_content_digest(content))
+        keys.append(h.copy().hexdigest())
+    return keys
+
+
+def is_stale_cache_error(error: Exception) -> bool:
+    """True when a request failed because its cached_content handle is gone."""
+    message = str(error).lower()
+    return "cache" in message and any(s in message for s in ("not found", "404", "expired", "invalid"))
+
+
+@dataclass
+class CacheEntry:
+    name: str
+    model: str
+    length: int               # number of history contents covered
+    tokens: int
+    expires_at: float
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+@dataclass
+class CachePlan:
+    """How to send a conversation: optional cache handle + the uncached contents."""
+    cached_content: Optional[str]
+    contents: List[types.Content]
+    cached_length: int = 0
+
+
+class ContextCacheManager:
+    """Creates, reuses, renews and evicts Gemini cached contents."""
+
+    def __init__(self, ttl: int = CONTEXT_CACHE_TTL, min_tokens: int = CONTEXT_CACHE_MIN_TOKENS,
+                 step_tokens: int = CONTEXT_CACHE_STEP_TOKENS, max_entries: int = CONTEXT_CACHE_MAX_ENTRIES,
+                 enabled: bool = CONTEXT_CACHE_ENABLED):
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.step_tokens = step_tokens
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._pending: set = set()     # keys being created
+        self._tasks: set = set()
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.renewed = 0
+        self.evicted = 0
+        self.invalidated = 0
+        self.failures = 0
+
+    # ── request path ─────────────────────────────────────────────────────────
+
+    def plan(self, client, model: str, system_instruction: str, history: List[types.Content],
+             current: List[types.Content]) -> CachePlan:
+        """Pick the longest live cached prefix of `history` and schedule upkeep."""
+        if not self.enabled or not history:
+            return CachePlan(None, history + current)
+        keys = prefix_keys(model, system_instruction, history)
+        now = time.time()
+        best = None
+        for i in range(len(keys) - 1, -1, -1):
+            entry = self._entries.get(keys[i])
+            if entry is None:
+                continue
+            if entry.expires_at - EXPIRY_SKEW <= now:
+                self._forget(keys[i])
+                continue
+            best = (keys[i], entry)
+            break
+
+        cached_length = 0
+        plan = CachePlan(None, history + current)
+        if best:
+            key, entry = best
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            self.hits += 1
+            cached_length = entry.length
+            plan = CachePlan(entry.name, history[cached_length:] + current, cached_length)
+            if entry.expires_at - now < self.ttl / 2:
+                self._spawn(self._renew(client, key, entry))
+        else:
+            self.misses += 1
+
+        # Worth a (longer) cache for the next turn?
+        uncached = history[cached_length:]
+        if estimate_tokens(history, system_instruction) >= self.min_tokens and \
+                estimate_tokens(uncached) >= (self.step_tokens if cached_length else 0):
+            key = keys[-1]
+            if key not in self._entries and key not in self._pending:
+                self._pending.add(key)
+                self._spawn(self._create(client, key, model, system_instruction, list(history)))
+        return plan
+
+    def config_for(self, config: types.GenerateContentConfig, plan: CachePlan) -> types.GenerateContentConfig:
+        """Cached requests must not repeat the system instruction (it lives in the cache)."""
+        if not plan.cached_content:
+            return config
+        return config.model_copy(update={"system_instruction": None, "cached_content": plan.cached_content})
+
+    async def invalidate(self, client, name: str):
+        """Forget a cache handle (e.g. after a stale-handle error) and delete it upstream."""
+        for key, entry in list(self._entries.items()):
+            if entry.name == name:
+                self._forget(key)
+                self.invalidated += 1
+        await self._delete(client, name)
+
+    # ── upkeep ───────────────────────────────────────────────────────────────
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _create(self, client, key: str, model: str, system_instruction: str, history: List[types.Content]):
+        try:
+            async with tier_semaphore("cache"):
+                cached = await client.aio.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        system_instruction=system_instruction,
+                        contents=history,
+                        ttl=f"{self.ttl}s",
+                        display_name=f"bandit-{key[:12]}",
+                    ),
+                )
+            tokens = getattr(cached.usage_metadata, "total_token_count", None) or estimate_tokens(history, system_instruction)
+            self._entries[key] = CacheEntry(cached.name, model, len(history), tokens, self._expiry(cached))
+            self.created += 1
+            print(f"[CONTEXT CACHE] Cached {len(history)} turns (~{tokens} tokens) for {model}")
+            while len(self._entries) > self.max_entries:
+                old_key, old = self._entries.popitem(last=False)
+                self.evicted += 1
+                await self._delete(client, old.name)
+        except Exception as e:
+            self.failures += 1
+            print(f"[CONTEXT CACHE] Create failed: {e}")
+        finally:
+            self._pending.discard(key)
+
+    async def _renew(self, client, key: str, entry: CacheEntry):
+        try:
+            async with tier_semaphore("cache"):
+                cached = await client.aio.caches.update(
+                    name=entry.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"),
+                )
+            entry.expires_at = self._expiry(cached)
+            self.renewed += 1
+        except Exception as e:
+            self.failures += 1
+            print(f"[CONTEXT CACHE] Renew failed, dropping {entry.name}: {e}")
+            self._forget(key)
+
+    async def _delete(self, client, name: str):
+        try:
+            async with tier_semaphore("cache"):
+                await client.aio.caches.delete(name=name)
+        except Exception as e:
+            print(f"[CONTEXT CACHE] Delete of {name} failed: {e}")
+
+    def _forget(self, key: str):
+        self._entries.pop(key, None)
+
+    def _expiry(self, cached) -> float:
+        expire_time = getattr(cached, "expire_time", None)
+        return expire_time.timestamp() if expire_time else time.time() + self.ttl
+
+    async def aclose(self, client):
+        """Delete every cache we own (call on shutdown; they cost storage until TTL)."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        entries = list(self._entries.values())
+        self._entries.clear()
+        await asyncio.gather(*(self._delete(client, e.name) for e in entries), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "pending": len(self._pending),
+            "cached_tokens": sum(e.tokens for e in self._entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "created": self.created,
+            "renewed": self.renewed,
+            "evicted": self.evicted,
+            "invalidated": self.invalidated,
+            "failures": self.failures,
+            "ttl_seconds": self.ttl,
+            "min_tokens": self.min_tokens,
+        }
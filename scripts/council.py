@@ -77,6 +77,10 @@ def _get_genai_client():
     """Get a google.genai client for council queries."""
     from google import genai
     from google.genai.types import HttpOptions
+    try:
+        from credential_broker import get_broker
+    except ImportError:
+        from scripts.credential_broker import get_broker
     
     project = os.getenv("GOOGLE_CLOUD_PROJECT", "project-5f169828-6f8d-450b-923")
     location = os.getenv("BANDIT_LOCATION", "global")
@@ -85,6 +89,7 @@ def _get_genai_client():
         vertexai=True,
         project=project,
         location=location,
+        credentials=get_broker().try_credentials(),
         http_options=HttpOptions(api_version="v1")
     )
 
@@ -0,0 +1,249 @@
+"""Shared Google Cloud credential broker.
+
+One place for every Bandit process (proxy, CLI, voice backends, deploy
+scripts) to get credentials and access tokens:
+- loads GOOGLE_APPLICATION_CREDENTIALS_JSON (fileless service account) or ADC
+- refreshes ahead of expiry in the background, so requests see a valid token
+- one lock guards refresh, so concurrent callers never stampede the token endpoint
+- falls back to `gcloud auth print-access-token` (no shell) when google-auth fails
+- BANDIT_VERTEX_STANDIN_URL points every google-genai client at the local
+  stand-in (scripts/vertex_standin.py) and hands out a static token
+"""
+
+import asyncio
+import calendar
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from typing import Any, Dict, Optional
+
+DEFAULT_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+REFRESH_MARGIN = int(os.getenv("BANDIT_TOKEN_REFRESH_MARGIN", 5 * 60))  # refresh 5 min before expiry
+EXPIRY_SKEW = 30                # treat tokens this close to expiry as expired
+FALLBACK_TOKEN_TTL = 55 * 60    # gcloud tokens / credentials without expiry
+VERTEX_STANDIN_URL = os.getenv("BANDIT_VERTEX_STANDIN_URL", "").rstrip("/")  # unset in production
+STANDIN_TOKEN = "standin-token"
+
+
+def use_vertex_standin(url: str = VERTEX_STANDIN_URL) -> bool:
+    """Route google-genai clients built after this call (Vertex and API-key) to the stand-in at `url`."""
+    if not url:
+        return False
+    # google-genai reads these when a client has no explicit http_options.base_url
+    os.environ["GOOGLE_VERTEX_BASE_URL"] = url
+    os.environ["GOOGLE_GEMINI_BASE_URL"] = url
+    return True
+
+
+class CredentialBroker:
+    """Thread-safe token source with proactive background refresh."""
+
+    def __init__(self, scopes=None, refresh_margin: int = REFRESH_MARGIN):
+        self.scopes = scopes or DEFAULT_SCOPES
+        self.refresh_margin = refresh_margin
+        self._credentials = None
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.background_refreshes = 0
+        self.failures = 0
+        self.gcloud_fallbacks = 0
+
+    # ── credentials ──────────────────────────────────────────────────────────
+
+    @property
+    def credentials(self):
+        """google-auth credentials (loaded once, shared by every client)."""
+        if self._credentials is None:
+            with self._load_lock:
+                if self._credentials is None:
+                    self._credentials = self._load()
+        return self._credentials
+
+    def try_credentials(self):
+        """Credentials, or None so SDK clients can fall back to their own ADC lookup."""
+        try:
+            return self.credentials
+        except Exception as e:
+            print(f"[AUTH WARNING] Credential broker could not load credentials: {e}")
+            return None
+
+    def _load(self):
+        import google.auth
+        from google.oauth2 import credentials as oauth2_credentials, service_account
+
+        if VERTEX_STANDIN_URL:
+            return oauth2_credentials.Credentials(token=STANDIN_TOKEN)
+
+        json_blob = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
+        if json_blob:
+            try:
+                info = json.loads(json_blob)
+                return service_account.Credentials.from_service_account_info(info, scopes=self.scopes)
+            except Exception as exc:
+                print(f"[AUTH WARNING] Failed to load GOOGLE_APPLICATION_CREDENTIALS_JSON: {exc}. Falling back to ADC.")
+        creds, _ = google.auth.default(scopes=self.scopes)
+        return creds
+
+    # ── tokens ───────────────────────────────────────────────────────────────
+
+    def _valid(self, now: float) -> bool:
+        return bool(self._token) and now < self._expires_at - EXPIRY_SKEW
+
+    def get_token(self) -> Optional[str]:
+        """Current access token. Only blocks when no valid token exists."""
+        now = time.time()
+        if self._valid(now):
+            self.hits += 1
+            if now >= self._expires_at - self.refresh_margin:
+                self.refresh_in_background()
+            return self._token
+        self.misses += 1
+        with self._refresh_lock:
+            if self._valid(time.time()):  # another caller refreshed while we waited
+                return self._token
+            self._refresh_locked()
+        return self._token if self._valid(time.time()) else None
+
+    async def get_token_async(self) -> Optional[str]:
+        """Async variant: returns immediately on the hot path, refreshes off-loop otherwise."""
+        if self._valid(time.time()):
+            return self.get_token()
+        return await asyncio.to_thread(self.get_token)
+
+    def refresh_in_background(self) -> bool:
+        """Start a refresh unless one is already running."""
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                self.background_refreshes += 1
+                self._refresh_locked()
+            finally:
+                self._refresh_lock.release()
+
+        threading.Thread(target=run, daemon=True, name="credential-refresh").start()
+        return True
+
+    def _refresh_locked(self):
+        """Refresh the token; caller must hold `_refresh_lock`."""
+        if VERTEX_STANDIN_URL:
+            self._store(STANDIN_TOKEN, None)
+            return
+        try:
+            from google.auth.transport.requests import Request as GoogleRequest
+            creds = self.credentials
+            creds.refresh(GoogleRequest())
+            self._store(creds.token, creds.expiry)
+            return
+        except Exception as e:
+            print(f"[AUTH ERROR] {e}")
+        token = self._gcloud_token()
+        if token:
+            self.gcloud_fallbacks += 1
+            self._store(token, None)
+        else:
+            self.failures += 1
+
+    def _store(self, token: Optional[str], expiry):
+        if not token:
+            self.failures += 1
+            return
+        # google-auth expiry is a naive UTC datetime
+        expires_at = calendar.timegm(expiry.timetuple()) if expiry else time.time() + FALLBACK_TOKEN_TTL
+        self._token = token
+        self._expires_at = expires_at
+        self.refreshes += 1
+        print(f"[AUTH] Token refreshed, valid for {int((expires_at - time.time()) // 60)} min")
+
+    @staticmethod
+    def _gcloud_token() -> Optional[str]:
+        gcloud = shutil.which("gcloud")
+        if not gcloud:
+            return None
+        try:
+            result = subprocess.run(
+                [gcloud, "auth", "print-access-token"],
+                capture_output=True, text=True, timeout=10,
+            )
+            if result.returncode == 0:
+                token = result.stdout.strip().split("\n")[-1]
+                if token.startswith("ya29."):
+                    return token
+        except Exception as e:
+            print(f"[AUTH ERROR] gcloud fallback failed: {e}")
+        return None
+
+    # ── proactive refresher ──────────────────────────────────────────────────
+
+    def start(self):
+        """Keep the token fresh even when no requests arrive (idempotent)."""
+        if self._refresher and self._refresher.is_alive():
+            return
+        self._stop.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, daemon=True, name="credential-broker")
+        self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        consecutive_failures = 0
+        while not self._stop.is_set():
+            if time.time() >= self._expires_at - self.refresh_margin:
+                with self._refresh_lock:
+                    if time.time() >= self._expires_at - self.refresh_margin:
+                        self._refresh_locked()
+            if self._valid(time.time()):
+                consecutive_failures = 0
+                # Wake at the next refresh point (at least every 15 min)
+                wait = max(1.0, min(self._expires_at - self.refresh_margin - time.time(), 15 * 60))
+            else:
+                consecutive_failures += 1
+                wait = min(300.0, 30.0 * 2 ** (consecutive_failures - 1))
+            self._stop.wait(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "token_valid": self._valid(time.time()),
+            "expires_in_seconds": max(0, int(self._expires_at - time.time())),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "background_refreshes": self.background_refreshes,
+            "gcloud_fallbacks": self.gcloud_fallbacks,
+            "failures": self.failures,
+        }
+
+
+_BROKER: Optional[CredentialBroker] = None
+_BROKER_LOCK = threading.Lock()
+
+
+def get_broker() -> CredentialBroker:
+    """Process-wide credential broker."""
+    global _BROKER
+    if _BROKER is None:
+        with _BROKER_LOCK:
+            if _BROKER is None:
+                _BROKER = CredentialBroker()
+    return _BROKER
+
+
+def get_access_token() -> Optional[str]:
+    """Shortcut for `get_broker().get_token()`."""
+    return get_broker().get_token()
+
+
+if use_vertex_standin():
+    print(f"[AUTH] Using the Vertex AI stand-in at {VERTEX_STANDIN_URL} (static token)")
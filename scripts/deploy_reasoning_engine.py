@@ -17,6 +17,13 @@ from langchain_core.messages import SystemMessage, HumanMessage
 import requests
 from typing import Dict, Any, List
 
+try:
+    from credential_broker import get_broker
+    import artifact_store
+except ImportError:
+    from scripts.credential_broker import get_broker
+    from scripts import artifact_store
+
 # Hardcoded for now, but could be dynamic
 DEFAULT_PROJECT = "project-5f169828-6f8d-450b-923"
 DEFAULT_LOCATION = "global"
@@ -50,10 +57,14 @@ def load_system_instruction(path: str) -> str:
 class BanditEngine:
     """The Bandit Agent Reasoning Engine with 6-tier intelligent model routing."""
 
-    def __init__(self, project: str, location: str, model: str, system_instruction: str):
+    def __init__(self, project: str, location: str, model: str, system_instruction: str,
+                 artifact_bucket: Optional[str] = None):
         self.project = project
         self.location = location
         self.system_instruction = system_instruction
+        # Generated images go to gs://<artifact_bucket>/artifacts/<sha256>; output carries a short tag
+        self.artifact_bucket = artifact_bucket
+        self._artifacts = None  # created lazily on the remote worker (storage clients don't pickle)
         
         # Initialize Vertex AI with regional endpoint for 2.5 models
         vertexai.init(project=self.project, location=self.location)
@@ -245,15 +256,13 @@ Respond with ONLY: flash, pro, or elite"""
         
         # Extract text and image from response
         result_parts = []
-        import base64
         
         for candidate in response.candidates:
             for part in candidate.content.parts:
                 # Check for image data FIRST (priority)
                 if hasattr(part, 'inline_data') and part.inline_data:
-                    # Return base64 for CLI to save locally
-                    b64_data = base64.b64encode(part.inline_data.data).decode('utf-8')
-                    result_parts.append(f"[IMAGE_B64]{b64_data}[/IMAGE_B64]")
+                    result_parts.append(self._image_reference(part.inline_data.data,
+                                                              part.inline_data.mime_type or "image/png"))
                     result_parts.append(f"✓ Image generated ({len(part.inline_data.data):,} bytes)")
                 # Also include any text (thinking/reasoning) 
                 elif part.text:
@@ -261,6 +270,22 @@ Respond with ONLY: flash, pro, or elite"""
         
         return "\n".join(result_parts) if result_parts else "Image generated (no content)."
 
+    def _image_reference(self, data: bytes, mime_type: str) -> str:
+        """Store the image out of band and return its [ARTIFACT ...] tag.
+
+        Without an artifact bucket (or if the upload fails) the image is inlined
+        as a legacy [IMAGE_B64] block, which clients still understand.
+        """
+        if self.artifact_bucket:
+            try:
+                if self._artifacts is None:
+                    self._artifacts = artifact_store.GCSArtifactStore(self.artifact_bucket, project=self.project)
+                return self._artifacts.put(data, mime_type).tag
+            except Exception as e:
+                print(f"[artifacts] Upload failed, inlining image: {e}")
+        import base64
+        return f"[IMAGE_B64]{base64.b64encode(data).decode('utf-8')}[/IMAGE_B64]"
+
     def call_external_agent(self, url: str, payload: dict) -> str:
         """Calls another external agent (Reasoning Engine or Cloud Run service).
         
@@ -380,12 +405,14 @@ def deploy(args):
     print(f"- Model: {args.model}")
     print(f"- Staging Bucket: {args.staging_bucket}")
 
-    vertexai.init(project=args.project, location=args.location, staging_bucket=args.staging_bucket)
+    credentials = get_broker().try_credentials()
+    vertexai.init(project=args.project, location=args.location, staging_bucket=args.staging_bucket,
+                  credentials=credentials)
 
     # Ensure staging bucket exists
     try:
         from google.cloud import storage
-        storage_client = storage.Client(project=args.project)
+        storage_client = storage.Client(project=args.project, credentials=credentials)
         bucket_name = args.staging_bucket.replace("gs://", "")
         bucket = storage_client.bucket(bucket_name)
         if not bucket.exists():
@@ -399,13 +426,19 @@ def deploy(args):
     # Load the actual system instruction to bake into the class
     system_instruction = load_system_instruction(args.system)
 
+    # The artifact store lives in a sibling module that is not installed remotely:
+    # pickle it by value along with the agent
+    import cloudpickle
+    cloudpickle.register_pickle_by_value(artifact_store)
+
     # Create the remote engine
     remote_app = reasoning_engines.ReasoningEngine.create(
         BanditEngine(
             project=args.project,
             location=args.location,
             model=args.model,
-            system_instruction=system_instruction
+            system_instruction=system_instruction,
+            artifact_bucket=args.artifact_bucket or args.staging_bucket,
         ),
         requirements=[
             "google-cloud-aiplatform[reasoningengine,langchain]",
@@ -429,6 +462,8 @@ if __name__ == "__main__":
     parser.add_argument("--model", default="gemini-3-pro-preview")
     parser.add_argument("--staging-bucket", required=True, help="GCS bucket for staging artifacts (gs://...)")
     parser.add_argument("--system", default="agent-bandit.md")
+    parser.add_argument("--artifact-bucket", default=None,
+                        help="GCS bucket for generated images (defaults to the staging bucket)")
     
     args = parser.parse_args()
     deploy(args)
@@ -0,0 +1,240 @@
+"""Batched, concurrent and cached embeddings for /v1/embeddings.
+
+`embed_content` accepts a list of texts, so instead of one round trip per
+input the service:
+- drops inputs already in the content-hash cache (and duplicates within the request)
+- packs the rest into batches under the model's per-request input and token limits
+- runs the batches concurrently under a per-request limit (plus the "embed" tier limit)
+- splits a batch in half if the API rejects its size (too many inputs or tokens),
+  down to single inputs; any other 400 fails the request at once
+
+Vectors are kept as float32, so the cache is compact and `encoding_format=base64`
+is a straight byte copy. Reduced `dimensions` are requested from the model
+(`output_dimensionality`) and enforced locally by truncating and re-normalizing.
+"""
+
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from google.genai import types
+
+try:
+    from model_runtime import embed_content
+except ImportError:
+    from scripts.model_runtime import embed_content
+
+EMBED_CACHE_BYTES = int(os.getenv("BANDIT_EMBED_CACHE_BYTES", 64 * 1024 * 1024))  # 64 MB
+EMBED_REQUEST_CONCURRENCY = int(os.getenv("BANDIT_EMBED_REQUEST_CONCURRENCY", 4))
+# Inputs per embed_content call (BANDIT_EMBED_BATCH_SIZE overrides for every model)
+MODEL_BATCH_LIMITS = {
+    "gemini-embedding-001": 250,
+    "text-embedding-005": 250,
+    "text-multilingual-embedding-002": 250,
+}
+DEFAULT_BATCH_LIMIT = 100
+EMBED_BATCH_SIZE = os.getenv("BANDIT_EMBED_BATCH_SIZE")
+# Vertex caps the summed input tokens of one request
+BATCH_TOKEN_LIMIT = int(os.getenv("BANDIT_EMBED_BATCH_TOKENS", 20000))
+# 400 messages that blame the batch size, not the request's parameters
+BATCH_TOO_LARGE_RE = re.compile(
+    r"instances|too many (inputs|texts|contents|requests)|token count|input tokens|tokens? limit|batch size"
+    r"|payload size|request is too large",
+    re.IGNORECASE,
+)
+
+
+def batch_limit(model: str) -> int:
+    if EMBED_BATCH_SIZE:
+        return int(EMBED_BATCH_SIZE)
+    return MODEL_BATCH_LIMITS.get(model.split("/")[-1], DEFAULT_BATCH_LIMIT)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def make_batches(texts: List[str], max_items: int, max_tokens: int = BATCH_TOKEN_LIMIT) -> List[List[int]]:
+    """Indices of `texts` grouped into batches under the item and token limits."""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    tokens = 0
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text)
+        if current and (len(current) >= max_items or tokens + cost > max_tokens):
+            batches.append(current)
+            current, tokens = [], 0
+        current.append(i)
+        tokens += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def reduce_dimensions(vector: np.ndarray, dimensions: Optional[int]) -> np.ndarray:
+    """Truncate to `dimensions` and L2-normalize again (Matryoshka-style, like OpenAI)."""
+    if not dimensions or len(vector) <= dimensions:
+        return vector
+    vector = vector[:dimensions]
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def encode_vector(vector: np.ndarray, encoding_format: str):
+    """OpenAI wire format: a float list, or base64 of little-endian float32."""
+    if encoding_format == "base64":
+        return base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+    return vector.tolist()
+
+
+def _is_batch_rejected(error: Exception) -> bool:
+    """The API refused the batch for its size (a 400 about too many inputs or tokens).
+
+    A 400 for a bad task_type or dimensions value would fail for every half too,
+    so it is not worth splitting.
+    """
+    if getattr(error, "code", None) != 400:
+        return False
+    return bool(BATCH_TOO_LARGE_RE.search(getattr(error, "message", None) or str(error)))
+
+
+class EmbeddingCache:
+    """Content-hash LRU of float32 vectors bounded by total bytes."""
+
+    def __init__(self, max_bytes: int = EMBED_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(model: str, task_type: Optional[str], dimensions: Optional[int], text: str) -> str:
+        h = hashlib.sha256(f"{model}\x00{task_type or ''}\x00{dimensions or 0}\x00".encode())
+        h.update(text.encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def set(self, key: str, vector: np.ndarray):
+        if vector.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = vector
+            self._bytes += vector.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class EmbeddingService:
+    """Embeds lists of texts with caching, batching and bounded concurrency."""
+
+    def __init__(self, cache: Optional[EmbeddingCache] = None, concurrency: int = EMBED_REQUEST_CONCURRENCY):
+        self.cache = cache or EmbeddingCache()
+        self.concurrency = concurrency
+        self.requests = 0
+        self.inputs = 0
+        self.upstream_calls = 0
+        self.split_batches = 0
+
+    async def embed(self, client, texts: List[str], model: str, task_type: Optional[str] = None,
+                    dimensions: Optional[int] = None) -> List[np.ndarray]:
+        """float32 vectors for `texts`, in order."""
+        self.requests += 1
+        self.inputs += len(texts)
+        keys = [EmbeddingCache.key(model, task_type, dimensions, t) for t in texts]
+        vectors: Dict[str, np.ndarray] = {}
+        missing: Dict[str, str] = {}  # key -> text, first occurrence wins
+        for key, text in zip(keys, texts):
+            if key in vectors or key in missing:
+                continue
+            cached = self.cache.get(key)
+            if cached is not None:
+                vectors[key] = cached
+            else:
+                missing[key] = text
+
+        if missing:
+            todo_keys = list(missing)
+            todo_texts = [missing[k] for k in todo_keys]
+            config = types.EmbedContentConfig(task_type=task_type, output_dimensionality=dimensions) \
+                if (task_type or dimensions) else None
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def run(batch: List[int]):
+                async with semaphore:
+                    return batch, await self._embed_batch(client, model, [todo_texts[i] for i in batch], config)
+
+            batches = make_batches(todo_texts, batch_limit(model))
+            for batch, batch_vectors in await asyncio.gather(*(run(b) for b in batches)):
+                for i, values in zip(batch, batch_vectors):
+                    vector = reduce_dimensions(np.asarray(values, dtype=np.float32), dimensions)
+                    vectors[todo_keys[i]] = vector
+                    self.cache.set(todo_keys[i], vector)
+        return [vectors[key] for key in keys]
+
+    async def _embed_batch(self, client, model: str, texts: List[str], config) -> List[List[float]]:
+        self.upstream_calls += 1
+        try:
+            kwargs = {"model": model, "contents": texts}
+            if config is not None:
+                kwargs["config"] = config
+            result = await embed_content(client, **kwargs)
+        except Exception as e:
+            if len(texts) == 1 or not _is_batch_rejected(e):
+                raise
+            self.split_batches += 1
+            middle = len(texts) // 2
+            left, right = await asyncio.gather(self._embed_batch(client, model, texts[:middle], config),
+                                               self._embed_batch(client, model, texts[middle:], config))
+            return left + right
+        embeddings = result.embeddings or []
+        if len(embeddings) != len(texts):
+            raise RuntimeError(f"embed_content returned {len(embeddings)} embeddings for {len(texts)} inputs")
+        return [e.values for e in embeddings]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "inputs": self.inputs,
+            "upstream_calls": self.upstream_calls,
+            "split_batches": self.split_batches,
+            "request_concurrency": self.concurrency,
+            "cache": self.cache.stats(),
+        }
@@ -0,0 +1,133 @@
+"""Pooled keep-alive HTTP client for Reasoning Engine `:query` calls.
+
+A bare `requests.post` opens a new TCP+TLS connection for every call. The
+clients here are shared per process, keep connections alive between calls,
+negotiate HTTP/2 when `h2` is installed, cap connections, and give every call
+its own deadline.
+"""
+
+import asyncio
+import importlib.util
+import os
+import threading
+from typing import Optional, Tuple
+
+import httpx
+
+try:
+    from credential_broker import VERTEX_STANDIN_URL
+except ImportError:
+    from scripts.credential_broker import VERTEX_STANDIN_URL
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+ENGINE_MAX_CONNECTIONS = int(os.getenv("BANDIT_ENGINE_MAX_CONNECTIONS", 32))
+ENGINE_MAX_KEEPALIVE = int(os.getenv("BANDIT_ENGINE_MAX_KEEPALIVE", 16))
+ENGINE_KEEPALIVE_EXPIRY = float(os.getenv("BANDIT_ENGINE_KEEPALIVE_EXPIRY", 120))
+ENGINE_CONNECT_TIMEOUT = 10.0
+ENGINE_DEFAULT_DEADLINE = float(os.getenv("BANDIT_ENGINE_DEADLINE", 120))
+
+_ASYNC_CLIENT: Optional[Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = None
+_SYNC_CLIENT: Optional[httpx.Client] = None
+_SYNC_LOCK = threading.Lock()
+
+
+class EngineQueryError(Exception):
+    """Non-200 response from the Reasoning Engine."""
+
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"Reasoning Engine returned {status_code}")
+        self.status_code = status_code
+        self.body = body
+
+
+def engine_endpoint(resource_name: str, location: str) -> str:
+    """REST `:query` URL for a Reasoning Engine resource."""
+    if VERTEX_STANDIN_URL:
+        return f"{VERTEX_STANDIN_URL}/v1beta1/{resource_name}:query"
+    return f"https://{location}-aiplatform.googleapis.com/v1beta1/{resource_name}:query"
+
+
+def engine_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=ENGINE_MAX_CONNECTIONS,
+        max_keepalive_connections=ENGINE_MAX_KEEPALIVE,
+        keepalive_expiry=ENGINE_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout(deadline: float) -> httpx.Timeout:
+    return httpx.Timeout(deadline, connect=min(ENGINE_CONNECT_TIMEOUT, deadline))
+
+
+def build_async_client(verify=True, http2: bool = HTTP2_AVAILABLE) -> httpx.AsyncClient:
+    return httpx.AsyncClient(http2=http2, limits=engine_limits(), verify=verify,
+                             timeout=_timeout(ENGINE_DEFAULT_DEADLINE))
+
+
+def build_sync_client(verify=True, http2: bool = HTTP2_AVAILABLE) -> httpx.Client:
+    return httpx.Client(http2=http2, limits=engine_limits(), verify=verify,
+                        timeout=_timeout(ENGINE_DEFAULT_DEADLINE))
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Process-wide pooled async client (bound to the running loop)."""
+    global _ASYNC_CLIENT
+    loop = asyncio.get_running_loop()
+    if _ASYNC_CLIENT is None or _ASYNC_CLIENT[0] is not loop or _ASYNC_CLIENT[1].is_closed:
+        _ASYNC_CLIENT = (loop, build_async_client())
+    return _ASYNC_CLIENT[1]
+
+
+def get_sync_client() -> httpx.Client:
+    """Process-wide pooled sync client for the CLI."""
+    global _SYNC_CLIENT
+    with _SYNC_LOCK:
+        if _SYNC_CLIENT is None or _SYNC_CLIENT.is_closed:
+            _SYNC_CLIENT = build_sync_client()
+        return _SYNC_CLIENT
+
+
+def _payload(prompt: str) -> dict:
+    # Reasoning Engine REST API requires both 'input' and 'classMethod'
+    return {"input": {"prompt": prompt}, "classMethod": "query"}
+
+
+def _headers(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+
+def _output(response: httpx.Response) -> str:
+    if response.status_code != 200:
+        raise EngineQueryError(response.status_code, response.text)
+    result = response.json()
+    output = result.get("output", str(result))
+    return str(output) if isinstance(output, dict) else output
+
+
+async def query_async(endpoint: str, prompt: str, token: str, deadline: float = ENGINE_DEFAULT_DEADLINE,
+                      client: Optional[httpx.AsyncClient] = None) -> str:
+    """POST a prompt to `:query` and return the output text, within `deadline` seconds overall."""
+    client = client or get_async_client()
+    request = client.post(endpoint, headers=_headers(token), json=_payload(prompt), timeout=_timeout(deadline))
+    try:
+        response = await asyncio.wait_for(request, timeout=deadline)
+    except asyncio.TimeoutError:
+        raise httpx.TimeoutException(f"Reasoning Engine deadline of {deadline:.0f}s exceeded")
+    return _output(response)
+
+
+def query_sync(endpoint: str, prompt: str, token: str, deadline: float = ENGINE_DEFAULT_DEADLINE,
+               client: Optional[httpx.Client] = None) -> str:
+    """Blocking variant of `query_async` on the shared sync pool."""
+    client = client or get_sync_client()
+    response = client.post(endpoint, headers=_headers(token), json=_payload(prompt), timeout=_timeout(deadline))
+    return _output(response)
+
+
+async def aclose():
+    """Close the shared async pool (call on shutdown)."""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT[1].aclose()
+        _ASYNC_CLIENT = None
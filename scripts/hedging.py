@@ -0,0 +1,197 @@
+"""Hedged requests for auto mode.
+
+The Reasoning Engine has a long latency tail. A hedged call starts the
+primary and, if it has not answered by a percentile of its own recent
+latency, starts a secondary on a faster path; the first answer wins and the
+other call is cancelled. Because the delay tracks the primary's live latency
+histogram (and hedges are capped to a fraction of traffic), only the slow
+tail pays for a second call.
+"""
+
+import asyncio
+import bisect
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+HEDGE_ENABLED = os.getenv("BANDIT_HEDGE", "1") != "0"
+HEDGE_PERCENTILE = float(os.getenv("BANDIT_HEDGE_PERCENTILE", 0.95))
+HEDGE_MIN_DELAY = float(os.getenv("BANDIT_HEDGE_MIN_DELAY", 0.5))
+HEDGE_MAX_DELAY = float(os.getenv("BANDIT_HEDGE_MAX_DELAY", 30))
+HEDGE_DEFAULT_DELAY = float(os.getenv("BANDIT_HEDGE_DEFAULT_DELAY", 8))   # until enough samples
+HEDGE_MIN_SAMPLES = int(os.getenv("BANDIT_HEDGE_MIN_SAMPLES", 20))
+HEDGE_MAX_RATIO = float(os.getenv("BANDIT_HEDGE_MAX_RATIO", 0.2))         # max share of calls hedged
+
+# Log-spaced bucket bounds from 10ms to ~10min (25% apart)
+BUCKET_BOUNDS = tuple(0.01 * 1.25 ** i for i in range(int(math.log(60000, 1.25)) + 2))
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram that halves its counts to follow recent traffic."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._counts = [0.0] * (len(BUCKET_BOUNDS) + 1)
+        self._total = 0.0
+        self._lock = threading.Lock()
+        self.samples = 0
+        self.sum = 0.0
+
+    def record(self, seconds: float):
+        index = bisect.bisect_left(BUCKET_BOUNDS, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._total += 1
+            self.samples += 1
+            self.sum += seconds
+            if self._total >= self.window:
+                self._counts = [c / 2 for c in self._counts]
+                self._total /= 2
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None when empty)."""
+        with self._lock:
+            if not self._total:
+                return None
+            target = q * self._total
+            cumulative = 0.0
+            for index, count in enumerate(self._counts):
+                cumulative += count
+                if cumulative >= target and count:
+                    return BUCKET_BOUNDS[min(index, len(BUCKET_BOUNDS) - 1)]
+            return BUCKET_BOUNDS[-1]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "samples": self.samples,
+            "mean": round(self.sum / self.samples, 4) if self.samples else 0.0,
+            **{name: round(value, 4) if value is not None else None
+               for name, value in (("p50", self.quantile(0.5)), ("p95", self.quantile(0.95)),
+                                   ("p99", self.quantile(0.99)))},
+        }
+
+
+class Hedger:
+    """Runs primary/secondary pairs with a histogram-driven hedge delay."""
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, min_delay: float = HEDGE_MIN_DELAY,
+                 max_delay: float = HEDGE_MAX_DELAY, default_delay: float = HEDGE_DEFAULT_DELAY,
+                 min_samples: int = HEDGE_MIN_SAMPLES, max_ratio: float = HEDGE_MAX_RATIO,
+                 enabled: bool = HEDGE_ENABLED):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self.enabled = enabled
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._recent = deque(maxlen=200)  # True where the call was hedged
+        self.calls = 0
+        self.hedged = 0
+        self.budget_skips = 0
+        self.wins: Dict[str, int] = {}
+        self.failures = 0
+
+    def histogram(self, path: str) -> LatencyHistogram:
+        if path not in self.histograms:
+            self.histograms[path] = LatencyHistogram()
+        return self.histograms[path]
+
+    def hedge_delay(self, path: str) -> float:
+        """Seconds to wait on `path` before hedging: its recent latency percentile, clamped."""
+        histogram = self.histogram(path)
+        if histogram.samples < self.min_samples:
+            return self.default_delay
+        return min(self.max_delay, max(self.min_delay, histogram.quantile(self.percentile)))
+
+    def _within_budget(self) -> bool:
+        if len(self._recent) < self.min_samples:  # too little traffic to judge a ratio
+            return True
+        return sum(self._recent) / len(self._recent) < self.max_ratio
+
+    async def _timed(self, path: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        start = time.perf_counter()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # A cancelled loser records how long it had run so far: a lower bound, but without it
+            # the slow tail would vanish from the histogram and the hedge delay would keep shrinking
+            self.histogram(path).record(time.perf_counter() - start)
+            raise
+        self.histogram(path).record(time.perf_counter() - start)
+        return result
+
+    async def run(self, primary: Tuple[str, Callable[[], Awaitable[Any]]],
+                  secondary: Tuple[str, Callable[[], Awaitable[Any]]]) -> Tuple[str, Any]:
+        """Return (winning path, result). A failed primary triggers the secondary at once."""
+        primary_path, primary_fn = primary
+        secondary_path, secondary_fn = secondary
+        self.calls += 1
+        primary_task = asyncio.ensure_future(self._timed(primary_path, primary_fn))
+        try:
+            return await self._race(primary_task, primary_path, secondary_path, secondary_fn)
+        except asyncio.CancelledError:
+            primary_task.cancel()  # caller went away
+            raise
+
+    async def _race(self, primary_task: asyncio.Future, primary_path: str, secondary_path: str,
+                    secondary_fn: Callable[[], Awaitable[Any]]) -> Tuple[str, Any]:
+        if not self.enabled:
+            self._recent.append(False)
+            result = await primary_task
+            self._win(primary_path)
+            return primary_path, result
+
+        done, _ = await asyncio.wait({primary_task}, timeout=self.hedge_delay(primary_path))
+        if done and not primary_task.exception():
+            self._recent.append(False)
+            self._win(primary_path)
+            return primary_path, primary_task.result()
+        if not done and not self._within_budget():
+            self.budget_skips += 1
+            self._recent.append(False)
+            result = await primary_task
+            self._win(primary_path)
+            return primary_path, result
+
+        self._recent.append(True)
+        self.hedged += 1
+        tasks = {primary_task: primary_path,
+                 asyncio.ensure_future(self._timed(secondary_path, secondary_fn)): secondary_path}
+        pending = set(tasks)
+        errors = {}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._win(tasks[task])
+                        return tasks[task], task.result()
+                    errors[tasks[task]] = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        self.failures += 1
+        raise errors.get(primary_path) or errors[secondary_path]
+
+    def _win(self, path: str):
+        self.wins[path] = self.wins.get(path, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "percentile": self.percentile,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.calls, 4) if self.calls else 0.0,
+            "max_ratio": self.max_ratio,
+            "budget_skips": self.budget_skips,
+            "wins": dict(self.wins),
+            "failures": self.failures,
+            "delays": {path: round(self.hedge_delay(path), 3) for path in self.histograms},
+            "latency_seconds": {path: h.summary() for path, h in self.histograms.items()},
+        }
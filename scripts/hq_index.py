@@ -0,0 +1,559 @@
+"""Local vector index over the HQ knowledge base (HQ/**/*.md).
+
+Replaces both remote Vertex AI Search round trips and per-query keyword scans
+that re-read every file:
+- documents are chunked by markdown section and embedded once
+- vectors live in a memory-mapped .npy matrix (float32, or int8 with per-row
+  scales) next to a JSON metadata sidecar
+- `update()` only re-reads files whose mtime/size changed and only re-embeds
+  chunks whose content hash is new; everything else is copied from the old matrix
+- a query is one matrix-vector product plus `argpartition` top-k, with the
+  `search_profiles` filters and boosts from HQ/memory/bandit_rag_config.yaml
+  applied as NumPy masks
+
+Chunk metadata has `path`, `dir`, `title` and `section`, plus any scalar
+fields from a document's YAML front matter (e.g. `category`, `confidence`),
+which is what profile filters and boosts match against.
+
+    python scripts/hq_index.py build
+    python scripts/hq_index.py search "what is velvet hours" --profile snow_context
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from embedding_service import batch_limit, make_batches
+except ImportError:
+    from scripts.embedding_service import batch_limit, make_batches
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+HQ_ROOT = Path(os.getenv("BANDIT_HQ_ROOT", REPO_ROOT / "HQ"))
+INDEX_PATH = Path(os.getenv("BANDIT_HQ_INDEX_PATH", REPO_ROOT / ".cache" / "hq_index"))
+RAG_CONFIG_PATH = Path(os.getenv("BANDIT_RAG_CONFIG", HQ_ROOT / "memory" / "bandit_rag_config.yaml"))
+INDEX_EMBED_MODEL = os.getenv("BANDIT_RAG_EMBED_MODEL", "text-embedding-004")
+INDEX_DTYPE = os.getenv("BANDIT_HQ_INDEX_DTYPE", "float32")  # or "int8"
+CHUNK_CHARS = int(os.getenv("BANDIT_HQ_CHUNK_CHARS", 1500))
+DEFAULT_TOP_K = 5
+INDEX_FORMAT = 1
+
+HEADING = re.compile(r"^(#{1,3})\s+(.+?)\s*#*\s*$")
+
+
+# ── chunking ─────────────────────────────────────────────────────────────────
+
+def split_front_matter(text: str) -> Tuple[Dict[str, str], str]:
+    """(scalar front matter fields, body) for a document starting with a `---` YAML block."""
+    if not text.startswith("---"):
+        return {}, text
+    end = text.find("\n---", 3)
+    if end == -1:
+        return {}, text
+    try:
+        import yaml
+        data = yaml.safe_load(text[3:end]) or {}
+    except Exception:
+        return {}, text
+    if not isinstance(data, dict):
+        return {}, text
+    fields = {str(k): str(v) for k, v in data.items() if isinstance(v, (str, int, float, bool))}
+    return fields, text[end + 4:].lstrip("\n")
+
+
+def _split_long(body: str, limit: int) -> List[str]:
+    """Split a section body at paragraph (then line) boundaries into pieces under `limit` chars."""
+    if len(body) <= limit:
+        return [body]
+    pieces, current = [], ""
+    for para in re.split(r"\n\s*\n", body):
+        units = [para] if len(para) <= limit else para.splitlines()
+        for unit in units:
+            while len(unit) > limit:  # one enormous line
+                pieces.append(unit[:limit])
+                unit = unit[limit:]
+            if current and len(current) + len(unit) + 2 > limit:
+                pieces.append(current)
+                current = ""
+            current = f"{current}\n\n{unit}" if current else unit
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_markdown(text: str, path: str, limit: int = CHUNK_CHARS) -> List[Dict[str, Any]]:
+    """Chunk metadata dicts (with `text` and `embed_text`) for one markdown document."""
+    front, body = split_front_matter(text)
+    title = front.get("title") or Path(path).stem
+    parts = Path(path).parts
+    base = {"path": path, "dir": parts[0] if len(parts) > 1 else ""}
+    base.update(front)
+
+    sections: List[Tuple[str, List[str]]] = [("", [])]
+    for line in body.splitlines():
+        match = HEADING.match(line)
+        if match:
+            if len(match.group(1)) == 1 and "title" not in front and not any(s for s, _ in sections[1:]):
+                title = match.group(2)
+            sections.append((match.group(2), []))
+        else:
+            sections[-1][1].append(line)
+
+    chunks = []
+    for section, lines in sections:
+        section_body = "\n".join(lines).strip()
+        if not section_body:
+            continue
+        for piece in _split_long(section_body, limit):
+            heading = f"{title} > {section}" if section and section != title else title
+            chunks.append({**base, "title": title, "section": section or title, "text": piece,
+                           "embed_text": f"{heading}\n\n{piece}"})
+    return chunks
+
+
+def chunk_hash(model: str, embed_text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{embed_text}".encode("utf-8")).hexdigest()
+
+
+# ── search profiles ──────────────────────────────────────────────────────────
+
+FILTER_EQ = re.compile(r"(\w+)\s*=\s*'([^']*)'")
+FILTER_IN = re.compile(r"(\w+)\s+IN\s*\((.*)\)", re.IGNORECASE)
+
+
+def parse_filter(expr: Optional[str]) -> List[List[Tuple[str, List[str]]]]:
+    """Vertex-style filter -> OR of ANDs of (field, allowed values).
+
+    Supports `field = 'v'`, `field IN ('a', 'b')`, AND and OR (AND binds tighter).
+    """
+    if not expr or not expr.strip():
+        return []
+    disjuncts = []
+    for disjunct in re.split(r"\s+OR\s+", expr.strip(), flags=re.IGNORECASE):
+        terms = []
+        for term in re.split(r"\s+AND\s+", disjunct, flags=re.IGNORECASE):
+            term = term.strip()
+            match = FILTER_IN.fullmatch(term)
+            if match:
+                terms.append((match.group(1), re.findall(r"'([^']*)'", match.group(2))))
+                continue
+            match = FILTER_EQ.fullmatch(term.strip("() "))
+            if not match:
+                raise ValueError(f"Unsupported filter term: {term!r}")
+            terms.append((match.group(1), [match.group(2)]))
+        disjuncts.append(terms)
+    return disjuncts
+
+
+@dataclass
+class Boost:
+    field: str
+    values: List[str]
+    factor: float
+
+
+@dataclass
+class SearchProfile:
+    name: str
+    filter: List[List[Tuple[str, List[str]]]] = field(default_factory=list)
+    boosts: List[Boost] = field(default_factory=list)
+    max_results: int = DEFAULT_TOP_K
+
+
+def load_search_profiles(path: Path = RAG_CONFIG_PATH) -> Dict[str, SearchProfile]:
+    """`search_profiles` from the RAG config. Boost values multiply the cosine score."""
+    try:
+        import yaml
+        with open(path, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return {}
+    profiles = {}
+    for name, spec in (config.get("search_profiles") or {}).items():
+        spec = spec or {}
+        boosts = []
+        for boost in spec.get("boost_specs") or []:
+            values = boost.get("condition_in") or ([boost["condition"]] if "condition" in boost else [])
+            boosts.append(Boost(boost["field"], [str(v) for v in values], float(boost.get("boost_value", 1.0))))
+        profiles[name] = SearchProfile(name, parse_filter(spec.get("filter")), boosts,
+                                       int(spec.get("max_results", DEFAULT_TOP_K)))
+    return profiles
+
+
+# ── embedding ────────────────────────────────────────────────────────────────
+
+class GeminiEmbedder:
+    """Sync document/query embeddings through google-genai, batched under the model's limits."""
+
+    def __init__(self, model: str = INDEX_EMBED_MODEL, client=None, project: Optional[str] = None,
+                 location: str = "us-central1"):
+        self.model = model
+        self._client = client
+        self.project = project or os.getenv("GOOGLE_CLOUD_PROJECT", os.getenv("GCP_PROJECT"))
+        self.location = location
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google import genai
+            try:
+                from credential_broker import get_broker
+            except ImportError:
+                from scripts.credential_broker import get_broker
+            self._client = genai.Client(vertexai=True, project=self.project, location=self.location,
+                                        credentials=get_broker().try_credentials())
+        return self._client
+
+    def _embed(self, texts: List[str], task_type: str) -> np.ndarray:
+        from google.genai import types
+        vectors = []
+        for batch in make_batches(texts, batch_limit(self.model)):
+            result = self.client.models.embed_content(
+                model=self.model, contents=[texts[i] for i in batch],
+                config=types.EmbedContentConfig(task_type=task_type),
+            )
+            vectors.extend(e.values for e in result.embeddings)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self._embed(texts, "RETRIEVAL_DOCUMENT")
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._embed([text], "RETRIEVAL_QUERY")[0]
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: matrix ~= q * scales[:, None]."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+# ── index ────────────────────────────────────────────────────────────────────
+
+@dataclass
+class SearchResult:
+    score: float
+    path: str
+    title: str
+    section: str
+    text: str
+    metadata: Dict[str, Any]
+
+
+class HQIndex:
+    """Memory-mapped embedding matrix + metadata sidecar, updated incrementally."""
+
+    def __init__(self, root: Path = HQ_ROOT, path: Path = INDEX_PATH, embedder=None,
+                 dtype: str = INDEX_DTYPE, profiles: Optional[Dict[str, SearchProfile]] = None,
+                 chunk_chars: int = CHUNK_CHARS):
+        if dtype not in ("float32", "int8"):
+            raise ValueError("dtype must be 'float32' or 'int8'")
+        self.root = Path(root)
+        self.path = Path(path)
+        self.embedder = embedder or GeminiEmbedder()
+        self.model = getattr(self.embedder, "model", "custom")
+        self.dtype = dtype
+        self.chunk_chars = chunk_chars
+        self._profiles = profiles
+        self.meta: Dict[str, Any] = {}
+        self.vectors: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self._columns: Dict[str, np.ndarray] = {}
+        self._masks: Dict[Any, np.ndarray] = {}
+        self.load()
+
+    @property
+    def profiles(self) -> Dict[str, SearchProfile]:
+        if self._profiles is None:
+            self._profiles = load_search_profiles()
+        return self._profiles
+
+    # ── persistence ──────────────────────────────────────────────────────────
+
+    def _file(self, name: str, generation: int) -> Path:
+        return self.path / f"{name}-{generation}.npy"
+
+    def load(self) -> bool:
+        """Open the on-disk index (memory-mapped); False when missing or built differently."""
+        meta_path = self.path / "meta.json"
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return False
+        if (meta.get("format"), meta.get("model"), meta.get("dtype"), meta.get("chunk_chars")) != \
+                (INDEX_FORMAT, self.model, self.dtype, self.chunk_chars):
+            return False
+        generation = meta["generation"]
+        try:
+            vectors = np.load(self._file("vectors", generation), mmap_mode="r") if meta["chunks"] else None
+            scales = np.load(self._file("scales", generation), mmap_mode="r") \
+                if meta["chunks"] and self.dtype == "int8" else None
+        except FileNotFoundError:
+            return False
+        self.meta, self.vectors, self.scales = meta, vectors, scales
+        self._columns.clear()
+        self._masks.clear()
+        return True
+
+    def _write(self, meta: Dict[str, Any], matrix: np.ndarray):
+        self.path.mkdir(parents=True, exist_ok=True)
+        previous = self.meta.get("generation")
+        generation = (previous or 0) + 1
+        meta.update(format=INDEX_FORMAT, model=self.model, dtype=self.dtype, chunk_chars=self.chunk_chars,
+                    generation=generation, dim=int(matrix.shape[1]) if matrix.size else 0, updated_at=time.time())
+        if len(matrix):
+            if self.dtype == "int8":
+                quantized, scales = quantize_int8(matrix)
+                np.save(self._file("vectors", generation), quantized)
+                np.save(self._file("scales", generation), scales)
+            else:
+                np.save(self._file("vectors", generation), matrix)
+        # The sidecar is swapped in last, so readers never see a half-written generation
+        tmp = self.path / "meta.json.tmp"
+        tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path / "meta.json")
+        for stale in self.path.glob("*.npy"):
+            if not stale.stem.endswith(f"-{generation}"):
+                try:
+                    stale.unlink()
+                except OSError:
+                    pass  # still mapped elsewhere (Windows); removed on a later update
+        self.vectors = self.scales = None
+        self.load()
+
+    def _row_vectors(self, rows: Sequence[int]) -> np.ndarray:
+        """Float32 copies of existing rows (dequantized for int8)."""
+        if not len(rows):
+            return np.zeros((0, self.meta.get("dim", 0)), dtype=np.float32)
+        rows = np.asarray(rows)
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors = _normalize_rows(vectors * np.asarray(self.scales[rows])[:, None])
+        return vectors
+
+    # ── updates ──────────────────────────────────────────────────────────────
+
+    def _documents(self) -> List[Path]:
+        index_dir = self.path.resolve()
+        return sorted(p for p in self.root.rglob("*.md") if index_dir not in p.resolve().parents)
+
+    def update(self) -> Dict[str, int]:
+        """Bring the index in line with the files on disk; returns what changed."""
+        old_files: Dict[str, Dict[str, Any]] = self.meta.get("files", {})
+        old_chunks: List[Dict[str, Any]] = self.meta.get("chunks", [])
+        chunks_by_path: Dict[str, List[Dict[str, Any]]] = {}
+        for chunk in old_chunks:
+            chunks_by_path.setdefault(chunk["path"], []).append(chunk)
+        row_by_hash = {chunk["hash"]: row for row, chunk in enumerate(old_chunks)}
+
+        files: Dict[str, Dict[str, Any]] = {}
+        chunks: List[Dict[str, Any]] = []
+        stats = {"files": 0, "changed": 0, "removed": 0, "chunks": 0, "embedded": 0, "reused": 0}
+        for file_path in self._documents():
+            rel = file_path.relative_to(self.root).as_posix()
+            st = file_path.stat()
+            previous = old_files.get(rel)
+            stats["files"] += 1
+            if previous and previous["mtime_ns"] == st.st_mtime_ns and previous["size"] == st.st_size:
+                files[rel] = previous
+                chunks.extend(chunks_by_path.get(rel, []))
+                continue
+            data = file_path.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()
+            files[rel] = {"sha256": digest, "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+            if previous and previous["sha256"] == digest:  # touched, not edited
+                chunks.extend(chunks_by_path.get(rel, []))
+                continue
+            stats["changed"] += 1
+            for chunk in chunk_markdown(data.decode("utf-8", errors="ignore"), rel, self.chunk_chars):
+                embed_text = chunk.pop("embed_text")
+                chunk["hash"] = chunk_hash(self.model, embed_text)
+                chunk["_embed_text"] = embed_text
+                chunks.append(chunk)
+        stats["removed"] = len(set(old_files) - set(files))
+        stats["chunks"] = len(chunks)
+
+        if not stats["changed"] and not stats["removed"] and files.keys() == old_files.keys():
+            if files != old_files:  # only mtimes moved
+                self.meta["files"] = files
+                self._write_meta_only()
+            return stats
+
+        reuse = [i for i, c in enumerate(chunks) if c["hash"] in row_by_hash]
+        fresh = [i for i, c in enumerate(chunks) if c["hash"] not in row_by_hash]
+        stats["reused"], stats["embedded"] = len(reuse), len(fresh)
+        dim = self.meta.get("dim", 0)
+        parts: Dict[int, np.ndarray] = {}
+        if reuse:
+            old_vectors = self._row_vectors([row_by_hash[chunks[i]["hash"]] for i in reuse])
+            parts.update(zip(reuse, old_vectors))
+        if fresh:
+            new_vectors = _normalize_rows(np.asarray(
+                self.embedder.embed_documents([chunks[i]["_embed_text"] for i in fresh]), dtype=np.float32))
+            parts.update(zip(fresh, new_vectors))
+            dim = new_vectors.shape[1]
+        for chunk in chunks:
+            chunk.pop("_embed_text", None)
+        matrix = np.stack([parts[i] for i in range(len(chunks))]) if chunks else np.zeros((0, dim), np.float32)
+        self._write({"files": files, "chunks": chunks}, matrix)
+        return stats
+
+    def _write_meta_only(self):
+        tmp = self.path / "meta.json.tmp"
+        tmp.write_text(json.dumps(self.meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path / "meta.json")
+
+    # ── queries ──────────────────────────────────────────────────────────────
+
+    def __len__(self) -> int:
+        return len(self.meta.get("chunks", []))
+
+    def _column(self, name: str) -> np.ndarray:
+        column = self._columns.get(name)
+        if column is None:
+            column = np.array([str(c.get(name, "")) for c in self.meta.get("chunks", [])], dtype=object)
+            self._columns[name] = column
+        return column
+
+    def _filter_mask(self, clauses: List[List[Tuple[str, List[str]]]]) -> np.ndarray:
+        key = ("filter", json.dumps(clauses))
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.zeros(len(self), dtype=bool)
+            for terms in clauses:
+                conjunct = np.ones(len(self), dtype=bool)
+                for name, values in terms:
+                    conjunct &= np.isin(self._column(name), values)
+                mask |= conjunct
+            self._masks[key] = mask
+        return mask
+
+    def _boost_factors(self, boosts: List[Boost]) -> np.ndarray:
+        key = ("boost", json.dumps([(b.field, b.values, b.factor) for b in boosts]))
+        factors = self._masks.get(key)
+        if factors is None:
+            factors = np.ones(len(self), dtype=np.float32)
+            for boost in boosts:
+                factors[np.isin(self._column(boost.field), boost.values)] *= boost.factor
+            self._masks[key] = factors
+        return factors
+
+    def scores(self, query_vector: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every chunk to the query (one matrix-vector product)."""
+        q = np.asarray(query_vector, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(q))
+        q = q / norm if norm else q
+        scores = self.vectors @ q
+        if self.scales is not None:
+            scores = scores * self.scales
+        return np.asarray(scores, dtype=np.float32)
+
+    def search(self, query: str, k: Optional[int] = None, profile: Optional[str] = None,
+               filter: Optional[str] = None, query_vector: Optional[np.ndarray] = None) -> List[SearchResult]:
+        """Top-k chunks for `query`, with an optional search profile and extra filter."""
+        if not len(self):
+            return []
+        spec = None
+        if profile:
+            spec = self.profiles.get(profile)
+            if spec is None:
+                raise KeyError(f"Unknown search profile: {profile}")
+        k = k or (spec.max_results if spec else DEFAULT_TOP_K)
+        if query_vector is None:
+            query_vector = self.embedder.embed_query(query)
+        scores = self.scores(query_vector)
+        if spec and spec.boosts:
+            scores = scores * self._boost_factors(spec.boosts)
+        for clauses in ((spec.filter if spec else []), parse_filter(filter)):
+            if clauses:
+                scores = np.where(self._filter_mask(clauses), scores, -np.inf)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        chunks = self.meta["chunks"]
+        return [SearchResult(float(scores[i]), chunks[i]["path"], chunks[i]["title"], chunks[i]["section"],
+                             chunks[i]["text"], chunks[i]) for i in top if np.isfinite(scores[i])]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path),
+            "model": self.model,
+            "dtype": self.dtype,
+            "files": len(self.meta.get("files", {})),
+            "chunks": len(self),
+            "dim": self.meta.get("dim", 0),
+            "matrix_bytes": int(self.vectors.nbytes) if self.vectors is not None else 0,
+            "generation": self.meta.get("generation", 0),
+            "updated_at": self.meta.get("updated_at"),
+        }
+
+
+def format_results(results: List[SearchResult], snippet_chars: int = 200) -> str:
+    """One `[file] section: snippet` line per result."""
+    lines = []
+    for r in results:
+        snippet = " ".join(r.text.split())[:snippet_chars]
+        lines.append(f"[{Path(r.path).name}] {r.section}: {snippet}")
+    return "\n".join(lines)
+
+
+_DEFAULT_INDEX: Optional[HQIndex] = None
+
+
+def get_index(update: bool = True) -> HQIndex:
+    """Process-wide index over HQ_ROOT, brought up to date on each call when `update`."""
+    global _DEFAULT_INDEX
+    if _DEFAULT_INDEX is None:
+        _DEFAULT_INDEX = HQIndex()
+    if update:
+        _DEFAULT_INDEX.update()
+    return _DEFAULT_INDEX
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Local vector index over HQ/**/*.md")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="Create or incrementally update the index")
+    search = sub.add_parser("search", help="Query the index")
+    search.add_argument("query")
+    search.add_argument("-k", type=int, default=None)
+    search.add_argument("--profile", default=None, help="search_profiles entry from the RAG config")
+    search.add_argument("--filter", default=None, help="e.g. \"dir = 'community'\"")
+    sub.add_parser("stats", help="Show index statistics")
+    args = parser.parse_args(argv)
+
+    index = HQIndex()
+    if args.command == "build":
+        start = time.perf_counter()
+        print(json.dumps({**index.update(), "seconds": round(time.perf_counter() - start, 2)}))
+    elif args.command == "search":
+        index.update()
+        start = time.perf_counter()
+        results = index.search(args.query, k=args.k, profile=args.profile, filter=args.filter)
+        for r in results:
+            print(f"{r.score:.3f}  {r.path} :: {r.section}")
+        print(f"({len(results)} results in {(time.perf_counter() - start) * 1000:.1f} ms incl. query embedding)",
+              file=sys.stderr)
+    else:
+        print(json.dumps(index.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Bounded background job executor for Reasoning Engine enrichment.
+
+Replaces one-daemon-thread-per-request with a fixed pool of asyncio workers
+pulling from a priority queue:
+- dedup: a key that is already pending or running is not queued again
+- backpressure: queue depth is capped; overflow is shed by policy
+- durability (optional): pending jobs are journaled to SQLite and reloaded on start;
+  journal writes are buffered and committed in batches off the event loop
+- introspection: depth, in-flight count, shed/dedup counters, wait and run latency
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+DEFAULT_WORKERS = int(os.getenv("BANDIT_JOB_WORKERS", 4))
+DEFAULT_MAX_DEPTH = int(os.getenv("BANDIT_JOB_MAX_DEPTH", 200))
+DEFAULT_SHED_POLICY = os.getenv("BANDIT_JOB_SHED_POLICY", "drop_lowest")  # or "drop_new"
+DEFAULT_JOURNAL_PATH = Path(os.getenv(
+    "BANDIT_JOB_JOURNAL",
+    Path(__file__).resolve().parent.parent / ".cache" / "bandit_jobs.sqlite",
+))
+
+# Lower number = served first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+
+@dataclass(order=True)
+class Job:
+    priority: int
+    seq: int
+    key: str = field(compare=False)
+    kind: str = field(compare=False)
+    payload: Dict[str, Any] = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.time)
+
+
+class JobJournal:
+    """SQLite journal of pending jobs so they survive restarts.
+
+    `add` and `remove` only buffer the change; `flush` applies everything
+    buffered in one transaction (the queue runs it in a worker thread).
+    """
+
+    def __init__(self, path: Path = DEFAULT_JOURNAL_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()          # the connection
+        self._buffer_lock = threading.Lock()   # the buffered changes, never held during disk I/O
+        self._buffer: list = []
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                enqueued_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def add(self, job: Job):
+        with self._buffer_lock:
+            self._buffer.append((
+                "INSERT OR REPLACE INTO jobs (key, kind, payload, priority, enqueued_at) VALUES (?, ?, ?, ?, ?)",
+                (job.key, job.kind, json.dumps(job.payload), job.priority, job.enqueued_at),
+            ))
+
+    def remove(self, key: str):
+        with self._buffer_lock:
+            self._buffer.append(("DELETE FROM jobs WHERE key = ?", (key,)))
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._buffer)
+
+    def flush(self):
+        """Write buffered changes, in order, in a single commit."""
+        with self._lock:
+            with self._buffer_lock:
+                changes, self._buffer = self._buffer, []
+            if not changes:
+                return
+            for statement, params in changes:
+                self._conn.execute(statement, params)
+            self._conn.commit()
+
+    def pending(self):
+        self.flush()
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, kind, payload, priority, enqueued_at FROM jobs ORDER BY priority, enqueued_at"
+            ).fetchall()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+class BackgroundJobQueue:
+    """Priority queue + fixed asyncio worker pool with dedup and load shedding."""
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_depth: int = DEFAULT_MAX_DEPTH,
+                 shed_policy: str = DEFAULT_SHED_POLICY, journal: Optional[JobJournal] = None):
+        if shed_policy not in ("drop_new", "drop_lowest"):
+            raise ValueError(f"Unknown shed policy: {shed_policy}")
+        self.workers = workers
+        self.max_depth = max_depth
+        self.shed_policy = shed_policy
+        self.journal = journal
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]] = {}
+        self._heap: list = []
+        self._keys = set()  # pending + running
+        self._running = 0
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._tasks: list = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._wait_times = deque(maxlen=500)
+        self._run_times = deque(maxlen=500)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.deduped = 0
+        self.shed = 0
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        """Register the coroutine that runs jobs of `kind` (by name, so journaled jobs can resume)."""
+        self._handlers[kind] = handler
+
+    def submit(self, kind: str, key: str, payload: Dict[str, Any], priority: int = PRIORITY_NORMAL) -> bool:
+        """Queue a job without blocking. False if deduped or shed."""
+        if kind not in self._handlers:
+            raise KeyError(f"No handler registered for job kind: {kind}")
+        if key in self._keys:
+            self.deduped += 1
+            return False
+        job = Job(priority, next(self._seq), key, kind, payload)
+        if len(self._heap) >= self.max_depth:
+            worst = max(self._heap) if self._heap else None
+            if self.shed_policy == "drop_new" or worst is None or worst < job:
+                self.shed += 1
+                return False
+            self._heap.remove(worst)
+            heapq.heapify(self._heap)
+            self._drop(worst.key)
+            self.shed += 1
+        heapq.heappush(self._heap, job)
+        self._keys.add(key)
+        self.submitted += 1
+        if self.journal:
+            self.journal.add(job)
+            self._schedule_flush()
+        self._notify()
+        return True
+
+    def _drop(self, key: str):
+        self._keys.discard(key)
+        if self.journal:
+            self.journal.remove(key)
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Commit journal changes from a worker thread; changes made meanwhile join the next batch."""
+        if self._flusher is not None and not self._flusher.done():
+            return
+        try:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_journal())
+        except RuntimeError:
+            self.journal.flush()  # no loop (submitted before start): write through
+
+    async def _flush_journal(self):
+        try:
+            while self.journal.dirty:
+                await asyncio.to_thread(self.journal.flush)
+        except sqlite3.Error as e:
+            print(f"[JOBS WARNING] Job journal write failed: {e}")
+        finally:
+            self._flusher = None
+
+    def _notify(self):
+        if self._wakeup is None:
+            return
+        async def wake():
+            async with self._wakeup:
+                self._wakeup.notify()
+        asyncio.ensure_future(wake())
+
+    async def start(self):
+        """Reload journaled jobs and spawn the worker pool on the running loop."""
+        self._wakeup = asyncio.Condition()
+        if self.journal:
+            for key, kind, payload, priority, enqueued_at in self.journal.pending():
+                if key in self._keys or kind not in self._handlers:
+                    continue
+                heapq.heappush(self._heap, Job(priority, next(self._seq), key, kind, json.loads(payload), enqueued_at))
+                self._keys.add(key)
+            if self._heap:
+                print(f"[JOBS] Resumed {len(self._heap)} journaled jobs")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        """Cancel workers; pending jobs stay journaled for the next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._flusher is not None and not self._flusher.done():
+            await self._flusher
+        if self.journal:
+            self.journal.flush()
+
+    async def _next_job(self) -> Job:
+        async with self._wakeup:
+            while not self._heap:
+                await self._wakeup.wait()
+            return heapq.heappop(self._heap)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await self._next_job()
+            self._running += 1
+            started = time.time()
+            self._wait_times.append(started - job.enqueued_at)
+            try:
+                await self._handlers[job.kind](job.payload)
+                self.completed += 1
+            except asyncio.CancelledError:
+                self._keys.discard(job.key)  # interrupted by stop(): stays journaled for the next start
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"[JOBS] {job.kind} job {job.key[:8]} failed: {e}")
+            finally:
+                self._run_times.append(time.time() - started)
+                self._running -= 1
+            self._drop(job.key)
+
+    async def join(self, timeout: float = 10.0):
+        """Wait until the queue is drained and idle (for tests and shutdown)."""
+        deadline = time.time() + timeout
+        while (self._heap or self._running) and time.time() < deadline:
+            await asyncio.sleep(0.01)
+
+    @staticmethod
+    def _summary(samples) -> Dict[str, float]:
+        if not samples:
+            return {"count": 0, "avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        ordered = sorted(samples)
+        return {
+            "count": len(ordered),
+            "avg": round(sum(ordered) / len(ordered), 4),
+            "p50": round(ordered[len(ordered) // 2], 4),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+            "max": round(ordered[-1], 4),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": len(self._heap),
+            "running": self._running,
+            "workers": self.workers,
+            "max_depth": self.max_depth,
+            "shed_policy": self.shed_policy,
+            "durable": self.journal is not None,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "deduped": self.deduped,
+            "shed": self.shed,
+            "wait_seconds": self._summary(self._wait_times),
+            "run_seconds": self._summary(self._run_times),
+        }
+
+
+def build_job_queue_from_env() -> BackgroundJobQueue:
+    """Job queue with an SQLite journal unless BANDIT_JOB_DURABLE=0."""
+    journal = None
+    if os.getenv("BANDIT_JOB_DURABLE", "1") != "0":
+        try:
+            journal = JobJournal()
+        except (sqlite3.Error, OSError) as e:
+            print(f"[JOBS WARNING] Job journal unavailable ({e}), jobs will not survive restarts")
+    return BackgroundJobQueue(journal=journal)
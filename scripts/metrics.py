@@ -0,0 +1,249 @@
+"""Prometheus text-format metrics for the proxy (GET /metrics).
+
+Telemetry used to be `print` lines with elapsed seconds. This module keeps
+counters and latency histograms that are cheap enough to leave on:
+
+- no locks: updates run on the event-loop thread and are a dict lookup
+  plus an in-place add on a list
+- histograms are pre-bucketed: an observation is one bisect over fixed
+  bounds; cumulative counts are only computed at scrape time
+- state that is already tracked elsewhere (cache, queue, admission and
+  breaker `stats()`) is not duplicated: collectors read it at scrape time
+
+Request-scoped state (thinking mode label, token usage) travels in a
+context variable set by MetricsMiddleware, so the usage of every upstream
+call made for a request can be reported in its `usage` block.
+"""
+
+import bisect
+import contextvars
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds: 5 ms .. 5 min, covering instant answers through Reasoning Engine runs
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+# (name, type, help, [(labels, value), ...]) produced by collectors at scrape time
+Family = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter keyed by label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels: Any, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: Any) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> Iterable[str]:
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+
+
+class Histogram:
+    """Fixed-bucket histogram keyed by label values."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, list] = {}  # labels -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value: float, *labels: Any):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *labels: Any) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self) -> Iterable[str]:
+        for labels, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = 'le="' + _number(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {count}"
+
+
+class MetricsRegistry:
+    """Owned metrics plus scrape-time collectors, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help, labels, buckets))
+
+    def collector(self, fn: Callable[[], Iterable[Family]]):
+        """Register `fn`, called on every scrape; usable as a decorator."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:  # a broken collector must not take the whole scrape down
+                print(f"[METRICS] Collector {getattr(collect, '__name__', collect)} failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+HTTP_REQUESTS = METRICS.counter("bandit_http_requests_total", "HTTP requests by route, status and thinking mode",
+                                ("method", "route", "status", "mode"))
+HTTP_LATENCY = METRICS.histogram("bandit_http_request_duration_seconds",
+                                 "HTTP request latency (to the last body byte) by route and thinking mode",
+                                 ("method", "route", "mode"))
+UPSTREAM_REQUESTS = METRICS.counter("bandit_upstream_requests_total", "Upstream model calls by model and outcome",
+                                    ("model", "outcome"))
+UPSTREAM_LATENCY = METRICS.histogram("bandit_upstream_latency_seconds", "Upstream model call latency by model",
+                                     ("model",))
+TOKENS = METRICS.counter("bandit_tokens_total", "Tokens reported by usage_metadata, by model and kind",
+                         ("model", "kind"))
+
+
+class RequestScope:
+    """Per-request labels and token usage, filled in by handlers and model calls."""
+
+    __slots__ = ("mode", "prompt_tokens", "completion_tokens", "total_tokens")
+
+    def __init__(self):
+        self.mode = ""
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+
+    def usage(self) -> Dict[str, int]:
+        return {"prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                "total_tokens": self.total_tokens}
+
+
+_request_scope: contextvars.ContextVar = contextvars.ContextVar("request_scope", default=None)
+
+
+def request_scope() -> RequestScope:
+    """The current request's scope (a detached one outside requests, so callers never check for None)."""
+    return _request_scope.get() or RequestScope()
+
+
+def set_request_mode(mode: str):
+    scope = _request_scope.get()
+    if scope is not None:
+        scope.mode = mode
+
+
+def usage_counts(usage_metadata: Any) -> Tuple[int, int, int]:
+    """(prompt, completion incl. thoughts, total) tokens from Gemini usage_metadata."""
+    if not usage_metadata:
+        return 0, 0, 0
+    prompt = getattr(usage_metadata, "prompt_token_count", None) or 0
+    completion = ((getattr(usage_metadata, "candidates_token_count", None) or 0)
+                  + (getattr(usage_metadata, "thoughts_token_count", None) or 0))
+    total = getattr(usage_metadata, "total_token_count", None) or prompt + completion
+    return prompt, completion, total
+
+
+def record_usage(model: str, usage_metadata: Any):
+    """Count a call's tokens globally and against the current request."""
+    prompt, completion, total = usage_counts(usage_metadata)
+    if not total:
+        return
+    model = (model or "unknown").split("/")[-1]
+    TOKENS.inc(model, "prompt", amount=prompt)
+    TOKENS.inc(model, "completion", amount=completion)
+    scope = _request_scope.get()
+    if scope is not None:
+        scope.prompt_tokens += prompt
+        scope.completion_tokens += completion
+        scope.total_tokens += total
+
+
+def record_upstream(model: str, seconds: float, error: Optional[BaseException] = None):
+    model = (model or "unknown").split("/")[-1]
+    UPSTREAM_LATENCY.observe(seconds, model)
+    UPSTREAM_REQUESTS.inc(model, "ok" if error is None else type(error).__name__)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request count and latency per route template, status and thinking mode."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        request = RequestScope()
+        token = _request_scope.set(request)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_scope.reset(token)
+            route = scope.get("route")
+            # Route templates (/research/{interaction_id}), never raw paths, to keep label sets bounded
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(scope["method"], path, str(status[0]), request.mode)
+            HTTP_LATENCY.observe(time.perf_counter() - start, scope["method"], path, request.mode)
@@ -0,0 +1,323 @@
+"""Shared model routing: circuit breakers, health scores and fallback order.
+
+Fallback used to be a hard-coded chain in each caller (instant, then the
+Reasoning Engine; deep think, then the Reasoning Engine; `with_retry` in the
+voice client), so every request rediscovered a failing tier by waiting
+through its own retries and sleeps. A ModelRouter keeps per-endpoint state
+shared by all callers:
+
+- a circuit breaker per endpoint opens when the error rate over its last
+  BREAKER_WINDOW calls reaches BREAKER_ERROR_RATE (or after
+  BREAKER_CONSECUTIVE failures in a row). While open, the endpoint is
+  skipped at once; after BREAKER_OPEN_SECONDS a single probe is let through
+  (half-open) and its outcome closes or re-opens the breaker
+- a health score in [0, 1]: rolling success rate times a latency factor
+  (EWMA latency against the endpoint's budget); degraded endpoints sort
+  behind healthy ones, otherwise the caller's preference order is kept
+- retries use full-jitter exponential backoff and honor Retry-After; a hint
+  longer than ROUTER_MAX_BACKOFF fails over to the next endpoint instead
+
+Only upstream failures count against an endpoint: client errors (4xx other
+than 408/429) and local admission shedding do not.
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from admission import AdmissionRejected, is_throttled, retry_after_from_error
+    from tracing import span
+except ImportError:
+    from scripts.admission import AdmissionRejected, is_throttled, retry_after_from_error
+    from scripts.tracing import span
+
+ROUTER_ATTEMPTS = int(os.getenv("BANDIT_ROUTER_ATTEMPTS", 3))          # per endpoint
+ROUTER_BASE_BACKOFF = float(os.getenv("BANDIT_ROUTER_BASE_BACKOFF", 0.5))
+ROUTER_MAX_BACKOFF = float(os.getenv("BANDIT_ROUTER_MAX_BACKOFF", 4))  # longer waits fail over instead
+BREAKER_WINDOW = int(os.getenv("BANDIT_BREAKER_WINDOW", 20))
+BREAKER_MIN_CALLS = int(os.getenv("BANDIT_BREAKER_MIN_CALLS", 5))
+BREAKER_ERROR_RATE = float(os.getenv("BANDIT_BREAKER_ERROR_RATE", 0.5))
+BREAKER_CONSECUTIVE = int(os.getenv("BANDIT_BREAKER_CONSECUTIVE", 5))
+BREAKER_OPEN_SECONDS = float(os.getenv("BANDIT_BREAKER_OPEN_SECONDS", 30))
+DEGRADED_SCORE = float(os.getenv("BANDIT_ROUTER_DEGRADED_SCORE", 0.5))
+LATENCY_ALPHA = 0.2  # EWMA weight of the newest sample
+
+# Latency (seconds) above which an endpoint's score starts to drop
+LATENCY_BUDGETS = {
+    "gemini-3-flash-preview": 10.0,
+    "gemini-3.1-pro-preview": 60.0,
+    "bandit-reasoning-engine": 120.0,
+}
+DEFAULT_LATENCY_BUDGET = 30.0
+
+# Attempts per endpoint where the default does not fit: the Reasoning Engine runs a whole
+# agent loop under its own deadline, so a retry would only stack another deadline on top
+ENDPOINT_ATTEMPTS = {"bandit-reasoning-engine": 1}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class NoHealthyEndpoint(Exception):
+    """Every endpoint in a route has an open breaker; `retry_after` is when the first one half-opens."""
+
+    def __init__(self, endpoints: Sequence[str], retry_after: float):
+        super().__init__(f"No healthy endpoint among {', '.join(endpoints)}; retry after {retry_after:.0f}s")
+        self.endpoints = list(endpoints)
+        self.retry_after = retry_after
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_endpoint_failure(error: BaseException) -> bool:
+    """Does this error say something about the endpoint's health (not about the request)?"""
+    if isinstance(error, AdmissionRejected):
+        return False
+    status = error_status(error)
+    if status is not None and 400 <= status < 500:
+        return status in (408, 429)
+    return True
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Worth another attempt on the same endpoint: throttling, 5xx, timeouts and connection errors."""
+    if isinstance(error, AdmissionRejected):
+        return False
+    if is_throttled(error):
+        return True
+    status = error_status(error)
+    if status is not None:
+        return status == 408 or status >= 500
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError, OSError)) or "timeout" in type(error).__name__.lower()
+
+
+def backoff_delay(attempt: int, error: Optional[BaseException] = None,
+                  base: float = ROUTER_BASE_BACKOFF) -> float:
+    """Retry-After when upstream sent one, else full jitter over base * 2**attempt."""
+    hint = retry_after_from_error(error) if error is not None else None
+    if hint is not None:
+        return hint
+    return random.uniform(0, base * (2 ** attempt))
+
+
+class EndpointHealth:
+    """Circuit breaker plus rolling error rate and latency for one endpoint."""
+
+    def __init__(self, name: str, latency_budget: float = DEFAULT_LATENCY_BUDGET, window: int = BREAKER_WINDOW,
+                 min_calls: int = BREAKER_MIN_CALLS, error_rate: float = BREAKER_ERROR_RATE,
+                 consecutive: int = BREAKER_CONSECUTIVE, open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.latency_budget = latency_budget
+        self.min_calls = min_calls
+        self.error_threshold = error_rate
+        self.consecutive_threshold = consecutive
+        self.open_seconds = open_seconds
+        self._outcomes = deque(maxlen=window)  # True = success
+        self.state = CLOSED
+        self.opened_until = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self.consecutive_failures = 0
+        self.latency_ewma: Optional[float] = None
+        self.calls = 0
+        self.failures = 0
+        self.skips = 0
+        self.opens = 0
+        self.retries = 0
+        self.fallbacks = 0  # times a route fell back to this endpoint
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return 1.0 - sum(self._outcomes) / len(self._outcomes)
+
+    @property
+    def score(self) -> float:
+        """1.0 is perfectly healthy, 0.0 while the breaker is open."""
+        if self.state == OPEN:
+            return 0.0
+        latency_factor = 1.0
+        if self.latency_ewma and self.latency_ewma > self.latency_budget:
+            latency_factor = self.latency_budget / self.latency_ewma
+        return (1.0 - self.error_rate) * latency_factor
+
+    def retry_after(self, now: Optional[float] = None) -> float:
+        return max(self.opened_until - (time.monotonic() if now is None else now), 0.0)
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        """May a call go to this endpoint now? Half-open admits one probe at a time."""
+        now = time.monotonic() if now is None else now
+        if self.state == OPEN:
+            if now < self.opened_until:
+                return False
+            self.state = HALF_OPEN
+            self._probing = False
+        if self.state == HALF_OPEN:
+            # A probe that never reported back (abandoned stream) stops blocking after open_seconds
+            if self._probing and now - self._probe_started < self.open_seconds:
+                return False
+            self._probing = True
+            self._probe_started = now
+        return True
+
+    def record(self, error: Optional[BaseException] = None, latency: Optional[float] = None,
+               now: Optional[float] = None):
+        """Outcome of one call; errors that are not endpoint failures only release a probe."""
+        now = time.monotonic() if now is None else now
+        if error is not None and not is_endpoint_failure(error):
+            self._probing = False
+            return
+        self.calls += 1
+        if latency is not None:
+            self.latency_ewma = latency if self.latency_ewma is None else (
+                LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.latency_ewma)
+        if error is None:
+            self._outcomes.append(True)
+            self.consecutive_failures = 0
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self._outcomes.clear()
+                self._outcomes.append(True)
+            self._probing = False
+            return
+        self._outcomes.append(False)
+        self.failures += 1
+        self.consecutive_failures += 1
+        tripped = (self.consecutive_failures >= self.consecutive_threshold
+                   or (len(self._outcomes) >= self.min_calls and self.error_rate >= self.error_threshold))
+        if self.state == HALF_OPEN or (self.state == CLOSED and tripped):
+            self._open(now, retry_after_from_error(error))
+        self._probing = False
+
+    def _open(self, now: float, hint: Optional[float] = None):
+        self.state = OPEN
+        self.opened_until = now + max(self.open_seconds, hint or 0.0)
+        self.opens += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "score": round(self.score, 3),
+            "error_rate": round(self.error_rate, 3),
+            "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "latency_budget": self.latency_budget,
+            "retry_after": round(self.retry_after(), 1) if self.state == OPEN else 0.0,
+            "calls": self.calls,
+            "failures": self.failures,
+            "skips": self.skips,
+            "opens": self.opens,
+            "retries": self.retries,
+            "fallbacks": self.fallbacks,
+        }
+
+
+Route = Sequence[Tuple[str, Callable[[], Awaitable[Any]]]]
+
+
+class ModelRouter:
+    """Runs a call against an ordered route of endpoints, skipping unhealthy ones."""
+
+    def __init__(self, attempts: int = ROUTER_ATTEMPTS, max_backoff: float = ROUTER_MAX_BACKOFF,
+                 latency_budgets: Optional[Dict[str, float]] = None,
+                 endpoint_attempts: Optional[Dict[str, int]] = None):
+        self.attempts = attempts
+        self.endpoint_attempts = ENDPOINT_ATTEMPTS if endpoint_attempts is None else endpoint_attempts
+        self.max_backoff = max_backoff
+        self.latency_budgets = LATENCY_BUDGETS if latency_budgets is None else latency_budgets
+        self.endpoints: Dict[str, EndpointHealth] = {}
+        self.fallbacks = 0
+
+    def health(self, name: str) -> EndpointHealth:
+        name = name.split("/")[-1]
+        endpoint = self.endpoints.get(name)
+        if endpoint is None:
+            endpoint = self.endpoints[name] = EndpointHealth(
+                name, self.latency_budgets.get(name, DEFAULT_LATENCY_BUDGET))
+        return endpoint
+
+    def available(self, name: str) -> bool:
+        """Breaker not open (does not claim the half-open probe)."""
+        endpoint = self.health(name)
+        return endpoint.state != OPEN or endpoint.retry_after() == 0
+
+    def order(self, names: Sequence[str]) -> List[str]:
+        """Available endpoints, healthy before degraded, otherwise in the given preference order."""
+        ranked = [(self.health(n).score < DEGRADED_SCORE, i, n) for i, n in enumerate(names) if self.available(n)]
+        return [n for _, _, n in sorted(ranked)]
+
+    async def _timed(self, endpoint: EndpointHealth, fn: Callable[[], Awaitable[Any]]) -> Any:
+        start = time.perf_counter()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            endpoint._probing = False  # a cancelled hedge loser says nothing about health
+            raise
+        except Exception as e:
+            endpoint.record(e, time.perf_counter() - start)
+            raise
+        endpoint.record(None, time.perf_counter() - start)
+        return result
+
+    def observed(self, name: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[str, Callable[[], Awaitable[Any]]]:
+        """(name, fn) whose single attempt is recorded against `name` (for hedged pairs)."""
+        return name, lambda: self._timed(self.health(name), fn)
+
+    async def call(self, name: str, fn: Callable[[], Awaitable[Any]], attempts: Optional[int] = None) -> Any:
+        """Call one endpoint with jittered retries; raises NoHealthyEndpoint if its breaker is open."""
+        return (await self.run([(name, fn)], attempts=attempts))[1]
+
+    async def run(self, route: Route, attempts: Optional[int] = None) -> Tuple[str, Any]:
+        """(endpoint, result) from the first endpoint in `route` that answers.
+
+        Open breakers are skipped without a call, retryable errors are retried
+        on the same endpoint (while its breaker stays closed and the backoff
+        fits ROUTER_MAX_BACKOFF), anything else fails over to the next one.
+        """
+        functions = dict(route)
+        names = [name for name, _ in route]
+        ordered = self.order(names)
+        for name in names:
+            if name not in ordered:
+                self.health(name).skips += 1
+        last_error: Optional[BaseException] = None
+        for position, name in enumerate(ordered):
+            endpoint = self.health(name)
+            if position:
+                self.fallbacks += 1
+                endpoint.fallbacks += 1
+                print(f"[ROUTER] Falling back to {name}")
+            tries = attempts or self.endpoint_attempts.get(name, self.attempts)
+            for attempt in range(tries):
+                if not endpoint.allow():
+                    endpoint.skips += 1
+                    break
+                try:
+                    return name, await self._timed(endpoint, functions[name])
+                except AdmissionRejected as e:
+                    last_error = e  # shed locally: the next endpoint has its own quota
+                    break
+                except Exception as e:
+                    last_error = e
+                    if attempt == tries - 1 or not is_retryable(e):
+                        break
+                    delay = backoff_delay(attempt, e)
+                    if delay > self.max_backoff:
+                        print(f"[ROUTER] {name} asks for {delay:.1f}s, failing over")
+                        break
+                    print(f"[ROUTER] {name} attempt {attempt + 1} failed ({e}), retrying in {delay:.2f}s")
+                    endpoint.retries += 1
+                    with span("retry_sleep", endpoint=name):
+                        await asyncio.sleep(delay)
+        if last_error is not None:
+            raise last_error
+        raise NoHealthyEndpoint(names, min(self.health(n).retry_after() for n in names))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"fallbacks": self.fallbacks, "endpoints": {n: e.stats() for n, e in self.endpoints.items()}}
@@ -0,0 +1,119 @@
+"""Async execution layer for Bandit model calls.
+
+Every proxy handler goes through here instead of calling the blocking
+`client.models.*` APIs, so one slow Gemini Pro call can no longer freeze
+the uvicorn event loop. Each model tier gets its own concurrency
+limit so a burst of deep-think traffic cannot starve instant mode, and
+every call is first admitted by the per-model admission controller
+(rate, AIMD concurrency and priority; see admission.py). Latency, outcome
+and token usage of every call are recorded in metrics.py, and the wait
+and call are traced as "admission" and "upstream" spans (tracing.py).
+"""
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Tuple
+
+try:
+    from admission import ADMISSION
+    from metrics import record_upstream, record_usage
+    from tracing import record_span
+except ImportError:
+    from scripts.admission import ADMISSION
+    from scripts.metrics import record_upstream, record_usage
+    from scripts.tracing import record_span
+
+# Max in-flight upstream calls per tier (override with BANDIT_CONCURRENCY_<TIER>)
+DEFAULT_TIER_CONCURRENCY = {
+    "instant": 32,
+    "auto": 16,
+    "thinking": 8,
+    "tools": 16,
+    "embed": 16,
+    "tts": 8,
+    "image": 4,
+    "research": 4,
+    "engine": 16,
+    "cache": 8,
+}
+
+TIER_CONCURRENCY = {
+    tier: int(os.getenv(f"BANDIT_CONCURRENCY_{tier.upper()}", limit))
+    for tier, limit in DEFAULT_TIER_CONCURRENCY.items()
+}
+
+# Semaphores are bound to the loop that created them
+_SEMAPHORES: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = {}
+
+
+def tier_semaphore(tier: str) -> asyncio.Semaphore:
+    """Return the concurrency limiter for a model tier on the running loop."""
+    loop = asyncio.get_running_loop()
+    entry = _SEMAPHORES.get(tier)
+    if entry is None or entry[0] is not loop:
+        limit = TIER_CONCURRENCY.get(tier, TIER_CONCURRENCY["auto"])
+        entry = (loop, asyncio.Semaphore(limit))
+        _SEMAPHORES[tier] = entry
+    return entry[1]
+
+
+def tier_stats() -> Dict[str, Dict[str, int]]:
+    """Snapshot of configured limits and free slots per tier."""
+    stats = {}
+    for tier, limit in TIER_CONCURRENCY.items():
+        entry = _SEMAPHORES.get(tier)
+        available = entry[1]._value if entry else limit
+        stats[tier] = {"limit": limit, "in_flight": limit - available}
+    return stats
+
+
+@asynccontextmanager
+async def upstream_call(model: str, tier: str):
+    """Admission slot + tier slot for one upstream call, timed into the upstream metrics and trace spans."""
+    queued = time.perf_counter()
+    async with ADMISSION.admit(model), tier_semaphore(tier):
+        start = time.perf_counter()
+        record_span("admission", queued, start, model=model)
+        try:
+            yield
+        except Exception as e:
+            record_upstream(model, time.perf_counter() - start, e)
+            record_span("upstream", start, model=model, error=type(e).__name__)
+            raise
+        record_upstream(model, time.perf_counter() - start)
+        record_span("upstream", start, model=model)
+
+
+async def generate_content(client, tier: str, **kwargs) -> Any:
+    """Non-blocking `generate_content` under admission control and the tier's concurrency limit."""
+    model = kwargs.get("model", tier)
+    async with upstream_call(model, tier):
+        response = await client.aio.models.generate_content(**kwargs)
+    record_usage(model, getattr(response, "usage_metadata", None))
+    return response
+
+
+async def embed_content(client, tier: str = "embed", **kwargs) -> Any:
+    """Non-blocking `embed_content` under admission control and the tier's concurrency limit."""
+    async with upstream_call(kwargs.get("model", tier), tier):
+        return await client.aio.models.embed_content(**kwargs)
+
+
+async def run_blocking(tier: str, func: Callable, *args, **kwargs) -> Any:
+    """Run a sync-only SDK call in a worker thread under the tier's limits (admitted per tier)."""
+    async with upstream_call(tier, tier):
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+async def generate_content_stream(client, tier: str, **kwargs):
+    """Stream `generate_content` chunks, holding the admission and tier slots until exhausted."""
+    model = kwargs.get("model", tier)
+    usage_metadata = None
+    async with upstream_call(model, tier):
+        async for chunk in await client.aio.models.generate_content_stream(**kwargs):
+            if getattr(chunk, "usage_metadata", None):
+                usage_metadata = chunk.usage_metadata  # cumulative: the last one covers the whole stream
+            yield chunk
+    record_usage(model, usage_metadata)
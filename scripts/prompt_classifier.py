@@ -0,0 +1,98 @@
+"""Shared keyword classification for prompt routing.
+
+The proxy's routing vocabularies (deep-think triggers, god-level domains)
+used to be re-scanned by every detector: the prompt lowercased again each
+time, one `re.search` per pattern and one `kw in prompt` per keyword. A
+`PromptClassifier` holds any number of named vocabularies; one `classify()`
+call lowercases the prompt once and returns every matched feature, so all
+routing decisions share a single result.
+
+Matching rules (the same as the scans they replace):
+- phrases match as substrings of the lowercased prompt (`kw in prompt_lower`)
+- features listed in `word_bounded` only match whole words, and a space in
+  one of their phrases matches any run of whitespace (`\\bthink\\s+more\\b`)
+
+Each word-bounded vocabulary compiles to one trie-shaped regex, so a single
+search replaces a loop of patterns. Plain substring vocabularies stay on
+`in`: it runs at memchr speed and stops at the first hit, which measured
+faster than scanning them with a pure-Python regex
+(see tests/bench_prompt_classifier.py). For the same reason a detector that
+only checks plain keyword lists gains nothing from a classifier.
+"""
+
+import itertools
+import re
+from typing import Dict, FrozenSet, Iterable, List
+
+
+def optional_spaces(phrases: Iterable[str]) -> List[str]:
+    """Expand each space to "space or nothing" (the `\\s*` in the old regex patterns)."""
+    expanded = []
+    for phrase in phrases:
+        words = phrase.split(" ")
+        for joins in itertools.product((" ", ""), repeat=len(words) - 1):
+            expanded.append(words[0] + "".join(j + w for j, w in zip(joins, words[1:])))
+    return expanded
+
+
+def _trie_pattern(phrases: Iterable[str]) -> str:
+    """Regex source for a set of literals, factored as a trie (spaces match any whitespace run)."""
+    trie: dict = {}
+    for phrase in phrases:
+        node = trie
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def emit(node: dict) -> str:
+        branches = [(r"\s+" if ch == " " else re.escape(ch)) + emit(child)
+                    for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+
+class PromptClassifier:
+    """Named keyword vocabularies classified together."""
+
+    def __init__(self, vocabularies: Dict[str, Iterable[str]], word_bounded: Iterable[str] = ()):
+        bounded = set(word_bounded)
+        self._substring: Dict[str, List[str]] = {}        # feature -> phrases, in vocabulary order
+        self._bounded: Dict[str, "re.Pattern[str]"] = {}  # feature -> compiled whole-word trie
+        for feature, phrases in vocabularies.items():
+            phrases = [" ".join(p.lower().split()) for p in phrases]
+            phrases = [p for p in phrases if p]
+            if feature in bounded:
+                # Greedy trie, but backtracks to a shorter phrase when the longer one ends mid-word
+                self._bounded[feature] = re.compile(rf"\b(?:{_trie_pattern(phrases)})\b")
+            else:
+                self._substring[feature] = phrases
+        self.features = tuple(vocabularies)
+
+    def _matches(self, feature: str, lowered: str) -> bool:
+        pattern = self._bounded.get(feature)
+        if pattern is not None:
+            return pattern.search(lowered) is not None
+        return any(phrase in lowered for phrase in self._substring.get(feature, ()))
+
+    def classify(self, text: str) -> FrozenSet[str]:
+        """Set of matched feature names."""
+        lowered = text.lower()
+        return frozenset(f for f in self.features if self._matches(f, lowered))
+
+    def scan(self, text: str) -> Dict[str, List[str]]:
+        """feature -> every matched phrase (for debugging and tests; routing uses classify())."""
+        lowered = text.lower()
+        found: Dict[str, List[str]] = {}
+        for feature, phrases in self._substring.items():
+            hits = [phrase for phrase in phrases if phrase in lowered]
+            if hits:
+                found.setdefault(feature, []).extend(hits)
+        for feature, pattern in self._bounded.items():
+            hits = [" ".join(m.group().split()) for m in pattern.finditer(lowered)]
+            if hits:
+                found.setdefault(feature, []).extend(hits)
+        return found
@@ -0,0 +1,403 @@
+"""Server-side tracking of Deep Research interactions.
+
+Clients used to poll /research/{id} every few seconds, and every poll was a
+live `interactions.get` round trip, even long after the report was done.
+Here each interaction has exactly one background poller; its interval starts
+short, backs off while nothing changes, and snaps back when new thinking
+summaries arrive. Clients wait on the local state instead (SSE or long-poll),
+and finished reports and thinking summaries are persisted in SQLite, so
+repeat fetches never reach the API.
+
+At most RESEARCH_MAX_CONCURRENT research jobs run at once. Further jobs are
+queued (persisted too) and started as slots free up; past RESEARCH_MAX_QUEUE
+submissions are refused.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+RESEARCH_MAX_CONCURRENT = int(os.getenv("BANDIT_RESEARCH_MAX_CONCURRENT", 3))
+RESEARCH_MAX_QUEUE = int(os.getenv("BANDIT_RESEARCH_MAX_QUEUE", 20))
+RESEARCH_POLL_MIN = float(os.getenv("BANDIT_RESEARCH_POLL_MIN", 5))
+RESEARCH_POLL_MAX = float(os.getenv("BANDIT_RESEARCH_POLL_MAX", 60))
+RESEARCH_POLL_BACKOFF = 1.5
+RESEARCH_MAX_POLL_ERRORS = 10  # consecutive failed polls before a job is marked failed
+RESEARCH_PATH = Path(os.getenv(
+    "BANDIT_RESEARCH_PATH",
+    Path(__file__).resolve().parent.parent / ".cache" / "research" / "research.sqlite",
+))
+
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "incomplete"}
+
+
+class ResearchQueueFull(RuntimeError):
+    """Every research slot is busy and the queue is at RESEARCH_MAX_QUEUE."""
+
+
+@dataclass
+class ResearchJob:
+    id: str                                # interaction id, or "rq_..." while queued
+    prompt: str
+    status: str = "queued"                 # queued | in_progress | completed | failed | cancelled | incomplete
+    interaction_id: Optional[str] = None
+    report: Optional[str] = None
+    error: Optional[str] = None
+    thoughts: List[str] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    completed_at: Optional[float] = None
+    polls: int = 0
+    version: int = 0                       # bumped on every visible change (SSE / long-poll cursor)
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def interaction_thoughts(interaction) -> List[str]:
+    """Thinking-summary texts in an interaction's outputs, in order."""
+    thoughts = []
+    for output in getattr(interaction, "outputs", None) or []:
+        if getattr(output, "type", None) != "thought":
+            continue
+        for summary in getattr(output, "summary", None) or []:
+            text = getattr(summary, "text", None)
+            if text:
+                thoughts.append(text)
+    return thoughts
+
+
+def interaction_report(interaction) -> Optional[str]:
+    """Text of the last text output (the final report)."""
+    for output in reversed(getattr(interaction, "outputs", None) or []):
+        if getattr(output, "type", "text") == "text" and getattr(output, "text", None):
+            return output.text
+    return None
+
+
+class ResearchStore:
+    """SQLite (WAL) persistence of research jobs."""
+
+    def __init__(self, path: Path = RESEARCH_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, timeout=10)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS research (
+                id TEXT PRIMARY KEY,
+                interaction_id TEXT,
+                status TEXT NOT NULL,
+                job TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_research_interaction ON research(interaction_id)")
+        self._conn.commit()
+
+    def save(self, job: ResearchJob):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO research (id, interaction_id, status, job, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job.id, job.interaction_id, job.status, json.dumps(job.to_dict()), job.updated_at),
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[ResearchJob]:
+        """Job by its id or by its interaction id."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job FROM research WHERE id = ? OR interaction_id = ? LIMIT 1", (job_id, job_id)
+            ).fetchone()
+        return ResearchJob(**json.loads(row[0])) if row else None
+
+    def unfinished(self) -> List[ResearchJob]:
+        placeholders = ",".join("?" * len(TERMINAL_STATUSES))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT job FROM research WHERE status NOT IN ({placeholders}) ORDER BY updated_at",
+                tuple(TERMINAL_STATUSES),
+            ).fetchall()
+        return [ResearchJob(**json.loads(row[0])) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResearchManager:
+    """One poller per interaction, a concurrency cap with a queue, and change notifications.
+
+    `create(prompt)` starts an interaction and `fetch(interaction_id)` reads it;
+    both are awaitables supplied by the caller (the proxy wraps the genai client).
+    """
+
+    def __init__(self, create: Callable[[str], Awaitable[Any]], fetch: Callable[[str], Awaitable[Any]],
+                 store: Optional[ResearchStore] = None, max_concurrent: int = RESEARCH_MAX_CONCURRENT,
+                 max_queue: int = RESEARCH_MAX_QUEUE, poll_min: float = RESEARCH_POLL_MIN,
+                 poll_max: float = RESEARCH_POLL_MAX):
+        self.create = create
+        self.fetch = fetch
+        self.store = store
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self._jobs: Dict[str, ResearchJob] = {}   # unfinished jobs, by id and interaction id
+        self._queue: deque = deque()
+        self._pollers: Dict[str, asyncio.Task] = {}
+        self._launches: set = set()                # queued jobs being started by _pump
+        self._active = 0                           # slots held (starting or polling)
+        self._closing = False
+        self._changed: Optional[asyncio.Condition] = None
+        self.submitted = 0
+        self.upstream_polls = 0
+        self.local_reads = 0
+
+    @property
+    def changed(self) -> asyncio.Condition:
+        if self._changed is None:  # bound to the running loop on first use
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    # ── lookups ─────────────────────────────────────────────────────────────
+
+    def get(self, job_id: str) -> Optional[ResearchJob]:
+        """Local state only: never calls the API."""
+        job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.get(job_id)
+        if job is not None:
+            self.local_reads += 1
+        return job
+
+    async def track(self, interaction_id: str) -> ResearchJob:
+        """Adopt an interaction this process did not start (one live read, then a poller)."""
+        interaction = await self.fetch(interaction_id)
+        job = ResearchJob(id=interaction_id, prompt="", status="in_progress", interaction_id=interaction_id)
+        self._jobs[job.id] = job
+        self._apply(job, interaction)
+        self._save(job)
+        if not job.done:
+            self._start_poller(job, holds_slot=False)
+        return job
+
+    async def wait(self, job_id: str, version: int, timeout: float) -> Optional[ResearchJob]:
+        """Block until the job changes past `version`, finishes, or `timeout` passes."""
+        job = self.get(job_id)
+        if job is None or job.done or job.version > version:
+            return job
+
+        def moved():
+            current = self._jobs.get(job.id, job)
+            return current.done or current.version > version
+
+        async with self.changed:
+            try:
+                await asyncio.wait_for(self.changed.wait_for(moved), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.get(job_id)
+
+    # ── lifecycle ───────────────────────────────────────────────────────────
+
+    async def submit(self, prompt: str) -> ResearchJob:
+        """Start a research job now, or queue it when every slot is busy."""
+        self.submitted += 1
+        if self._active >= self.max_concurrent:
+            if len(self._queue) >= self.max_queue:
+                raise ResearchQueueFull(f"{self._active} research jobs running and {len(self._queue)} queued")
+            job = ResearchJob(id=f"rq_{uuid.uuid4().hex}", prompt=prompt)
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._save(job)
+            return job
+        self._active += 1
+        job = ResearchJob(id="", prompt=prompt)
+        try:
+            await self._launch(job)
+        except Exception:
+            self._release()
+            raise
+        return job
+
+    def queue_position(self, job: ResearchJob) -> Optional[int]:
+        for position, queued in enumerate(self._queue, 1):
+            if queued.id == job.id:
+                return position
+        return None
+
+    async def _launch(self, job: ResearchJob):
+        """Create the interaction for a job holding a slot and start its poller."""
+        interaction = await self.create(job.prompt)
+        job.interaction_id = interaction.id
+        if not job.id:
+            job.id = interaction.id
+        self._jobs[job.id] = self._jobs[interaction.id] = job
+        self._apply(job, interaction)
+        if job.status == "queued":
+            job.status = "in_progress"
+        self._save(job)
+        self._start_poller(job, holds_slot=True)
+
+    async def _launch_queued(self, job: ResearchJob):
+        try:
+            await self._launch(job)
+        except Exception as e:
+            print(f"[RESEARCH] Failed to start queued job {job.id}: {e}")
+            self._finish(job, "failed", error=str(e))
+            self._forget(job)
+            self._release()
+        await self._notify()
+
+    def _start_poller(self, job: ResearchJob, holds_slot: bool):
+        if job.interaction_id in self._pollers:
+            return
+        self._pollers[job.interaction_id] = asyncio.create_task(self._poll(job, holds_slot))
+
+    async def _poll(self, job: ResearchJob, holds_slot: bool):
+        interval = self.poll_min
+        errors = 0
+        try:
+            while not job.done:
+                await asyncio.sleep(interval)
+                try:
+                    interaction = await self.fetch(job.interaction_id)
+                    errors = 0
+                except Exception as e:
+                    errors += 1
+                    print(f"[RESEARCH] Poll {job.interaction_id} failed ({errors}): {e}")
+                    if errors >= RESEARCH_MAX_POLL_ERRORS:
+                        self._finish(job, "failed", error=f"Polling failed: {e}")
+                        await self._notify()
+                        break
+                    interval = min(interval * RESEARCH_POLL_BACKOFF, self.poll_max)
+                    continue
+                self.upstream_polls += 1
+                job.polls += 1
+                changed = self._apply(job, interaction)
+                # New thinking summaries mean the agent is moving: look again soon
+                interval = self.poll_min if changed else min(interval * RESEARCH_POLL_BACKOFF, self.poll_max)
+                if changed or job.done:
+                    self._save(job)
+                    await self._notify()
+        finally:
+            self._pollers.pop(job.interaction_id, None)
+            self._forget(job)
+            if holds_slot:
+                self._release()
+
+    def _apply(self, job: ResearchJob, interaction) -> bool:
+        """Copy interaction state into the job; True if anything visible changed."""
+        changed = False
+        thoughts = interaction_thoughts(interaction)
+        if len(thoughts) > len(job.thoughts):
+            job.thoughts = thoughts
+            changed = True
+        status = getattr(interaction, "status", None) or job.status
+        if status == "requires_action":
+            status = "in_progress"
+        if status in TERMINAL_STATUSES:
+            error = getattr(interaction, "error", None)
+            self._finish(job, status, report=interaction_report(interaction) if status == "completed" else None,
+                         error=str(error) if error and status != "completed" else None)
+            return True
+        if status != job.status:
+            job.status = status
+            changed = True
+        if changed:
+            job.version += 1
+            job.updated_at = time.time()
+        return changed
+
+    def _finish(self, job: ResearchJob, status: str, report: Optional[str] = None, error: Optional[str] = None):
+        job.status = status
+        job.report = report
+        job.error = error or (None if status == "completed" else f"Research {status}")
+        job.completed_at = job.updated_at = time.time()
+        job.version += 1
+        self._save(job)
+
+    def _forget(self, job: ResearchJob):
+        """Finished jobs live in the store only (when there is one)."""
+        if self.store is None:
+            return
+        for key in (job.id, job.interaction_id):
+            self._jobs.pop(key, None)
+
+    def _release(self):
+        self._active -= 1
+        self._pump()
+
+    def _pump(self):
+        """Start queued jobs while slots are free (never during shutdown: they stay queued for resume)."""
+        while self._queue and self._active < self.max_concurrent and not self._closing:
+            self._active += 1
+            task = asyncio.create_task(self._launch_queued(self._queue.popleft()))
+            self._launches.add(task)
+            task.add_done_callback(self._launches.discard)
+
+    async def _notify(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+    def _save(self, job: ResearchJob):
+        if self.store is not None and job.id:
+            self.store.save(job)
+
+    async def resume(self):
+        """Re-attach pollers to jobs left in progress and re-queue jobs never started."""
+        if self.store is None:
+            return
+        for job in self.store.unfinished():
+            self._jobs[job.id] = job
+            if job.interaction_id:
+                self._jobs[job.interaction_id] = job
+                self._active += 1
+                self._start_poller(job, holds_slot=True)
+            else:
+                self._queue.append(job)
+        self._pump()
+
+    async def close(self):
+        """Stop polling without starting anything new; unfinished jobs stay persisted for resume()."""
+        self._closing = True
+        tasks = list(self._pollers.values()) + list(self._launches)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.store is not None:
+            self.store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "queued": len(self._queue),
+            "max_queue": self.max_queue,
+            "pollers": len(self._pollers),
+            "submitted": self.submitted,
+            "upstream_polls": self.upstream_polls,
+            "local_reads": self.local_reads,
+        }
+
+
+def build_research_store_from_env() -> Optional[ResearchStore]:
+    """Store at BANDIT_RESEARCH_PATH, or None (memory only) if the disk is unusable."""
+    try:
+        return ResearchStore()
+    except (sqlite3.Error, OSError) as e:
+        print(f"[RESEARCH WARNING] Persistence unavailable ({e}), tracking research in memory")
+        return None
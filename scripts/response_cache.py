@@ -0,0 +1,347 @@
+"""Pluggable response cache for the Bandit proxy.
+
+Replaces the old in-process `BACKGROUND_CACHE` OrderedDict:
+- MemoryCache: in-process L1 (LRU, byte budget, per-entry TTL)
+- SQLiteCache: on-disk L2 shared by every worker on the box and kept across restarts
+- TieredCache: L1 in front of L2, promoting L2 hits into L1
+
+All backends are thread-safe and report hit/miss/eviction stats. They do
+blocking I/O, so async callers go through a thread (asyncio.to_thread).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+DEFAULT_TTL = int(os.getenv("BANDIT_CACHE_TTL", 24 * 60 * 60))              # 24h
+DEFAULT_L1_BYTES = int(os.getenv("BANDIT_CACHE_L1_BYTES", 16 * 1024 * 1024))  # 16 MB
+DEFAULT_L2_BYTES = int(os.getenv("BANDIT_CACHE_L2_BYTES", 256 * 1024 * 1024))  # 256 MB
+ACCESS_FLUSH_EVERY = 64  # buffered L2 access times written per batch
+DEFAULT_CACHE_PATH = Path(os.getenv(
+    "BANDIT_CACHE_PATH",
+    Path(__file__).resolve().parent.parent / ".cache" / "bandit_responses.sqlite",
+))
+
+
+class CacheBackend(ABC):
+    """Interface shared by all response cache backends."""
+
+    name = "base"
+
+    def __init__(self, max_bytes: int, default_ttl: Optional[float] = DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @property
+    @abstractmethod
+    def size_bytes(self) -> int:
+        ...
+
+    def _expires_at(self, ttl: Optional[float]) -> Optional[float]:
+        ttl = self.default_ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "entries": len(self),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU cache bounded by total value size in bytes."""
+
+    name = "memory"
+
+    def __init__(self, max_bytes: int = DEFAULT_L1_BYTES, default_ttl: Optional[float] = DEFAULT_TTL):
+        super().__init__(max_bytes, default_ttl)
+        self._entries: OrderedDict = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None, expires_at: Optional[float] = None):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at if expires_at is not None else self._expires_at(ttl))
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+
+class SQLiteCache(CacheBackend):
+    """On-disk cache in a WAL-mode SQLite file, evicting least recently used rows.
+
+    Hits do not write: access times are buffered and applied in batches
+    (before every eviction pass, and every ACCESS_FLUSH_EVERY touches).
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_L2_BYTES,
+                 default_ttl: Optional[float] = DEFAULT_TTL):
+        super().__init__(max_bytes, default_ttl)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}  # key -> last access not yet written
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        value, _ = self.get_with_expiry(key)
+        return value
+
+    def get_with_expiry(self, key: str):
+        """Return (value, expires_at) so a tier above can keep the same deadline."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None, None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._touched.pop(key, None)
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.expirations += 1
+                self.misses += 1
+                return None, None
+            self._touch_locked(key, now)
+            self.hits += 1
+            return value, expires_at
+
+    def touch(self, key: str):
+        """Record a hit served from a tier above, so LRU eviction keeps hot keys."""
+        with self._lock:
+            self._touch_locked(key, time.time())
+
+    def _touch_locked(self, key: str, now: float):
+        self._touched[key] = now
+        if len(self._touched) >= ACCESS_FLUSH_EVERY:
+            self._flush_access_locked()
+            self._conn.commit()
+
+    def _flush_access_locked(self):
+        if self._touched:
+            self._conn.executemany("UPDATE responses SET last_access = ? WHERE key = ?",
+                                   [(at, key) for key, at in self._touched.items()])
+            self._touched.clear()
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, self._expires_at(ttl), time.time()),
+            )
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        self._flush_access_locked()
+        now = time.time()
+        expired = self._conn.execute(
+            "DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+        ).rowcount
+        self.expirations += max(expired, 0)
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._touched.pop(key, None)
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._touched.clear()
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @property
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._flush_access_locked()
+            self._conn.commit()
+            self._conn.close()
+
+
+class TieredCache(CacheBackend):
+    """Memory L1 in front of a persistent L2."""
+
+    name = "tiered"
+
+    def __init__(self, l1: MemoryCache, l2: SQLiteCache):
+        super().__init__(l1.max_bytes + l2.max_bytes, l1.default_ttl)
+        self.l1 = l1
+        self.l2 = l2
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.l1.get(key)
+        if value is not None:
+            self.l2.touch(key)
+            self.hits += 1
+            return value
+        value, expires_at = self.l2.get_with_expiry(key)
+        if value is not None:
+            self.l1.set(key, value, expires_at=expires_at)
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self.l1.set(key, value, ttl)
+        self.l2.set(key, value, ttl)
+
+    def delete(self, key: str):
+        self.l1.delete(key)
+        self.l2.delete(key)
+
+    def clear(self):
+        self.l1.clear()
+        self.l2.clear()
+
+    def __len__(self) -> int:
+        return len(self.l2)
+
+    @property
+    def size_bytes(self) -> int:
+        return self.l2.size_bytes
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["evictions"] = self.l1.evictions + self.l2.evictions
+        stats["expirations"] = self.l1.expirations + self.l2.expirations
+        stats["l1"] = self.l1.stats()
+        stats["l2"] = self.l2.stats()
+        return stats
+
+
+def build_cache_from_env() -> CacheBackend:
+    """Build the configured backend (BANDIT_CACHE_BACKEND=tiered|memory|sqlite)."""
+    backend = os.getenv("BANDIT_CACHE_BACKEND", "tiered").lower()
+    if backend == "memory":
+        return MemoryCache()
+    try:
+        if backend == "sqlite":
+            return SQLiteCache()
+        return TieredCache(MemoryCache(), SQLiteCache())
+    except (sqlite3.Error, OSError) as e:
+        print(f"[CACHE WARNING] Persistent cache unavailable ({e}), using memory only")
+        return MemoryCache()
@@ -0,0 +1,187 @@
+"""Embedding-keyed semantic cache for near-duplicate prompts.
+
+"what's on my calendar today" and "what do I have today" miss the exact-match
+response cache, but their embeddings sit close together. Each thinking mode
+gets its own small in-memory vector index; a lookup is one normalized
+matrix-vector product, so near-duplicates are answered in milliseconds.
+"""
+
+import itertools
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+
+SEMANTIC_EMBED_MODEL = os.getenv("BANDIT_SEMANTIC_EMBED_MODEL", "gemini-embedding-001")
+SEMANTIC_EMBED_DIM = int(os.getenv("BANDIT_SEMANTIC_EMBED_DIM", 768))
+# The lookup sits in front of the model call: past this the request skips the cache instead of waiting
+SEMANTIC_EMBED_TIMEOUT = float(os.getenv("BANDIT_SEMANTIC_EMBED_TIMEOUT", 0.25))
+
+# Per-mode policy: only instant answers are cheap enough to be worth
+# approximating; deep think and Reasoning Engine answers stay exact-match only.
+SEMANTIC_CACHE_POLICY = {
+    "instant": {
+        "enabled": os.getenv("BANDIT_SEMANTIC_CACHE", "1") != "0",
+        "threshold": float(os.getenv("BANDIT_SEMANTIC_THRESHOLD", 0.92)),
+        "ttl": float(os.getenv("BANDIT_SEMANTIC_TTL", 60 * 60)),
+        "max_entries": int(os.getenv("BANDIT_SEMANTIC_MAX_ENTRIES", 5000)),
+    },
+    "auto": {"enabled": False},
+    "thinking": {"enabled": False},
+}
+
+
+@dataclass
+class SemanticHit:
+    """A served near-duplicate (entry_id lets clients report false hits)."""
+    entry_id: int
+    response: str
+    prompt: str
+    score: float
+
+
+class SemanticIndex:
+    """Fixed-capacity cosine-similarity index with oldest-first replacement."""
+
+    def __init__(self, dim: int, capacity: int, threshold: float, ttl: float):
+        self.dim = dim
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._expires = np.zeros(capacity, dtype=np.float64)  # 0 = empty slot
+        self._ids = np.full(capacity, -1, dtype=np.int64)
+        self._payloads: Dict[int, tuple] = {}  # entry_id -> (slot, prompt, response)
+        self._next_slot = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector) -> Optional[np.ndarray]:
+        v = np.asarray(vector, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else None
+
+    def search(self, vector) -> Optional[SemanticHit]:
+        q = self._normalize(vector)
+        if q is None or q.shape[0] != self.dim:
+            return None
+        with self._lock:
+            live = self._expires > time.time()
+            if not live.any():
+                return None
+            scores = self._vectors @ q
+            scores[~live] = -1.0
+            slot = int(np.argmax(scores))
+            score = float(scores[slot])
+            if score < self.threshold:
+                return None
+            entry_id = int(self._ids[slot])
+            _, prompt, response = self._payloads[entry_id]
+            return SemanticHit(entry_id, response, prompt, score)
+
+    def add(self, entry_id: int, vector, prompt: str, response: str) -> Optional[int]:
+        """Insert an entry; returns the id it replaced, if any."""
+        v = self._normalize(vector)
+        if v is None or v.shape[0] != self.dim:
+            return None
+        with self._lock:
+            slot = self._next_slot
+            self._next_slot = (slot + 1) % self.capacity
+            old_id = int(self._ids[slot])
+            self._payloads.pop(old_id, None)
+            self._vectors[slot] = v
+            self._expires[slot] = time.time() + self.ttl
+            self._ids[slot] = entry_id
+            self._payloads[entry_id] = (slot, prompt, response)
+            return old_id if old_id >= 0 else None
+
+    def remove(self, entry_id: int) -> bool:
+        with self._lock:
+            payload = self._payloads.pop(entry_id, None)
+            if payload is None:
+                return False
+            slot = payload[0]
+            self._expires[slot] = 0.0
+            self._ids[slot] = -1
+            return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int((self._expires > time.time()).sum())
+
+
+class SemanticCache:
+    """Per-mode semantic indexes plus hit/miss/false-hit metrics."""
+
+    def __init__(self, policy: Dict[str, dict] = None, dim: int = SEMANTIC_EMBED_DIM):
+        self.policy = policy or SEMANTIC_CACHE_POLICY
+        self.dim = dim
+        self._indexes: Dict[str, SemanticIndex] = {}
+        self._entry_modes: Dict[int, str] = {}
+        self._ids = itertools.count(1)
+        self.hits = 0
+        self.misses = 0
+        self.false_hits = 0
+        self.embed_timeouts = 0  # lookups skipped because the embedding was slower than SEMANTIC_EMBED_TIMEOUT
+
+    def enabled(self, mode: str) -> bool:
+        return bool(self.policy.get(mode, {}).get("enabled"))
+
+    def _index(self, mode: str) -> SemanticIndex:
+        index = self._indexes.get(mode)
+        if index is None:
+            p = self.policy[mode]
+            index = SemanticIndex(self.dim, p["max_entries"], p["threshold"], p["ttl"])
+            self._indexes[mode] = index
+        return index
+
+    def lookup(self, mode: str, vector) -> Optional[SemanticHit]:
+        if not self.enabled(mode):
+            return None
+        hit = self._index(mode).search(vector)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return hit
+
+    def add(self, mode: str, vector, prompt: str, response: str) -> Optional[int]:
+        if not self.enabled(mode) or not response:
+            return None
+        entry_id = next(self._ids)
+        replaced = self._index(mode).add(entry_id, vector, prompt, response)
+        self._entry_modes.pop(replaced, None)
+        self._entry_modes[entry_id] = mode
+        return entry_id
+
+    def report_false_hit(self, entry_id: int) -> bool:
+        """Client says a served near-duplicate was wrong: count it and drop the entry."""
+        mode = self._entry_modes.pop(entry_id, None)
+        if mode is None or not self._indexes[mode].remove(entry_id):
+            return False
+        self.false_hits += 1
+        return True
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "embed_model": SEMANTIC_EMBED_MODEL,
+            "dimensions": self.dim,
+            "hits": self.hits,
+            "misses": self.misses,
+            "false_hits": self.false_hits,
+            "embed_timeouts": self.embed_timeouts,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "false_hit_rate": round(self.false_hits / self.hits, 4) if self.hits else 0.0,
+            "modes": {
+                mode: {
+                    "enabled": self.enabled(mode),
+                    "threshold": p.get("threshold"),
+                    "entries": len(self._indexes[mode]) if mode in self._indexes else 0,
+                }
+                for mode, p in self.policy.items()
+            },
+        }
@@ -0,0 +1,144 @@
+"""Server-side conversation sessions for delta uploads.
+
+Mobile clients on cellular links re-send the whole conversation (including
+base64 images) every turn. With a session the client sends a `session_id`
+plus only the new message; the proxy keeps the history here with images
+already decoded, so neither the upload nor the base64 parse is repeated.
+Sessions are in-memory, evicted after an idle TTL or when the store is full.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+SESSION_IDLE_TTL = float(os.getenv("BANDIT_SESSION_IDLE_TTL", 30 * 60))
+SESSION_MAX_SESSIONS = int(os.getenv("BANDIT_SESSION_MAX", 1000))
+SESSION_MAX_MESSAGES = int(os.getenv("BANDIT_SESSION_MAX_MESSAGES", 200))
+
+
+@dataclass
+class SessionMessage:
+    """One stored message, already parsed into Gemini-ready contents."""
+    role: str
+    text: str
+    contents: Any     # str or decoded Parts (see proxy_server.parse_gemini_content)
+    wire_bytes: int   # what the client would have uploaded for it (base64 included)
+
+
+@dataclass
+class Session:
+    id: str
+    messages: List[SessionMessage] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    last_access: float = field(default_factory=time.time)
+    turns: int = 0
+    cache_name: Optional[str] = None  # last Gemini cached_content used by this session
+
+    def history_bytes(self) -> int:
+        return sum(m.wire_bytes for m in self.messages)
+
+
+class SessionStore:
+    """Idle-evicting LRU of sessions."""
+
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL, max_sessions: int = SESSION_MAX_SESSIONS,
+                 max_messages: int = SESSION_MAX_MESSAGES, on_evict: Optional[Callable[[Session], None]] = None):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.on_evict = on_evict
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+        self.turns = 0
+        self.bytes_received = 0
+        self.bytes_saved = 0
+
+    def create(self, messages: Optional[List[SessionMessage]] = None) -> Session:
+        session = Session(id=uuid.uuid4().hex)
+        self._append(session, messages or [])
+        evicted = []
+        with self._lock:
+            self._sessions[session.id] = session
+            self.created += 1
+            evicted += self._sweep_locked(time.time())
+            while len(self._sessions) > self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False)[1])
+                self.evicted += 1
+        self._notify(evicted)
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Session by id (refreshing its idle timer), or None if unknown/expired."""
+        now = time.time()
+        with self._lock:
+            evicted = self._sweep_locked(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_access = now
+                self._sessions.move_to_end(session_id)
+        self._notify(evicted)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        self._notify([session] if session else [])
+        return session is not None
+
+    def record_turn(self, session: Session, new_messages: List[SessionMessage]):
+        """Append a finished turn (the delta plus the reply) and count the upload it saved."""
+        received = sum(m.wire_bytes for m in new_messages if m.role != "assistant")
+        with self._lock:
+            self.turns += 1
+            self.bytes_received += received
+            self.bytes_saved += session.history_bytes()
+        self._append(session, new_messages)
+        session.turns += 1
+        session.last_access = time.time()
+
+    def _append(self, session: Session, messages: List[SessionMessage]):
+        session.messages.extend(messages)
+        if len(session.messages) > self.max_messages:
+            del session.messages[:len(session.messages) - self.max_messages]
+
+    def _sweep_locked(self, now: float) -> List[Session]:
+        expired = []
+        # Oldest-accessed first, so stop at the first live session
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_access < self.idle_ttl:
+                break
+            expired.append(self._sessions.pop(session_id))
+            self.expired += 1
+        return expired
+
+    def _notify(self, sessions: List[Session]):
+        if self.on_evict:
+            for session in sessions:
+                self.on_evict(session)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            "sessions": len(sessions),
+            "max_sessions": self.max_sessions,
+            "idle_ttl_seconds": self.idle_ttl,
+            "stored_messages": sum(len(s.messages) for s in sessions),
+            "stored_bytes": sum(s.history_bytes() for s in sessions),
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "turns": self.turns,
+            "bytes_received": self.bytes_received,
+            "upload_bytes_saved": self.bytes_saved,
+        }
@@ -0,0 +1,87 @@
+"""Single-flight request coalescing.
+
+When fleet agents or retrying clients send the same prompt at the same moment,
+only the first caller (the leader) hits the model; everyone else awaits the
+leader's result. Keys come from `request_fingerprint` (mode, model, normalized
+contents), so identical requests in different modes are never merged.
+"""
+
+import asyncio
+import hashlib
+import re
+from typing import Any, Awaitable, Callable, Dict
+
+
+def _normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _update_fingerprint(h, item: Any):
+    if isinstance(item, str):
+        h.update(_normalize_text(item).encode())
+    elif getattr(item, "parts", None) is not None:  # types.Content (multi-turn history)
+        h.update(f"{item.role}:".encode())
+        for part in item.parts:
+            _update_fingerprint(h, part)
+    elif getattr(item, "text", None):
+        h.update(_normalize_text(item.text).encode())
+    elif getattr(item, "inline_data", None) and item.inline_data.data:
+        h.update(item.inline_data.mime_type.encode() if item.inline_data.mime_type else b"")
+        h.update(hashlib.sha256(item.inline_data.data).digest())
+    else:
+        h.update(repr(item).encode())
+    h.update(b"\x01")
+
+
+def request_fingerprint(mode: str, model: str, contents: Any) -> str:
+    """Stable hash of (mode, model, normalized contents) for str, Part or Content lists."""
+    h = hashlib.sha256(f"{mode}\x00{model}\x00".encode())
+    items = contents if isinstance(contents, list) else [contents]
+    for item in items:
+        _update_fingerprint(h, item)
+    return h.hexdigest()
+
+
+class SingleFlight:
+    """Coalesce concurrent async calls that share a key."""
+
+    def __init__(self, name: str = "default"):
+        self.name = name
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `fn()` once per key at a time; concurrent callers share the result or error."""
+        task = self._tasks.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        else:
+            self.coalesced += 1
+        # Shield so one caller disconnecting does not cancel the shared call,
+        # but cancel it once the last caller is gone (e.g. a losing hedge)
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter went away
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._tasks), "leaders": self.leaders, "coalesced": self.coalesced}
+
@@ -0,0 +1,114 @@
+"""Aggregate exported request traces into per-stage latency percentiles.
+
+Reads the JSONL written by tracing.py (rotated files included) and prints,
+per stage, how many traces contained it and the p50/p90/p99/max of its
+total time per request. It also shows the stage's share of all traced
+request time, so the stage eating a slow request stands out.
+
+    python scripts/trace_report.py                       # default trace file
+    python scripts/trace_report.py --slow                # only slow requests
+    python scripts/trace_report.py --route /v1/chat/completions --json
+"""
+
+import argparse
+import json
+import math
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+try:
+    from tracing import TRACE_PATH
+except ImportError:
+    from scripts.tracing import TRACE_PATH
+
+REQUEST_STAGE = "(request)"
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))]
+
+
+def trace_files(path: Path) -> List[Path]:
+    """The trace file and its rotated backups, oldest first."""
+    backups = [p for p in path.parent.glob(f"{path.name}.*") if p.suffix[1:].isdigit()]
+    backups.sort(key=lambda p: int(p.suffix[1:]), reverse=True)  # .3 is older than .1
+    return backups + ([path] if path.exists() else [])
+
+
+def read_traces(paths: Iterable[Path]) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # a torn last line from a crash
+
+
+def aggregate(traces: Iterable[Dict[str, Any]], route: Optional[str] = None, slow_only: bool = False) -> Dict[str, Any]:
+    """Per-stage {count, p50, p90, p99, max, share} in milliseconds, plus the whole-request row."""
+    per_stage: Dict[str, List[float]] = {}
+    total_ms = 0.0
+    count = 0
+    for trace in traces:
+        if route and trace.get("route") != route:
+            continue
+        if slow_only and not trace.get("slow"):
+            continue
+        count += 1
+        total_ms += trace.get("duration_ms", 0.0)
+        per_stage.setdefault(REQUEST_STAGE, []).append(trace.get("duration_ms", 0.0))
+        stages: Dict[str, float] = {}
+        for span in trace.get("spans", []):
+            stages[span["name"]] = stages.get(span["name"], 0.0) + span.get("duration_ms", 0.0)
+        for name, ms in stages.items():
+            per_stage.setdefault(name, []).append(ms)
+
+    rows = {}
+    for name, values in per_stage.items():
+        values.sort()
+        rows[name] = {
+            "count": len(values),
+            "p50": round(percentile(values, 0.50), 3),
+            "p90": round(percentile(values, 0.90), 3),
+            "p99": round(percentile(values, 0.99), 3),
+            "max": round(values[-1], 3),
+            # Nested (parse > decode_image) and concurrent (hedged) spans overlap, so shares can pass 100%
+            "share": round(sum(values) / total_ms, 4) if total_ms else 0.0,
+        }
+    return {"traces": count, "stages": rows}
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [f"{report['traces']} traces",
+             f"{'stage':<24}{'count':>8}{'p50 ms':>12}{'p90 ms':>12}{'p99 ms':>12}{'max ms':>12}{'share':>8}"]
+    rows = sorted(report["stages"].items(), key=lambda item: (item[0] != REQUEST_STAGE, -item[1]["p90"]))
+    for name, row in rows:
+        lines.append(f"{name:<24}{row['count']:>8}{row['p50']:>12.1f}{row['p90']:>12.1f}{row['p99']:>12.1f}"
+                     f"{row['max']:>12.1f}{row['share']:>8.1%}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=str(TRACE_PATH), help="trace JSONL file (rotated copies included)")
+    parser.add_argument("--route", help="only traces of this route template, e.g. /v1/chat/completions")
+    parser.add_argument("--slow", action="store_true", help="only requests over the slow threshold")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    files = trace_files(Path(args.path))
+    if not files:
+        print(f"No traces at {args.path}", file=sys.stderr)
+        return 1
+    report = aggregate(read_traces(files), route=args.route, slow_only=args.slow)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
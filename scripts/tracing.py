@@ -0,0 +1,234 @@
+"""Per-request stage tracing with a rotating JSONL export.
+
+A 14 s chat completion used to leave only `print` lines behind, with no
+way to tell whether the time went to message parsing, base64 image
+decoding, the OAuth token, admission, the upstream call or a retry sleep.
+TracingMiddleware starts a trace for every request. Its id is taken from
+an incoming X-Bandit-Trace-Id header or generated, and it is returned in
+the same header. Pipeline stages record spans into the trace through
+`span()` (a no-op outside requests).
+
+When the request finishes, the trace is appended to a JSONL file (size-
+rotated) if any of these holds:
+
+- it was sampled (BANDIT_TRACE_SAMPLE)
+- it ran longer than BANDIT_TRACE_SLOW_SECONDS; slow requests are always
+  kept and also summarized in the log
+- it failed with a 5xx
+
+`python scripts/trace_report.py` aggregates the file into per-stage
+percentiles.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+TRACE_ENABLED = os.getenv("BANDIT_TRACE", "1") != "0"
+TRACE_SAMPLE = float(os.getenv("BANDIT_TRACE_SAMPLE", 0.05))         # share of ordinary requests exported
+TRACE_SLOW_SECONDS = float(os.getenv("BANDIT_TRACE_SLOW_SECONDS", 5))  # always exported above this
+# The root requests.jsonl is taken by the work backlog, so traces live under .cache by default
+TRACE_PATH = Path(os.getenv(
+    "BANDIT_TRACE_PATH",
+    Path(__file__).resolve().parent.parent / ".cache" / "traces" / "requests.jsonl",
+))
+TRACE_MAX_BYTES = int(os.getenv("BANDIT_TRACE_MAX_BYTES", 32 * 1024 * 1024))
+TRACE_BACKUPS = int(os.getenv("BANDIT_TRACE_BACKUPS", 3))
+TRACE_HEADER = b"x-bandit-trace-id"  # request and response
+TRACE_ID_RE = re.compile(r"^[0-9a-fA-F-]{8,64}$")
+
+
+class Trace:
+    """Spans recorded for one request, as offsets from its start."""
+
+    __slots__ = ("trace_id", "start", "wall_start", "spans")
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, name: str, start: float, end: float, attrs: Optional[Dict[str, Any]] = None):
+        span = {"name": name, "start_ms": round((start - self.start) * 1000, 3),
+                "duration_ms": round((end - start) * 1000, 3)}
+        if attrs:
+            span.update(attrs)
+        self.spans.append(span)
+
+    def stage_totals(self) -> Dict[str, float]:
+        """Milliseconds per stage name (repeated stages, e.g. retries, are summed)."""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span["name"]] = totals.get(span["name"], 0.0) + span["duration_ms"]
+        return totals
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time the enclosed block as stage `name` of the current trace (works around awaits too)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        trace.add(name, start, time.perf_counter(), attrs)
+
+
+def record_span(name: str, start: float, end: Optional[float] = None, **attrs):
+    """Add an already-measured stage (perf_counter timestamps) to the current trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, start, time.perf_counter() if end is None else end, attrs)
+
+
+class TraceExporter:
+    """Appends trace records to a JSONL file, rotating it at max_bytes (file.1 .. file.N)."""
+
+    def __init__(self, path: Path = TRACE_PATH, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.exported = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{index}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{index + 1}"))
+        if self.backups:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+    def export(self, record: Dict[str, Any]):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        try:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                if self.path.exists() and self.path.stat().st_size + len(line) > self.max_bytes:
+                    self._rotate()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            self.exported += 1
+        except OSError as e:
+            self.failures += 1
+            print(f"[TRACE WARNING] Could not write {self.path}: {e}")
+
+
+class Tracer:
+    """Decides which finished traces are exported and logs slow ones."""
+
+    def __init__(self, exporter: Optional[TraceExporter] = None, sample: float = TRACE_SAMPLE,
+                 slow_seconds: float = TRACE_SLOW_SECONDS, enabled: bool = TRACE_ENABLED):
+        self.exporter = exporter or TraceExporter()
+        self.sample = sample
+        self.slow_seconds = slow_seconds
+        self.enabled = enabled
+        self.traced = 0
+        self.slow = 0
+
+    def finish(self, trace: Trace, method: str, route: str, status: int) -> Optional[Dict[str, Any]]:
+        """Record for an exported trace, None if it was dropped."""
+        record = self._record(trace, method, route, status)
+        if record is not None:
+            self.exporter.export(record)
+        return record
+
+    async def finish_async(self, trace: Trace, method: str, route: str, status: int) -> Optional[Dict[str, Any]]:
+        """finish() for the event loop: the file write and rotation run in a worker thread."""
+        record = self._record(trace, method, route, status)
+        if record is not None:
+            await asyncio.to_thread(self.exporter.export, record)
+        return record
+
+    def _record(self, trace: Trace, method: str, route: str, status: int) -> Optional[Dict[str, Any]]:
+        self.traced += 1
+        duration = time.perf_counter() - trace.start
+        slow = duration >= self.slow_seconds
+        if not (slow or status >= 500 or random.random() < self.sample):
+            return None
+        record = {
+            "trace_id": trace.trace_id,
+            "ts": round(trace.wall_start, 3),
+            "method": method,
+            "route": route,
+            "status": status,
+            "duration_ms": round(duration * 1000, 3),
+            "slow": slow,
+            "spans": trace.spans,
+        }
+        if slow:
+            self.slow += 1
+            stages = sorted(trace.stage_totals().items(), key=lambda item: -item[1])
+            breakdown = ", ".join(f"{name} {ms / 1000:.2f}s" for name, ms in stages[:5]) or "no spans"
+            print(f"[SLOW REQUEST] {method} {route} {duration:.2f}s trace={trace.trace_id}: {breakdown}")
+        return record
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample": self.sample,
+            "slow_seconds": self.slow_seconds,
+            "path": str(self.exporter.path),
+            "traced": self.traced,
+            "slow": self.slow,
+            "exported": self.exporter.exported,
+            "export_failures": self.exporter.failures,
+        }
+
+
+TRACER = Tracer()
+
+
+class TracingMiddleware:
+    """ASGI middleware: one Trace per HTTP request, its id echoed in X-Bandit-Trace-Id."""
+
+    def __init__(self, app, tracer: Tracer = TRACER):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.enabled:
+            return await self.app(scope, receive, send)
+        incoming = next((v for k, v in scope.get("headers", ()) if k == TRACE_HEADER), b"").decode("latin-1")
+        trace = Trace(incoming if TRACE_ID_RE.match(incoming) else None)
+        token = _current_trace.set(trace)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(TRACE_HEADER, trace.trace_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            await self.tracer.finish_async(trace, scope["method"], route, status[0])
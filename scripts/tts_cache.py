@@ -0,0 +1,240 @@
+"""Content-addressed disk cache for synthesized speech.
+
+Bandit repeats a lot of short lines (greetings, confirmations, error lines)
+in the same voice. Each clip is stored once under sha256(text, voice, model,
+style): the audio bytes in a blob file, the metadata (mime type, size,
+synthesis time, last access) in a WAL-mode SQLite index. A hit is served
+from disk without calling Gemini TTS; the least recently used clips are
+evicted once the byte budget is exceeded.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+TTS_CACHE_ENABLED = os.getenv("BANDIT_TTS_CACHE", "1") != "0"
+TTS_CACHE_BYTES = int(os.getenv("BANDIT_TTS_CACHE_BYTES", 256 * 1024 * 1024))  # 256 MB
+TTS_CACHE_PATH = Path(os.getenv(
+    "BANDIT_TTS_CACHE_PATH",
+    Path(__file__).resolve().parent.parent / ".cache" / "tts",
+))
+TTS_PREWARM_FILE = os.getenv("BANDIT_TTS_PREWARM_FILE")     # one phrase per line
+TTS_PREWARM_CONCURRENCY = int(os.getenv("BANDIT_TTS_PREWARM_CONCURRENCY", 2))
+
+
+def tts_key(text: str, voice: str, model: str, style: Optional[str]) -> str:
+    payload = json.dumps([text, voice, model, style or ""], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_phrases(path: Path) -> List[str]:
+    """Non-empty, non-comment lines of a phrase file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+@dataclass
+class CachedAudio:
+    data: bytes
+    mime_type: str
+    key: str
+
+
+class TTSCache:
+    """Blob files + SQLite index, LRU-evicted to a byte budget."""
+
+    def __init__(self, path: Path = TTS_CACHE_PATH, max_bytes: int = TTS_CACHE_BYTES,
+                 enabled: bool = TTS_CACHE_ENABLED):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self.seconds_saved = 0.0
+        self.prewarmed = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if enabled:
+            (self.path / "blobs").mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path / "index.sqlite"), check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS clips (
+                    key TEXT PRIMARY KEY,
+                    mime_type TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    synth_seconds REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_clips_access ON clips(last_access)")
+            self._conn.commit()
+
+    def _blob(self, key: str) -> Path:
+        return self.path / "blobs" / key[:2] / key
+
+    def get(self, key: str) -> Optional[CachedAudio]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mime_type, size, synth_seconds FROM clips WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            mime_type, size, synth_seconds = row
+            try:
+                data = self._blob(key).read_bytes()
+            except FileNotFoundError:  # removed behind our back
+                self._conn.execute("DELETE FROM clips WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE clips SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            self.bytes_saved += size
+            self.seconds_saved += synth_seconds
+            return CachedAudio(data, mime_type, key)
+
+    def __contains__(self, key: str) -> bool:
+        if not self.enabled:
+            return False
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM clips WHERE key = ?", (key,)).fetchone() is not None
+
+    def set(self, key: str, data: bytes, mime_type: str, synth_seconds: float = 0.0):
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        blob = self._blob(key)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp = blob.with_name(f"{key}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, blob)  # same key -> same bytes, so concurrent writers are harmless
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO clips (key, mime_type, size, synth_seconds, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, mime_type, len(data), synth_seconds, now, now),
+            )
+            evicted = self._evict_locked()
+            self._conn.commit()
+        for old in evicted:
+            try:
+                self._blob(old).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _evict_locked(self) -> List[str]:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM clips").fetchone()[0]
+        evicted = []
+        if total <= self.max_bytes:
+            return evicted
+        for key, size in self._conn.execute("SELECT key, size FROM clips ORDER BY last_access ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM clips WHERE key = ?", (key,))
+            total -= size
+            evicted.append(key)
+            self.evictions += 1
+        return evicted
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            keys = [k for (k,) in self._conn.execute("SELECT key FROM clips").fetchall()]
+            self._conn.execute("DELETE FROM clips")
+            self._conn.commit()
+        for key in keys:
+            try:
+                self._blob(key).unlink()
+            except FileNotFoundError:
+                pass
+
+    async def prewarm(self, phrases: Iterable[Tuple[str, str]],
+                      synthesize: Callable[[str], Awaitable[Tuple[bytes, str]]],
+                      concurrency: int = TTS_PREWARM_CONCURRENCY) -> Dict[str, int]:
+        """Synthesize and store every (key, speech_text) not cached yet.
+
+        `synthesize(speech_text)` returns (audio bytes, mime type).
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        counts = {"cached": 0, "synthesized": 0, "failed": 0}
+
+        async def warm(key: str, speech_text: str):
+            if await asyncio.to_thread(self.__contains__, key):
+                counts["cached"] += 1
+                return
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    data, mime_type = await synthesize(speech_text)
+                except Exception as e:
+                    counts["failed"] += 1
+                    print(f"[TTS CACHE] Pre-warm failed for {speech_text[:40]!r}: {e}")
+                    return
+                await asyncio.to_thread(self.set, key, data, mime_type, time.perf_counter() - start)
+                counts["synthesized"] += 1
+                self.prewarmed += 1
+
+        await asyncio.gather(*(warm(key, text) for key, text in phrases))
+        return counts
+
+    def __len__(self) -> int:
+        if not self.enabled:
+            return 0
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM clips").fetchone()[0]
+
+    @property
+    def size_bytes(self) -> int:
+        if not self.enabled:
+            return 0
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM clips").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "synth_seconds_saved": round(self.seconds_saved, 3),
+            "evictions": self.evictions,
+            "prewarmed": self.prewarmed,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+
+
+def build_tts_cache_from_env() -> TTSCache:
+    """TTS cache at BANDIT_TTS_CACHE_PATH, disabled (with a warning) if the disk is unusable."""
+    try:
+        return TTSCache()
+    except (sqlite3.Error, OSError) as e:
+        print(f"[TTS CACHE WARNING] Disk cache unavailable ({e}), synthesizing every request")
+        return TTSCache(enabled=False)
@@ -0,0 +1,75 @@
+"""Raw audio framing for streamed speech.
+
+Gemini TTS returns headerless PCM (`audio/L16;codec=pcm;rate=24000`). For
+/tts/stream the chunks are forwarded as they arrive, either as bare PCM or
+behind a streaming WAV header. The header's RIFF and data sizes are set to
+0xFFFFFFFF ("unknown length"), which players treat as "read until EOF", so
+playback can start on the first chunk.
+"""
+
+import re
+import struct
+from dataclasses import dataclass
+from typing import Iterator
+
+STREAM_CHUNK_BYTES = 9600  # 200 ms of 24 kHz mono 16-bit, when replaying cached clips
+UNKNOWN_LENGTH = 0xFFFFFFFF
+
+
+@dataclass
+class PCMFormat:
+    rate: int = 24000
+    channels: int = 1
+    bits: int = 16
+
+    @property
+    def media_type(self) -> str:
+        return f"audio/L{self.bits};rate={self.rate};channels={self.channels}"
+
+
+def is_pcm(mime_type: str) -> bool:
+    mime_type = (mime_type or "").lower()
+    return mime_type.startswith("audio/l16") or mime_type.startswith("audio/l8") or "codec=pcm" in mime_type
+
+
+def parse_pcm_mime(mime_type: str) -> PCMFormat:
+    """PCMFormat from e.g. `audio/L16;codec=pcm;rate=24000` (Gemini TTS defaults otherwise)."""
+    fmt = PCMFormat()
+    mime_type = mime_type or ""
+    bits = re.match(r"\s*audio/l(\d+)", mime_type, re.IGNORECASE)
+    if bits:
+        fmt.bits = int(bits.group(1))
+    rate = re.search(r"rate=(\d+)", mime_type, re.IGNORECASE)
+    if rate:
+        fmt.rate = int(rate.group(1))
+    channels = re.search(r"channels=(\d+)", mime_type, re.IGNORECASE)
+    if channels:
+        fmt.channels = int(channels.group(1))
+    return fmt
+
+
+def wav_header(fmt: PCMFormat, data_size: int = UNKNOWN_LENGTH) -> bytes:
+    """44-byte PCM WAV header; the default `data_size` is the streaming "unknown length"."""
+    block_align = fmt.channels * fmt.bits // 8
+    riff_size = UNKNOWN_LENGTH if data_size == UNKNOWN_LENGTH else 36 + data_size
+    return (
+        b"RIFF" + struct.pack("<I", riff_size) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, fmt.channels, fmt.rate,
+                                fmt.rate * block_align, block_align, fmt.bits)
+        + b"data" + struct.pack("<I", data_size)
+    )
+
+
+def audio_chunks(response) -> Iterator:
+    """inline_data parts carrying audio in one streamed response chunk."""
+    for candidate in getattr(response, "candidates", None) or []:
+        content = getattr(candidate, "content", None)
+        for part in getattr(content, "parts", None) or []:
+            inline = getattr(part, "inline_data", None)
+            if inline is not None and inline.data:
+                yield inline
+
+
+def split_chunks(data: bytes, size: int = STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
@@ -0,0 +1,479 @@
+"""Deterministic local stand-in for the Vertex AI / Gemini endpoints Bandit calls.
+
+Every latency or throughput experiment used to need live Vertex AI, so it
+cost money and the upstream noise hid the change being measured. This
+server speaks the REST subset the stack uses. google-genai clients reach it
+through their normal code paths, with the same request bodies, response
+parsing, SSE streaming and error types as production:
+
+- `:generateContent` and `:streamGenerateContent` (text, thinking, TTS audio
+  as headerless PCM, images), Vertex and Gemini API paths
+- `:predict`, `:embedContent` and `:batchEmbedContents` embeddings
+- Deep Research `interactions` (create / get / cancel) that finish after a
+  configured time, with thought summaries appearing along the way
+- Reasoning Engine `:query`
+
+Each model family has a ModelProfile: lognormal time to first byte, output
+token rate, streaming chunk size (the chunk cadence is chunk_tokens /
+tokens_per_second) and a 429 injection rate. Everything is seeded.
+Answers, embeddings and audio depend only on (seed, model, input), and the
+n-th call to a model always draws the same latency and error, so two runs
+with the same seed and arrival order see the same upstream.
+
+Start it and point Bandit at it:
+
+    python scripts/vertex_standin.py --port 8090 --time-scale 0.1
+    BANDIT_VERTEX_STANDIN_URL=http://127.0.0.1:8090 python proxy_server.py
+
+Profiles can be overridden with a JSON file (--profile or
+BANDIT_STANDIN_PROFILE). Its "models" keys are substrings of model names,
+checked before the built-in families:
+
+    {"seed": 7, "models": {"flash": {"first_byte_ms": 800, "error_rate": 0.05}}}
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import struct
+import sys
+import time
+import uuid
+from dataclasses import asdict, dataclass, fields, replace
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STANDIN_HOST = os.getenv("BANDIT_STANDIN_HOST", "127.0.0.1")
+STANDIN_PORT = int(os.getenv("BANDIT_STANDIN_PORT", 8090))
+STANDIN_SEED = int(os.getenv("BANDIT_STANDIN_SEED", 0))
+STANDIN_TIME_SCALE = float(os.getenv("BANDIT_STANDIN_TIME_SCALE", 1.0))  # 0.1 = ten times faster than life
+STANDIN_PROFILE = os.getenv("BANDIT_STANDIN_PROFILE")
+
+PCM_RATE = 24000                 # Gemini TTS: 16-bit mono PCM at 24 kHz
+PCM_SECONDS_PER_TOKEN = 0.25     # speech length per synthesized "token"
+EMBED_DIM = 768
+WORDS = ("bandit", "signal", "model", "cache", "latency", "answer", "stream", "token", "vector", "engine",
+         "research", "council", "voice", "fleet", "context", "prompt", "result", "quick", "steady", "clear")
+# 1x1 transparent PNG for image generation
+PNG_PIXEL = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=")
+
+
+@dataclass
+class ModelProfile:
+    """Simulated behaviour of one model family."""
+
+    first_byte_ms: float = 400.0      # median time to first byte
+    latency_sigma: float = 0.35       # lognormal spread of first_byte_ms (0 = fixed)
+    tokens_per_second: float = 150.0  # output rate after the first byte (0 = instant)
+    output_tokens: int = 60           # answer length
+    thought_tokens: int = 0           # reported when thinking is enabled
+    chunk_tokens: int = 8             # tokens per streamed chunk
+    error_rate: float = 0.0           # share of calls answered with 429 RESOURCE_EXHAUSTED
+    retry_after: float = 2.0          # Retry-After seconds on injected 429s
+
+    def first_byte(self, rng: random.Random) -> float:
+        seconds = self.first_byte_ms / 1000
+        return seconds * math.exp(rng.gauss(0, self.latency_sigma)) if self.latency_sigma else seconds
+
+    def generation(self, tokens: int) -> float:
+        return tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+
+
+# First matching substring wins, so the specific families come before "flash" and "pro"
+DEFAULT_PROFILES: Dict[str, ModelProfile] = {
+    "tts": ModelProfile(first_byte_ms=600, tokens_per_second=40, output_tokens=12, chunk_tokens=2),
+    "embedding": ModelProfile(first_byte_ms=60, latency_sigma=0.2, tokens_per_second=0),
+    "image": ModelProfile(first_byte_ms=6000, latency_sigma=0.25, tokens_per_second=0, output_tokens=20),
+    "deep-research": ModelProfile(first_byte_ms=45000, latency_sigma=0.2, tokens_per_second=40, output_tokens=600),
+    "reasoning-engine": ModelProfile(first_byte_ms=2500, tokens_per_second=60, output_tokens=120),
+    "flash-lite": ModelProfile(first_byte_ms=250, tokens_per_second=250),
+    "flash": ModelProfile(first_byte_ms=450, tokens_per_second=180, output_tokens=80, thought_tokens=200),
+    "pro": ModelProfile(first_byte_ms=1800, tokens_per_second=80, output_tokens=160, thought_tokens=800),
+    "default": ModelProfile(),
+}
+
+
+class InjectedError(Exception):
+    """A simulated upstream 429."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Resource exhausted (stand-in injected 429)")
+        self.retry_after = retry_after
+
+
+def _seeded(*parts: Any) -> random.Random:
+    digest = hashlib.sha256(":".join(str(p) for p in parts).encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def text_of(value: Any) -> str:
+    """All text parts of a request value (contents, content, instances, input)."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return "\n".join(filter(None, (text_of(item) for item in value)))
+    if isinstance(value, dict):
+        if isinstance(value.get("text"), str):
+            return value["text"]
+        for key in ("parts", "content", "contents", "prompt", "input"):
+            if key in value:
+                return text_of(value[key])
+    return ""
+
+
+def count_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / 4))
+
+
+def error_body(code: int, status: str, message: str) -> Dict[str, Any]:
+    return {"error": {"code": code, "message": message, "status": status}}
+
+
+class VertexStandIn:
+    """Profiles, seeded randomness, call counters and in-flight Deep Research interactions."""
+
+    def __init__(self, profiles: Optional[Dict[str, ModelProfile]] = None, seed: int = STANDIN_SEED,
+                 time_scale: float = STANDIN_TIME_SCALE):
+        self.profiles = dict(DEFAULT_PROFILES) if profiles is None else profiles
+        self.seed = seed
+        self.time_scale = time_scale
+        self.calls: Dict[str, int] = {}
+        self.injected: Dict[str, int] = {}
+        self.interactions: Dict[str, Dict[str, Any]] = {}
+
+    def profile(self, model: str) -> ModelProfile:
+        name = model.lower()
+        for key, profile in self.profiles.items():
+            if key != "default" and key in name:
+                return profile
+        return self.profiles.get("default", ModelProfile())
+
+    def begin(self, model: str) -> Tuple[ModelProfile, random.Random]:
+        """Count a call and return its profile and per-call RNG; raises InjectedError for a simulated 429."""
+        index = self.calls.get(model, 0)
+        self.calls[model] = index + 1
+        profile = self.profile(model)
+        rng = _seeded(self.seed, model, index)
+        if profile.error_rate and rng.random() < profile.error_rate:
+            self.injected[model] = self.injected.get(model, 0) + 1
+            raise InjectedError(profile.retry_after)
+        return profile, rng
+
+    async def sleep(self, seconds: float):
+        if seconds > 0 and self.time_scale > 0:
+            await asyncio.sleep(seconds * self.time_scale)
+
+    # ── content ─────────────────────────────────────────────────────────────
+
+    def answer(self, model: str, prompt: str, tokens: int) -> List[str]:
+        """Deterministic answer words for (seed, model, prompt)."""
+        rng = _seeded(self.seed, model, prompt)
+        return [f"Stand-in {model.split('/')[-1]} answer:"] + [rng.choice(WORDS) for _ in range(max(0, tokens - 1))]
+
+    def embedding(self, model: str, text: str, dim: int) -> List[float]:
+        rng = _seeded(self.seed, model, "embed", text)
+        vector = [rng.gauss(0, 1) for _ in range(dim)]
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [round(v / norm, 6) for v in vector]
+
+    def pcm(self, model: str, text: str, tokens: int) -> bytes:
+        """Quiet deterministic tone, PCM_SECONDS_PER_TOKEN of 16-bit mono audio per token."""
+        frequency = 180 + _seeded(self.seed, model, text).randrange(200)
+        samples = int(PCM_RATE * PCM_SECONDS_PER_TOKEN * tokens)
+        return b"".join(struct.pack("<h", int(2000 * math.sin(2 * math.pi * frequency * i / PCM_RATE)))
+                        for i in range(samples))
+
+    @staticmethod
+    def usage(prompt: str, completion: int, thoughts: int) -> Dict[str, int]:
+        prompt_tokens = count_tokens(prompt)
+        usage = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": completion,
+                 "totalTokenCount": prompt_tokens + completion + thoughts}
+        if thoughts:
+            usage["thoughtsTokenCount"] = thoughts
+        return usage
+
+    # ── generateContent ─────────────────────────────────────────────────────
+
+    @staticmethod
+    def _generation_config(body: Dict[str, Any]) -> Dict[str, Any]:
+        return body.get("generationConfig") or body.get("generation_config") or {}
+
+    def _thoughts(self, profile: ModelProfile, config: Dict[str, Any]) -> int:
+        thinking = config.get("thinkingConfig") or {}
+        if not thinking or thinking.get("thinkingBudget") == 0:
+            return 0
+        budget = thinking.get("thinkingBudget")
+        return min(profile.thought_tokens, budget) if budget and budget > 0 else profile.thought_tokens
+
+    def plan(self, model: str, body: Dict[str, Any], profile: ModelProfile) -> Dict[str, Any]:
+        """What a generate call returns: modality, prompt text, token counts and the parts to send in order."""
+        config = self._generation_config(body)
+        prompt = text_of(body.get("contents"))
+        modalities = [m.upper() for m in config.get("responseModalities") or []]
+        tokens = profile.output_tokens
+        if config.get("maxOutputTokens"):
+            tokens = min(tokens, int(config["maxOutputTokens"]))
+        thoughts = self._thoughts(profile, config)
+        if "AUDIO" in modalities:
+            mime = f"audio/L16;codec=pcm;rate={PCM_RATE}"
+            audio = self.pcm(model, prompt, tokens)
+            step = int(PCM_RATE * 2 * PCM_SECONDS_PER_TOKEN * max(1, profile.chunk_tokens))
+            chunks = [{"inlineData": {"mimeType": mime, "data": base64.b64encode(audio[i:i + step]).decode()}}
+                      for i in range(0, len(audio), step)]
+        elif "IMAGE" in modalities:
+            chunks = [{"inlineData": {"mimeType": "image/png", "data": base64.b64encode(PNG_PIXEL).decode()}}]
+        else:
+            words = self.answer(model, prompt, tokens)
+            size = max(1, profile.chunk_tokens)
+            chunks = [{"text": " ".join(words[i:i + size]) + (" " if i + size < len(words) else "")}
+                      for i in range(0, len(words), size)]
+        thinking = (config.get("thinkingConfig") or {}).get("includeThoughts")
+        thought_parts = [{"text": f"Considering the request ({thoughts} thinking tokens).", "thought": True}] \
+            if thoughts and thinking else []
+        return {"prompt": prompt, "tokens": tokens, "thoughts": thoughts, "parts": thought_parts + chunks}
+
+    def response(self, model: str, parts: List[Dict[str, Any]], usage: Optional[Dict[str, int]] = None,
+                 finished: bool = True) -> Dict[str, Any]:
+        candidate: Dict[str, Any] = {"content": {"role": "model", "parts": parts}, "index": 0}
+        if finished:
+            candidate["finishReason"] = "STOP"
+        response = {"candidates": [candidate], "modelVersion": model, "responseId": uuid.uuid4().hex[:16]}
+        if usage:
+            response["usageMetadata"] = usage
+        return response
+
+    async def generate(self, model: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        profile, rng = self.begin(model)
+        plan = self.plan(model, body, profile)
+        await self.sleep(profile.first_byte(rng) + profile.generation(plan["tokens"] + plan["thoughts"]))
+        parts = plan["parts"]
+        if parts and "text" in parts[-1] and not parts[-1].get("thought"):
+            # One text part for the whole answer, like the real unary response
+            text = "".join(p["text"] for p in parts if not p.get("thought"))
+            parts = [p for p in parts if p.get("thought")] + [{"text": text}]
+        elif parts and "inlineData" in parts[0] and len(parts) > 1:
+            data = b"".join(base64.b64decode(p["inlineData"]["data"]) for p in parts)
+            parts = [{"inlineData": {"mimeType": parts[0]["inlineData"]["mimeType"],
+                                     "data": base64.b64encode(data).decode()}}]
+        return self.response(model, parts, self.usage(plan["prompt"], plan["tokens"], plan["thoughts"]))
+
+    async def stream(self, model: str, body: Dict[str, Any], profile: ModelProfile, rng: random.Random):
+        """SSE chunks at the profile's cadence; usage and finishReason ride on the last one."""
+        plan = self.plan(model, body, profile)
+        await self.sleep(profile.first_byte(rng) + profile.generation(plan["thoughts"]))
+        parts = plan["parts"]
+        for index, part in enumerate(parts):
+            if index:
+                await self.sleep(profile.generation(max(1, profile.chunk_tokens)))
+            last = index == len(parts) - 1
+            usage = self.usage(plan["prompt"], plan["tokens"], plan["thoughts"]) if last else None
+            yield f"data: {json.dumps(self.response(model, [part], usage, finished=last))}\r\n\r\n"
+
+    # ── embeddings ──────────────────────────────────────────────────────────
+
+    async def predict(self, model: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        profile, rng = self.begin(model)
+        await self.sleep(profile.first_byte(rng))
+        dim = (body.get("parameters") or {}).get("outputDimensionality") or EMBED_DIM
+        predictions = []
+        for instance in body.get("instances") or []:
+            text = text_of(instance)
+            predictions.append({"embeddings": {"values": self.embedding(model, text, dim),
+                                               "statistics": {"token_count": count_tokens(text), "truncated": False}}})
+        return {"predictions": predictions, "metadata": {"billableCharacterCount": len(text_of(body["instances"]))}}
+
+    async def embed_content(self, model: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        profile, rng = self.begin(model)
+        await self.sleep(profile.first_byte(rng))
+        dim = body.get("outputDimensionality") or (body.get("embedContentConfig") or {}).get("outputDimensionality") \
+            or EMBED_DIM
+        text = text_of(body.get("content"))
+        return {"embedding": {"values": self.embedding(model, text, dim)},
+                "usageMetadata": {"promptTokenCount": count_tokens(text)}}
+
+    async def batch_embed_contents(self, model: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        profile, rng = self.begin(model)
+        await self.sleep(profile.first_byte(rng))
+        embeddings = []
+        for request in body.get("requests") or []:
+            dim = request.get("outputDimensionality") or EMBED_DIM
+            embeddings.append({"values": self.embedding(model, text_of(request.get("content")), dim)})
+        return {"embeddings": embeddings}
+
+    # ── Reasoning Engine ────────────────────────────────────────────────────
+
+    async def engine_query(self, engine: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        model = f"reasoning-engine/{engine}"
+        profile, rng = self.begin(model)
+        prompt = text_of(body.get("input"))
+        await self.sleep(profile.first_byte(rng) + profile.generation(profile.output_tokens))
+        return {"output": " ".join(self.answer(model, prompt, profile.output_tokens))}
+
+    # ── Deep Research interactions ──────────────────────────────────────────
+
+    def create_interaction(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        agent = body.get("agent") or body.get("model") or "deep-research"
+        profile, rng = self.begin(agent)
+        interaction_id = f"standin-{uuid.uuid4().hex[:20]}"
+        duration = profile.first_byte(rng) + profile.generation(profile.output_tokens)
+        now = _now_iso()
+        self.interactions[interaction_id] = {
+            "record": {"id": interaction_id, "agent": agent, "status": "in_progress", "created": now, "updated": now,
+                       "role": "agent", "outputs": []},
+            "prompt": text_of(body.get("input")),
+            "profile": profile,
+            "started": time.monotonic(),
+            "duration": duration * self.time_scale,
+        }
+        return self.interaction(interaction_id)
+
+    def interaction(self, interaction_id: str) -> Optional[Dict[str, Any]]:
+        """Current state: thought summaries accrue over the run, the report appears at the end."""
+        entry = self.interactions.get(interaction_id)
+        if entry is None:
+            return None
+        record = entry["record"]
+        if record["status"] != "in_progress":
+            return record
+        progress = (time.monotonic() - entry["started"]) / entry["duration"] if entry["duration"] else 1.0
+        thoughts = [{"type": "thought", "summary": [{"type": "text", "text": f"Research step {step + 1}: gathering sources."}]}
+                    for step in range(min(4, int(progress * 5)))]
+        record["outputs"] = thoughts
+        if progress >= 1.0:
+            profile = entry["profile"]
+            words = self.answer(record["agent"], entry["prompt"], profile.output_tokens)
+            record["outputs"] = thoughts + [{"type": "text", "text": " ".join(words)}]
+            record["status"] = "completed"
+            prompt_tokens = count_tokens(entry["prompt"])
+            record["usage"] = {"total_input_tokens": prompt_tokens, "total_output_tokens": profile.output_tokens,
+                               "total_tokens": prompt_tokens + profile.output_tokens}
+        record["updated"] = _now_iso()
+        return record
+
+    def cancel_interaction(self, interaction_id: str) -> Optional[Dict[str, Any]]:
+        record = self.interaction(interaction_id)
+        if record is not None and record["status"] == "in_progress":
+            record["status"] = "cancelled"
+        return record
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "seed": self.seed,
+            "time_scale": self.time_scale,
+            "calls": dict(sorted(self.calls.items())),
+            "injected_429": dict(sorted(self.injected.items())),
+            "interactions": len(self.interactions),
+            "profiles": {name: asdict(profile) for name, profile in self.profiles.items()},
+        }
+
+
+def load_profiles(path: Optional[str]) -> Tuple[Dict[str, ModelProfile], Optional[int]]:
+    """Built-in profiles overlaid with a JSON profile file; returns (profiles, seed from the file)."""
+    profiles = dict(DEFAULT_PROFILES)
+    if not path:
+        return profiles, None
+    with open(path, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    known = {field.name for field in fields(ModelProfile)}
+    overrides = {}
+    for name, values in (spec.get("models") or {}).items():
+        unknown = set(values) - known
+        if unknown:
+            raise ValueError(f"{path}: unknown profile fields for {name!r}: {sorted(unknown)}")
+        overrides[name] = replace(profiles.get(name, profiles["default"]), **values)
+    # File entries are matched first, then the remaining built-in families
+    return {**overrides, **{k: v for k, v in profiles.items() if k not in overrides}}, spec.get("seed")
+
+
+def build_app(standin: Optional[VertexStandIn] = None) -> FastAPI:
+    standin = standin or VertexStandIn()
+    app = FastAPI(title="Vertex AI stand-in")
+    app.state.standin = standin
+
+    def failure(e: Exception) -> JSONResponse:
+        if isinstance(e, InjectedError):
+            return JSONResponse(status_code=429, content=error_body(429, "RESOURCE_EXHAUSTED", str(e)),
+                                headers={"Retry-After": f"{e.retry_after:g}"})
+        return JSONResponse(status_code=400, content=error_body(400, "INVALID_ARGUMENT", str(e)))
+
+    @app.get("/standin/stats")
+    async def standin_stats():
+        return standin.stats()
+
+    @app.api_route("/{path:path}", methods=["GET", "POST"])
+    async def dispatch(path: str, request: Request):
+        body = await request.json() if request.method == "POST" and await request.body() else {}
+        resource, _, method = path.rpartition(":") if ":" in path.rsplit("/", 1)[-1] else (path, "", "")
+        segments = resource.split("/")
+        try:
+            if method and "models" in segments:
+                model = segments[segments.index("models") + 1]
+                if method == "generateContent":
+                    return await standin.generate(model, body)
+                if method == "streamGenerateContent":
+                    profile, rng = standin.begin(model)  # a 429 must arrive as a status, not mid-stream
+                    return StreamingResponse(standin.stream(model, body, profile, rng), media_type="text/event-stream")
+                if method == "predict":
+                    return await standin.predict(model, body)
+                if method == "embedContent":
+                    return await standin.embed_content(model, body)
+                if method == "batchEmbedContents":
+                    return await standin.batch_embed_contents(model, body)
+            if method == "query" and "reasoningEngines" in segments:
+                return await standin.engine_query(segments[segments.index("reasoningEngines") + 1], body)
+            if "interactions" in segments:
+                index = segments.index("interactions")
+                if request.method == "POST" and index == len(segments) - 1:
+                    return standin.create_interaction(body)
+                interaction_id = segments[index + 1] if index + 1 < len(segments) else ""
+                if segments[-1] == "cancel":
+                    record = standin.cancel_interaction(interaction_id)
+                else:
+                    record = standin.interaction(interaction_id)
+                if record is None:
+                    return JSONResponse(status_code=404,
+                                        content=error_body(404, "NOT_FOUND", f"Interaction {interaction_id} not found"))
+                return record
+        except Exception as e:
+            return failure(e)
+        return JSONResponse(status_code=404, content=error_body(404, "NOT_FOUND", f"Stand-in has no route for {path}"))
+
+    return app
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=STANDIN_HOST)
+    parser.add_argument("--port", type=int, default=STANDIN_PORT)
+    parser.add_argument("--profile", default=STANDIN_PROFILE, help="JSON profile overrides")
+    parser.add_argument("--seed", type=int, help="overrides the profile file and BANDIT_STANDIN_SEED")
+    parser.add_argument("--time-scale", type=float, default=STANDIN_TIME_SCALE,
+                        help="multiplier on every simulated delay (0 = no delays)")
+    parser.add_argument("--error-rate", type=float, help="429 rate applied to every model")
+    args = parser.parse_args(argv)
+
+    profiles, file_seed = load_profiles(args.profile)
+    if args.error_rate is not None:
+        profiles = {name: replace(profile, error_rate=args.error_rate) for name, profile in profiles.items()}
+    seed = args.seed if args.seed is not None else file_seed if file_seed is not None else STANDIN_SEED
+    standin = VertexStandIn(profiles, seed=seed, time_scale=args.time_scale)
+    print(f"[STANDIN] Vertex AI stand-in on http://{args.host}:{args.port} (seed {seed}, time scale {args.time_scale})")
+    uvicorn.run(build_app(standin), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
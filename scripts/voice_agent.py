@@ -9,6 +9,11 @@ import io
 import wave
 import sys
 
+try:
+    from credential_broker import get_broker
+except ImportError:
+    from scripts.credential_broker import get_broker
+
 # Configuration
 API_KEY = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
 MODEL_CHAT = "gemini-2.5-flash-lite"  # Fastest, cheapest for chat
@@ -72,12 +77,13 @@ def initialize_client():
     project = os.environ.get("GOOGLE_CLOUD_PROJECT") or os.environ.get("GCP_PROJECT")
     if project:
         print(f"☁️  Using Vertex AI authentication (project: {project})")
-        return genai.Client(vertexai=True, project=project, location="global")
+        return genai.Client(vertexai=True, project=project, location="global",
+                            credentials=get_broker().try_credentials())
     
     # Fallback: Try Vertex AI with default project
     try:
         print("☁️  Using Vertex AI with default credentials")
-        return genai.Client(vertexai=True, location="global")
+        return genai.Client(vertexai=True, location="global", credentials=get_broker().try_credentials())
     except Exception as e:
         print(f"❌ Auth error: {e}")
         print("Set GEMINI_API_KEY or run: gcloud auth application-default login")
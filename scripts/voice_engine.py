@@ -42,6 +42,11 @@ from rich import box
 from google import genai
 from google.genai import types
 
+try:
+    from credential_broker import get_broker
+except ImportError:
+    from scripts.credential_broker import get_broker
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONFIGURATION
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -711,10 +716,11 @@ def initialize_client() -> genai.Client:
     project = os.environ.get("GOOGLE_CLOUD_PROJECT") or os.environ.get("GCP_PROJECT")
     if project:
         print(f"[*] Using Vertex AI (project: {project})")
-        return genai.Client(vertexai=True, project=project, location="global")
+        return genai.Client(vertexai=True, project=project, location="global",
+                            credentials=get_broker().try_credentials())
     
     print("[*] Using Vertex AI with default credentials")
-    return genai.Client(vertexai=True, location="global")
+    return genai.Client(vertexai=True, location="global", credentials=get_broker().try_credentials())
 
 
 async def main():
@@ -41,6 +41,11 @@ from google.api_core.client_options import ClientOptions
 from google import genai
 from google.genai import types
 
+try:
+    from credential_broker import get_broker
+except ImportError:
+    from scripts.credential_broker import get_broker
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONFIGURATION
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -205,6 +210,7 @@ class ChirpSTTService:
     """Google Cloud Speech-to-Text v2 (Chirp)."""
     def __init__(self, project_id: str, location: str):
         self.client = speech_v2.SpeechClient(
+            credentials=get_broker().try_credentials(),
             client_options=ClientOptions(api_endpoint=f"{location}-speech.googleapis.com")
         )
         self.project_id = project_id
@@ -260,7 +266,7 @@ class ChirpSTTService:
 class ChirpTTSService:
     """Google Cloud Text-to-Speech (Chirp HD)."""
     def __init__(self, voice_name: str = DEFAULT_VOICE):
-        self.client = texttospeech.TextToSpeechClient()
+        self.client = texttospeech.TextToSpeechClient(credentials=get_broker().try_credentials())
         self.voice_name = voice_name
         self.voice_params = texttospeech.VoiceSelectionParams(
             language_code=TTS_LANGUAGE,
@@ -425,8 +431,9 @@ def initialize_client() -> genai.Client:
     api_key = os.environ.get("GEMINI_API_KEY")
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
     if api_key: return genai.Client(api_key=api_key)
-    if project: return genai.Client(vertexai=True, project=project, location="global")
-    return genai.Client(vertexai=True, location="global")
+    credentials = get_broker().try_credentials()
+    if project: return genai.Client(vertexai=True, project=project, location="global", credentials=credentials)
+    return genai.Client(vertexai=True, location="global", credentials=credentials)
 
 async def main():
     parser = argparse.ArgumentParser(description="Bandit Hi-Fi Voice Engine")
@@ -23,6 +23,11 @@ import warnings
 from google import genai
 from google.genai import types
 
+try:
+    from credential_broker import get_broker
+except ImportError:
+    from scripts.credential_broker import get_broker
+
 # Suppress deprecation warnings for cleaner output
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
@@ -131,10 +136,11 @@ def initialize_client() -> genai.Client:
     project = os.environ.get("GOOGLE_CLOUD_PROJECT") or os.environ.get("GCP_PROJECT")
     if project:
         print(f"[*] Using Vertex AI (project: {project})")
-        return genai.Client(vertexai=True, project=project, location="global")
+        return genai.Client(vertexai=True, project=project, location="global",
+                            credentials=get_broker().try_credentials())
     
     print("[*] Using Vertex AI with default credentials")
-    return genai.Client(vertexai=True, location="global")
+    return genai.Client(vertexai=True, location="global", credentials=get_broker().try_credentials())
 
 
 async def live_mode(voice: str = BANDIT_VOICE):
@@ -48,6 +48,16 @@ except ImportError:
 from google import genai
 from google.genai import types
 
+try:
+    from credential_broker import get_broker
+except ImportError:
+    from scripts.credential_broker import get_broker
+
+try:
+    from model_router import ModelRouter
+except ImportError:
+    from scripts.model_router import ModelRouter
+
 # Voice Search & Home Automation
 try:
     from voice_search import VoiceAISearchEngine
@@ -369,12 +379,8 @@ class ElgatoService:
         # Map 0.0-1.0 to 0-32768
         return int(self.current_level * 32768)
 
-async def with_retry(fn, max_attempts=3, base_delay=1.0):
-    for attempt in range(max_attempts):
-        try: return await fn()
-        except Exception:
-            if attempt == max_attempts - 1: raise
-            await asyncio.sleep(base_delay * (2 ** attempt))
+# Shared breakers: once a model is failing, turns skip it instead of retrying into it
+ROUTER = ModelRouter()
 
 class TTSService:
     def __init__(self, client, mic_service, barge_threshold=6000):
@@ -834,7 +840,7 @@ class ConversationManager:
             print(f"\n[FAST] Routing: {text[:50]}...")
             # 15s Timeout to prevent 'Stuck' state
             resp = await asyncio.wait_for(
-                with_retry(lambda: self.client.aio.models.generate_content(model=MODEL_FAST, contents=self.history, config=self.fast)),
+                ROUTER.call(MODEL_FAST, lambda: self.client.aio.models.generate_content(model=MODEL_FAST, contents=self.history, config=self.fast)),
                 timeout=15.0
             )
             router = resp.parsed
@@ -856,11 +862,16 @@ class ConversationManager:
         return router.reply, router.requires_deep_reasoning, deep
 
     async def _invoke_deep(self, query: str) -> str:
-        chat = self.client.aio.chats.create(model=MODEL_DEEP, history=self.history[:-1], config=self.deep)
         prompt = f"Deep Task: {query}"
         self.stats.add_usage(MODEL_DEEP, input_units=len(prompt)//4)
+        
+        async def start(model):
+            chat = self.client.aio.chats.create(model=model, history=self.history[:-1], config=self.deep)
+            return chat, await chat.send_message(prompt)
+        
         try:
-            resp = await with_retry(lambda: chat.send_message(prompt))
+            # Deep model first, the fast model when its breaker is open or it keeps failing
+            model, (chat, resp) = await ROUTER.run([(m, lambda m=m: start(m)) for m in (MODEL_DEEP, MODEL_FAST)])
             turns = 0
             while resp.function_calls and turns < 5:
                 turns += 1; parts = []
@@ -869,10 +880,10 @@ class ConversationManager:
                     res = await self._exec(call)
                     print(f"[DEEP] Observation: {str(res)[:100]}...")
                     parts.append(types.Part(function_response=types.FunctionResponse(name=call.name, response={"result": res})))
-                resp = await with_retry(lambda: chat.send_message(parts))
+                resp = await ROUTER.call(model, lambda: chat.send_message(parts))
             txt = resp.text or "Done."
             print(f"[DEEP] Final Thought: {txt[:100]}...")
-            self.stats.add_usage(MODEL_DEEP, output_units=len(txt)//4)
+            self.stats.add_usage(model, output_units=len(txt)//4)
             self.history.append(types.Content(role="model", parts=[types.Part(text=txt)]))
             return txt
         except Exception as e: 
@@ -979,7 +990,8 @@ class BanditVoiceEngine:
         self.state = AtomicState()
         self.stats = SessionStats()
         self.audio_cfg = AudioConfig()
-        self.client = genai.Client(vertexai=True, project=os.environ.get("GOOGLE_CLOUD_PROJECT"), location="global")
+        self.client = genai.Client(vertexai=True, project=os.environ.get("GOOGLE_CLOUD_PROJECT"), location="global",
+                                   credentials=get_broker().try_credentials())
         global SEARCH_ENGINE
         if VoiceAISearchEngine: SEARCH_ENGINE = VoiceAISearchEngine(client=self.client)
         
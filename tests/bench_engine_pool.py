@@ -0,0 +1,161 @@
+"""
+Micro-benchmark: pooled keep-alive engine client vs a new connection per call.
+
+Starts a local HTTPS stand-in for the Reasoning Engine `:query` endpoint
+(self-signed cert, HTTP/1.1 keep-alive) and counts TLS handshakes so the
+connection-reuse win is visible without touching GCP.
+
+    python tests/bench_engine_pool.py --calls 200 --setup-delay-ms 20
+
+--setup-delay-ms adds a per-connection delay on the server to approximate
+WAN handshake round trips (localhost TLS is nearly free).
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import ssl
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from scripts import engine_client
+
+
+def make_self_signed_cert(directory: str):
+    """Write a localhost cert/key pair and return their paths."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers `:query` like the Reasoning Engine, keeping the connection open."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # otherwise delayed ACKs dominate keep-alive latency
+    setup_delay = 0.0
+    handshakes = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        with StandInHandler.lock:
+            StandInHandler.handshakes += 1
+        if self.setup_delay:
+            time.sleep(self.setup_delay)
+        super().setup()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt = body.get("input", {}).get("prompt", "")
+        payload = json.dumps({"output": f"echo: {prompt}"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stand_in(cert_path: str, key_path: str):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def summarize(label: str, samples, handshakes: int) -> dict:
+    ordered = sorted(samples)
+    return {
+        "client": label,
+        "calls": len(samples),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 2),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        "handshakes": handshakes,
+    }
+
+
+async def bench_async(endpoint: str, verify: ssl.SSLContext, calls: int, concurrency: int, pooled: bool):
+    StandInHandler.handshakes = 0
+    shared = engine_client.build_async_client(verify=verify) if pooled else None
+    samples = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            if pooled:
+                await engine_client.query_async(endpoint, f"q{i}", "token", deadline=10, client=shared)
+            else:
+                async with engine_client.build_async_client(verify=verify) as client:
+                    await engine_client.query_async(endpoint, f"q{i}", "token", deadline=10, client=client)
+            samples.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    if shared:
+        await shared.aclose()
+    return summarize("pooled" if pooled else "per-call", samples, StandInHandler.handshakes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--setup-delay-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    StandInHandler.setup_delay = args.setup_delay_ms / 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_path, key_path = make_self_signed_cert(tmp)
+        server = start_stand_in(cert_path, key_path)
+        endpoint = f"https://localhost:{server.server_address[1]}/v1beta1/reasoningEngines/bench:query"
+        verify = ssl.create_default_context(cafile=cert_path)
+        try:
+            results = [
+                asyncio.run(bench_async(endpoint, verify, args.calls, args.concurrency, pooled=False)),
+                asyncio.run(bench_async(endpoint, verify, args.calls, args.concurrency, pooled=True)),
+            ]
+        finally:
+            server.shutdown()
+
+    print(f"{'client':<10} {'calls':>6} {'mean_ms':>9} {'p50_ms':>8} {'p95_ms':>8} {'handshakes':>11}")
+    for r in results:
+        print(f"{r['client']:<10} {r['calls']:>6} {r['mean_ms']:>9} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['handshakes']:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Micro-benchmark: proxy routing via PromptClassifier vs the per-pattern scans it replaced.
+
+Builds long multimodal-style prompts (pasted documents, code, OCR'd image text
+and inline base64 image data) and times, per prompt, the proxy's routing
+decisions: detect_deep_thinking + detect_god_level_domain.
+
+The legacy implementation is copied verbatim below; every prompt is also
+checked for identical decisions. The seven deep-think re.search calls are where
+the single pass pays off. Plain keyword lists gain nothing from it: `kw in prompt`
+runs at memchr speed and stops at the first hit, which is why
+HQ/memory/bandit_tools.py and scripts/deploy_reasoning_engine.py keep their
+own scans (the classifier measured 0.76x-0.97x there).
+
+    python tests/bench_prompt_classifier.py --sizes 2000 10000 50000 --repeat 20
+"""
+import argparse
+import base64
+import contextlib
+import io
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import proxy_server
+
+# ── legacy implementations (before the classifier) ─────────────────────────────
+
+LEGACY_DEEP_THINK_PATTERNS = [
+    r'\bthink\s*(harder|deeply|more)\b',
+    r'\bdeep\s*think\b',
+    r'\bultra\s*think\b',
+    r'\breason\s*(through|about|deeply)\b',
+    r'\banalyze\s*(carefully|deeply|thoroughly)\b',
+    r'\btake\s*your\s*time\b',
+    r'\bcareful(ly)?\s*consider\b',
+]
+
+
+def legacy_detect_deep_thinking(prompt):
+    prompt_lower = prompt.lower()
+    for pattern in LEGACY_DEEP_THINK_PATTERNS:
+        if re.search(pattern, prompt_lower, re.IGNORECASE):
+            return True
+    return False
+
+
+def legacy_proxy_domain(prompt):
+    prompt_lower = prompt.lower()
+    for domain_key, domain_info in proxy_server.GOD_LEVEL_DOMAINS.items():
+        if any(kw in prompt_lower for kw in domain_info["keywords"]):
+            return domain_info
+    return None
+
+
+def legacy_proxy(prompt):
+    return legacy_detect_deep_thinking(prompt), legacy_proxy_domain(prompt)
+
+
+def classifier_proxy(prompt):
+    proxy_server.classify_prompt.cache_clear()  # time the scan, not the lru_cache
+    return proxy_server.detect_deep_thinking(prompt), proxy_server.detect_god_level_domain(prompt)
+
+
+# ── workload ───────────────────────────────────────────────────────────────────
+
+FILLER = (
+    "The quarterly report covers revenue, churn and hiring across three regions. "
+    "Figure 2 shows the onboarding funnel; the drop after step four is unexplained. "
+    "def merge(a, b):\n    return sorted(a + b)\n"
+    "OCR from attached screenshot: Invoice #4471 Total 1,280.00 EUR Due 2026-11-01\n"
+)
+ASKS = [
+    "Please think harder about the tradeoffs here.",
+    "Can you summarize the sentiment of these customer notes?",
+    "Detect objects in the photo and describe the segmentation masks.",
+    "What is the latest news on this vendor?",
+    "Draw a diagram of the pipeline.",
+    "Reason through the failure modes step by step.",
+    "thanks",
+]
+
+
+def make_prompt(rng, size):
+    """Text, code and OCR'd content interleaved with inline image data up to `size` chars."""
+    parts = [rng.choice(ASKS)]
+    while sum(map(len, parts)) < size:
+        if rng.random() < 0.25:
+            blob = base64.b64encode(rng.randbytes(rng.randint(300, 1500))).decode()
+            parts.append(f"[image/png;base64,{blob}]")
+        else:
+            parts.append(FILLER)
+    parts.append(rng.choice(ASKS))
+    return "\n".join(parts)[:max(size, 1)]
+
+
+def time_route(fn, prompts, repeat):
+    samples = []
+    for _ in range(repeat):
+        for prompt in prompts:
+            start = time.perf_counter()
+            fn(prompt)
+            samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.mean(samples) * 1e6, samples[int(len(samples) * 0.95)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2000, 10000, 50000])
+    parser.add_argument("--prompts", type=int, default=20, help="prompts per size")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    prompts_by_size = {size: [make_prompt(rng, size) for _ in range(args.prompts)] for size in args.sizes}
+    short = ["hi", "Think  harder", "rethinking more broadly", "take your\ttime with the contract"]
+
+    mismatches = 0
+    for prompt in short + [p for prompts in prompts_by_size.values() for p in prompts]:
+        if legacy_proxy(prompt) != classifier_proxy(prompt):
+            mismatches += 1
+            print(f"MISMATCH: {prompt[:80]!r}")
+
+    print(f"{'size':>7} {'legacy_us':>10} {'legacy_p95':>11} {'single_us':>10} {'single_p95':>11} {'speedup':>8}")
+    for size, prompts in prompts_by_size.items():
+        legacy_mean, legacy_p95 = time_route(legacy_proxy, prompts, args.repeat)
+        single_mean, single_p95 = time_route(classifier_proxy, prompts, args.repeat)
+        print(f"{size:>7} {legacy_mean:>10.1f} {legacy_p95:>11.1f} {single_mean:>10.1f} "
+              f"{single_p95:>11.1f} {legacy_mean / single_mean:>7.2f}x")
+    print(f"decision mismatches: {mismatches}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
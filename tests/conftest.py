@@ -0,0 +1,51 @@
+"""pytest hooks: record/replay cassettes for google-genai calls (see genai_cassette.py).
+
+    BANDIT_CASSETTE_MODE=replay python -m pytest tests/year5      # offline, seconds
+    python -m pytest tests/year5 --cassette-mode record            # fill in missing cassettes
+    python -m pytest tests/year5 --cassette-mode rerecord          # refresh them all
+"""
+
+import time
+
+import pytest
+
+from genai_cassette import CASSETTE_MODE, MODES, CassetteRecorder, install
+
+RECORDER = CassetteRecorder("off")
+
+
+def pytest_addoption(parser):
+    parser.addoption("--cassette-mode", choices=MODES, default=CASSETTE_MODE,
+                     help="record/replay google-genai traffic (default: BANDIT_CASSETTE_MODE or off)")
+
+
+def pytest_configure(config):
+    RECORDER.mode = config.getoption("--cassette-mode")
+    if RECORDER.enabled:
+        # Before collection, so module-level and session-scoped clients are covered
+        config.add_cleanup(install(RECORDER))
+        config.add_cleanup(RECORDER.eject)
+
+
+def pytest_collection_modifyitems(items):
+    if RECORDER.mode != "replay":
+        return
+    # The curriculum modules pace live calls with API_CALL_DELAY; replayed calls need no pacing
+    for module in {item.module for item in items if getattr(item, "module", None)}:
+        if hasattr(module, "API_CALL_DELAY"):
+            module.API_CALL_DELAY = 0
+
+
+@pytest.fixture(autouse=True)
+def genai_cassette(request, monkeypatch):
+    """Load the test's cassette (saved afterwards when recording); replay also skips in-test sleeps."""
+    if not RECORDER.enabled:
+        yield None
+        return
+    cassette = RECORDER.use(request.node.nodeid)
+    if RECORDER.mode == "replay":
+        monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    try:
+        yield cassette
+    finally:
+        RECORDER.eject()
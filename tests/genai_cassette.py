@@ -0,0 +1,276 @@
+"""Record/replay cassettes for google-genai clients.
+
+The curriculum suites (tests/year1 .. tests/year12) call live Gemini and
+sleep up to 20 s between tests, so a full run takes hours. This module sits
+at the httpx transport layer underneath `genai.Client`, for sync calls and
+`client.aio` alike. It stores each request/response pair in a gzip-compressed
+JSON cassette, keyed by a hash of the normalized request.
+
+The normalized request is the method, the URL path with the project
+replaced by a placeholder, the sorted query (minus `key`), the canonical
+JSON body (or a hash of a binary body) and the resumable-upload command
+header. Auth and SDK version headers are not part of the key, so cassettes
+recorded with one project or credential replay under another. Streaming
+responses are recorded as their full SSE body, so every chunk replays in
+order. Identical requests made several times in one test replay their
+recorded responses in sequence.
+
+Modes (BANDIT_CASSETTE_MODE or pytest --cassette-mode):
+
+- off       live calls, nothing recorded (default)
+- replay    cassettes only: no network, no sleeps. A request that was never
+            recorded fails with CassetteMiss
+- record    replay what is recorded, go live for the rest and save it
+- rerecord  ignore existing cassettes, go live for everything and overwrite
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode
+
+import httpx
+
+MODES = ("off", "replay", "record", "rerecord")
+CASSETTE_MODE = os.getenv("BANDIT_CASSETTE_MODE", "off")
+CASSETTE_DIR = Path(os.getenv("BANDIT_CASSETTE_DIR", Path(__file__).resolve().parent / "cassettes"))
+CASSETTE_VERSION = 1
+REPLAY_TOKEN = "cassette-replay"
+PROJECT_RE = re.compile(r"/projects/[^/]+/")
+# Recomputed by httpx on replay, or meaningless once the body is stored decoded
+DROPPED_RESPONSE_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "set-cookie"}
+KEY_HEADERS = ("x-goog-upload-command", "x-goog-upload-protocol")
+
+
+class CassetteMiss(httpx.TransportError):
+    """Replay mode met a request the cassette has no recording for."""
+
+
+def request_key(request: httpx.Request) -> str:
+    return hashlib.sha256(canonical_request(request).encode()).hexdigest()[:32]
+
+
+def canonical_request(request: httpx.Request) -> str:
+    """Stable text form of a request: what has to match for a recording to apply."""
+    path = PROJECT_RE.sub("/projects/{project}/", request.url.path)
+    query = sorted((k, v) for k, v in parse_qsl(request.url.query.decode()) if k != "key")
+    body = request.content or b""
+    try:
+        body_text = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")) if body else ""
+    except ValueError:
+        body_text = "sha256:" + hashlib.sha256(body).hexdigest()
+    headers = ",".join(f"{name}={request.headers[name]}" for name in KEY_HEADERS if name in request.headers)
+    return "\n".join((request.method, path, urlencode(query), headers, body_text))
+
+
+def _encode_body(body: bytes) -> Dict[str, str]:
+    try:
+        return {"encoding": "utf-8", "body": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"encoding": "base64", "body": base64.b64encode(body).decode()}
+
+
+def _decode_body(entry: Dict[str, str]) -> bytes:
+    if entry.get("encoding") == "base64":
+        return base64.b64decode(entry["body"])
+    return entry["body"].encode("utf-8")
+
+
+class Cassette:
+    """Recorded interactions of one test, loaded from and saved to a .json.gz file."""
+
+    def __init__(self, path: Path, mode: str):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r} (expected one of {', '.join(MODES)})")
+        self.path = Path(path)
+        self.mode = mode
+        self.interactions: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.dirty = False
+        self.replayed = 0
+        self.recorded = 0
+        if mode in ("replay", "record") and self.path.exists():
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"{self.path}: cassette version {data.get('version')} != {CASSETTE_VERSION}, re-record it")
+            self.interactions = data["interactions"]
+
+    def next_response(self, key: str) -> Optional[httpx.Response]:
+        """The next recorded response for `key` (the last one repeats), or None if none was recorded."""
+        with self._lock:
+            recordings = self.interactions.get(key)
+            if not recordings:
+                return None
+            index = self._served.get(key, 0)
+            self._served[key] = index + 1
+            if index >= len(recordings) and self.mode == "record":
+                return None  # a new repeat of this request: record it
+            recorded = recordings[min(index, len(recordings) - 1)]["response"]
+            self.replayed += 1
+        return httpx.Response(recorded["status"], headers=recorded["headers"], content=_decode_body(recorded))
+
+    def record(self, key: str, request: httpx.Request, status: int, headers: httpx.Headers, body: bytes):
+        entry = {
+            "request": {"method": request.method, "path": request.url.path, **_encode_body(request.content or b"")},
+            "response": {"status": status,
+                         "headers": [[k, v] for k, v in headers.items() if k.lower() not in DROPPED_RESPONSE_HEADERS],
+                         **_encode_body(body)},
+        }
+        with self._lock:
+            self.interactions.setdefault(key, []).append(entry)
+            self._served[key] = len(self.interactions[key])
+            self.dirty = True
+            self.recorded += 1
+
+    def save(self):
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump({"version": CASSETTE_VERSION, "interactions": self.interactions}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+class CassetteRecorder:
+    """Holds the active cassette; shared by every transport, so session-scoped clients follow each test."""
+
+    def __init__(self, mode: str = CASSETTE_MODE, directory: Path = CASSETTE_DIR):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r} (expected one of {', '.join(MODES)})")
+        self.mode = mode
+        self.directory = Path(directory)
+        self.cassette: Optional[Cassette] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def path_for(self, test_id: str) -> Path:
+        """tests/year5/test_x.py::TestA::test_001 -> <dir>/year5/test_x/TestA__test_001.json.gz"""
+        file_part, _, name = test_id.partition("::")
+        file_path = Path(file_part)
+        parts = file_path.parts[1:] if file_path.parts and file_path.parts[0] == "tests" else file_path.parts
+        name = re.sub(r"[^\w.-]+", "_", name.replace("::", "__")) or "module"
+        return self.directory.joinpath(*parts[:-1], file_path.stem, f"{name}.json.gz")
+
+    def use(self, test_id: str) -> Cassette:
+        self.eject()
+        self.cassette = Cassette(self.path_for(test_id), self.mode)
+        return self.cassette
+
+    def eject(self):
+        if self.cassette is not None:
+            self.cassette.save()
+            self.cassette = None
+
+    def lookup(self, request: httpx.Request) -> tuple:
+        """(key, recorded response or None); raises CassetteMiss when replaying without a recording."""
+        key = request_key(request)
+        cassette = self.cassette
+        if cassette is None:
+            if self.mode == "replay":
+                raise CassetteMiss(f"No cassette is active for {request.method} {request.url.path}", request=request)
+            return key, None
+        response = cassette.next_response(key) if self.mode != "rerecord" else None
+        if response is None and self.mode == "replay":
+            raise CassetteMiss(
+                f"No recording for {request.method} {request.url.path} (key {key}) in {cassette.path}; "
+                f"record it with BANDIT_CASSETTE_MODE=record", request=request)
+        return key, response
+
+    def store(self, key: str, request: httpx.Request, response: httpx.Response, body: bytes):
+        if self.cassette is not None:
+            self.cassette.record(key, request, response.status_code, response.headers, body)
+
+
+class CassetteTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """httpx transport that replays from the recorder and records live responses (sync and async)."""
+
+    def __init__(self, recorder: CassetteRecorder, live: Any = None):
+        self.recorder = recorder
+        # Where misses go when recording; one transport may serve both (e.g. httpx.MockTransport)
+        self._sync = live
+        self._async = live
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        key, replayed = self.recorder.lookup(request)
+        if replayed is not None:
+            return replayed
+        self._sync = self._sync or httpx.HTTPTransport()
+        live = self._sync.handle_request(request)
+        try:
+            body = live.read()  # streams are buffered whole: the SSE chunks are all in the body
+        finally:
+            live.close()
+        return self._keep(key, request, live, body)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        key, replayed = self.recorder.lookup(request)
+        if replayed is not None:
+            return replayed
+        self._async = self._async or httpx.AsyncHTTPTransport()
+        live = await self._async.handle_async_request(request)
+        try:
+            body = await live.aread()
+        finally:
+            await live.aclose()
+        return self._keep(key, request, live, body)
+
+    def _keep(self, key: str, request: httpx.Request, live: httpx.Response, body: bytes) -> httpx.Response:
+        self.recorder.store(key, request, live, body)
+        headers = [(k, v) for k, v in live.headers.items() if k.lower() not in DROPPED_RESPONSE_HEADERS]
+        return httpx.Response(live.status_code, headers=headers, content=body)
+
+    def close(self):
+        if self._sync is not None:
+            self._sync.close()
+
+    async def aclose(self):
+        if self._async is not None:
+            await self._async.aclose()
+
+
+def install(recorder: CassetteRecorder, live: Any = None):
+    """Route every genai.Client created from now on through `recorder`; returns an undo function.
+
+    Replay mode also gives Vertex clients a static token, so no ADC or gcloud
+    login is needed offline.
+    """
+    from google import genai
+    from google.genai import types
+
+    original_init = genai.Client.__init__
+    transport = CassetteTransport(recorder, live)
+
+    def __init__(self, *args, **kwargs):
+        options = kwargs.get("http_options") or types.HttpOptions()
+        if isinstance(options, dict):
+            options = types.HttpOptions(**options)
+        kwargs["http_options"] = options.model_copy(update={
+            "client_args": {**(options.client_args or {}), "transport": transport},
+            "async_client_args": {**(options.async_client_args or {}), "transport": transport},
+        })
+        if recorder.mode == "replay" and kwargs.get("vertexai") and not kwargs.get("credentials") \
+                and not kwargs.get("api_key"):
+            from google.oauth2.credentials import Credentials
+            kwargs["credentials"] = Credentials(token=REPLAY_TOKEN)
+        original_init(self, *args, **kwargs)
+
+    genai.Client.__init__ = __init__
+
+    def uninstall():
+        genai.Client.__init__ = original_init
+
+    return uninstall
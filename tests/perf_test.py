@@ -1,102 +1,434 @@
 """
-Performance test - 100 iterations with timing stats
-Goal: Make each iteration faster
+Open-loop load generator for the Bandit proxy.
+
+The old perf test sent "hi" serially and waited for each answer before
+sending the next (closed loop), so a slow server simply received less
+traffic and queueing latency never showed up. This generator fires
+requests on an arrival schedule that does not depend on responses:
+
+- arrival patterns: constant, poisson, or ramp (linear from --rate to
+  --ramp-to over the run)
+- a weighted mix of endpoints and thinking modes, read from a workload file
+  (tests/perf_workload.json by default)
+- latency is measured from each request's *scheduled* send time, so a
+  client-side backlog counts too (no coordinated omission)
+- HDR-style histograms (log buckets, ~1% relative error) with
+  p50/p90/p99/p99.9, for the whole run and for each workload
+- errors by type (http_429, ReadTimeout, stream_error_503 for an
+  in-band SSE error on a 200 stream, dropped for arrivals the client
+  could not send), per-window throughput,
+  and the first window where the server saturated: throughput fell
+  behind the offered rate, or the error rate or p99 went past their
+  limits
+- a JSON report with stable keys. --compare prints deltas against an
+  earlier report, e.g. from the previous commit.
+
+    python tests/perf_test.py --rate 5 --duration 60
+    python tests/perf_test.py --arrival ramp --rate 1 --ramp-to 40 --duration 120 --output after.json
+    python tests/perf_test.py --workload my_mix.json --compare before.json
 """
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
 import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
 import httpx
-import statistics
-from rich.console import Console
-from rich.live import Live
-from rich.table import Table
-from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TimeElapsedColumn
-
-PROXY_URL = "http://localhost:8000/v1/chat/completions"
-console = Console()
-
-def run_single_test(query: str = "hi") -> float:
-    """Run a single query and return response time."""
-    start = time.perf_counter()
+
+DEFAULT_URL = os.getenv("BANDIT_PROXY_URL", "http://localhost:8000")
+DEFAULT_WORKLOAD = Path(__file__).with_name("perf_workload.json")
+REPORT_VERSION = 1
+
+
+class LatencyHistogram:
+    """HDR-style histogram: log buckets with bounded relative error, constant memory, mergeable."""
+
+    def __init__(self, precision: float = 0.01, lowest: float = 1e-5):
+        self.precision = precision
+        self.lowest = lowest
+        self._log_base = math.log1p(precision)
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        index = int(math.log(max(seconds, self.lowest) / self.lowest) / self._log_base)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def value_at(self, quantile: float) -> float:
+        """Upper bound of the bucket holding `quantile` (clamped to the observed max)."""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(quantile * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self.lowest * (1 + self.precision) ** (index + 1), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """Milliseconds."""
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 2),
+            "min_ms": round(self.min * 1000, 2),
+            "p50_ms": round(self.value_at(0.50) * 1000, 2),
+            "p90_ms": round(self.value_at(0.90) * 1000, 2),
+            "p99_ms": round(self.value_at(0.99) * 1000, 2),
+            "p99_9_ms": round(self.value_at(0.999) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+def arrival_times(pattern: str, rate: float, duration: float, ramp_to: Optional[float] = None,
+                  rng: Optional[random.Random] = None) -> Iterator[float]:
+    """Send offsets (seconds from start) for an open-loop schedule."""
+    rng = rng or random.Random()
+    t = 0.0
+    while True:
+        if pattern == "constant":
+            t += 1.0 / rate
+        elif pattern == "poisson":
+            t += rng.expovariate(rate)
+        elif pattern == "ramp":
+            # Instantaneous rate grows linearly from `rate` to `ramp_to` over the run
+            current = rate + ((ramp_to or rate) - rate) * min(t / duration, 1.0)
+            t += 1.0 / max(current, 1e-6)
+        else:
+            raise ValueError(f"Unknown arrival pattern: {pattern}")
+        if t >= duration:
+            return
+        yield t
+
+
+def offered_rate(pattern: str, rate: float, duration: float, ramp_to: Optional[float], t: float) -> float:
+    if pattern == "ramp":
+        return rate + ((ramp_to or rate) - rate) * min(t / duration, 1.0)
+    return rate
+
+
+def load_workload(path: Path) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        workload = json.load(f)
+    if not workload.get("requests"):
+        raise ValueError(f"{path}: 'requests' must list at least one request")
+    for spec in workload["requests"]:
+        spec.setdefault("method", "POST" if "json" in spec else "GET")
+        spec.setdefault("weight", 1)
+        spec.setdefault("name", f"{spec['method']} {spec['path']}")
+    return workload
+
+
+def error_type(status: Optional[int] = None, exception: Optional[BaseException] = None) -> str:
+    return f"http_{status}" if exception is None else type(exception).__name__
+
+
+def stream_error(body: bytes) -> Optional[str]:
+    """stream_error_<code> for the first `data: {"error": ...}` event of an SSE body, else None."""
+    for line in body.decode("utf-8", "replace").splitlines():
+        if not line.startswith("data: {") or '"error"' not in line:
+            continue
+        try:
+            error = json.loads(line[len("data: "):]).get("error")
+        except ValueError:
+            continue
+        if error:
+            return f"stream_error_{error.get('code', 'unknown') if isinstance(error, dict) else 'unknown'}"
+    return None
+
+
+class Stats:
+    """Histogram + error counts for one slice of the run (overall, a workload, a time window)."""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.first_byte = LatencyHistogram()
+        self.sent = 0
+        self.ok = 0
+        self.errors: Dict[str, int] = {}
+
+    def record(self, latency: float, error: Optional[str], first_byte: Optional[float] = None):
+        if error is None:
+            self.ok += 1
+            self.latency.record(latency)
+            if first_byte is not None:
+                self.first_byte.record(first_byte)
+        else:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self, seconds: Optional[float] = None) -> Dict[str, Any]:
+        failed = sum(self.errors.values())
+        done = self.ok + failed
+        summary = {
+            "sent": self.sent,
+            "ok": self.ok,
+            "errors": dict(sorted(self.errors.items())),
+            "error_rate": round(failed / done, 4) if done else 0.0,
+            "latency": self.latency.summary(),
+        }
+        if self.first_byte.count:
+            summary["first_byte"] = self.first_byte.summary()
+        if seconds:
+            summary["throughput_rps"] = round(self.ok / seconds, 3)
+        return summary
+
+
+class LoadRun:
+    """One open-loop run: schedule, in-flight tasks and the collected stats."""
+
+    def __init__(self, workload: Dict[str, Any], base_url: str, pattern: str, rate: float, duration: float,
+                 ramp_to: Optional[float] = None, window: float = 5.0, max_in_flight: int = 2000,
+                 timeout: float = 120.0, seed: Optional[int] = None):
+        self.workload = workload
+        self.base_url = base_url.rstrip("/")
+        self.pattern = pattern
+        self.rate = rate
+        self.duration = duration
+        self.ramp_to = ramp_to
+        self.window = window
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.specs = workload["requests"]
+        self.weights = [spec["weight"] for spec in self.specs]
+        self.overall = Stats()
+        self.per_request = {spec["name"]: Stats() for spec in self.specs}
+        self.windows: Dict[int, Stats] = {}
+        self.dropped = 0  # arrivals skipped because max_in_flight was reached (the client saturated)
+        self.elapsed = 0.0
+
+    def _window(self, offset: float) -> Stats:
+        return self.windows.setdefault(int(offset // self.window), Stats())
+
+    async def _fire(self, client: httpx.AsyncClient, spec: Dict[str, Any], scheduled: float, start: float):
+        loop = asyncio.get_running_loop()
+        first_byte = None
+        error = None
+        body = bytearray()
+        try:
+            request = client.build_request(spec["method"], self.base_url + spec["path"], json=spec.get("json"),
+                                           headers=spec.get("headers"))
+            response = await client.send(request, stream=True)
+            try:
+                async for chunk in response.aiter_bytes():
+                    if first_byte is None:
+                        first_byte = loop.time() - scheduled
+                    if spec.get("stream"):
+                        body += chunk
+            finally:
+                await response.aclose()
+            if response.status_code >= 400:
+                error = error_type(response.status_code)
+            elif spec.get("stream"):
+                error = stream_error(bytes(body))  # the status is sent before the answer: failures come in-band
+        except Exception as e:
+            error = error_type(exception=e)
+        done = loop.time()
+        latency = done - scheduled  # from the scheduled send time: client-side queueing counts
+        for stats in (self.overall, self.per_request[spec["name"]]):
+            stats.record(latency, error, first_byte if spec.get("stream") else None)
+        # Completions are bucketed by when they finished, so a window's throughput is what the server delivered
+        self._window(done - start).record(latency, error)
+
+    async def run(self, client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+        own_client = client is None
+        if own_client:
+            limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+            client = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+        loop = asyncio.get_running_loop()
+        tasks = set()
+        start = loop.time()
+        try:
+            for offset in arrival_times(self.pattern, self.rate, self.duration, self.ramp_to, self.rng):
+                delay = start + offset - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                spec = self.rng.choices(self.specs, weights=self.weights)[0]
+                self.overall.sent += 1
+                self.per_request[spec["name"]].sent += 1
+                self._window(offset).sent += 1
+                if len(tasks) >= self.max_in_flight:
+                    self.dropped += 1
+                    for stats in (self.overall, self.per_request[spec["name"]], self._window(offset)):
+                        stats.record(0.0, "dropped")  # never sent: counts against the error rate
+                    continue
+                task = asyncio.ensure_future(self._fire(client, spec, start + offset, start))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            self.elapsed = loop.time() - start
+            if own_client:
+                await client.aclose()
+        return self.report()
+
+    def saturation(self, max_error_rate: float, slo_p99_ms: Optional[float]) -> Optional[Dict[str, Any]]:
+        """First full window whose completions fell behind the offered rate or broke the limits."""
+        for index in sorted(self.windows):
+            if (index + 1) * self.window > self.duration:
+                break
+            stats = self.windows[index]
+            offered = offered_rate(self.pattern, self.rate, self.duration, self.ramp_to, (index + 0.5) * self.window)
+            achieved = stats.ok / self.window
+            failed = sum(stats.errors.values())
+            error_rate = failed / (stats.ok + failed) if stats.ok + failed else 0.0
+            p99_ms = stats.latency.value_at(0.99) * 1000
+            reasons = []
+            if index and achieved < 0.9 * offered:  # the first window is still filling the pipeline
+                reasons.append("throughput")
+            if error_rate > max_error_rate:
+                reasons.append("errors")
+            if slo_p99_ms and p99_ms > slo_p99_ms:
+                reasons.append("p99")
+            if reasons:
+                return {"window_start_s": index * self.window, "offered_rps": round(offered, 3),
+                        "achieved_rps": round(achieved, 3), "error_rate": round(error_rate, 4),
+                        "p99_ms": round(p99_ms, 2), "reasons": reasons}
+        return None
+
+    def report(self) -> Dict[str, Any]:
+        limits = self.workload.get("limits", {})
+        return {
+            "version": REPORT_VERSION,
+            "commit": git_commit(),
+            "config": {
+                "url": self.base_url,
+                "arrival": self.pattern,
+                "rate": self.rate,
+                "ramp_to": self.ramp_to,
+                "duration_s": self.duration,
+                "window_s": self.window,
+                "max_in_flight": self.max_in_flight,
+                "requests": [{"name": s["name"], "weight": s["weight"]} for s in self.specs],
+            },
+            "elapsed_s": round(self.elapsed, 3),
+            "dropped": self.dropped,
+            "overall": self.overall.summary(self.duration),
+            "requests": {name: stats.summary(self.duration) for name, stats in self.per_request.items()},
+            "windows": [
+                {"start_s": index * self.window, "sent": stats.sent,
+                 "throughput_rps": round(stats.ok / self.window, 3),
+                 "errors": sum(stats.errors.values()),
+                 "p99_ms": round(stats.latency.value_at(0.99) * 1000, 2)}
+                for index, stats in sorted(self.windows.items())
+            ],
+            "saturation": self.saturation(limits.get("max_error_rate", 0.01), limits.get("slo_p99_ms")),
+        }
+
+
+def git_commit() -> Optional[str]:
     try:
-        r = httpx.post(PROXY_URL, json={
-            "model": "test",
-            "messages": [{"role": "user", "content": query}],
-            "thinking_mode": "instant"
-        }, timeout=60)
-        if r.status_code != 200:
-            return -1
-        return time.perf_counter() - start
-    except Exception as e:
-        console.print(f"[red]Error: {e}[/red]")
-        return -1
-
-def run_performance_test(num_iterations: int = 100):
-    """Run performance test with stats."""
-    console.print(f"\n[bold blue]🚀 Performance Test - {num_iterations} iterations[/bold blue]\n")
-    
-    times = []
-    errors = 0
-    best_time = float('inf')
-    worst_time = 0
-    
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-        TimeElapsedColumn(),
-        console=console,
-    ) as progress:
-        task = progress.add_task("Testing...", total=num_iterations)
-        
-        for i in range(num_iterations):
-            elapsed = run_single_test("hi")
-            
-            if elapsed > 0:
-                times.append(elapsed)
-                if elapsed < best_time:
-                    best_time = elapsed
-                if elapsed > worst_time:
-                    worst_time = elapsed
-                
-                # Update progress description
-                avg = statistics.mean(times) if times else 0
-                progress.update(task, advance=1, 
-                    description=f"Iter {i+1}: {elapsed:.2f}s | Avg: {avg:.2f}s | Best: {best_time:.2f}s")
-            else:
-                errors += 1
-                progress.update(task, advance=1, description=f"Iter {i+1}: ERROR")
-    
-    # Final stats
-    if times:
-        console.print("\n[bold green]📊 Final Results[/bold green]")
-        table = Table(show_header=True)
-        table.add_column("Metric", style="cyan")
-        table.add_column("Value", justify="right")
-        
-        table.add_row("Total Iterations", str(num_iterations))
-        table.add_row("Successful", str(len(times)))
-        table.add_row("Errors", str(errors))
-        table.add_row("Best Time", f"{best_time:.3f}s")
-        table.add_row("Worst Time", f"{worst_time:.3f}s")
-        table.add_row("Average", f"{statistics.mean(times):.3f}s")
-        table.add_row("Median", f"{statistics.median(times):.3f}s")
-        if len(times) > 1:
-            table.add_row("Std Dev", f"{statistics.stdev(times):.3f}s")
-        table.add_row("P95", f"{sorted(times)[int(len(times)*0.95)]:.3f}s" if len(times) >= 20 else "N/A")
-        
-        console.print(table)
-        
-        # Target check
-        target = 15.0
-        under_target = sum(1 for t in times if t <= target)
-        console.print(f"\n[bold]Under {target}s target: {under_target}/{len(times)} ({100*under_target/len(times):.1f}%)[/bold]")
-        
-        return statistics.mean(times)
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare_reports(before: Dict[str, Any], after: Dict[str, Any]) -> List[str]:
+    """Human-readable deltas of the headline numbers, overall and per request."""
+    lines = [f"{before.get('commit') or 'before'} -> {after.get('commit') or 'after'}"]
+
+    def row(name: str, old: Dict[str, Any], new: Dict[str, Any]):
+        cells = []
+        for key in ("p50_ms", "p99_ms", "p99_9_ms"):
+            a, b = old.get("latency", {}).get(key), new.get("latency", {}).get(key)
+            if a and b:
+                cells.append(f"{key[:-3]} {a:.0f}->{b:.0f}ms ({(b - a) / a:+.1%})")
+        a, b = old.get("throughput_rps"), new.get("throughput_rps")
+        if a is not None and b is not None:
+            cells.append(f"rps {a:.2f}->{b:.2f}")
+        cells.append(f"errors {old.get('error_rate', 0):.2%}->{new.get('error_rate', 0):.2%}")
+        lines.append(f"  {name:<28} " + "  ".join(cells))
+
+    row("overall", before.get("overall", {}), after.get("overall", {}))
+    for name, new in after.get("requests", {}).items():
+        if name in before.get("requests", {}):
+            row(name, before["requests"][name], new)
+    return lines
+
+
+def print_report(report: Dict[str, Any]):
+    config = report["config"]
+    print(f"\nOpen-loop {config['arrival']} @ {config['rate']}"
+          f"{'->' + str(config['ramp_to']) if config['ramp_to'] else ''} req/s for {config['duration_s']}s "
+          f"({report['elapsed_s']}s incl. drain), {report['dropped']} dropped at the client")
+    header = f"{'request':<28}{'sent':>7}{'ok':>7}{'err%':>7}{'rps':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'p99.9':>9}{'max':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, summary in [("overall", report["overall"])] + list(report["requests"].items()):
+        latency = summary["latency"]
+        cells = [latency.get(k, 0) for k in ("p50_ms", "p90_ms", "p99_ms", "p99_9_ms", "max_ms")]
+        print(f"{name[:27]:<28}{summary['sent']:>7}{summary['ok']:>7}{summary['error_rate']:>7.1%}"
+              f"{summary.get('throughput_rps', 0):>8.2f}" + "".join(f"{c:>9.0f}" for c in cells))
+    if report["overall"]["errors"]:
+        print("errors: " + ", ".join(f"{k}={v}" for k, v in report["overall"]["errors"].items()))
+    saturation = report["saturation"]
+    if saturation:
+        print(f"saturated at ~{saturation['offered_rps']} req/s offered (t={saturation['window_start_s']}s): "
+              f"{', '.join(saturation['reasons'])}; achieved {saturation['achieved_rps']} req/s, "
+              f"p99 {saturation['p99_ms']:.0f}ms, errors {saturation['error_rate']:.1%}")
     else:
-        console.print("[red]All tests failed![/red]")
-        return -1
+        print("no saturation detected")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL, help="proxy base URL")
+    parser.add_argument("--workload", type=Path, default=DEFAULT_WORKLOAD, help="JSON request mix")
+    parser.add_argument("--arrival", choices=("constant", "poisson", "ramp"), help="overrides the workload file")
+    parser.add_argument("--rate", type=float, help="requests/s (start rate for ramp)")
+    parser.add_argument("--ramp-to", type=float, help="final requests/s for --arrival ramp")
+    parser.add_argument("--duration", type=float, help="seconds of arrivals")
+    parser.add_argument("--window", type=float, default=5.0, help="seconds per throughput/saturation window")
+    parser.add_argument("--max-in-flight", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, help="fixed seed for a reproducible schedule and mix")
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    parser.add_argument("--compare", type=Path, help="earlier JSON report to diff against")
+    args = parser.parse_args(argv)
+
+    workload = load_workload(args.workload)
+    arrival = workload.get("arrival", {})
+    pattern = args.arrival or arrival.get("pattern", "poisson")
+    ramp_to = args.ramp_to if args.ramp_to is not None else arrival.get("ramp_to")
+    if pattern == "ramp" and ramp_to is None:
+        parser.error("--arrival ramp needs --ramp-to (or arrival.ramp_to in the workload)")
+    run = LoadRun(workload, args.url, pattern, args.rate or arrival.get("rate", 1.0),
+                  args.duration or arrival.get("duration", 30.0), ramp_to, args.window,
+                  args.max_in_flight, args.timeout, args.seed)
+    report = asyncio.run(run.run())
+    print_report(report)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+        print(f"report written to {args.output}")
+    if args.compare:
+        print("\n".join(compare_reports(json.loads(args.compare.read_text()), report)))
+    return 0
+
 
 if __name__ == "__main__":
-    import sys
-    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10  # Default 10, pass arg for more
-    run_performance_test(n)
+    sys.exit(main())
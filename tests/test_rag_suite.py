@@ -11,6 +11,9 @@ import time
 from datetime import datetime
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from scripts.hq_index import HQIndex, format_results
+
 # Set environment
 os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "project-5f169828-6f8d-450b-923")
 os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", 
@@ -51,40 +54,31 @@ TEST_QUESTIONS = [
 
 
 def search_local_hq(query: str, hq_path: str = "HQ") -> str:
-    """Search HQ files locally for relevant content."""
-    results = []
-    query_lower = query.lower()
-    keywords = [w for w in query_lower.split() if len(w) > 3]
-    
+    """Search HQ files through the local vector index (embedded once, updated incrementally)."""
     hq = Path(hq_path)
     if not hq.exists():
         return "HQ folder not found"
     
-    for file_path in hq.rglob("*.md"):
-        try:
-            content = file_path.read_text(encoding='utf-8', errors='ignore')
-            content_lower = content.lower()
-            
-            # Score by keyword matches
-            score = sum(1 for kw in keywords if kw in content_lower)
-            if score >= 2:
-                # Extract relevant snippet
-                for line in content.split('\n'):
-                    if any(kw in line.lower() for kw in keywords):
-                        results.append((score, file_path.name, line[:200]))
-                        break
-        except Exception as e:
-            pass
-    
-    # Sort by score, take top 5
-    results.sort(reverse=True, key=lambda x: x[0])
-    top_results = results[:5]
+    index = get_local_index(hq)
+    index.update()
+    results = index.search(query, k=5)
     
-    if top_results:
-        return "\n".join([f"[{r[1]}] {r[2]}" for r in top_results])
+    if results:
+        return format_results(results)
     return "No matching content found"
 
 
+_LOCAL_INDEXES = {}
+
+
+def get_local_index(hq: Path):
+    """One HQIndex per HQ folder for the whole suite run."""
+    key = hq.resolve()
+    if key not in _LOCAL_INDEXES:
+        _LOCAL_INDEXES[key] = HQIndex(root=key)
+    return _LOCAL_INDEXES[key]
+
+
 async def search_gcs_bucket(query: str) -> str:
     """Search GCS bucket for HQ documents."""
     try:
@@ -10,6 +10,8 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import asyncio
+import json
+import time
 from datetime import datetime
 from pathlib import Path
 
@@ -186,6 +188,1672 @@ def test_memory_limit_value():
 
 test_memory_limit_value()
 
+# ============================================
+# MODEL RUNTIME (async execution layer)
+# ============================================
+print("\n⚡ Testing model_runtime...")
+
+class _FakeAioModels:
+    """Stands in for client.aio.models with a fixed latency."""
+    def __init__(self, delay):
+        self.delay = delay
+        self.in_flight = 0
+        self.peak = 0
+
+    async def generate_content(self, **kwargs):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        return kwargs["contents"]
+
+class _FakeClient:
+    def __init__(self, delay):
+        self.aio = type("Aio", (), {})()
+        self.aio.models = _FakeAioModels(delay)
+
+@test("Concurrent calls finish in ~max(latency), not sum")
+def test_runtime_concurrency():
+    from scripts.model_runtime import generate_content
+    client = _FakeClient(0.1)
+
+    async def burst():
+        return await asyncio.gather(*[
+            generate_content(client, "instant", model="m", contents=str(i)) for i in range(10)
+        ])
+
+    start = time.perf_counter()
+    out = asyncio.run(burst())
+    elapsed = time.perf_counter() - start
+    assert out == [str(i) for i in range(10)]
+    assert elapsed < 0.5, f"took {elapsed:.2f}s"
+
+test_runtime_concurrency()
+
+@test("Tier concurrency limit is enforced")
+def test_runtime_tier_limit():
+    from scripts import model_runtime
+    client = _FakeClient(0.02)
+    limit = model_runtime.TIER_CONCURRENCY["image"]
+
+    async def burst():
+        await asyncio.gather(*[
+            model_runtime.generate_content(client, "image", model="m", contents="x") for _ in range(limit * 3)
+        ])
+
+    asyncio.run(burst())
+    assert client.aio.models.peak == limit, f"peak {client.aio.models.peak} != {limit}"
+
+test_runtime_tier_limit()
+
+# ============================================
+# PROXY SSE STREAMING
+# ============================================
+print("\n📡 Testing proxy SSE helpers...")
+
+@test("sse_chunk emits an OpenAI chat.completion.chunk event")
+def test_sse_chunk():
+    import json
+    from proxy_server import sse_chunk
+    event = sse_chunk("chatcmpl-1", 1, "m", {"content": "hi"})
+    assert event.startswith("data: ") and event.endswith("\n\n")
+    chunk = json.loads(event[len("data: "):])
+    assert chunk["object"] == "chat.completion.chunk"
+    assert chunk["choices"][0]["delta"] == {"content": "hi"}
+    assert "usage" not in chunk
+
+test_sse_chunk()
+
+@test("Gemini finish reasons map to OpenAI values")
+def test_finish_reason_map():
+    from proxy_server import map_finish_reason
+    from google.genai import types
+    assert map_finish_reason(types.FinishReason.MAX_TOKENS) == "length"
+    assert map_finish_reason(types.FinishReason.SAFETY) == "content_filter"
+    assert map_finish_reason(None) == "stop"
+
+test_finish_reason_map()
+
+@test("OpenAI messages map to Gemini history with merged system instructions")
+def test_build_conversation():
+    from proxy_server import build_conversation, Message, BANDIT_SYSTEM_PROMPT
+    conversation = build_conversation([
+        Message(role="system", content="Answer in French."),
+        Message(role="user", content="hi"),
+        Message(role="assistant", content="salut"),
+        Message(role="user", content="and again"),
+        Message(role="user", content="what time is it?"),
+    ])
+    assert conversation.system_instruction == BANDIT_SYSTEM_PROMPT + "\n\nAnswer in French."
+    assert [c.role for c in conversation.history] == ["user", "model", "user"]
+    assert conversation.prompt == "what time is it?" and conversation.current == "what time is it?"
+    assert conversation.engine_prompt("q").endswith("User: and again\n\nCurrent query: q")
+
+test_build_conversation()
+
+# ============================================
+# RESPONSE CACHE
+# ============================================
+print("\n💾 Testing response_cache...")
+
+@test("MemoryCache evicts LRU entries past the byte budget")
+def test_memory_cache_budget():
+    from scripts.response_cache import MemoryCache
+    c = MemoryCache(max_bytes=30)
+    c.set("a", "x" * 10)
+    c.set("b", "y" * 10)
+    c.get("a")  # a is now most recent
+    c.set("c", "z" * 15)
+    assert c.get("b") is None
+    assert c.get("a") == "x" * 10
+    assert c.size_bytes <= 30
+    assert c.stats()["evictions"] == 1
+
+test_memory_cache_budget()
+
+@test("MemoryCache honors per-entry TTL")
+def test_memory_cache_ttl():
+    from scripts.response_cache import MemoryCache
+    c = MemoryCache(max_bytes=1024)
+    c.set("short", "v", ttl=0.01)
+    c.set("long", "v", ttl=60)
+    time.sleep(0.02)
+    assert c.get("short") is None
+    assert c.get("long") == "v"
+    assert c.stats()["expirations"] == 1
+
+test_memory_cache_ttl()
+
+@test("CacheBackend subclasses must implement the whole interface")
+def test_cache_backend_abstract():
+    from scripts.response_cache import CacheBackend, MemoryCache
+
+    class Partial(CacheBackend):
+        def get(self, key):
+            return None
+
+    for cls in (CacheBackend, Partial):
+        try:
+            cls(max_bytes=1024)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError(f"{cls.__name__} should not be instantiable")
+    assert isinstance(MemoryCache(max_bytes=1024), CacheBackend)
+
+test_cache_backend_abstract()
+
+@test("TieredCache survives a restart via the SQLite L2")
+def test_tiered_cache_persistence():
+    import tempfile
+    from scripts.response_cache import MemoryCache, SQLiteCache, TieredCache
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "cache.sqlite"
+        first = TieredCache(MemoryCache(), SQLiteCache(path))
+        for i in range(150):
+            first.set(f"k{i}", f"answer {i}")
+        first.l2.close()
+        second = TieredCache(MemoryCache(), SQLiteCache(path))
+        assert len(second) == 150
+        assert second.get("k3") == "answer 3"
+        assert second.l1.get("k3") == "answer 3"  # promoted into L1
+        second.l2.close()
+
+test_tiered_cache_persistence()
+
+@test("SQLiteCache evicts least recently used rows past the byte budget")
+def test_sqlite_cache_budget():
+    import tempfile
+    from scripts.response_cache import SQLiteCache
+    with tempfile.TemporaryDirectory() as tmp:
+        c = SQLiteCache(Path(tmp) / "cache.sqlite", max_bytes=100)
+        for i in range(20):
+            c.set(f"k{i}", "v" * 10)
+        assert c.size_bytes <= 100
+        assert c.get("k19") == "v" * 10
+        assert c.get("k0") is None
+        assert c.stats()["evictions"] == 10
+        c.close()
+
+test_sqlite_cache_budget()
+
+@test("L1 hits keep their L2 rows warm, with access times written in batches")
+def test_tiered_cache_touch():
+    import sqlite3
+    import tempfile
+    from scripts.response_cache import MemoryCache, SQLiteCache, TieredCache
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "cache.sqlite"
+        c = TieredCache(MemoryCache(), SQLiteCache(path, max_bytes=100))
+        c.set("hot", "v" * 10)
+        stamp = lambda: sqlite3.connect(str(path)).execute(
+            "SELECT last_access FROM responses WHERE key = 'hot'").fetchone()[0]
+        for i in range(9):
+            c.set(f"k{i}", "v" * 10)
+        written = stamp()
+        time.sleep(0.01)
+        assert c.get("hot") == "v" * 10 and c.l2.hits == 0  # served by L1
+        assert stamp() == written  # the hit did not write
+        c.set("k9", "v" * 10)  # over budget: the least recently used row goes, and "hot" was just read
+        assert c.l2.get("hot") == "v" * 10 and c.l2.get("k0") is None
+        c.l2.close()
+
+test_tiered_cache_touch()
+
+# ============================================
+# SEMANTIC CACHE
+# ============================================
+print("\n🧭 Testing semantic_cache...")
+
+@test("SemanticCache serves near-duplicates above the threshold only")
+def test_semantic_cache_threshold():
+    from scripts.semantic_cache import SemanticCache
+    policy = {"instant": {"enabled": True, "threshold": 0.9, "ttl": 60, "max_entries": 4}}
+    c = SemanticCache(policy, dim=3)
+    c.add("instant", [1.0, 0.0, 0.0], "what's on my calendar today", "standup at 10")
+    hit = c.lookup("instant", [0.95, 0.1, 0.0])
+    assert hit and hit.response == "standup at 10"
+    assert c.lookup("instant", [0.0, 1.0, 0.0]) is None
+    assert c.lookup("thinking", [1.0, 0.0, 0.0]) is None  # mode not in policy
+    assert c.stats()["hits"] == 1 and c.stats()["misses"] == 1
+
+test_semantic_cache_threshold()
+
+@test("SemanticCache false-hit report evicts the entry")
+def test_semantic_cache_false_hit():
+    from scripts.semantic_cache import SemanticCache
+    policy = {"instant": {"enabled": True, "threshold": 0.9, "ttl": 60, "max_entries": 2}}
+    c = SemanticCache(policy, dim=2)
+    entry = c.add("instant", [1.0, 0.0], "q", "a")
+    assert c.report_false_hit(entry)
+    assert c.lookup("instant", [1.0, 0.0]) is None
+    assert c.stats()["false_hits"] == 1
+    for i in range(5):  # ring replacement keeps capacity bounded
+        c.add("instant", [1.0, float(i)], f"q{i}", f"a{i}")
+    assert c.stats()["modes"]["instant"]["entries"] == 2
+
+test_semantic_cache_false_hit()
+
+# ============================================
+# SINGLE-FLIGHT COALESCING
+# ============================================
+print("\n🪁 Testing single_flight...")
+
+@test("Concurrent identical calls share one upstream call")
+def test_single_flight_coalesces():
+    from scripts.single_flight import SingleFlight, request_fingerprint
+    flights = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def burst():
+        key = request_fingerprint("instant", "m", "hello   there")
+        assert key == request_fingerprint("instant", "m", " hello there ")
+        return await asyncio.gather(*[flights.do(key, upstream) for _ in range(5)])
+
+    assert asyncio.run(burst()) == ["answer"] * 5
+    assert len(calls) == 1
+    assert flights.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+test_single_flight_coalesces()
+
+@test("Fingerprint separates modes and models")
+def test_single_flight_fingerprint():
+    from scripts.single_flight import request_fingerprint
+    assert request_fingerprint("instant", "m", "x") != request_fingerprint("thinking", "m", "x")
+    assert request_fingerprint("instant", "a", "x") != request_fingerprint("instant", "b", "x")
+
+test_single_flight_fingerprint()
+
+@test("Shared call survives one waiter cancelling but stops when the last one does")
+def test_single_flight_cancellation():
+    from scripts.single_flight import SingleFlight
+    flights = SingleFlight()
+    cancelled = []
+
+    async def upstream():
+        try:
+            await asyncio.sleep(0.2)
+            return "answer"
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        first = asyncio.ensure_future(flights.do("k", upstream))
+        second = asyncio.ensure_future(flights.do("k", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled  # second caller still waiting
+        second.cancel()
+        await asyncio.sleep(0.01)
+        return cancelled
+
+    assert asyncio.run(run()) == [True]
+
+test_single_flight_cancellation()
+
+# ============================================
+# BACKGROUND JOB QUEUE
+# ============================================
+print("\n🧵 Testing job_queue...")
+
+@test("Job queue dedups by key and bounds concurrency to the worker pool")
+def test_job_queue_dedup():
+    from scripts.job_queue import BackgroundJobQueue
+    q = BackgroundJobQueue(workers=2, max_depth=50)
+    state = {"running": 0, "peak": 0, "done": []}
+
+    async def handler(job):
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await asyncio.sleep(0.01)
+        state["running"] -= 1
+        state["done"].append(job["n"])
+
+    async def run():
+        q.register("enrich", handler)
+        await q.start()
+        for n in range(10):
+            q.submit("enrich", f"k{n}", {"n": n})
+            q.submit("enrich", f"k{n}", {"n": n})  # duplicate
+        await q.join()
+        await q.stop()
+
+    asyncio.run(run())
+    assert sorted(state["done"]) == list(range(10))
+    assert state["peak"] <= 2
+    assert q.stats()["deduped"] == 10
+
+test_job_queue_dedup()
+
+@test("Full job queue sheds lowest-priority work first")
+def test_job_queue_shed():
+    from scripts.job_queue import BackgroundJobQueue, PRIORITY_HIGH, PRIORITY_LOW
+
+    async def handler(job):
+        pass
+
+    q = BackgroundJobQueue(workers=1, max_depth=2)
+    q.register("enrich", handler)
+    assert q.submit("enrich", "a", {}, PRIORITY_LOW)
+    assert q.submit("enrich", "b", {}, PRIORITY_LOW)
+    assert q.submit("enrich", "c", {}, PRIORITY_HIGH)   # evicts a low job
+    assert not q.submit("enrich", "d", {}, PRIORITY_LOW)  # worse than everything queued
+    assert q.stats()["shed"] == 2 and q.stats()["depth"] == 2
+
+    q = BackgroundJobQueue(workers=1, max_depth=1, shed_policy="drop_new")
+    q.register("enrich", handler)
+    assert q.submit("enrich", "a", {}, PRIORITY_LOW)
+    assert not q.submit("enrich", "b", {}, PRIORITY_HIGH)
+
+test_job_queue_shed()
+
+@test("Journaled jobs survive a restart")
+def test_job_queue_durable():
+    import tempfile
+    from scripts.job_queue import BackgroundJobQueue, JobJournal
+    done = []
+
+    async def handler(job):
+        done.append(job["prompt"])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "jobs.sqlite"
+        first = BackgroundJobQueue(workers=1, journal=JobJournal(path))
+        first.register("enrich", handler)
+        first.submit("enrich", "k1", {"prompt": "hello"})  # never started: simulated crash
+        first.journal.close()
+
+        second = BackgroundJobQueue(workers=1, journal=JobJournal(path))
+        second.register("enrich", handler)
+
+        async def run():
+            await second.start()
+            await second.join()
+            await second.stop()
+
+        asyncio.run(run())
+        assert done == ["hello"]
+        assert second.journal.pending() == []
+        second.journal.close()
+
+test_job_queue_durable()
+
+@test("Jobs interrupted by stop() stay journaled and run after the next start")
+def test_job_queue_stop_keeps_running_jobs():
+    import tempfile
+    from scripts.job_queue import BackgroundJobQueue, JobJournal
+    done = []
+
+    async def slow(job):
+        await asyncio.sleep(10)
+
+    async def fast(job):
+        done.append(job["prompt"])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        q = BackgroundJobQueue(workers=1, journal=JobJournal(Path(tmp) / "jobs.sqlite"))
+
+        async def run():
+            q.register("enrich", slow)
+            await q.start()
+            q.submit("enrich", "k1", {"prompt": "hello"})
+            await asyncio.sleep(0.05)
+            assert q.stats()["running"] == 1
+            await q.stop()
+            assert [row[0] for row in q.journal.pending()] == ["k1"]
+            q.register("enrich", fast)
+            await q.start()
+            await q.join()
+            await q.stop()
+
+        asyncio.run(run())
+        assert done == ["hello"] and q.journal.pending() == []
+        q.journal.close()
+
+test_job_queue_stop_keeps_running_jobs()
+
+@test("Journal writes from submit are batched off the event loop")
+def test_job_queue_batched_journal():
+    import tempfile
+    from scripts.job_queue import BackgroundJobQueue, JobJournal
+
+    async def handler(job):
+        pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = JobJournal(Path(tmp) / "jobs.sqlite")
+        q = BackgroundJobQueue(workers=1, journal=journal)
+        q.register("enrich", handler)
+
+        async def run():
+            for n in range(50):
+                q.submit("enrich", f"k{n}", {"n": n})
+            assert journal.dirty  # buffered: nothing committed on the loop yet
+            await q.stop()
+
+        asyncio.run(run())
+        assert not journal.dirty and len(journal.pending()) == 50
+        journal.close()
+
+test_job_queue_batched_journal()
+
+# ============================================
+# CREDENTIAL BROKER
+# ============================================
+print("\n🔐 Testing credential_broker...")
+
+class _FakeCredentials:
+    """google-auth stand-in that counts refreshes."""
+    def __init__(self, lifetime=3600, delay=0.0):
+        self.lifetime = lifetime
+        self.delay = delay
+        self.refreshes = 0
+        self.token = None
+        self.expiry = None
+
+    def refresh(self, request):
+        from datetime import datetime, timedelta, timezone
+        time.sleep(self.delay)
+        self.refreshes += 1
+        self.token = f"ya29.token-{self.refreshes}"
+        self.expiry = (datetime.now(timezone.utc) + timedelta(seconds=self.lifetime)).replace(tzinfo=None)
+
+def _fake_broker(creds, margin=300):
+    from scripts.credential_broker import CredentialBroker
+    broker = CredentialBroker(refresh_margin=margin)
+    broker._load = lambda: creds
+    return broker
+
+@test("Concurrent cold callers trigger a single refresh")
+def test_broker_thundering_herd():
+    import threading
+    creds = _FakeCredentials(delay=0.05)
+    broker = _fake_broker(creds)
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(broker.get_token())) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert creds.refreshes == 1, f"{creds.refreshes} refreshes"
+    assert tokens == ["ya29.token-1"] * 20
+
+test_broker_thundering_herd()
+
+@test("Valid token is served without blocking; near expiry refreshes in background")
+def test_broker_background_refresh():
+    creds = _FakeCredentials(lifetime=200, delay=0.05)  # inside the 300s refresh margin
+    broker = _fake_broker(creds)
+    assert broker.get_token() == "ya29.token-1"
+    start = time.perf_counter()
+    assert broker.get_token() == "ya29.token-1"  # old token returned immediately
+    assert time.perf_counter() - start < 0.03
+    time.sleep(0.1)
+    assert creds.refreshes == 2
+    assert broker.stats()["background_refreshes"] >= 1
+
+test_broker_background_refresh()
+
+# ============================================
+# ENGINE CLIENT
+# ============================================
+print("\n🔌 Testing engine_client...")
+
+@test("Engine query posts input/classMethod and maps non-200 to EngineQueryError")
+def test_engine_client_query():
+    import asyncio
+    import httpx
+    from scripts.engine_client import EngineQueryError, query_async
+    seen = []
+
+    def handler(request):
+        seen.append(json.loads(request.content))
+        if b"fail" in request.content:
+            return httpx.Response(503, text="overloaded")
+        return httpx.Response(200, json={"output": {"answer": 42}})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            output = await query_async("https://engine/q:query", "hi", "tok", client=client)
+            try:
+                await query_async("https://engine/q:query", "fail", "tok", client=client)
+                raise AssertionError("expected EngineQueryError")
+            except EngineQueryError as e:
+                assert e.status_code == 503 and e.body == "overloaded"
+        return output
+
+    assert asyncio.run(run()) == "{'answer': 42}"
+    assert seen[0] == {"input": {"prompt": "hi"}, "classMethod": "query"}
+
+test_engine_client_query()
+
+@test("Engine query enforces its overall deadline")
+def test_engine_client_deadline():
+    import asyncio
+    import httpx
+    from scripts.engine_client import query_async
+
+    async def slow(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200, json={"output": "late"})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(slow)) as client:
+            start = time.perf_counter()
+            try:
+                await query_async("https://engine/q:query", "hi", "tok", deadline=0.05, client=client)
+                raise AssertionError("expected timeout")
+            except httpx.TimeoutException:
+                return time.perf_counter() - start
+
+    assert asyncio.run(run()) < 0.5
+
+test_engine_client_deadline()
+
+# ============================================
+# CONTEXT CACHE (multi-turn)
+# ============================================
+print("\n🗂️ Testing context_cache...")
+
+def _turns(*texts):
+    from google.genai import types
+    roles = ["user", "model"]
+    return [types.Content(role=roles[i % 2], parts=[types.Part.from_text(text=t)]) for i, t in enumerate(texts)]
+
+class _FakeCaches:
+    def __init__(self):
+        self.created = []
+        self.deleted = []
+
+    async def create(self, model, config):
+        from types import SimpleNamespace
+        self.created.append(len(config.contents))
+        return SimpleNamespace(name=f"caches/{len(self.created)}", expire_time=None, usage_metadata=None)
+
+    async def update(self, name, config):
+        return None
+
+    async def delete(self, name):
+        self.deleted.append(name)
+
+@test("Context cache creates a prefix cache and reuses the longest cached prefix")
+def test_context_cache_prefix_reuse():
+    from types import SimpleNamespace
+    from scripts.context_cache import ContextCacheManager
+    caches = _FakeCaches()
+    client = SimpleNamespace(aio=SimpleNamespace(caches=caches))
+    manager = ContextCacheManager(ttl=600, min_tokens=100, step_tokens=100, enabled=True)
+    history = _turns("x " * 400, "answer")
+    current = _turns("follow up")
+
+    async def run():
+        first = manager.plan(client, "m", "sys", history, current)
+        assert first.cached_content is None and len(first.contents) == 3
+        await asyncio.sleep(0.01)  # background create
+        # Next turn: same prefix plus a short new exchange -> reuse, no new cache yet
+        longer = history + _turns("follow up", "answer two")
+        second = manager.plan(client, "m", "sys", longer, current)
+        assert second.cached_content == "caches/1"
+        assert second.cached_length == 2 and len(second.contents) == 3
+        await asyncio.sleep(0.01)
+        # A different system instruction never matches
+        assert manager.plan(client, "m", "other", history, current).cached_content is None
+
+    asyncio.run(run())
+    assert caches.created == [2, 2]  # second create is for the "other" system instruction
+
+test_context_cache_prefix_reuse()
+
+@test("Cached requests drop system_instruction and stale handles are invalidated")
+def test_context_cache_config_and_invalidate():
+    from types import SimpleNamespace
+    from google.genai import types
+    from scripts.context_cache import CachePlan, ContextCacheManager, is_stale_cache_error
+    caches = _FakeCaches()
+    client = SimpleNamespace(aio=SimpleNamespace(caches=caches))
+    manager = ContextCacheManager(min_tokens=10, enabled=True)
+    config = types.GenerateContentConfig(system_instruction="sys", temperature=1.0)
+    cached = manager.config_for(config, CachePlan("caches/9", []))
+    assert cached.cached_content == "caches/9" and cached.system_instruction is None
+    assert manager.config_for(config, CachePlan(None, [])) is config
+    assert is_stale_cache_error(RuntimeError("404 NOT_FOUND: CachedContent caches/9 not found"))
+    assert not is_stale_cache_error(RuntimeError("429 RESOURCE_EXHAUSTED"))
+
+    async def run():
+        manager.plan(client, "m", "sys", _turns("y " * 100), _turns("q"))
+        await asyncio.sleep(0.01)
+        await manager.invalidate(client, "caches/1")
+
+    asyncio.run(run())
+    assert caches.deleted == ["caches/1"] and manager.stats()["entries"] == 0
+
+test_context_cache_config_and_invalidate()
+
+# ============================================
+# SESSION STORE
+# ============================================
+print("\n🧳 Testing session_store...")
+
+@test("Sessions keep decoded history and count upload bytes saved")
+def test_session_store_turns():
+    from scripts.session_store import SessionStore, SessionMessage
+    store = SessionStore(idle_ttl=60, max_sessions=10)
+    session = store.create([SessionMessage("system", "terse", "terse", 5)])
+    store.record_turn(session, [SessionMessage("user", "hi", "hi", 1000), SessionMessage("assistant", "yo", "yo", 2)])
+    store.record_turn(session, [SessionMessage("user", "more", "more", 4), SessionMessage("assistant", "ok", "ok", 2)])
+    assert store.get(session.id) is session and len(session.messages) == 5
+    stats = store.stats()
+    assert stats["bytes_received"] == 1004
+    assert stats["upload_bytes_saved"] == 5 + 1007  # history the second turn did not re-send
+
+test_session_store_turns()
+
+@test("Idle and over-capacity sessions are evicted with a callback")
+def test_session_store_eviction():
+    from scripts.session_store import SessionStore
+    evicted = []
+    store = SessionStore(idle_ttl=0.05, max_sessions=2, on_evict=lambda s: evicted.append(s.id))
+    a, b, c = store.create(), store.create(), store.create()
+    assert evicted == [a.id] and store.get(a.id) is None
+    time.sleep(0.06)
+    assert store.get(b.id) is None and len(store) == 0
+    assert set(evicted) == {a.id, b.id, c.id}
+    assert store.stats()["evicted"] == 1 and store.stats()["expired"] == 2
+
+test_session_store_eviction()
+
+# ============================================
+# HEDGED REQUESTS
+# ============================================
+print("\n🪂 Testing hedging...")
+
+@test("Latency histogram quantiles follow the recorded distribution")
+def test_latency_histogram():
+    from scripts.hedging import LatencyHistogram
+    histogram = LatencyHistogram()
+    assert histogram.quantile(0.5) is None
+    for _ in range(90):
+        histogram.record(0.1)
+    for _ in range(10):
+        histogram.record(5.0)
+    assert 0.1 <= histogram.quantile(0.5) < 0.13
+    assert 5.0 <= histogram.quantile(0.95) < 6.3
+
+test_latency_histogram()
+
+@test("Slow primary is hedged, the secondary wins and the primary is cancelled")
+def test_hedger_slow_primary():
+    from scripts.hedging import Hedger
+    hedger = Hedger(default_delay=0.05, min_samples=100, enabled=True)
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+            return "primary"
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def fast():
+        return "secondary"
+
+    async def quick():
+        return "primary"
+
+    async def run():
+        slow_result = await hedger.run(("engine", slow), ("flash", fast))
+        quick_result = await hedger.run(("engine", quick), ("flash", fast))
+        return slow_result, quick_result
+
+    start = time.perf_counter()
+    slow_result, quick_result = asyncio.run(run())
+    assert slow_result == ("flash", "secondary") and quick_result == ("engine", "primary")
+    assert cancelled == [True] and time.perf_counter() - start < 0.5
+    assert hedger.stats()["hedged"] == 1 and hedger.stats()["wins"] == {"flash": 1, "engine": 1}
+
+test_hedger_slow_primary()
+
+@test("Failed primary falls over to the secondary; both failing raises the primary error")
+def test_hedger_failover():
+    from scripts.hedging import Hedger
+    hedger = Hedger(default_delay=5, enabled=True)
+
+    async def boom():
+        raise ValueError("engine down")
+
+    async def fallback():
+        return "flash"
+
+    async def also_boom():
+        raise RuntimeError("flash down")
+
+    assert asyncio.run(hedger.run(("engine", boom), ("flash", fallback))) == ("flash", "flash")
+    try:
+        asyncio.run(hedger.run(("engine", boom), ("flash", also_boom)))
+        raise AssertionError("expected ValueError")
+    except ValueError:
+        pass
+
+test_hedger_failover()
+
+# ============================================
+# PROMPT CLASSIFIER
+# ============================================
+print("\n🧭 Testing prompt_classifier...")
+
+@test("Word-bounded phrases match across whitespace but not inside longer words")
+def test_prompt_classifier_word_bounded():
+    from scripts.prompt_classifier import PromptClassifier, optional_spaces
+    classifier = PromptClassifier(
+        {"deep": optional_spaces(["think more", "think harder"]), "nlp": ["text", "ner"]},
+        word_bounded={"deep"},
+    )
+    assert classifier.classify("Please THINK\n more about this") == {"deep"}
+    assert classifier.classify("thinkharder") == {"deep"}
+    assert classifier.classify("I think moreover") == frozenset()
+    assert classifier.classify("General context") == {"nlp"}  # plain keywords stay substrings
+    assert classifier.scan("think more, then think harder")["deep"] == ["think more", "think harder"]
+
+test_prompt_classifier_word_bounded()
+
+@test("Proxy deep-think and domain detection share one classification")
+def test_proxy_prompt_classification():
+    from proxy_server import detect_deep_thinking, detect_god_level_domain, classify_prompt, GOD_LEVEL_DOMAINS
+    classify_prompt.cache_clear()
+    prompt = "Take your\ttime and analyze thoroughly"
+    assert detect_deep_thinking(prompt)
+    detect_god_level_domain(prompt)
+    assert classify_prompt.cache_info().misses == 1
+    assert not detect_deep_thinking("rethinking more broadly")
+    domain_key, domain_info = next(iter(GOD_LEVEL_DOMAINS.items()))
+    assert detect_god_level_domain(f"something about {domain_info['keywords'][0]}") is domain_info
+
+test_proxy_prompt_classification()
+
+# ============================================
+# EMBEDDINGS
+# ============================================
+print("\n🧮 Testing embedding_service...")
+
+@test("Embeddings are batched, deduplicated and served from the content-hash cache")
+def test_embedding_service_batches_and_caches():
+    from types import SimpleNamespace
+    from scripts.embedding_service import EmbeddingService, make_batches
+    calls = []
+
+    class Models:
+        async def embed_content(self, model, contents, config=None):
+            calls.append(list(contents))
+            return SimpleNamespace(embeddings=[SimpleNamespace(values=[float(len(t)), 1.0]) for t in contents])
+
+    client = SimpleNamespace(aio=SimpleNamespace(models=Models()))
+    service = EmbeddingService()
+    texts = [f"doc {i}" for i in range(250)] + ["doc 0"]
+    vectors = asyncio.run(service.embed(client, texts, model="text-embedding-005"))
+    assert len(vectors) == 251 and vectors[250][0] == 5.0
+    assert [len(c) for c in calls] == [250]  # one call, duplicate sent once
+    asyncio.run(service.embed(client, ["doc 1", "doc 999"], model="text-embedding-005"))
+    assert calls[-1] == ["doc 999"] and service.cache.hits == 1
+    assert make_batches(["x" * 400] * 5, max_items=10, max_tokens=250) == [[0, 1], [2, 3], [4]]
+
+test_embedding_service_batches_and_caches()
+
+@test("Embedding batches split only when the API rejects their size")
+def test_embedding_batch_split():
+    from types import SimpleNamespace
+    from scripts.embedding_service import EmbeddingService
+
+    class BadRequest(Exception):
+        code = 400
+
+    calls = []
+
+    class Models:
+        def __init__(self, max_inputs, message):
+            self.max_inputs, self.message = max_inputs, message
+
+        async def embed_content(self, model, contents, config=None):
+            calls.append(len(contents))
+            if len(contents) > self.max_inputs:
+                raise BadRequest(self.message)
+            return SimpleNamespace(embeddings=[SimpleNamespace(values=[1.0, 0.0]) for _ in contents])
+
+    def embed(models, texts):
+        return asyncio.run(EmbeddingService().embed(SimpleNamespace(aio=SimpleNamespace(models=models)), texts,
+                                                    model="text-embedding-005"))
+
+    texts = [f"doc {i}" for i in range(200)]
+    assert len(embed(Models(60, "400 INVALID_ARGUMENT. The number of instances exceeds 60"), texts)) == 200
+    assert sorted(calls) == [50, 50, 50, 50, 100, 100, 200]  # halved until the batches fit
+    calls.clear()
+    try:
+        embed(Models(0, "400 INVALID_ARGUMENT. Invalid value at 'task_type' (TaskType), \"FOO\""), texts)
+        assert False, "a bad parameter must fail"
+    except BadRequest:
+        pass
+    assert calls == [200]  # failed on the first 400 instead of splitting down to single inputs
+
+test_embedding_batch_split()
+
+@test("Embedding dimensions are truncated and re-normalized; base64 is float32")
+def test_embedding_encoding():
+    import base64
+    import numpy as np
+    from scripts.embedding_service import encode_vector, reduce_dimensions
+    vector = reduce_dimensions(np.array([3.0, 4.0, 12.0], dtype=np.float32), 2)
+    assert np.allclose(vector, [0.6, 0.8])
+    decoded = np.frombuffer(base64.b64decode(encode_vector(vector, "base64")), dtype="<f4")
+    assert np.allclose(decoded, vector) and encode_vector(vector, "float") == vector.tolist()
+
+test_embedding_encoding()
+
+# ============================================
+# HQ VECTOR INDEX
+# ============================================
+print("\n📚 Testing hq_index...")
+
+class BagOfWordsEmbedder:
+    """Deterministic offline embedder for index tests."""
+    model = "test-bow"
+
+    def __init__(self):
+        self.embedded = 0
+
+    def _vector(self, text):
+        import hashlib
+        import numpy as np
+        vector = np.zeros(64, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1
+        return vector
+
+    def embed_documents(self, texts):
+        import numpy as np
+        self.embedded += len(texts)
+        return np.stack([self._vector(t) for t in texts])
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+@test("HQ index embeds once and re-embeds only changed chunks")
+def test_hq_index_incremental():
+    import tempfile
+    from pathlib import Path
+    from scripts.hq_index import HQIndex
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / "HQ"
+        (root / "community").mkdir(parents=True)
+        (root / "community" / "igloo.md").write_text("# Igloo\n\n## Domes\nWelcome Dome and Frosted Market\n\n## Roles\nVIP roles\n")
+        (root / "notes.md").write_text("# Notes\n\ntax filing checklist\n")
+        embedder = BagOfWordsEmbedder()
+        index = HQIndex(root=root, path=Path(tmp) / "index", embedder=embedder, profiles={})
+        assert index.update()["embedded"] == 3 and len(index) == 3
+        assert index.search("frosted market domes", k=1)[0].section == "Domes"
+
+        (root / "community" / "igloo.md").write_text("# Igloo\n\n## Domes\nWelcome Dome and Frosted Market\n\n## Roles\nVIP and Practitioner roles\n")
+        stats = index.update()
+        assert stats["changed"] == 1 and stats["embedded"] == 1 and stats["reused"] == 2
+        assert index.update()["embedded"] == 0 and embedder.embedded == 4
+
+        reopened = HQIndex(root=root, path=Path(tmp) / "index", embedder=BagOfWordsEmbedder(), profiles={})
+        assert len(reopened) == 3 and reopened.search("practitioner", k=1)[0].path == "community/igloo.md"
+        del index, reopened  # release the memory maps before the directory is removed
+
+test_hq_index_incremental()
+
+@test("Search profiles apply RAG config filters and boosts at query time")
+def test_hq_index_profiles():
+    import tempfile
+    from pathlib import Path
+    from scripts.hq_index import HQIndex, SearchProfile, Boost, parse_filter, load_search_profiles
+    assert parse_filter("category = 'boundaries' OR category = 'ethics'") == [[("category", ["boundaries"])], [("category", ["ethics"])]]
+    assert parse_filter("category IN ('a', 'b') AND dir = 'x'") == [[("category", ["a", "b"]), ("dir", ["x"])]]
+    assert load_search_profiles()["safety_check"].max_results == 5
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / "HQ"
+        root.mkdir()
+        (root / "a.md").write_text("---\ncategory: ethics\n---\n# A\n\nconsent basics\n")
+        (root / "b.md").write_text("---\ncategory: money\nconfidence: sure\n---\n# B\n\nconsent pricing\n")
+        profiles = {
+            "safe": SearchProfile("safe", parse_filter("category = 'ethics'"), max_results=5),
+            "sure": SearchProfile("sure", boosts=[Boost("confidence", ["sure"], 3.0)], max_results=1),
+        }
+        index = HQIndex(root=root, path=Path(tmp) / "index", embedder=BagOfWordsEmbedder(), profiles=profiles)
+        index.update()
+        assert [r.path for r in index.search("consent", profile="safe")] == ["a.md"]
+        assert [r.path for r in index.search("consent basics", profile="sure")] == ["b.md"]
+        assert [r.path for r in index.search("consent", filter="category = 'money'")] == ["b.md"]
+        del index
+
+test_hq_index_profiles()
+
+# ============================================
+# TTS CACHE
+# ============================================
+print("\n🔊 Testing TTS Cache...")
+
+@test("TTS cache serves hits from disk and evicts LRU clips over the byte budget")
+def test_tts_cache_lru():
+    import tempfile
+    from scripts.tts_cache import TTSCache, tts_key
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TTSCache(path=tmp, max_bytes=250, enabled=True)
+        a, b, c = (tts_key(t, "Charon", "tts", None) for t in ("a", "b", "c"))
+        assert tts_key("a", "Charon", "tts", "calm") != a and tts_key("a", "Puck", "tts", None) != a
+        cache.set(a, b"x" * 100, "audio/wav", synth_seconds=1.5)
+        cache.set(b, b"y" * 100, "audio/wav")
+        time.sleep(0.01)
+        assert cache.get(a).data == b"x" * 100  # a is now more recent than b
+        cache.set(c, b"z" * 100, "audio/wav")
+        assert a in cache and c in cache and b not in cache
+        assert cache.get(b) is None
+        stats = cache.stats()
+        assert stats["size_bytes"] == 200 and stats["evictions"] == 1
+        assert stats["hit_rate"] == 0.5 and stats["bytes_saved"] == 100 and stats["synth_seconds_saved"] == 1.5
+        reopened = TTSCache(path=tmp, max_bytes=250, enabled=True)
+        assert reopened.get(c).mime_type == "audio/wav"
+        cache.close()
+        reopened.close()
+
+test_tts_cache_lru()
+
+@test("TTS pre-warm synthesizes only phrases that are not cached")
+def test_tts_cache_prewarm():
+    import tempfile
+    from scripts.tts_cache import TTSCache, tts_key
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TTSCache(path=tmp, max_bytes=10_000, enabled=True)
+        synthesized = []
+
+        async def synthesize(text):
+            synthesized.append(text)
+            if text == "broken":
+                raise RuntimeError("no audio")
+            return text.encode(), "audio/wav"
+
+        phrases = [(tts_key(p, "Charon", "tts", None), p) for p in ("hello", "on it", "broken")]
+        assert asyncio.run(cache.prewarm(phrases, synthesize)) == {"cached": 0, "synthesized": 2, "failed": 1}
+        assert asyncio.run(cache.prewarm(phrases, synthesize)) == {"cached": 2, "synthesized": 0, "failed": 1}
+        assert synthesized.count("hello") == 1 and cache.get(phrases[1][0]).data == b"on it"
+        cache.close()
+
+test_tts_cache_prewarm()
+
+@test("Streamed TTS framing parses Gemini PCM mime types and writes valid WAV headers")
+def test_tts_stream_framing():
+    import io
+    import wave
+    from scripts.tts_stream import PCMFormat, is_pcm, parse_pcm_mime, split_chunks, wav_header, UNKNOWN_LENGTH
+    fmt = parse_pcm_mime("audio/L16;codec=pcm;rate=24000")
+    assert (fmt.rate, fmt.channels, fmt.bits) == (24000, 1, 16) and fmt.media_type == "audio/L16;rate=24000;channels=1"
+    assert is_pcm("audio/L16;codec=pcm;rate=24000") and not is_pcm("audio/wav")
+    samples = b"\x01\x00" * 2400
+    with wave.open(io.BytesIO(wav_header(fmt, len(samples)) + samples)) as wf:
+        assert wf.getframerate() == 24000 and wf.getnchannels() == 1 and wf.readframes(2400) == samples
+    streaming = wav_header(PCMFormat(rate=16000, channels=2))
+    assert len(streaming) == 44 and int.from_bytes(streaming[40:44], "little") == UNKNOWN_LENGTH
+    assert b"".join(split_chunks(samples, 1000)) == samples and len(list(split_chunks(samples, 1000))) == 5
+
+test_tts_stream_framing()
+
+# ============================================
+# ARTIFACT STORE
+# ============================================
+print("\n🖼️ Testing Artifact Store...")
+
+@test("Artifact store dedupes by content hash and reads byte ranges")
+def test_artifact_store():
+    import tempfile
+    from scripts.artifact_store import LocalArtifactStore, fetch_artifact, parse_tags
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LocalArtifactStore(tmp)
+        data = bytes(range(256)) * 2000
+        first = store.put(data, "image/png")
+        assert store.put(data, "image/png") == first and store.stats()["writes"] == 1
+        assert store.get(first.id).size == len(data) and store.get("../../etc/passwd") is None
+        assert b"".join(store.read(first.id, 1000, 300_000)) == data[1000:300_001]
+        text = f"Here you go\n{first.tag}\n✓ Image generated"
+        [(tag, ref)] = parse_tags(text)
+        assert tag == first.tag and ref.id == first.id and fetch_artifact(ref, store) == data
+        assert parse_tags("[IMAGE_B64]abc[/IMAGE_B64]") == []
+
+test_artifact_store()
+
+@test("Engine artifacts are linked from the engine bucket only and read from there")
+def test_artifact_link_remote():
+    import tempfile
+    from scripts import artifact_store
+    from scripts.artifact_store import Artifact, LocalArtifactStore, artifact_id, parse_tags
+    data = b"\x89PNG engine image"
+    aid = artifact_id(data)
+    [(_, ref)] = parse_tags(f"[ARTIFACT uri=gs://engine-bucket/artifacts/{aid} type=image/png size={len(data)}]")
+
+    class Bucket:
+        def read(self, aid, start=0, end=None):
+            yield data[start:None if end is None else end + 1]
+
+    buckets = []
+    original = artifact_store.remote_store
+    artifact_store.remote_store = lambda uri: buckets.append(uri) or Bucket()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = LocalArtifactStore(tmp, engine_bucket="gs://engine-bucket", engine_prefix="artifacts")
+            assert store.get(aid) is None
+            foreign = Artifact(aid, "image/png", len(data), f"gs://private-bucket/artifacts/{aid}")
+            assert not store.link(foreign) and store.get(aid) is None  # model output cannot pick the bucket
+            assert not LocalArtifactStore(tmp, engine_bucket=None).link(ref)  # no engine bucket configured
+            assert store.link(ref)
+            assert store.get(aid) == Artifact(aid, "image/png", len(data), ref.uri)
+            assert not store.link(Artifact(aid, "text/html", 1, ref.uri))  # never repointed or rewritten
+            assert b"".join(store.read(aid, 2, 4)) == data[2:5] and buckets == [ref.uri]
+            assert LocalArtifactStore(tmp, engine_bucket="engine-bucket").get(aid) == store.get(aid)  # after restart
+            assert LocalArtifactStore(tmp, engine_bucket="other-bucket").get(aid) is None
+    finally:
+        artifact_store.remote_store = original
+
+test_artifact_link_remote()
+
+@test("Range headers map to inclusive byte spans")
+def test_artifact_ranges():
+    from scripts.artifact_store import parse_range, RangeNotSatisfiable
+    assert parse_range(None, 100) is None and parse_range("bytes=0-9,20-29", 100) is None
+    assert parse_range("bytes=10-19", 100) == (10, 19) and parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99) and parse_range("bytes=50-500", 100) == (50, 99)
+    try:
+        parse_range("bytes=100-", 100)
+        assert False, "range past the end must be unsatisfiable"
+    except RangeNotSatisfiable:
+        pass
+
+test_artifact_ranges()
+
+# ============================================
+# DEEP RESEARCH JOBS
+# ============================================
+print("\n🔬 Testing Deep Research jobs...")
+
+class FakeInteractions:
+    """Interactions that finish after `steps` polls, adding a thinking summary per poll."""
+    def __init__(self, steps=3):
+        from types import SimpleNamespace
+        self.ns = SimpleNamespace
+        self.steps = steps
+        self.polls = {}
+
+    async def create(self, prompt):
+        interaction_id = f"int-{len(self.polls)}"
+        self.polls[interaction_id] = 0
+        return self.ns(id=interaction_id, status="in_progress", outputs=[])
+
+    async def fetch(self, interaction_id):
+        self.polls[interaction_id] += 1
+        n = self.polls[interaction_id]
+        outputs = [self.ns(type="thought", summary=[self.ns(type="text", text=f"step {i}")]) for i in range(n)]
+        if n >= self.steps:
+            return self.ns(id=interaction_id, status="completed", outputs=outputs + [self.ns(type="text", text="REPORT")])
+        return self.ns(id=interaction_id, status="in_progress", outputs=outputs)
+
+@test("Research jobs queue past the concurrency cap and finish from one poller each")
+def test_research_queue():
+    from scripts.research_jobs import ResearchManager, ResearchQueueFull
+
+    async def scenario():
+        fake = FakeInteractions()
+        manager = ResearchManager(fake.create, fake.fetch, max_concurrent=1, max_queue=1, poll_min=0.01, poll_max=0.02)
+        first = await manager.submit("a")
+        second = await manager.submit("b")
+        assert first.status == "in_progress" and second.status == "queued" and manager.queue_position(second) == 1
+        try:
+            await manager.submit("c")
+            assert False, "queue should be full"
+        except ResearchQueueFull:
+            pass
+        done = await manager.wait(first.id, first.version, timeout=5)
+        while not done.done:
+            done = await manager.wait(first.id, done.version, timeout=5)
+        assert done.report == "REPORT" and done.thoughts == ["step 0", "step 1", "step 2"]
+        while not manager.get(second.id).done:
+            await manager.wait(second.id, manager.get(second.id).version, timeout=5)
+        assert manager.get(second.id).interaction_id == "int-1" and fake.polls == {"int-0": 3, "int-1": 3}
+        assert manager.stats()["active"] == 0
+        await manager.close()
+
+    asyncio.run(scenario())
+
+test_research_queue()
+
+@test("Finished research is served from the local store without API calls")
+def test_research_persistence():
+    import tempfile
+    from scripts.research_jobs import ResearchManager, ResearchStore
+
+    async def scenario(path):
+        fake = FakeInteractions(steps=1)
+        manager = ResearchManager(fake.create, fake.fetch, store=ResearchStore(path), poll_min=0.01)
+        job = await manager.submit("topic")
+        await manager.wait(job.id, job.version, timeout=5)
+        await manager.close()
+
+        reopened = ResearchManager(fake.create, fake.fetch, store=ResearchStore(path))
+        await reopened.resume()
+        for _ in range(3):
+            assert reopened.get(job.id).report == "REPORT"
+        assert fake.polls == {job.id: 1} and reopened.stats()["pollers"] == 0
+        await reopened.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(scenario(Path(tmp) / "research.sqlite"))
+
+test_research_persistence()
+
+@test("Closing the research manager leaves queued jobs persisted instead of starting them")
+def test_research_close_keeps_queue():
+    import tempfile
+    from scripts.research_jobs import ResearchManager, ResearchStore
+
+    async def scenario(path):
+        fake = FakeInteractions(steps=1000)
+        manager = ResearchManager(fake.create, fake.fetch, store=ResearchStore(path), max_concurrent=1, poll_min=0.01)
+        running = await manager.submit("a")
+        queued = await manager.submit("b")
+        await asyncio.sleep(0.05)  # the poller is running when it gets cancelled
+        await manager.close()
+        await asyncio.sleep(0.05)
+        assert list(fake.polls) == [running.id]  # the freed slot did not start the queued job
+
+        reopened = ResearchManager(fake.create, fake.fetch, store=ResearchStore(path), max_concurrent=1, poll_min=0.01)
+        await reopened.resume()
+        assert reopened.stats()["pollers"] == 1 and reopened.queue_position(reopened.get(queued.id)) == 1
+        await reopened.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(scenario(Path(tmp) / "research.sqlite"))
+
+test_research_close_keeps_queue()
+
+# ============================================
+# ADMISSION CONTROL
+# ============================================
+print("\n🚦 Testing admission control...")
+
+@test("Admission serves interactive calls before background ones and sheds past the wait budget")
+def test_admission_priorities():
+    from scripts.admission import (ModelLimiter, AdmissionRejected, PRIORITY_INTERACTIVE,
+                                   PRIORITY_FLEET, PRIORITY_BACKGROUND)
+
+    async def scenario():
+        limiter = ModelLimiter("m", rate=100, burst=10, initial_limit=2)
+        order = []
+
+        async def call(level, tag):
+            await limiter.acquire(level)
+            order.append(tag)
+            await asyncio.sleep(0.02)
+            limiter.release()
+
+        await asyncio.gather(call(PRIORITY_BACKGROUND, "b1"), call(PRIORITY_BACKGROUND, "b2"),
+                             call(PRIORITY_FLEET, "f1"), call(PRIORITY_INTERACTIVE, "i1"))
+        assert order[0] == "b1" and order[1] == "i1" and order[-1] == "b2", order  # background gets half the limit
+
+        limiter.paused_until = time.monotonic() + 30
+        start = time.monotonic()
+        try:
+            await limiter.acquire(PRIORITY_INTERACTIVE)
+            assert False, "a 30s pause exceeds every wait budget"
+        except AdmissionRejected as e:
+            assert e.retry_after >= 29 and time.monotonic() - start < 0.1  # shed at once, not after queueing
+        assert limiter.stats()["rejected"]["interactive"] == 1
+
+    asyncio.run(scenario())
+
+test_admission_priorities()
+
+@test("Admission halves the concurrency limit and honours Retry-After on upstream 429s")
+def test_admission_aimd():
+    from types import SimpleNamespace
+    from scripts.admission import AdmissionController, retry_after_from_error
+
+    class Throttled(Exception):
+        code = 429
+        response = SimpleNamespace(headers={"retry-after": "0.2"})
+
+    async def scenario():
+        controller = AdmissionController(enabled=True, rates={}, default_rate=1000)
+        limiter = controller.limiter("publishers/google/models/gemini-x")
+        assert controller.limiter("gemini-x") is limiter
+        for _ in range(5):
+            async with controller.admit("gemini-x"):
+                pass
+        grown = limiter.limit
+        assert grown > 16
+        try:
+            async with controller.admit("gemini-x"):
+                raise Throttled("429 RESOURCE_EXHAUSTED")
+        except Throttled:
+            pass
+        assert limiter.limit == grown / 2 and limiter.throttled == 1 and limiter.in_flight == 0
+        start = time.monotonic()
+        async with controller.admit("gemini-x"):
+            assert time.monotonic() - start >= 0.15  # waited out the Retry-After pause
+
+    asyncio.run(scenario())
+    assert retry_after_from_error(Exception("429 ... 'retryDelay': '7s'")) == 7.0
+
+test_admission_aimd()
+
+# ============================================
+# MODEL ROUTING
+# ============================================
+print("\n🔀 Testing model routing...")
+
+@test("Circuit breaker opens on a failing endpoint, then closes after a successful half-open probe")
+def test_circuit_breaker():
+    from scripts.model_router import EndpointHealth, CLOSED, OPEN, HALF_OPEN
+
+    class Unavailable(Exception):
+        code = 503
+
+    class BadRequest(Exception):
+        code = 400
+
+    health = EndpointHealth("m", min_calls=4, error_rate=0.5, consecutive=10, open_seconds=5)
+    now = 1000.0
+    for _ in range(3):
+        health.record(BadRequest("400 INVALID_ARGUMENT"), now=now)  # the request's fault, not the endpoint's
+    assert health.state == CLOSED and health.calls == 0
+    health.record(None, 0.1, now=now)
+    health.record(None, 0.1, now=now)
+    health.record(Unavailable("503"), now=now)
+    assert health.state == CLOSED
+    health.record(Unavailable("503"), now=now)  # 2 of 4 failed
+    assert health.state == OPEN and health.score == 0.0
+    assert not health.allow(now=now + 1) and health.retry_after(now=now + 1) == 4
+    assert health.allow(now=now + 5) and health.state == HALF_OPEN
+    assert not health.allow(now=now + 5)  # one probe at a time
+    health.record(Unavailable("503"), now=now + 6)
+    assert health.state == OPEN and health.opens == 2  # failed probe re-opens
+    assert health.allow(now=now + 11)
+    health.record(None, 0.1, now=now + 11)
+    assert health.state == CLOSED and health.error_rate == 0.0
+
+test_circuit_breaker()
+
+@test("Router falls back across a route and skips endpoints whose breaker is open")
+def test_model_router_fallback():
+    from types import SimpleNamespace
+    from scripts.model_router import ModelRouter, NoHealthyEndpoint
+
+    class Unavailable(Exception):
+        code = 503
+
+    class Throttled(Exception):
+        code = 429
+        response = SimpleNamespace(headers={"retry-after": "60"})
+
+    calls = {"primary": 0, "secondary": 0}
+
+    async def primary():
+        calls["primary"] += 1
+        raise Unavailable("503 UNAVAILABLE")
+
+    async def secondary():
+        calls["secondary"] += 1
+        return "ok"
+
+    async def throttled():
+        raise Throttled("429 RESOURCE_EXHAUSTED")
+
+    async def scenario():
+        router = ModelRouter(attempts=2)
+        router.health("primary").consecutive_threshold = 2
+        route = [("primary", primary), ("secondary", secondary)]
+        assert await router.run(route) == ("secondary", "ok")
+        assert calls == {"primary": 2, "secondary": 1}  # retried once with jitter, then failed over
+        assert router.health("primary").state == "open"
+        assert await router.run(route) == ("secondary", "ok")
+        assert calls == {"primary": 2, "secondary": 2}  # open breaker: not called at all
+        start = time.monotonic()
+        assert await router.run([("slow", throttled), ("secondary", secondary)]) == ("secondary", "ok")
+        assert time.monotonic() - start < 0.5  # a 60s Retry-After fails over instead of sleeping
+        router.health("secondary")._open(time.monotonic())
+        try:
+            await router.run(route)
+            assert False, "every breaker is open"
+        except NoHealthyEndpoint as e:
+            assert e.retry_after > 0
+
+    asyncio.run(scenario())
+
+test_model_router_fallback()
+
+@test("Single-delta streams report any failure as an in-band error event")
+def test_stream_single_delta_errors():
+    from proxy_server import stream_single_delta
+    from scripts.model_router import NoHealthyEndpoint
+
+    async def collect(error):
+        async def fail():
+            raise error
+        return [event async for event in stream_single_delta("bandit-reasoning-engine", fail)]
+
+    events = asyncio.run(collect(NoHealthyEndpoint(["gemini-flash"], retry_after=2.5)))
+    assert events[-1] == "data: [DONE]\n\n"
+    assert json.loads(events[-2][6:])["error"] == {"code": 503, "retry_after": 3,
+        "message": "No healthy endpoint among gemini-flash; retry after 2s"}
+    events = asyncio.run(collect(RuntimeError("upstream exploded")))
+    assert json.loads(events[-2][6:])["error"] == {"message": "upstream exploded", "code": 500}
+
+test_stream_single_delta_errors()
+
+# ============================================
+# METRICS
+# ============================================
+print("\n📈 Testing metrics...")
+
+@test("Metrics render Prometheus text with cumulative buckets, collectors and per-request usage")
+def test_metrics_exposition():
+    from types import SimpleNamespace
+    from scripts.metrics import MetricsRegistry, RequestScope, _request_scope, record_usage, request_scope, TOKENS
+
+    registry = MetricsRegistry()
+    requests_total = registry.counter("t_requests_total", "Requests", ("route",))
+    latency = registry.histogram("t_latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    requests_total.inc("/a")
+    requests_total.inc("/a", amount=2)
+    for seconds in (0.05, 0.5, 5.0):
+        latency.observe(seconds, "/a")
+    registry.collector(lambda: [("t_depth", "gauge", "Depth", [({"queue": 'q"1'}, 3)])])
+    registry.collector(lambda: 1 / 0)  # a failing collector is skipped, not fatal
+    text = registry.render()
+    assert 't_requests_total{route="/a"} 3' in text
+    assert 't_latency_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 't_latency_seconds_bucket{route="/a",le="1"} 2' in text
+    assert 't_latency_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 't_latency_seconds_count{route="/a"} 3' in text
+    assert 't_depth{queue="q\\"1"} 3' in text
+    assert "# TYPE t_latency_seconds histogram" in text
+
+    usage = SimpleNamespace(prompt_token_count=10, candidates_token_count=4, thoughts_token_count=3,
+                            total_token_count=17)
+    before = TOKENS.value("gemini-x", "completion")
+    token = _request_scope.set(RequestScope())
+    try:
+        record_usage("publishers/google/models/gemini-x", usage)
+        record_usage("gemini-x", None)
+        assert request_scope().usage() == {"prompt_tokens": 10, "completion_tokens": 7, "total_tokens": 17}
+    finally:
+        _request_scope.reset(token)
+    assert TOKENS.value("gemini-x", "completion") - before == 7
+    assert request_scope().usage()["total_tokens"] == 0  # outside a request: detached scope
+
+test_metrics_exposition()
+
+# ============================================
+# REQUEST TRACING
+# ============================================
+print("\n🧵 Testing request tracing...")
+
+@test("Tracing exports sampled and slow traces to rotating JSONL and aggregates per-stage percentiles")
+def test_request_tracing():
+    import tempfile
+    from pathlib import Path
+    from scripts.tracing import Trace, TraceExporter, Tracer, _current_trace, span
+    from scripts.trace_report import aggregate, read_traces, trace_files
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "requests.jsonl"
+        tracer = Tracer(TraceExporter(path, max_bytes=600, backups=2), sample=0.0, slow_seconds=0.05)
+
+        with span("outside"):
+            pass  # no trace: a no-op
+
+        def request(sleep: float, status: int = 200) -> Trace:
+            trace = Trace()
+            token = _current_trace.set(trace)
+            try:
+                with span("parse", messages=1):
+                    pass
+                with span("upstream", model="m"):
+                    time.sleep(sleep)
+            finally:
+                _current_trace.reset(token)
+            return trace
+
+        fast = request(0)
+        assert tracer.finish(fast, "POST", "/v1/chat/completions", 200) is None  # unsampled, fast, ok
+        record = tracer.finish(request(0.06), "POST", "/v1/chat/completions", 200)
+        assert record["slow"] and [s["name"] for s in record["spans"]] == ["parse", "upstream"]
+        assert record["spans"][1]["model"] == "m" and record["spans"][1]["duration_ms"] >= 50
+        assert tracer.finish(request(0), "GET", "/research/{interaction_id}", 502) is not None  # errors always kept
+        for _ in range(3):
+            tracer.finish(request(0.06), "POST", "/v1/chat/completions", 200)
+
+        files = trace_files(path)
+        assert files[-1] == path and len(files) == 3  # rotated into .2 and .1, oldest first
+        report = aggregate(read_traces(files), route="/v1/chat/completions", slow_only=True)
+        upstream = report["stages"]["upstream"]
+        assert report["traces"] == upstream["count"] >= 2
+        assert upstream["p50"] >= 50 and upstream["p99"] >= upstream["p50"] and upstream["share"] > 0.5
+        assert tracer.stats()["slow"] == 4
+
+test_request_tracing()
+
+@test("TracingMiddleware writes traces from a worker thread, not the event loop")
+def test_tracing_export_off_loop():
+    import threading
+    from scripts.tracing import TraceExporter, Tracer, TracingMiddleware
+
+    class RecordingExporter(TraceExporter):
+        def export(self, record):
+            self.thread = threading.get_ident()
+            self.record = record
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    exporter = RecordingExporter("unused.jsonl")
+    middleware = TracingMiddleware(app, Tracer(exporter, sample=1.0, enabled=True))
+
+    async def run():
+        await middleware({"type": "http", "method": "GET", "headers": []}, None, send)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert exporter.record["status"] == 201 and exporter.record["route"] == "unmatched"
+    assert exporter.thread != loop_thread
+
+test_tracing_export_off_loop()
+
+# ============================================
+# LOAD GENERATOR
+# ============================================
+print("\n📈 Testing open-loop load generator...")
+
+@test("Load generator: HDR percentiles, arrival schedules and saturation")
+def test_load_generator():
+    import random
+    from tests.perf_test import LatencyHistogram, LoadRun, arrival_times, stream_error
+
+    hist = LatencyHistogram()
+    for ms in range(1, 1001):
+        hist.record(ms / 1000)
+    summary = hist.summary()
+    assert summary["count"] == 1000
+    assert abs(summary["p50_ms"] - 500) <= 5, summary  # within the 1% bucket precision
+    assert abs(summary["p99_ms"] - 990) <= 10, summary
+    assert summary["p99_9_ms"] <= summary["max_ms"] == 1000.0
+
+    other = LatencyHistogram()
+    other.record(5.0)
+    hist.merge(other)
+    assert hist.count == 1001 and hist.max == 5.0
+
+    constant = list(arrival_times("constant", 10, 2))
+    assert len(constant) == 19 and abs(constant[1] - constant[0] - 0.1) < 1e-9
+    poisson = list(arrival_times("poisson", 50, 10, rng=random.Random(7)))
+    assert 400 < len(poisson) < 600
+    ramp = list(arrival_times("ramp", 1, 10, ramp_to=20))
+    assert ramp[-1] - ramp[-2] < ramp[1] - ramp[0]  # arrivals get denser
+
+    workload = {"requests": [{"name": "x", "path": "/", "weight": 1}], "limits": {"max_error_rate": 0.05}}
+    run = LoadRun(workload, "http://t", "constant", 10, 4, window=1)
+    for second in range(4):
+        window = run._window(second)
+        for _ in range(10 if second < 2 else 5):  # the server falls behind after 2 s
+            window.record(0.05, None)
+    saturation = run.saturation(0.05, None)
+    assert saturation["window_start_s"] == 2 and saturation["reasons"] == ["throughput"], saturation
+    run.windows[2].record(0.05, "http_503")
+    run.windows[2].record(0.05, "ReadTimeout")
+    assert set(run.saturation(0.05, None)["reasons"]) == {"throughput", "errors"}
+
+    ok = b'data: {"choices": [{"delta": {"content": "hi"}}]}\n\ndata: [DONE]\n\n'
+    failed = b'data: {"choices": [{"delta": {"role": "assistant"}}]}\n\n' \
+             b'data: {"error": {"message": "overloaded", "code": 429, "retry_after": 2}}\n\ndata: [DONE]\n\n'
+    assert stream_error(ok) is None and stream_error(failed) == "stream_error_429"
+
+test_load_generator()
+
+# ============================================
+# VERTEX AI STAND-IN
+# ============================================
+print("\n🧪 Testing Vertex AI stand-in...")
+
+@test("Vertex stand-in: deterministic answers, streaming cadence, embeddings, 429 injection, interactions")
+def test_vertex_standin():
+    import asyncio
+    import json
+    import httpx
+    from dataclasses import replace
+    from scripts.vertex_standin import DEFAULT_PROFILES, VertexStandIn, build_app
+
+    profiles = dict(DEFAULT_PROFILES, tts=replace(DEFAULT_PROFILES["tts"], error_rate=1.0, retry_after=3))
+    standin = VertexStandIn(profiles, seed=5, time_scale=0)
+    assert standin.profile("gemini-2.5-flash-lite-preview-tts") is profiles["tts"]  # not "flash-lite"
+    assert standin.profile("gemini-3.1-pro-preview") is profiles["pro"]
+    vertex = "/v1beta1/projects/p/locations/global/publishers/google/models"
+
+    async def run():
+        transport = httpx.ASGITransport(app=build_app(standin))
+        async with httpx.AsyncClient(transport=transport, base_url="http://standin") as client:
+            body = {"contents": [{"role": "user", "parts": [{"text": "hello"}]}]}
+            first = (await client.post(f"{vertex}/gemini-3-flash-preview:generateContent", json=body)).json()
+            again = (await client.post(f"{vertex}/gemini-3-flash-preview:generateContent", json=body)).json()
+            assert first["candidates"][0]["content"] == again["candidates"][0]["content"]
+            assert first["usageMetadata"]["candidatesTokenCount"] == profiles["flash"].output_tokens
+
+            stream = await client.post(f"{vertex}/gemini-3-flash-preview:streamGenerateContent?alt=sse", json=body)
+            chunks = [json.loads(line[6:]) for line in stream.text.splitlines() if line.startswith("data: ")]
+            assert len(chunks) == profiles["flash"].output_tokens // profiles["flash"].chunk_tokens
+            assert "usageMetadata" in chunks[-1] and "usageMetadata" not in chunks[0]
+
+            embed = await client.post(f"{vertex}/gemini-embedding-001:predict",
+                                      json={"instances": [{"content": "a"}, {"content": "b"}],
+                                            "parameters": {"outputDimensionality": 16}})
+            vectors = [p["embeddings"]["values"] for p in embed.json()["predictions"]]
+            assert len(vectors) == 2 and len(vectors[0]) == 16 and vectors[0] != vectors[1]
+
+            tts = await client.post(f"{vertex}/gemini-2.5-flash-lite-preview-tts:generateContent", json=body)
+            assert tts.status_code == 429 and tts.headers["retry-after"] == "3"
+            assert tts.json()["error"]["status"] == "RESOURCE_EXHAUSTED"
+
+            engine = await client.post("/v1beta1/projects/p/locations/us-central1/reasoningEngines/42:query",
+                                       json={"input": {"prompt": "hi"}, "classMethod": "query"})
+            assert engine.json()["output"].startswith("Stand-in")
+
+            created = (await client.post("/v1beta1/projects/p/locations/global/interactions",
+                                         json={"input": "topic", "agent": "deep-research-pro-preview-12-2025"})).json()
+            done = (await client.get(f"/v1beta1/projects/p/locations/global/interactions/{created['id']}")).json()
+            assert done["status"] == "completed" and done["outputs"][-1]["type"] == "text"  # time_scale 0: instant
+            missing = await client.get("/v1beta1/projects/p/locations/global/interactions/nope")
+            assert missing.status_code == 404
+
+    asyncio.run(run())
+    assert standin.stats()["injected_429"] == {"gemini-2.5-flash-lite-preview-tts": 1}
+
+test_vertex_standin()
+
+# ============================================
+# GENAI CASSETTES
+# ============================================
+print("\n📼 Testing genai record/replay cassettes...")
+
+@test("Cassettes: record sync, streaming and aio genai calls, then replay them with no network")
+def test_genai_cassettes():
+    import asyncio
+    import json
+    import tempfile
+    import httpx
+    from google import genai
+    from tests.genai_cassette import CassetteMiss, CassetteRecorder, install
+
+    calls = []
+
+    def upstream(request):
+        calls.append(request.url.path)
+        text = f"answer {len(calls)}"
+        chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+        if request.url.path.endswith(":streamGenerateContent"):
+            return httpx.Response(200, content=f"data: {json.dumps(chunk)}\r\n\r\ndata: {json.dumps(chunk)}\r\n\r\n",
+                                  headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json=chunk)
+
+    def offline(request):
+        raise AssertionError(f"network call in replay: {request.url}")
+
+    def run_suite():
+        client = genai.Client(api_key="test-key")
+        first = client.models.generate_content(model="gemini-2.5-flash", contents="hi").text
+        second = client.models.generate_content(model="gemini-2.5-flash", contents="hi").text
+        streamed = [c.text for c in client.models.generate_content_stream(model="gemini-2.5-flash", contents="go")]
+
+        async def aio():
+            return (await client.aio.models.generate_content(model="gemini-2.5-flash", contents="async")).text
+        return first, second, streamed, asyncio.run(aio())
+
+    test_id = "tests/year9_10/test_x.py::TestA::test_b"
+    with tempfile.TemporaryDirectory() as tmp:
+        recorder = CassetteRecorder("record", tmp)
+        uninstall = install(recorder, httpx.MockTransport(upstream))
+        try:
+            recorder.use(test_id)
+            recorded = run_suite()
+            recorder.eject()
+        finally:
+            uninstall()
+        assert recorded == ("answer 1", "answer 2", ["answer 3", "answer 3"], "answer 4") and len(calls) == 4
+        assert recorder.path_for(test_id).name == "TestA__test_b.json.gz"
+
+        recorder = CassetteRecorder("replay", tmp)
+        uninstall = install(recorder, httpx.MockTransport(offline))
+        try:
+            recorder.use(test_id)
+            assert run_suite() == recorded  # repeated identical requests replay in order
+            recorder.use("tests/year9_10/test_x.py::TestA::test_unrecorded")
+            client = genai.Client(api_key="test-key")
+            try:
+                client.models.generate_content(model="gemini-2.5-flash", contents="hi")
+                assert False, "expected a cassette miss"
+            except CassetteMiss:
+                pass
+        finally:
+            recorder.eject()
+            uninstall()
+
+test_genai_cassettes()
+
 # ============================================
 # SUMMARY
 # ============================================